@@ -0,0 +1,29 @@
+"""Add message channel time index
+
+Revision ID: 4e7b2c91d0a6
+Revises: c3d9a1f27b40
+Create Date: 2026-10-19 10:03:27.551640
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e7b2c91d0a6'
+down_revision = 'c3d9a1f27b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_messages_channel_created_id',
+        'messages',
+        ['channel_id', 'created_at', 'id'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_channel_created_id', table_name='messages')
@@ -0,0 +1,53 @@
+"""Add attachments table
+
+Revision ID: 5b8e2d4f1a90
+Revises: d81f3a6c4e27
+Create Date: 2026-10-19 18:12:30.514276
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8e2d4f1a90'
+down_revision = 'd81f3a6c4e27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'attachments',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('owner_id', sa.Integer(), nullable=False),
+        sa.Column('file_name', sa.String(length=255), nullable=False),
+        sa.Column('content_type', sa.String(length=100), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=True),
+        sa.Column('storage_key', sa.String(length=255), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('upload_id', sa.String(length=255), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('completed_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['owner_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('storage_key')
+    )
+    op.create_index(op.f('ix_attachments_id'), 'attachments', ['id'], unique=False)
+    op.create_index(op.f('ix_attachments_owner_id'), 'attachments', ['owner_id'], unique=False)
+    op.create_index('ix_attachments_status_created', 'attachments', ['status', 'created_at'], unique=False)
+
+    op.add_column('messages', sa.Column('attachment_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('fk_messages_attachment_id', 'messages', 'attachments', ['attachment_id'], ['id'])
+    op.create_index(op.f('ix_messages_attachment_id'), 'messages', ['attachment_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_messages_attachment_id'), table_name='messages')
+    op.drop_constraint('fk_messages_attachment_id', 'messages', type_='foreignkey')
+    op.drop_column('messages', 'attachment_id')
+
+    op.drop_index('ix_attachments_status_created', table_name='attachments')
+    op.drop_index(op.f('ix_attachments_owner_id'), table_name='attachments')
+    op.drop_index(op.f('ix_attachments_id'), table_name='attachments')
+    op.drop_table('attachments')
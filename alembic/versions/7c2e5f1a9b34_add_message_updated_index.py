@@ -0,0 +1,29 @@
+"""Add message updated index
+
+Revision ID: 7c2e5f1a9b34
+Revises: e6f04b8a3c15
+Create Date: 2026-10-19 15:12:08.417263
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2e5f1a9b34'
+down_revision = 'e6f04b8a3c15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_messages_updated_id',
+        'messages',
+        ['updated_at', 'id'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_updated_id', table_name='messages')
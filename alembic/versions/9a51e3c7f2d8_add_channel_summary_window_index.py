@@ -0,0 +1,29 @@
+"""Add channel summary window index
+
+Revision ID: 9a51e3c7f2d8
+Revises: 4e7b2c91d0a6
+Create Date: 2026-10-19 11:20:05.734912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a51e3c7f2d8'
+down_revision = '4e7b2c91d0a6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_channel_summaries_window',
+        'channel_summaries',
+        ['channel_id', 'summary_type', 'summary_start_time', 'summary_end_time'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_channel_summaries_window', table_name='channel_summaries')
@@ -0,0 +1,55 @@
+"""Add content-addressed attachment blobs
+
+Revision ID: 9c4f7a2e6b13
+Revises: 5b8e2d4f1a90
+Create Date: 2026-10-19 20:41:07.218734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4f7a2e6b13'
+down_revision = '5b8e2d4f1a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'attachment_blobs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('storage_key', sa.String(length=255), nullable=False),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('last_used_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('sha256'),
+        sa.UniqueConstraint('storage_key')
+    )
+    op.create_index(op.f('ix_attachment_blobs_id'), 'attachment_blobs', ['id'], unique=False)
+    op.create_index('ix_attachment_blobs_unreferenced', 'attachment_blobs', ['ref_count', 'last_used_at'], unique=False)
+
+    # 内容相同的附件共用同一个对象键
+    op.drop_constraint('attachments_storage_key_key', 'attachments', type_='unique')
+    op.create_index(op.f('ix_attachments_storage_key'), 'attachments', ['storage_key'], unique=False)
+    op.add_column('attachments', sa.Column('blob_id', sa.Integer(), nullable=True))
+    op.add_column('attachments', sa.Column('sha256', sa.String(length=64), nullable=True))
+    op.create_foreign_key('fk_attachments_blob_id', 'attachments', 'attachment_blobs', ['blob_id'], ['id'])
+    op.create_index(op.f('ix_attachments_blob_id'), 'attachments', ['blob_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_attachments_blob_id'), table_name='attachments')
+    op.drop_constraint('fk_attachments_blob_id', 'attachments', type_='foreignkey')
+    op.drop_column('attachments', 'sha256')
+    op.drop_column('attachments', 'blob_id')
+    op.drop_index(op.f('ix_attachments_storage_key'), table_name='attachments')
+    op.create_unique_constraint('attachments_storage_key_key', 'attachments', ['storage_key'])
+
+    op.drop_index('ix_attachment_blobs_unreferenced', table_name='attachment_blobs')
+    op.drop_index(op.f('ix_attachment_blobs_id'), table_name='attachment_blobs')
+    op.drop_table('attachment_blobs')
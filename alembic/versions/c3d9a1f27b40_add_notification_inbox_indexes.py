@@ -0,0 +1,36 @@
+"""Add notification inbox indexes
+
+Revision ID: c3d9a1f27b40
+Revises: 583c069fca2e
+Create Date: 2026-10-19 09:12:40.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3d9a1f27b40'
+down_revision = '583c069fca2e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_notifications_user_created_id',
+        'notifications',
+        ['user_id', 'created_at', 'id'],
+        unique=False
+    )
+    op.create_index(
+        'ix_notifications_read_created',
+        'notifications',
+        ['is_read', 'created_at'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_notifications_read_created', table_name='notifications')
+    op.drop_index('ix_notifications_user_created_id', table_name='notifications')
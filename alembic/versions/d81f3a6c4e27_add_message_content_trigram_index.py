@@ -0,0 +1,51 @@
+"""Add message content trigram index
+
+Revision ID: d81f3a6c4e27
+Revises: 7c2e5f1a9b34
+Create Date: 2026-10-19 16:05:44.120398
+
+需要 pg_trgm 扩展。PostgreSQL 13 起有数据库 CREATE 权限的用户即可创建（受信任扩展），更早的版本需要超级用户；
+迁移用户没有权限时，先由管理员在目标数据库中执行 CREATE EXTENSION pg_trgm; 再运行迁移。
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd81f3a6c4e27'
+down_revision = '7c2e5f1a9b34'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # 关键词检索使用 ILIKE '%词%'，只有 PostgreSQL 的 pg_trgm GIN 索引能加速
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    installed = bind.execute(sa.text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar()
+    if not installed:
+        try:
+            # 在保存点中创建，失败时不会让整个迁移事务进入中止状态
+            with bind.begin_nested():
+                bind.execute(sa.text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        except sa.exc.DBAPIError as e:
+            raise RuntimeError(
+                "The pg_trgm extension is missing and the migration user cannot create it. "
+                "Ask a database superuser to run 'CREATE EXTENSION pg_trgm;' in this database, "
+                "then run the migration again."
+            ) from e
+    op.create_index(
+        'ix_messages_content_trgm',
+        'messages',
+        ['content'],
+        unique=False,
+        postgresql_using='gin',
+        postgresql_ops={'content': 'gin_trgm_ops'}
+    )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_messages_content_trgm', table_name='messages')
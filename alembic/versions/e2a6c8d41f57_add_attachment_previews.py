@@ -0,0 +1,51 @@
+"""Add attachment previews
+
+Revision ID: e2a6c8d41f57
+Revises: 9c4f7a2e6b13
+Create Date: 2026-10-19 22:05:43.610928
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a6c8d41f57'
+down_revision = '9c4f7a2e6b13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('attachment_blobs', sa.Column('preview_status', sa.String(length=20), nullable=True))
+    op.add_column('attachment_blobs', sa.Column('preview_claimed_at', sa.DateTime(timezone=True), nullable=True))
+    op.create_index(op.f('ix_attachment_blobs_preview_status'), 'attachment_blobs', ['preview_status'], unique=False)
+
+    op.create_table(
+        'attachment_previews',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('blob_id', sa.Integer(), nullable=False),
+        sa.Column('variant', sa.String(length=20), nullable=False),
+        sa.Column('content_type', sa.String(length=50), nullable=False),
+        sa.Column('width', sa.Integer(), nullable=False),
+        sa.Column('height', sa.Integer(), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('storage_key', sa.String(length=255), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['blob_id'], ['attachment_blobs.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('blob_id', 'variant', name='uq_attachment_previews_blob_variant'),
+        sa.UniqueConstraint('storage_key')
+    )
+    op.create_index(op.f('ix_attachment_previews_id'), 'attachment_previews', ['id'], unique=False)
+    op.create_index(op.f('ix_attachment_previews_blob_id'), 'attachment_previews', ['blob_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_attachment_previews_blob_id'), table_name='attachment_previews')
+    op.drop_index(op.f('ix_attachment_previews_id'), table_name='attachment_previews')
+    op.drop_table('attachment_previews')
+
+    op.drop_index(op.f('ix_attachment_blobs_preview_status'), table_name='attachment_blobs')
+    op.drop_column('attachment_blobs', 'preview_claimed_at')
+    op.drop_column('attachment_blobs', 'preview_status')
@@ -0,0 +1,36 @@
+"""Add AI task execution columns
+
+Revision ID: e6f04b8a3c15
+Revises: 9a51e3c7f2d8
+Create Date: 2026-10-19 13:41:52.906337
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6f04b8a3c15'
+down_revision = '9a51e3c7f2d8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('ai_tasks', sa.Column('attempts', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('ai_tasks', sa.Column('max_attempts', sa.Integer(), server_default='3', nullable=False))
+    op.add_column('ai_tasks', sa.Column('next_run_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('ai_tasks', sa.Column('cancel_requested', sa.Boolean(), server_default=sa.false(), nullable=False))
+    op.add_column('ai_tasks', sa.Column('locked_by', sa.String(length=100), nullable=True))
+    op.add_column('ai_tasks', sa.Column('heartbeat_at', sa.DateTime(timezone=True), nullable=True))
+    op.create_index('ix_ai_tasks_status_next_run', 'ai_tasks', ['status', 'next_run_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_ai_tasks_status_next_run', table_name='ai_tasks')
+    op.drop_column('ai_tasks', 'heartbeat_at')
+    op.drop_column('ai_tasks', 'locked_by')
+    op.drop_column('ai_tasks', 'cancel_requested')
+    op.drop_column('ai_tasks', 'next_run_at')
+    op.drop_column('ai_tasks', 'max_attempts')
+    op.drop_column('ai_tasks', 'attempts')
@@ -3,7 +3,7 @@ API v1 路由
 """
 from fastapi import APIRouter
 
-from app.api.v1 import auth, users, teams, channels, messages, notifications
+from app.api.v1 import auth, users, teams, channels, messages, notifications, attachments, profiling
 from app.routers import ai
 
 api_router = APIRouter()
@@ -14,4 +14,6 @@ api_router.include_router(teams.router, prefix="/teams", tags=["团队"])
 api_router.include_router(channels.router, prefix="/channels", tags=["频道"])
 api_router.include_router(messages.router, prefix="/messages", tags=["消息"])
 api_router.include_router(notifications.router, prefix="/notifications", tags=["通知"])
-api_router.include_router(ai.router, prefix="/ai", tags=["AI智能功能"]) 
\ No newline at end of file
+api_router.include_router(attachments.router, prefix="/attachments", tags=["附件"])
+api_router.include_router(ai.router, prefix="/ai", tags=["AI智能功能"])
+api_router.include_router(profiling.router, prefix="/profiling", tags=["性能分析"]) 
\ No newline at end of file
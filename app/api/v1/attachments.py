@@ -0,0 +1,406 @@
+"""
+附件API路由
+"""
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.auth.auth import get_current_active_user
+from app.database.database import get_db
+from app.models.attachment import Attachment
+from app.models.user import User
+from app.schemas.attachment import (
+    AttachmentHashCheck, AttachmentResponse, AttachmentUploadCreate, DirectUploadResponse, UploadPartResponse,
+    UploadSessionResponse
+)
+from app.services.attachment_service import AttachmentService, AttachmentTooLarge, limit_size
+from app.services.object_store import LocalObjectStore, get_object_store
+from app.utils.config import config
+
+router = APIRouter()
+
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+
+
+def _error(e: Exception) -> HTTPException:
+    if isinstance(e, AttachmentTooLarge):
+        return HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    if isinstance(e, PermissionError):
+        return HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=str(e))
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析 Range 请求头，返回 (start, end)，包含 end
+
+    只支持单个字节范围；格式不对或请求多个范围时返回 None（按完整内容响应），范围超出文件时抛出 ValueError。
+    """
+    unit, _, spec = header.partition("=")
+    first, separator, last = spec.strip().partition("-")
+    if unit.strip().lower() != "bytes" or not separator or "," in spec:
+        return None
+    if not (first.isdigit() or first == "") or not (last.isdigit() or last == "") or first == last == "":
+        return None
+    if first:
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # bytes=-N：最后 N 个字节
+        if int(last) == 0:
+            raise ValueError("Range not satisfiable")
+        start, end = max(size - int(last), 0), size - 1
+    if start >= size:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match 是否包含 etag（弱比较）"""
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def _requested_range(request: Request, etag: str, size: int) -> Optional[Tuple[int, int]]:
+    """请求的字节范围；If-Range 与当前 ETag 不一致时忽略 Range，返回完整内容"""
+    header = request.headers.get("range")
+    if header is None:
+        return None
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range.strip() != etag:
+        return None
+    return _parse_range(header, size)
+
+
+def _range_not_satisfiable(size: int) -> Response:
+    return Response(
+        status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+        headers={"Content-Range": f"bytes */{size}"}
+    )
+
+
+def _partial_headers(headers: Dict[str, str], start: int, end: int, size: int) -> Dict[str, str]:
+    return {**headers, "Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(end - start + 1)}
+
+
+async def _get_upload(service: AttachmentService, attachment_id: int, user_id: int) -> Attachment:
+    attachment = await service.get_upload(attachment_id, user_id)
+    if attachment is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    return attachment
+
+
+async def _get_readable(service: AttachmentService, attachment_id: int, user_id: int) -> Attachment:
+    try:
+        attachment = await service.get_attachment(attachment_id, user_id)
+    except PermissionError as e:
+        raise _error(e)
+    if attachment is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Attachment not found")
+    return attachment
+
+
+async def _serve(
+    request: Request, service: AttachmentService, storage_key: str, content_type: str, file_name: str
+) -> Response:
+    """
+    发送附件或预览的内容
+
+    支持 Range（视频拖动进度、断点续传下载）和 If-None-Match（浏览器缓存未变化时返回304）。
+    小文件从内存缓存返回；本地存储的完整文件交给服务器发送，范围请求由本服务读取对应字节；S3 存储重定向到预签名地址，文件内容不经过本服务。
+    """
+    try:
+        info = await service.get_object_info(storage_key)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+    etag = f'"{info.etag}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={config.attachments.cache_max_age}",
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"inline; filename*=utf-8''{quote(file_name)}",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and _etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    data = await service.read_hot(storage_key, info)
+    if data is not None:
+        try:
+            byte_range = _requested_range(request, etag, info.size)
+        except ValueError:
+            return _range_not_satisfiable(info.size)
+        if byte_range is None:
+            return Response(data, media_type=content_type, headers=headers)
+        start, end = byte_range
+        return Response(
+            data[start:end + 1],
+            status_code=status.HTTP_206_PARTIAL_CONTENT,
+            media_type=content_type,
+            headers=_partial_headers(headers, start, end, info.size)
+        )
+
+    path = service.store.local_path(storage_key)
+    if path is None and config.attachments.download_redirect:
+        presigned = service.presign_download(storage_key)
+        return RedirectResponse(
+            presigned.url,
+            status_code=status.HTTP_302_FOUND,
+            headers={"Cache-Control": f"private, max-age={config.attachments.presign_expiry // 4}"}
+        )
+
+    try:
+        byte_range = _requested_range(request, etag, info.size)
+    except ValueError:
+        return _range_not_satisfiable(info.size)
+    if byte_range is None:
+        if path is not None:
+            # 完整内容交给 FileResponse；服务器支持 http.response.pathsend 扩展时由服务器直接发送文件
+            return FileResponse(path, media_type=content_type, headers=headers)
+        return StreamingResponse(
+            service.open(storage_key),
+            media_type=content_type,
+            headers={**headers, "Content-Length": str(info.size)}
+        )
+    # 范围请求自己处理，不依赖 FileResponse：较旧的 Starlette 会忽略 Range 返回完整文件
+    start, end = byte_range
+    return StreamingResponse(
+        service.open(storage_key, start, end),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=content_type,
+        headers=_partial_headers(headers, start, end, info.size)
+    )
+
+
+@router.post("", response_model=AttachmentResponse, status_code=status.HTTP_201_CREATED)
+async def upload_attachment(
+    request: Request,
+    name: str = Query(..., min_length=1, max_length=255, description="文件名"),
+    content_type: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    流式上传文件
+
+    请求体就是文件内容（不使用 multipart/form-data），边接收边写入对象存储
+    """
+    service = AttachmentService(db)
+    try:
+        return await service.upload(current_user.id, name, content_type or DEFAULT_CONTENT_TYPE, request.stream())
+    except ValueError as e:
+        raise _error(e)
+
+
+@router.post("/instant", response_model=AttachmentResponse, status_code=status.HTTP_201_CREATED)
+async def create_from_hash(
+    check: AttachmentHashCheck,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """秒传：当前用户能访问的相同内容已存在时直接创建附件；返回404时客户端再正常上传"""
+    service = AttachmentService(db)
+    try:
+        attachment = await service.create_from_hash(
+            current_user.id, check.file_name, check.content_type, check.sha256, check.size
+        )
+    except ValueError as e:
+        raise _error(e)
+    if attachment is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Content not found, upload the file")
+    return attachment
+
+
+@router.post("/uploads", response_model=UploadSessionResponse, status_code=status.HTTP_201_CREATED)
+async def create_upload(
+    upload: AttachmentUploadCreate,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """开始断点续传：按返回的 part_size 切分文件，分片编号从1开始"""
+    service = AttachmentService(db)
+    try:
+        attachment = await service.create_upload(current_user.id, upload.file_name, upload.content_type, upload.size)
+    except ValueError as e:
+        raise _error(e)
+    return UploadSessionResponse(attachment=attachment, part_size=service.part_size)
+
+
+@router.get("/uploads/{attachment_id}", response_model=UploadSessionResponse)
+async def get_upload(
+    attachment_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """查询上传进度，返回已上传的分片"""
+    service = AttachmentService(db)
+    attachment = await _get_upload(service, attachment_id, current_user.id)
+    parts = await service.list_parts(attachment)
+    return UploadSessionResponse(
+        attachment=attachment,
+        part_size=service.part_size,
+        parts=[UploadPartResponse(part_number=part.part_number, etag=part.etag, size=part.size) for part in parts]
+    )
+
+
+@router.put("/uploads/{attachment_id}/parts/{part_number}", response_model=UploadPartResponse)
+async def upload_part(
+    attachment_id: int,
+    part_number: int,
+    request: Request,
+    content_length: Optional[int] = Header(None),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """上传一个分片（请求体就是分片内容）；重复上传同一编号会覆盖"""
+    service = AttachmentService(db)
+    attachment = await _get_upload(service, attachment_id, current_user.id)
+    try:
+        part = await service.upload_part(attachment, part_number, request.stream(), content_length)
+    except ValueError as e:
+        raise _error(e)
+    return UploadPartResponse(part_number=part.part_number, etag=part.etag, size=part.size)
+
+
+@router.post("/uploads/{attachment_id}/complete", response_model=AttachmentResponse)
+async def complete_upload(
+    attachment_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """合并分片，完成上传"""
+    service = AttachmentService(db)
+    attachment = await _get_upload(service, attachment_id, current_user.id)
+    try:
+        return await service.complete_upload(attachment)
+    except ValueError as e:
+        raise _error(e)
+
+
+@router.delete("/uploads/{attachment_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def abort_upload(
+    attachment_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """取消上传"""
+    service = AttachmentService(db)
+    attachment = await _get_upload(service, attachment_id, current_user.id)
+    await service.abort_upload(attachment)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.post("/direct", response_model=DirectUploadResponse, status_code=status.HTTP_201_CREATED)
+async def create_direct_upload(
+    upload: AttachmentUploadCreate,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """签发预签名上传地址，客户端直接上传到对象存储后调用完成接口"""
+    if upload.size is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="File size is required")
+    service = AttachmentService(db)
+    try:
+        attachment, presigned = await service.create_direct_upload(
+            current_user.id, upload.file_name, upload.content_type, upload.size
+        )
+    except ValueError as e:
+        raise _error(e)
+    return DirectUploadResponse(
+        attachment=attachment,
+        method=presigned.method,
+        url=presigned.url,
+        headers=presigned.headers,
+        expires_at=presigned.expires_at
+    )
+
+
+@router.post("/direct/{attachment_id}/complete", response_model=AttachmentResponse)
+async def complete_direct_upload(
+    attachment_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """确认直传完成"""
+    service = AttachmentService(db)
+    attachment = await _get_upload(service, attachment_id, current_user.id)
+    try:
+        return await service.complete_direct_upload(attachment)
+    except ValueError as e:
+        raise _error(e)
+
+
+@router.put("/local/{key:path}", status_code=status.HTTP_204_NO_CONTENT)
+async def put_local_object(
+    key: str,
+    request: Request,
+    expires: int = Query(...),
+    signature: str = Query(...),
+    content_type: Optional[str] = Header(None),
+    content_length: Optional[int] = Header(None)
+):
+    """
+    本地存储的预签名上传地址
+
+    只在使用本地存储（开发和测试）时可用，凭签名而不是登录状态授权。
+    签名绑定了 Content-Length，请求体超过该长度时中止，不会写入比申请时更大的文件。
+    """
+    store = get_object_store()
+    if not isinstance(store, LocalObjectStore):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+    if not store.verify("PUT", key, expires, signature, content_type, content_length):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid or expired signature")
+    max_size = config.attachments.max_size if content_length is None else content_length
+    try:
+        await store.put(key, limit_size(request.stream(), max_size), content_type)
+    except AttachmentTooLarge as e:
+        raise _error(e)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+@router.get("/{attachment_id}", response_model=AttachmentResponse)
+async def get_attachment(
+    attachment_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """获取附件信息"""
+    return await _get_readable(AttachmentService(db), attachment_id, current_user.id)
+
+
+@router.get("/{attachment_id}/download")
+async def download_attachment(
+    attachment_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """下载附件"""
+    service = AttachmentService(db)
+    attachment = await _get_readable(service, attachment_id, current_user.id)
+    return await _serve(request, service, attachment.storage_key, attachment.content_type, attachment.file_name)
+
+
+@router.get("/{attachment_id}/previews/{variant}")
+async def download_preview(
+    attachment_id: int,
+    variant: str,
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """下载附件的预览（缩略图或 PDF 首页），可用的档位见附件或消息的 previews"""
+    service = AttachmentService(db)
+    attachment = await _get_readable(service, attachment_id, current_user.id)
+    preview = await service.get_preview(attachment, variant)
+    if preview is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Preview not found")
+    stem = attachment.file_name.rsplit(".", 1)[0]
+    return await _serve(request, service, preview.storage_key, preview.content_type, f"{stem}-{variant}.webp")
@@ -78,6 +78,8 @@ async def create_message(
                     "attachment_type": message.attachment_type,
                     "attachment_name": message.attachment_name,
                     "attachment_size": message.attachment_size,
+                    "attachment_id": message.attachment_id,
+                    "attachment_previews": message.attachment_previews,
                     "created_at": message.created_at.isoformat(),
                     "updated_at": message.updated_at.isoformat(),
                     "author": {
@@ -1,33 +1,44 @@
 """
 通知API路由
 """
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.auth.auth import get_current_active_user
 from app.database.database import get_db
 from app.models.user import User
 from app.schemas.notification import NotificationResponse, NotificationUpdate
-from app.services.notification_service import NotificationService
+from app.services.notification_service import NotificationService, encode_notification_cursor
 
 router = APIRouter()
 
 
 @router.get("", response_model=List[NotificationResponse])
 async def get_notifications(
+    response: Response,
     unread_only: bool = Query(False, description="Only return unread notifications"),
     skip: int = Query(0, ge=0),
     limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header of the previous page"),
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    """获取用户通知列表"""
+    """获取用户通知列表（下一页游标通过 X-Next-Cursor 响应头返回）"""
     notification_service = NotificationService(db)
-    notifications = await notification_service.get_user_notifications(
-        current_user.id, skip=skip, limit=limit, unread_only=unread_only
-    )
+    try:
+        notifications = await notification_service.get_user_notifications(
+            current_user.id, skip=skip, limit=limit, unread_only=unread_only, cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    if len(notifications) == limit:
+        response.headers["X-Next-Cursor"] = encode_notification_cursor(notifications[-1])
     return notifications
 
 
@@ -0,0 +1,85 @@
+"""
+性能分析API路由（仅限 monitoring.profiling_admins 中配置的用户）
+
+请求由负载均衡分到某个 worker，分析的是处理该请求的 worker；响应头 X-Worker-Pid 为其进程号。
+每个分析都在一个请求内完成；单请求分析结果保存在各 worker 共享的目录中，可由任意 worker 取回。
+"""
+import os
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+
+from app.auth.auth import get_current_active_user
+from app.models.user import User
+from app.utils.config import config
+from app.utils.profiling import DEFAULT_SAMPLE_INTERVAL, cpu_profiler, is_profiling_admin, memory_profiler, request_profiles
+
+router = APIRouter()
+
+
+async def get_profiling_admin(current_user: User = Depends(get_current_active_user)) -> User:
+    """只允许配置中的管理员使用性能分析接口"""
+    if not is_profiling_admin(current_user.username):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    return current_user
+
+
+def _worker_headers() -> dict:
+    return {"X-Worker-Pid": str(os.getpid())}
+
+
+@router.get("/cpu")
+async def profile_cpu(
+    seconds: float = Query(10.0, gt=0, le=config.monitoring.profile_max_seconds),
+    interval: float = Query(DEFAULT_SAMPLE_INTERVAL, gt=0, le=1),
+    current_user: User = Depends(get_profiling_admin)
+):
+    """对当前 worker 的事件循环线程采样 seconds 秒，返回折叠栈（可用 flamegraph.pl / speedscope 打开）"""
+    try:
+        collapsed = await cpu_profiler.sample(seconds, interval)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return Response(collapsed, media_type="text/plain", headers=_worker_headers())
+
+
+@router.get("/requests/{profile_id}")
+async def get_request_profile(
+    profile_id: str,
+    format: str = Query("text", pattern="^(text|pstats)$"),
+    sort: str = Query("cumulative"),
+    limit: int = Query(50, ge=1, le=1000),
+    current_user: User = Depends(get_profiling_admin)
+):
+    """取回带 X-Profile 请求头的请求的 cProfile 结果：text 为文本报告，pstats 为 pstats 文件"""
+    try:
+        content = await request_profiles.render(profile_id, format, sort, limit)
+    except KeyError as e:
+        # pstats 不认识的排序字段
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unsupported sort key: {e}")
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    if format == "pstats":
+        return Response(
+            content,
+            media_type="application/octet-stream",
+            headers={**_worker_headers(), "Content-Disposition": f'attachment; filename="{profile_id}.pstats"'},
+        )
+    return Response(content, media_type="text/plain", headers=_worker_headers())
+
+
+@router.get("/memory")
+async def profile_memory(
+    seconds: float = Query(10.0, gt=0, le=config.monitoring.profile_max_seconds),
+    frames: int = Query(1, ge=1, le=64),
+    key_type: str = Query("lineno", pattern="^(lineno|filename|traceback)$"),
+    limit: int = Query(20, ge=1, le=500),
+    current_user: User = Depends(get_profiling_admin)
+):
+    """在当前 worker 上追踪内存分配 seconds 秒，返回这段时间内新增且仍未释放的分配最多的位置"""
+    try:
+        diff = await memory_profiler.growth(seconds, frames, key_type, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {"seconds": seconds, "pid": os.getpid(), "diff": diff}
@@ -12,7 +12,7 @@ from app.models.user import User
 from app.models.team_member import TeamRole
 from app.schemas.team import (
     TeamCreate, TeamUpdate, TeamResponse, TeamSummary,
-    TeamMemberAdd, TeamMemberUpdate, TeamMemberResponse, TeamStats
+    TeamMemberAdd, TeamMemberUpdate, TeamMemberResponse, TeamStats, TeamAnnouncementCreate
 )
 from app.services.team_service import TeamService
 
@@ -270,6 +270,33 @@ async def update_member_role(
         )
 
 
+@router.post("/{team_id}/announcements", status_code=status.HTTP_202_ACCEPTED)
+async def create_team_announcement(
+    team_id: int,
+    announcement: TeamAnnouncementCreate,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """发送团队公告（通知全体成员）"""
+    team_service = TeamService(db)
+    
+    try:
+        recipients = await team_service.announce(
+            team_id, current_user.id, announcement.title, announcement.message
+        )
+        if recipients is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Team not found"
+            )
+        return {"message": "公告已发送", "recipients": recipients}
+    except PermissionError as e:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=str(e)
+        )
+
+
 @router.get("/search", response_model=List[TeamSummary])
 async def search_teams(
     q: str = Query(..., min_length=1),
@@ -0,0 +1,53 @@
+"""
+附件垃圾回收
+
+删除没有消息引用、超过保留期的文件内容，并取消超过有效期仍未完成的上传（删除已上传的分片和临时文件），
+建议用 cron 定期运行：
+
+    python -m app.attachment_gc --batch-size 500
+
+多个进程同时运行时各自跳过其他进程已锁定的记录。
+"""
+import argparse
+import asyncio
+import logging
+from typing import Optional, Tuple
+
+from app.database.database import AsyncSessionLocal
+from app.services.attachment_service import AttachmentService
+from app.services.object_store import close_object_store
+from app.utils.config import config, load_config
+
+logger = logging.getLogger(__name__)
+
+
+async def collect_garbage(batch_size: int, grace_seconds: int, upload_expiry: Optional[int] = None) -> Tuple[int, int]:
+    """返回 (取消的过期上传数, 删除的文件内容数)"""
+    try:
+        async with AsyncSessionLocal() as db:
+            service = AttachmentService(db)
+            expired = await service.expire_uploads(batch_size=batch_size, max_age=upload_expiry)
+            deleted = await service.collect_garbage(batch_size=batch_size, grace_seconds=grace_seconds)
+            return expired, deleted
+    finally:
+        await close_object_store()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    load_config()
+
+    parser = argparse.ArgumentParser(description="删除无引用的附件内容和过期未完成的上传")
+    parser.add_argument("--batch-size", type=int, default=config.attachments.gc_batch_size, help="每批删除的数量")
+    parser.add_argument("--grace", type=int, default=config.attachments.gc_grace, help="保留期（秒）")
+    parser.add_argument(
+        "--upload-expiry", type=int, default=config.attachments.upload_expiry, help="未完成上传的有效期（秒）"
+    )
+    args = parser.parse_args()
+
+    expired, deleted = asyncio.run(collect_garbage(args.batch_size, args.grace, args.upload_expiry))
+    logger.info(f"共取消 {expired} 个过期上传，删除 {deleted} 个文件")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,10 +9,10 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database.database import get_db
+from app.database.database import bind_session_user, get_db
 from app.models.user import User
 from app.schemas.auth import TokenData
-from app.utils.password import verify_password, get_password_hash
+from app.utils.password import verify_password_async, get_password_hash
 
 # JWT配置
 SECRET_KEY = "your-secret-key-here"  # 生产环境应该从环境变量获取
@@ -49,7 +49,7 @@ async def authenticate_user(
     user = await user_service.get_user_by_username(username)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password_async(password, user.hashed_password):
         return None
     return user
 
@@ -79,6 +79,7 @@ async def get_current_user(
     user = await user_service.get_user_by_username(username=token_data.username or "")
     if user is None:
         raise credentials_exception
+    bind_session_user(db, user.id)
     return user
 
 
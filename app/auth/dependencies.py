@@ -5,7 +5,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError, jwt
 
 from app.utils.config import config
-from app.database.database import get_db
+from app.database.database import bind_session_user, get_db
 from app.services.user_service import UserService
 from app.auth.auth import SECRET_KEY, ALGORITHM
 
@@ -39,6 +39,7 @@ async def get_current_user(
     user = await user_service.get_user_by_username(username)
     if user is None:
         raise credentials_exception
+    bind_session_user(db, user.id)
     return user
 
 
@@ -58,4 +59,6 @@ async def verify_websocket_token(token: str, db: AsyncSession) -> Optional[objec
     
     user_service = UserService(db)
     user = await user_service.get_user_by_username(username)
+    if user is not None:
+        bind_session_user(db, user.id)
     return user 
\ No newline at end of file
@@ -1,14 +1,21 @@
 """
 数据库连接和会话管理
 """
+import asyncio
+import functools
 import logging
-from typing import AsyncGenerator
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import AsyncGenerator, Dict, Iterator, Optional, Set
 
-from sqlalchemy import create_engine
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
-from sqlalchemy.orm import DeclarativeBase, sessionmaker
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import DeclarativeBase, Session, sessionmaker
+from sqlalchemy.sql.dml import UpdateBase
 
 from app.utils.config import config
+from app.utils.metrics import DB_POOL_CHECKED_OUT, DB_POOL_IDLE, metrics_registry
 
 logger = logging.getLogger(__name__)
 
@@ -38,6 +45,157 @@ async_engine = create_async_engine(
     connect_args={"server_settings": {"search_path": config.database.schema}}
 )
 
+# 只读副本引擎（未配置副本时为 None，所有查询走主库）
+async_replica_engine: Optional[AsyncEngine] = None
+if config.database.replica_url:
+    async_replica_engine = create_async_engine(
+        config.database.replica_url.replace("postgresql://", "postgresql+asyncpg://"),
+        echo=True if config.service.env == "local" else False,
+        pool_size=20,
+        max_overflow=0,
+        pool_pre_ping=True,
+        connect_args={"server_settings": {"search_path": config.database.schema}}
+    )
+
+
+def _pool_collector(name: str, engine: AsyncEngine):
+    checked_out = DB_POOL_CHECKED_OUT.labels(name)
+    idle = DB_POOL_IDLE.labels(name)
+
+    def collect() -> None:
+        pool = engine.sync_engine.pool
+        checked_out.set(pool.checkedout())
+        idle.set(pool.checkedin())
+
+    return collect
+
+
+# 导出指标时读取连接池状态
+metrics_registry.register_collector(_pool_collector("primary", async_engine))
+if async_replica_engine is not None:
+    metrics_registry.register_collector(_pool_collector("replica", async_replica_engine))
+
+
+# 最近写入过的用户: {user_id: 最后一次提交写操作的 monotonic 时间}
+# 注意：这是进程内状态，多 worker 部署时只对同一进程内的后续请求生效；
+# 用户写入后被负载均衡分到其他 worker 的读请求仍可能在复制延迟窗口内读到副本上的旧数据
+_recent_writers: Dict[int, float] = {}
+# 上次清理过期记录的 monotonic 时间
+_last_pruned = 0.0
+
+
+def mark_user_write(user_id: int) -> None:
+    """记录用户刚刚提交了写操作；每个保护窗口清理一次过期的记录，写过一次就不再读的用户不会一直占用内存"""
+    global _last_pruned
+    now = time.monotonic()
+    _recent_writers[user_id] = now
+    window = config.database.replica_lag_window
+    if now - _last_pruned >= window:
+        _last_pruned = now
+        for expired in [uid for uid, written_at in _recent_writers.items() if now - written_at > window]:
+            del _recent_writers[expired]
+
+
+def is_recent_writer(user_id: Optional[int]) -> bool:
+    """用户是否仍处于复制延迟保护窗口内"""
+    if user_id is None:
+        return False
+    written_at = _recent_writers.get(user_id)
+    if written_at is None:
+        return False
+    if time.monotonic() - written_at > config.database.replica_lag_window:
+        del _recent_writers[user_id]
+        return False
+    return True
+
+
+class RoutingSession(Session):
+    """
+    读写分离会话
+
+    默认所有语句都走主库；只有在 replica_reads() 标记的只读区间内、
+    不在 flush 中、不是 DML 语句，并且当前用户不在复制延迟保护窗口内时，才路由到只读副本。
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica_bind = self.info.get("replica_bind")
+        if (
+            replica_bind is not None
+            and self.info.get("read_only", 0) > 0
+            and not self._flushing
+            and not isinstance(clause, UpdateBase)
+            and not is_recent_writer(self.info.get("user_id"))
+        ):
+            return replica_bind
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _record_flush_write(session, flush_context):
+    session.info["has_writes"] = True
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _record_dml_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["has_writes"] = True
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _record_user_write(session):
+    if session.info.pop("has_writes", False) and session.info.get("user_id") is not None:
+        mark_user_write(session.info["user_id"])
+
+
+@event.listens_for(RoutingSession, "after_rollback")
+def _discard_writes(session):
+    session.info.pop("has_writes", None)
+
+
+def create_routing_sessionmaker(
+    primary: AsyncEngine,
+    replica: Optional[AsyncEngine] = None,
+) -> async_sessionmaker:
+    """创建读写分离的异步会话工厂"""
+    return async_sessionmaker(
+        bind=primary,
+        class_=AsyncSession,
+        sync_session_class=RoutingSession,
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+        info={"replica_bind": replica.sync_engine if replica is not None else None},
+    )
+
+
+@contextmanager
+def replica_reads(db: AsyncSession) -> Iterator[None]:
+    """在该区间内允许会话把只读查询路由到副本（可嵌套）"""
+    db.info["read_only"] = db.info.get("read_only", 0) + 1
+    try:
+        yield
+    finally:
+        db.info["read_only"] -= 1
+
+
+def read_only(method):
+    """
+    标记服务方法为只读，方法内的查询可以走只读副本
+
+    被装饰的方法必须定义在持有 self.db 的服务类上。
+    """
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        with replica_reads(self.db):
+            return await method(self, *args, **kwargs)
+    return wrapper
+
+
+def bind_session_user(db: AsyncSession, user_id: int) -> None:
+    """把当前请求的用户绑定到会话，用于复制延迟保护"""
+    db.info["user_id"] = user_id
+
+
 # 会话工厂
 SessionLocal = sessionmaker(
     bind=sync_engine,
@@ -45,13 +203,7 @@ SessionLocal = sessionmaker(
     autoflush=False,
 )
 
-AsyncSessionLocal = async_sessionmaker(
-    bind=async_engine,
-    class_=AsyncSession,
-    autocommit=False,
-    autoflush=False,
-    expire_on_commit=False,
-)
+AsyncSessionLocal = create_routing_sessionmaker(async_engine, async_replica_engine)
 
 
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
@@ -67,19 +219,71 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
             await session.close()
 
 
+ALEMBIC_INI_PATH = Path(__file__).resolve().parents[2] / "alembic.ini"
+
+# 预启动（pre-fork）时由主进程完成结构检查后置为 True，worker 进程不再重复检查
+schema_ready = False
+
+
+def _alembic_head_revisions() -> Set[str]:
+    """读取迁移脚本目录中的 head 版本"""
+    from alembic.config import Config as AlembicConfig
+    from alembic.script import ScriptDirectory
+
+    alembic_config = AlembicConfig(str(ALEMBIC_INI_PATH))
+    alembic_config.set_main_option("script_location", str(ALEMBIC_INI_PATH.parent / "alembic"))
+    return set(ScriptDirectory.from_config(alembic_config).get_heads())
+
+
+def _current_revisions(sync_conn) -> Set[str]:
+    from alembic.runtime.migration import MigrationContext
+
+    return set(MigrationContext.configure(sync_conn).get_current_heads())
+
+
 async def init_db() -> None:
-    """初始化数据库"""
+    """初始化数据库（数据库已迁移到最新版本时跳过建表）"""
+    global schema_ready
+    if schema_ready:
+        return
     try:
-        # 测试数据库连接
         async with async_engine.begin() as conn:
-            await conn.run_sync(Base.metadata.create_all)
-        logger.info("Database initialized successfully")
+            current = await conn.run_sync(_current_revisions)
+            heads = _alembic_head_revisions()
+            if current and current == heads:
+                logger.info(f"Database schema at alembic head {sorted(heads)}, skipping create_all")
+            else:
+                await conn.run_sync(Base.metadata.create_all)
+                logger.info("Database initialized successfully")
+        schema_ready = True
     except Exception as e:
         logger.error(f"Database initialization failed: {e}")
         raise
 
 
+async def warm_up_pool(engine: AsyncEngine, connections: int) -> None:
+    """并发建立连接填充连接池，避免第一批请求承担建连开销"""
+    async def _ping() -> None:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(_ping() for _ in range(connections)))
+
+
+async def warm_up_db() -> None:
+    """预热主库和只读副本的连接池"""
+    connections = config.database.pool_warmup
+    if connections <= 0:
+        return
+    await warm_up_pool(async_engine, connections)
+    if async_replica_engine is not None:
+        await warm_up_pool(async_replica_engine, connections)
+    logger.info(f"Database pools warmed up with {connections} connections")
+
+
 async def close_db() -> None:
     """关闭数据库连接"""
     await async_engine.dispose()
-    logger.info("Database connections closed") 
\ No newline at end of file
+    if async_replica_engine is not None:
+        await async_replica_engine.dispose()
+    logger.info("Database connections closed")
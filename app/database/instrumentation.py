@@ -0,0 +1,209 @@
+"""
+SQL 语句统计
+
+基于 SQLAlchemy 引擎事件，按 HTTP 请求和 WebSocket 命令统计执行的语句数量和耗时：
+
+- 同一语句（参数化后的 SQL 文本相同）在一次请求中执行多次时报告为疑似 N+1 查询；
+- 响应头 Server-Timing 返回数据库耗时和语句数，浏览器开发者工具中可以直接看到；
+- 慢请求和疑似 N+1 的请求记录日志，附带耗时最多的几条语句；
+- 测试中可以用 query_budget() 限定一段代码最多执行多少条语句；
+- 所有语句的耗时按操作类型计入 db_query_duration_seconds 指标。
+
+统计对象放在 contextvar 中，可以嵌套：外层（如测试中的 query_budget）同样统计内层请求执行的语句。
+"""
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.utils.config import config
+from app.utils.metrics import DB_QUERY_DURATION
+
+logger = logging.getLogger(__name__)
+
+# 日志中列出的语句数
+TOP_STATEMENTS = 5
+# 日志中语句的最大长度
+STATEMENT_PREVIEW_LENGTH = 300
+
+# 按 SQL 的前六个字符区分操作类型
+_OPERATION_DURATIONS = {operation: DB_QUERY_DURATION.labels(operation) for operation in ("select", "insert", "update", "delete")}
+_OTHER_DURATION = DB_QUERY_DURATION.labels("other")
+
+_active: ContextVar[Tuple["QueryStats", ...]] = ContextVar("query_stats", default=())
+
+
+@dataclass
+class StatementStats:
+    count: int = 0
+    duration: float = 0.0
+
+
+@dataclass
+class QueryStats:
+    """一次请求（或一段代码）执行的语句"""
+    name: str
+    started_at: float = field(default_factory=time.perf_counter)
+    finished_at: Optional[float] = None
+    count: int = 0
+    duration: float = 0.0
+    # {SQL 文本: 统计}
+    statements: Dict[str, StatementStats] = field(default_factory=dict)
+
+    def record(self, statement: str, duration: float) -> None:
+        # 请求结束后，请求中创建的后台任务继承了同一个上下文，它们执行的语句不再计入
+        if self.finished_at is not None:
+            return
+        self.count += 1
+        self.duration += duration
+        stats = self.statements.get(statement)
+        if stats is None:
+            stats = self.statements[statement] = StatementStats()
+        stats.count += 1
+        stats.duration += duration
+
+    def finish(self) -> None:
+        if self.finished_at is None:
+            self.finished_at = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    def n_plus_one_suspects(self, threshold: Optional[int] = None) -> List[Tuple[str, StatementStats]]:
+        """执行次数不少于 threshold 的语句，按次数从多到少"""
+        threshold = threshold or config.monitoring.n_plus_one_threshold
+        suspects = [(statement, stats) for statement, stats in self.statements.items() if stats.count >= threshold]
+        return sorted(suspects, key=lambda item: item[1].count, reverse=True)
+
+    def top_statements(self, limit: int = TOP_STATEMENTS) -> List[Tuple[str, StatementStats]]:
+        return sorted(self.statements.items(), key=lambda item: item[1].duration, reverse=True)[:limit]
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.duration * 1000:.1f};desc="{self.count} queries", total;dur={self.elapsed * 1000:.1f}'
+
+    def report(self) -> str:
+        """慢请求日志：总耗时、数据库耗时和耗时最多的语句"""
+        lines = [
+            f"{self.name}: 耗时 {self.elapsed * 1000:.1f}ms，{self.count} 条语句，数据库耗时 {self.duration * 1000:.1f}ms"
+        ]
+        suspects = self.n_plus_one_suspects()
+        for statement, stats in suspects:
+            lines.append(f"  疑似 N+1: 执行 {stats.count} 次，共 {stats.duration * 1000:.1f}ms: {_preview(statement)}")
+        for statement, stats in self.top_statements():
+            lines.append(f"  {stats.duration * 1000:.1f}ms / {stats.count} 次: {_preview(statement)}")
+        return "\n".join(lines)
+
+
+def _preview(statement: str) -> str:
+    statement = " ".join(statement.split())
+    if len(statement) > STATEMENT_PREVIEW_LENGTH:
+        return statement[:STATEMENT_PREVIEW_LENGTH] + "..."
+    return statement
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("query_started_at")
+    if not started:
+        return
+    duration = time.perf_counter() - started.pop()
+    _OPERATION_DURATIONS.get(statement[:6].lower(), _OTHER_DURATION).observe(duration)
+    for stats in _active.get():
+        stats.record(statement, duration)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    # 执行失败时 after_cursor_execute 不会被调用，丢弃对应的开始时间
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_started_at"):
+        connection.info["query_started_at"].pop()
+
+
+@contextmanager
+def track_queries(name: str) -> Iterator[QueryStats]:
+    """统计代码块中执行的语句"""
+    stats = QueryStats(name)
+    token = _active.set(_active.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        stats.finish()
+        _active.reset(token)
+
+
+def log_query_stats(stats: QueryStats) -> None:
+    """慢请求或疑似 N+1 时记录日志"""
+    if stats.elapsed >= config.monitoring.slow_request:
+        logger.warning(f"慢请求 {stats.report()}")
+    elif stats.n_plus_one_suspects():
+        logger.warning(f"疑似 N+1 查询 {stats.report()}")
+
+
+@contextmanager
+def track_command(name: str) -> Iterator[Optional[QueryStats]]:
+    """统计一次 WebSocket 命令执行的语句，结束时按需记录日志"""
+    if not config.monitoring.query_stats:
+        yield None
+        return
+    with track_queries(name) as stats:
+        yield stats
+    log_query_stats(stats)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """执行的语句超过预算"""
+
+
+@contextmanager
+def query_budget(max_queries: int, name: str = "query budget") -> Iterator[QueryStats]:
+    """
+    限定代码块最多执行 max_queries 条语句（用于测试）
+
+        with query_budget(3):
+            await client.get(...)
+    """
+    with track_queries(name) as stats:
+        yield stats
+    if stats.count > max_queries:
+        raise QueryBudgetExceeded(
+            f"Expected at most {max_queries} queries, got {stats.count}\n{stats.report()}"
+        )
+
+
+class QueryStatsMiddleware:
+    """
+    按请求统计语句的 ASGI 中间件
+
+    Server-Timing 在响应头发出时写入，流式响应发出响应头之后执行的语句只计入日志。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not config.monitoring.query_stats:
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries(f"{scope['method']} {scope['path']}") as stats:
+            async def send_with_timing(message):
+                if message["type"] == "http.response.start" and config.monitoring.server_timing:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", stats.server_timing().encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_with_timing)
+        log_query_stats(stats)
@@ -6,23 +6,61 @@ from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 
 from app.api.v1 import api_router
 from app.websocket_routes import router as websocket_router
-from app.database.database import init_db
+from app.database.database import close_db, init_db, warm_up_db
+from app.database.instrumentation import QueryStatsMiddleware
+from app.services.ai_job_service import ai_job_worker
+from app.services.attachment_previews import preview_generator
+from app.services.llm_client import close_llm_client
+from app.services.notification_service import notification_outbox, notification_retention_job
+from app.services.object_store import close_object_store
+from app.services.user_profiles import user_profiler
+from app.services.vector_index import message_indexer
+from app.services.websocket_manager import connection_manager
+from app.services.websocket_relay import websocket_relay
 from app.utils.config import config, load_config
+from app.utils.loop_watchdog import loop_watchdog
+from app.utils.metrics import CONTENT_TYPE, MetricsMiddleware, metrics_registry, preallocate_http_metrics
+from app.utils.profiling import ProfilingMiddleware
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
-    # 启动时执行
+    # 启动时执行：结构检查（已在最新迁移版本时跳过建表），并在接收流量前预热连接池
     load_config()
     await init_db()
+    await warm_up_db()
+    if config.service.relay_url:
+        await websocket_relay.start()
+    notification_outbox.start()
+    notification_retention_job.start()
+    if config.ai_jobs.embedded:
+        ai_job_worker.start()
+    await message_indexer.start()
+    await user_profiler.start()
+    preview_generator.start()
+    metrics_registry.start()
+    if config.monitoring.loop_watchdog:
+        loop_watchdog.start()
     yield
-    # 关闭时执行
-    pass
+    # 关闭时执行：先写完待发送的通知并断开WebSocket，再释放数据库连接
+    loop_watchdog.stop()
+    await ai_job_worker.stop()
+    await message_indexer.stop()
+    await user_profiler.stop()
+    await preview_generator.stop()
+    await notification_retention_job.stop()
+    await notification_outbox.stop()
+    await websocket_relay.stop()
+    await connection_manager.close_all()
+    await close_llm_client()
+    await close_object_store()
+    await close_db()
+    await metrics_registry.stop()
 
 
 # 创建FastAPI应用
@@ -40,8 +78,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Profile-Id", "X-Worker-Pid"],
 )
 
+# 管理员带 X-Profile 请求头的请求执行 cProfile（未配置管理员时直接转发）
+app.add_middleware(ProfilingMiddleware)
+
+# 按请求统计 SQL 语句（Server-Timing 响应头、慢请求和疑似 N+1 查询日志）
+app.add_middleware(QueryStatsMiddleware)
+
+# 按路由模板统计请求耗时和状态（/metrics 导出）
+app.add_middleware(MetricsMiddleware)
+
 # 包含API路由
 app.include_router(api_router, prefix="/api/v1")
 
@@ -65,6 +113,16 @@ async def health_check():
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus 指标"""
+    return Response(await metrics_registry.render(), media_type=CONTENT_TYPE)
+
+
+# 所有路由注册完成后预先创建各路由的请求指标
+preallocate_http_metrics(app)
+
+
 # 全局异常处理
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
@@ -74,13 +132,23 @@ async def http_exception_handler(request, exc):
     )
 
 
+def main() -> None:
+    """命令行入口：本地环境热重载，其他环境使用预启动多进程服务"""
+    if config.service.env == "local":
+        import uvicorn
+        
+        uvicorn.run(
+            "app.main:app",
+            host=config.service.host,
+            port=config.service.port,
+            reload=True,
+            log_level="info"
+        )
+    else:
+        from app.server import serve
+        
+        serve()
+
+
 if __name__ == "__main__":
-    import uvicorn
-    
-    uvicorn.run(
-        "app.main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True if config.service.env == "local" else False,
-        log_level="info"
-    ) 
\ No newline at end of file
+    main()
@@ -8,6 +8,7 @@ from app.models.message import Message
 from app.models.team_member import TeamMember
 from app.models.channel_member import ChannelMember
 from app.models.notification import Notification
+from app.models.attachment import Attachment, AttachmentBlob, AttachmentPreview
 from app.models.ai_task import AITask, AIConfig, MessageSuggestionLog, ChannelSummary
 
 __all__ = [
@@ -18,6 +19,9 @@ __all__ = [
     "TeamMember",
     "ChannelMember",
     "Notification",
+    "Attachment",
+    "AttachmentBlob",
+    "AttachmentPreview",
     "AITask",
     "AIConfig", 
     "MessageSuggestionLog",
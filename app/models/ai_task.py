@@ -4,7 +4,7 @@ AI任务相关数据库模型
 from datetime import datetime
 from typing import Optional, Dict, Any
 
-from sqlalchemy import Boolean, DateTime, String, Text, Integer, JSON, func
+from sqlalchemy import Boolean, DateTime, Index, String, Text, Integer, JSON, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.database.database import Base
@@ -13,15 +13,27 @@ from app.database.database import Base
 class AITask(Base):
     """AI任务表"""
     __tablename__ = "ai_tasks"
+    __table_args__ = (
+        # 执行器按状态和计划时间领取任务
+        Index("ix_ai_tasks_status_next_run", "status", "next_run_at"),
+    )
     
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     task_id: Mapped[str] = mapped_column(String(100), unique=True, index=True, nullable=False)
     
     # 任务信息
     task_type: Mapped[str] = mapped_column(String(50), nullable=False)  # suggestion, summary, search, analysis
-    status: Mapped[str] = mapped_column(String(20), default="pending", nullable=False)  # pending, processing, completed, failed
+    status: Mapped[str] = mapped_column(String(20), default="pending", nullable=False)  # pending, processing, completed, failed, cancelled
     progress: Mapped[float] = mapped_column(default=0.0, nullable=False)
     
+    # 执行控制
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    max_attempts: Mapped[int] = mapped_column(Integer, default=3, nullable=False)
+    next_run_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    cancel_requested: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    locked_by: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    
     # 关联信息
     user_id: Mapped[int] = mapped_column(Integer, nullable=False)
     channel_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
@@ -121,6 +133,10 @@ class MessageSuggestionLog(Base):
 class ChannelSummary(Base):
     """频道摘要表"""
     __tablename__ = "channel_summaries"
+    __table_args__ = (
+        # 按频道、类型和时间窗口查找可复用的摘要
+        Index("ix_channel_summaries_window", "channel_id", "summary_type", "summary_start_time", "summary_end_time"),
+    )
     
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     
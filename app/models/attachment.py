@@ -0,0 +1,156 @@
+"""
+附件模型
+"""
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+
+from sqlalchemy import BigInteger, DateTime, ForeignKey, Index, Integer, String, UniqueConstraint, func
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+
+from app.database.database import Base
+
+
+class AttachmentStatus(str, Enum):
+    """附件状态"""
+    UPLOADING = "uploading"
+    COMPLETE = "complete"
+    ABORTED = "aborted"
+    # 没有消息引用，内容已被垃圾回收
+    DELETED = "deleted"
+
+
+class PreviewStatus(str, Enum):
+    """预览生成状态；不需要预览的内容为空"""
+    PENDING = "pending"
+    PROCESSING = "processing"
+    READY = "ready"
+    FAILED = "failed"
+
+
+class AttachmentBlob(Base):
+    """
+    附件内容表：相同内容（SHA-256 相同）只在对象存储中保存一份，多个附件共用
+
+    ref_count 是引用它的未删除消息数，降为0并超过保留期后由垃圾回收删除。
+    """
+    __tablename__ = "attachment_blobs"
+    __table_args__ = (
+        # 垃圾回收扫描无引用的内容
+        Index("ix_attachment_blobs_unreferenced", "ref_count", "last_used_at"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    sha256: Mapped[str] = mapped_column(String(64), unique=True, nullable=False)
+    size: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    storage_key: Mapped[str] = mapped_column(String(255), unique=True, nullable=False)
+    ref_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    preview_status: Mapped[Optional[PreviewStatus]] = mapped_column(String(20), nullable=True, index=True)
+    # 预览生成开始的时间，超时未完成时由其他进程重新生成
+    preview_claimed_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False
+    )
+    # 最近一次被上传、引用或释放引用的时间，垃圾回收的保留期从这里算起
+    last_used_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False
+    )
+
+    def __repr__(self) -> str:
+        return f"<AttachmentBlob(id={self.id}, sha256={self.sha256[:12]}, ref_count={self.ref_count})>"
+
+
+class AttachmentPreview(Base):
+    """附件预览：图片的缩略图、PDF 首页的预览图，按内容生成，内容相同的附件共用"""
+    __tablename__ = "attachment_previews"
+    __table_args__ = (
+        UniqueConstraint("blob_id", "variant", name="uq_attachment_previews_blob_variant"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    blob_id: Mapped[int] = mapped_column(ForeignKey("attachment_blobs.id"), nullable=False, index=True)
+    # 尺寸档位，见 attachment_previews.PREVIEW_SIZES
+    variant: Mapped[str] = mapped_column(String(20), nullable=False)
+    content_type: Mapped[str] = mapped_column(String(50), nullable=False)
+    width: Mapped[int] = mapped_column(Integer, nullable=False)
+    height: Mapped[int] = mapped_column(Integer, nullable=False)
+    size: Mapped[int] = mapped_column(Integer, nullable=False)
+    storage_key: Mapped[str] = mapped_column(String(255), unique=True, nullable=False)
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False
+    )
+
+    def __repr__(self) -> str:
+        return f"<AttachmentPreview(blob_id={self.blob_id}, variant={self.variant}, {self.width}x{self.height})>"
+
+
+class Attachment(Base):
+    """附件表：文件内容保存在对象存储中，这里只记录元数据"""
+    __tablename__ = "attachments"
+    __table_args__ = (
+        # 清理长时间未完成的上传
+        Index("ix_attachments_status_created", "status", "created_at"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    owner_id: Mapped[int] = mapped_column(ForeignKey("users.id"), nullable=False, index=True)
+
+    file_name: Mapped[str] = mapped_column(String(255), nullable=False)
+    content_type: Mapped[str] = mapped_column(String(100), nullable=False)
+    # 上传完成前是客户端声明的大小（可能为空），完成后是实际大小
+    size: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+
+    # 对象存储中的键：上传过程中是本次上传独占的临时键，完成后是内容的键（内容相同的附件相同）
+    storage_key: Mapped[str] = mapped_column(String(255), nullable=False, index=True)
+    blob_id: Mapped[Optional[int]] = mapped_column(ForeignKey("attachment_blobs.id"), nullable=True, index=True)
+    sha256: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    status: Mapped[AttachmentStatus] = mapped_column(String(20), default=AttachmentStatus.UPLOADING, nullable=False)
+    # 断点续传时对象存储的分片上传id；预签名直传为空
+    upload_id: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False
+    )
+    completed_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    owner: Mapped["User"] = relationship("User")
+    # 预览属于内容，随附件一起加载
+    previews: Mapped[list["AttachmentPreview"]] = relationship(
+        "AttachmentPreview",
+        primaryjoin="Attachment.blob_id == foreign(AttachmentPreview.blob_id)",
+        order_by="AttachmentPreview.width",
+        viewonly=True,
+        lazy="selectin"
+    )
+
+    @property
+    def url(self) -> str:
+        """下载地址"""
+        return f"/api/v1/attachments/{self.id}/download"
+
+    @property
+    def preview_items(self) -> list[dict]:
+        """预览列表（带下载地址），从小到大排列"""
+        return [
+            {
+                "variant": preview.variant,
+                "content_type": preview.content_type,
+                "width": preview.width,
+                "height": preview.height,
+                "url": f"/api/v1/attachments/{self.id}/previews/{preview.variant}",
+            }
+            for preview in self.previews
+        ]
+
+    def __repr__(self) -> str:
+        return f"<Attachment(id={self.id}, owner_id={self.owner_id}, status={self.status})>"
@@ -4,7 +4,7 @@
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import Boolean, DateTime, ForeignKey, Integer, String, Text, func
+from sqlalchemy import Boolean, DateTime, ForeignKey, Index, Integer, String, Text, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.database.database import Base
@@ -13,6 +13,13 @@ from app.database.database import Base
 class Message(Base):
     """消息表"""
     __tablename__ = "messages"
+    __table_args__ = (
+        # 按频道和时间窗口读取历史消息（摘要、分页）
+        Index("ix_messages_channel_created_id", "channel_id", "created_at", "id"),
+        # 向量索引按 (updated_at, id) 水位增量同步
+        Index("ix_messages_updated_id", "updated_at", "id"),
+        # PostgreSQL 上 content 另有 pg_trgm GIN 索引（见迁移 d81f3a6c4e27），加速关键词检索
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     content: Mapped[str] = mapped_column(Text, nullable=False)
@@ -33,6 +40,8 @@ class Message(Base):
     attachment_type: Mapped[Optional[str]] = mapped_column(String(50), nullable=True)
     attachment_name: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     attachment_size: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    # 通过附件服务上传的文件；attachment_* 字段是它的副本，便于直接展示
+    attachment_id: Mapped[Optional[int]] = mapped_column(ForeignKey("attachments.id"), nullable=True, index=True)
     
     # 时间戳
     created_at: Mapped[datetime] = mapped_column(
@@ -70,5 +79,17 @@ class Message(Base):
         cascade="all, delete-orphan"
     )
     
+    # 附件服务上传的附件，和消息一起加载以便返回预览
+    attachment: Mapped[Optional["Attachment"]] = relationship(
+        "Attachment",
+        viewonly=True,
+        lazy="selectin"
+    )
+    
+    @property
+    def attachment_previews(self) -> list[dict]:
+        """附件的缩略图和预览图"""
+        return self.attachment.preview_items if self.attachment is not None else []
+    
     def __repr__(self) -> str:
         return f"<Message(id={self.id}, author_id={self.author_id}, channel_id={self.channel_id})>" 
\ No newline at end of file
@@ -5,7 +5,7 @@ from datetime import datetime
 from enum import Enum
 from typing import Optional, Dict, Any
 
-from sqlalchemy import Boolean, DateTime, ForeignKey, String, Text, JSON, func
+from sqlalchemy import Boolean, DateTime, ForeignKey, Index, String, Text, JSON, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from app.database.database import Base
@@ -22,6 +22,12 @@ class NotificationType(str, Enum):
 class Notification(Base):
     """通知表"""
     __tablename__ = "notifications"
+    __table_args__ = (
+        # 收件箱按 (created_at, id) 倒序做游标分页
+        Index("ix_notifications_user_created_id", "user_id", "created_at", "id"),
+        # 保留期清理按已读状态和创建时间筛选
+        Index("ix_notifications_read_created", "is_read", "created_at"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     
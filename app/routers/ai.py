@@ -5,12 +5,20 @@ import logging
 from datetime import datetime, timedelta
 from typing import Dict, Any
 
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.database.database import get_db
 from app.models.user import User
+from app.services.ai_config_service import AIConfigService, AISettings
+from app.services.ai_job_service import AIJobService
 from app.services.ai_service import AIService
+from app.services.ai_stream import SSE_HEADERS, suggestion_events, summary_events, to_sse
+from app.services.channel_analytics import ChannelAnalyticsService
+from app.services.channel_service import ChannelService
+from app.services.team_service import TeamService
+from app.services import user_profiles
 from app.auth.auth import get_current_user
 from app.schemas.ai import (
     MessageSuggestionRequest, MessageSuggestionResponse,
@@ -65,6 +73,52 @@ async def generate_auto_summary(
         raise HTTPException(status_code=500, detail="生成自动摘要失败")
 
 
+async def _ensure_channel_access(db: AsyncSession, channel_id: int, user_id: int) -> None:
+    """检查频道权限；流式接口在开始推送前检查，以便返回正确的状态码"""
+    if not await ChannelService(db).can_user_access_channel(channel_id, user_id):
+        raise HTTPException(status_code=403, detail="Access denied to this channel")
+
+
+@router.post("/suggestions/stream")
+async def stream_message_suggestions(
+    request: MessageSuggestionRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    流式获取智能消息建议（Server-Sent Events）
+    
+    模型每生成一段文本就推送一个 token 事件，最后推送与 /suggestions 响应相同结构的 result 事件；
+    客户端断开连接即取消生成
+    """
+    await _ensure_channel_access(db, request.channel_id, current_user.id)
+    return StreamingResponse(
+        to_sse(suggestion_events(request, current_user.id)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+
+@router.post("/summary/stream")
+async def stream_auto_summary(
+    request: AutoSummaryRequest,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    流式生成自动摘要（Server-Sent Events）
+    
+    摘要正文以 token 事件推送，最后推送与 /summary 响应相同结构的 result 事件；
+    客户端断开连接即取消生成
+    """
+    await _ensure_channel_access(db, request.channel_id, current_user.id)
+    return StreamingResponse(
+        to_sse(summary_events(request, current_user.id)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS
+    )
+
+
 @router.post("/search", response_model=SmartSearchResponse)
 async def intelligent_search(
     request: SmartSearchRequest,
@@ -84,6 +138,18 @@ async def intelligent_search(
         raise HTTPException(status_code=500, detail="智能搜索失败")
 
 
+def _config_response(settings: AISettings) -> AIConfigResponse:
+    return AIConfigResponse(
+        user_id=settings.user_id,
+        enable_suggestions=settings.enable_suggestions,
+        enable_auto_summary=settings.enable_auto_summary,
+        enable_smart_search=settings.enable_smart_search,
+        suggestion_sensitivity=settings.suggestion_sensitivity,
+        language_preference=settings.language_preference,
+        updated_at=settings.updated_at
+    )
+
+
 @router.get("/config", response_model=AIConfigResponse)
 async def get_ai_config(
     db: AsyncSession = Depends(get_db),
@@ -93,37 +159,8 @@ async def get_ai_config(
     获取用户的AI配置
     """
     try:
-        from app.models.ai_task import AIConfig
-        from sqlalchemy import select
-        
-        # 查询用户的AI配置
-        query = select(AIConfig).where(AIConfig.user_id == current_user.id)
-        result = await db.execute(query)
-        ai_config = result.scalars().first()
-        
-        if not ai_config:
-            # 创建默认配置
-            ai_config = AIConfig(
-                user_id=current_user.id,
-                enable_suggestions=True,
-                enable_auto_summary=True,
-                enable_smart_search=True,
-                suggestion_sensitivity=0.7,
-                language_preference="zh"
-            )
-            db.add(ai_config)
-            await db.commit()
-            await db.refresh(ai_config)
-        
-        return AIConfigResponse(
-            user_id=ai_config.user_id,
-            enable_suggestions=ai_config.enable_suggestions,
-            enable_auto_summary=ai_config.enable_auto_summary,
-            enable_smart_search=ai_config.enable_smart_search,
-            suggestion_sensitivity=ai_config.suggestion_sensitivity,
-            language_preference=ai_config.language_preference,
-            updated_at=ai_config.updated_at
-        )
+        settings = await AIConfigService(db).get_or_create(current_user.id)
+        return _config_response(settings)
     except Exception as e:
         logger.error(f"获取AI配置失败: {e}")
         raise HTTPException(status_code=500, detail="获取AI配置失败")
@@ -139,38 +176,8 @@ async def update_ai_config(
     更新用户的AI配置
     """
     try:
-        from app.models.ai_task import AIConfig
-        from sqlalchemy import select
-        
-        # 查询现有配置
-        query = select(AIConfig).where(AIConfig.user_id == current_user.id)
-        result = await db.execute(query)
-        ai_config = result.scalars().first()
-        
-        if not ai_config:
-            # 创建新配置
-            ai_config = AIConfig(user_id=current_user.id)
-            db.add(ai_config)
-        
-        # 更新配置
-        ai_config.enable_suggestions = request.enable_suggestions
-        ai_config.enable_auto_summary = request.enable_auto_summary
-        ai_config.enable_smart_search = request.enable_smart_search
-        ai_config.suggestion_sensitivity = request.suggestion_sensitivity
-        ai_config.language_preference = request.language_preference
-        
-        await db.commit()
-        await db.refresh(ai_config)
-        
-        return AIConfigResponse(
-            user_id=ai_config.user_id,
-            enable_suggestions=ai_config.enable_suggestions,
-            enable_auto_summary=ai_config.enable_auto_summary,
-            enable_smart_search=ai_config.enable_smart_search,
-            suggestion_sensitivity=ai_config.suggestion_sensitivity,
-            language_preference=ai_config.language_preference,
-            updated_at=ai_config.updated_at
-        )
+        settings = await AIConfigService(db).update(current_user.id, request)
+        return _config_response(settings)
     except Exception as e:
         logger.error(f"更新AI配置失败: {e}")
         raise HTTPException(status_code=500, detail="更新AI配置失败")
@@ -185,21 +192,17 @@ async def analyze_channel(
     """
     分析频道活动
     
-    分析频道的活跃度、情感倾向、主要话题等
+    分析频道的活跃度、活跃时段、发言集中度和回复时间分布。
+    time_range 可以包含 start 和 end，默认分析最近30天
     """
+    await _ensure_channel_access(db, request.channel_id, current_user.id)
+    time_range = request.time_range or {}
     try:
-        ai_service = AIService(db)
-        # 这里我们暂时返回模拟数据，实际实现需要更复杂的分析逻辑
-        return ChannelAnalysisResponse(
-            channel_id=request.channel_id,
-            analysis_type=request.analysis_type,
-            message_count=150,
-            active_users=12,
-            activity_level="medium",
-            recommendations=[
-                "频道活跃度适中，建议定期发起讨论话题",
-                "可以考虑增加互动性活动提升参与度"
-            ]
+        return await ChannelAnalyticsService(db).analyze(
+            request.channel_id,
+            request.analysis_type,
+            start_time=time_range.get("start"),
+            end_time=time_range.get("end")
         )
     except Exception as e:
         logger.error(f"频道分析失败: {e}")
@@ -215,24 +218,16 @@ async def analyze_user_behavior(
     """
     分析用户行为模式
     
-    分析用户的沟通风格、活跃时间、协作模式等
+    根据增量维护的行为画像（活跃时段、频道分布、回复时间和消息长度）分析沟通风格、活跃时间和协作模式。
+    画像覆盖全部历史消息，time_range 暂不生效。只能分析自己或同一团队的成员，
+    常用频道只列出当前用户可以访问的频道
     """
+    target_user_id = request.user_id or current_user.id
+    if target_user_id != current_user.id and not await TeamService(db).shares_team(current_user.id, target_user_id):
+        raise HTTPException(status_code=403, detail="Not enough permissions")
     try:
-        target_user_id = request.user_id or current_user.id
-        
-        # 简化的用户行为分析
-        return UserBehaviorAnalysisResponse(
-            user_id=target_user_id,
-            message_count=85,
-            active_channels=5,
-            communication_style="简洁直接",
-            preferred_times=["09:00-12:00", "14:00-17:00"],
-            collaboration_pattern="主动参与讨论",
-            suggestions=[
-                "您的沟通风格很高效，建议多参与头脑风暴活动",
-                "考虑在下午时段发起重要讨论，这是您的活跃时间"
-            ]
-        )
+        visible_channels = await ChannelService(db).get_user_channel_ids(current_user.id)
+        return await user_profiles.user_profiler.analyze(target_user_id, visible_channels)
     except Exception as e:
         logger.error(f"用户行为分析失败: {e}")
         raise HTTPException(status_code=500, detail="用户行为分析失败")
@@ -241,60 +236,44 @@ async def analyze_user_behavior(
 @router.post("/batch", response_model=BatchProcessResponse)
 async def create_batch_process(
     request: BatchProcessRequest,
-    background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """
     创建批量处理任务
     
-    用于大规模的AI分析任务，如批量摘要生成、趋势分析等
+    用于大规模的AI分析任务，如批量摘要生成、趋势分析等。任务写入队列后由任务执行器异步处理
     """
     try:
-        import uuid
-        
-        task_id = str(uuid.uuid4())
-        
-        # 创建AI任务记录
-        from app.models.ai_task import AITask
-        
-        ai_task = AITask(
-            task_id=task_id,
-            task_type="batch_process",
-            status="pending",
-            user_id=current_user.id,
-            input_data={
-                "operation": request.operation,
-                "target_channels": request.target_channels,
-                "time_range": request.time_range,
-                "parameters": request.parameters
-            }
-        )
-        
-        db.add(ai_task)
-        await db.commit()
-        
-        # 添加后台任务
-        background_tasks.add_task(
-            process_batch_task,
-            task_id,
-            request.operation,
-            request.target_channels,
-            current_user.id
-        )
+        job_service = AIJobService(db)
+        task = await job_service.enqueue(request, current_user.id)
         
         return BatchProcessResponse(
-            task_id=task_id,
+            task_id=task.task_id,
             operation=request.operation,
-            status="pending",
+            status=task.status,
             estimated_completion=datetime.now() + timedelta(minutes=10),
-            progress_url=f"/api/ai/tasks/{task_id}"
+            progress_url=f"/api/v1/ai/tasks/{task.task_id}"
         )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"创建批量处理任务失败: {e}")
         raise HTTPException(status_code=500, detail="创建批量处理任务失败")
 
 
+def _task_status(task) -> AITaskStatus:
+    return AITaskStatus(
+        task_id=task.task_id,
+        status=task.status,
+        progress=task.progress,
+        result=task.output_data,
+        error=task.error_message,
+        created_at=task.created_at,
+        updated_at=task.updated_at
+    )
+
+
 @router.get("/tasks/{task_id}", response_model=AITaskStatus)
 async def get_task_status(
     task_id: str,
@@ -305,39 +284,55 @@ async def get_task_status(
     获取AI任务状态
     """
     try:
-        from app.models.ai_task import AITask
-        from sqlalchemy import select
-        
-        query = select(AITask).where(
-            AITask.task_id == task_id,
-            AITask.user_id == current_user.id
-        )
-        result = await db.execute(query)
-        task = result.scalars().first()
+        job_service = AIJobService(db)
+        task = await job_service.get_task(task_id, current_user.id)
         
         if not task:
             raise HTTPException(status_code=404, detail="任务不存在")
         
-        return AITaskStatus(
-            task_id=task.task_id,
-            status=task.status,
-            progress=task.progress,
-            result=task.output_data,
-            error=task.error_message,
-            created_at=task.created_at,
-            updated_at=task.updated_at
-        )
+        return _task_status(task)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"获取任务状态失败: {e}")
         raise HTTPException(status_code=500, detail="获取任务状态失败")
 
 
+@router.post("/tasks/{task_id}/cancel", response_model=AITaskStatus)
+async def cancel_task(
+    task_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    取消AI任务
+    
+    未开始的任务立即取消；执行中的任务会在执行器下一次心跳时中断
+    """
+    try:
+        job_service = AIJobService(db)
+        task = await job_service.cancel(task_id, current_user.id)
+        
+        if not task:
+            raise HTTPException(status_code=404, detail="任务不存在")
+        
+        return _task_status(task)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"取消任务失败: {e}")
+        raise HTTPException(status_code=500, detail="取消任务失败")
+
+
 @router.get("/health")
 async def ai_health_check():
     """
     AI服务健康检查
     """
     try:
+        from app.services.llm_client import get_llm_client
         from app.utils.config import config
         
         # 检查配置
@@ -346,6 +341,7 @@ async def ai_health_check():
             "model": config.llm.model,
             "has_api_key": bool(config.llm.api_key)
         }
+        llm = get_llm_client()
         
         return {
             "status": "healthy",
@@ -357,34 +353,11 @@ async def ai_health_check():
                 "user_behavior_analysis": True
             },
             "llm_config": llm_config,
+            # 当前自适应并发上限和按功能统计的调用指标
+            "llm_concurrency_limit": int(llm.limiter.limit),
+            "llm_metrics": llm.metrics.snapshot(),
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
         logger.error(f"AI健康检查失败: {e}")
         raise HTTPException(status_code=500, detail="AI服务异常")
-
-
-async def process_batch_task(
-    task_id: str, 
-    operation: str, 
-    target_channels: list, 
-    user_id: int
-):
-    """
-    后台处理批量任务
-    """
-    try:
-        # 这里是批量处理的具体逻辑
-        # 实际实现会根据operation类型进行不同的处理
-        
-        # 模拟处理过程
-        import asyncio
-        await asyncio.sleep(5)  # 模拟处理时间
-        
-        logger.info(f"批量任务 {task_id} 处理完成")
-        
-        # 更新任务状态
-        # 这里需要数据库连接，实际实现中需要传递db session
-        
-    except Exception as e:
-        logger.error(f"批量任务处理失败: {task_id}, {e}") 
\ No newline at end of file
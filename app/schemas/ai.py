@@ -46,7 +46,9 @@ class SmartSearchRequest(BaseModel):
     query: str = Field(..., description="搜索查询")
     channels: Optional[List[int]] = Field(None, description="限制搜索的频道")
     time_range: Optional[Dict[str, datetime]] = Field(None, description="时间范围")
-    search_type: str = Field(default="semantic", description="搜索类型: semantic, keyword, mixed")
+    search_type: str = Field(default="semantic", pattern="^(semantic|keyword|mixed)$", description="搜索类型: semantic, keyword, mixed")
+    offset: int = Field(default=0, ge=0, description="结果偏移量")
+    limit: int = Field(default=20, ge=1, le=100, description="返回结果数")
 
 
 class SearchResult(BaseModel):
@@ -63,7 +65,7 @@ class SearchResult(BaseModel):
 class SmartSearchResponse(BaseModel):
     """智能搜索响应"""
     results: List[SearchResult] = Field(..., description="搜索结果")
-    total_count: int = Field(..., description="结果总数")
+    total_count: int = Field(..., description="融合后的候选总数（分页前）；大于 offset + limit 时还有下一页")
     search_type: str = Field(..., description="实际使用的搜索类型")
     query_understanding: str = Field(..., description="查询理解")
     suggestions: Optional[List[str]] = Field(None, description="搜索建议")
@@ -73,7 +75,7 @@ class SmartSearchResponse(BaseModel):
 class AITaskStatus(BaseModel):
     """AI任务状态"""
     task_id: str = Field(..., description="任务ID")
-    status: str = Field(..., description="状态: pending, processing, completed, failed")
+    status: str = Field(..., description="状态: pending, processing, completed, failed, cancelled")
     progress: float = Field(default=0.0, description="进度 (0-1)")
     result: Optional[Dict[str, Any]] = Field(None, description="结果数据")
     error: Optional[str] = Field(None, description="错误信息")
@@ -105,6 +107,26 @@ class TopicAnalysis(BaseModel):
     trend: str = Field(..., description="趋势: rising, stable, declining")
 
 
+class ResponseTimeStats(BaseModel):
+    """回复时间分布"""
+    count: int = Field(..., description="样本数")
+    p50_seconds: Optional[float] = Field(None, description="中位数（秒）")
+    p90_seconds: Optional[float] = Field(None, description="90分位（秒）")
+    buckets: Dict[str, int] = Field(..., description="按时长分桶的数量")
+
+
+class ChannelActivityStats(BaseModel):
+    """频道活动统计"""
+    messages_per_day: float = Field(..., description="日均消息数")
+    heatmap: List[List[int]] = Field(..., description="按星期（周一开始）和小时（UTC）统计的消息数，7x24")
+    peak_hours: List[str] = Field(..., description="最活跃的时段")
+    top_author_share: float = Field(..., description="发言最多的成员占全部消息的比例")
+    author_gini: float = Field(..., description="成员发言数的基尼系数，越接近1越集中")
+    average_length: float = Field(..., description="平均消息长度（字符）")
+    reply_time: ResponseTimeStats = Field(..., description="线程回复距原消息的时间")
+    turn_time: ResponseTimeStats = Field(..., description="相邻消息换人发言的间隔")
+
+
 class ChannelAnalysisResponse(BaseModel):
     """频道分析响应"""
     channel_id: int = Field(..., description="频道ID")
@@ -114,6 +136,7 @@ class ChannelAnalysisResponse(BaseModel):
     sentiment: Optional[SentimentAnalysis] = Field(None, description="情感分析")
     topics: Optional[List[TopicAnalysis]] = Field(None, description="话题分析")
     activity_level: Optional[str] = Field(None, description="活跃度: low, medium, high")
+    activity: Optional[ChannelActivityStats] = Field(None, description="活动统计")
     recommendations: List[str] = Field(default=[], description="AI建议")
 
 
@@ -124,6 +147,17 @@ class UserBehaviorAnalysisRequest(BaseModel):
     time_range: Optional[Dict[str, datetime]] = Field(None, description="分析时间范围")
 
 
+class UserBehaviorProfile(BaseModel):
+    """用户行为特征"""
+    hour_histogram: List[int] = Field(..., description="按小时（UTC）统计的发言数，24项")
+    weekday_histogram: List[int] = Field(..., description="按星期（周一开始）统计的发言数，7项")
+    top_channels: List[int] = Field(..., description="发言最多的频道")
+    length_distribution: Dict[str, int] = Field(..., description="消息长度分布")
+    reply_latency: Dict[str, int] = Field(..., description="回复他人消息的时间分布")
+    typical_reply_time: Optional[str] = Field(None, description="回复时间中位数所在的分桶")
+    last_active: Optional[datetime] = Field(None, description="最后发言时间")
+
+
 class UserBehaviorAnalysisResponse(BaseModel):
     """用户行为分析响应"""
     user_id: int = Field(..., description="用户ID")
@@ -133,6 +167,7 @@ class UserBehaviorAnalysisResponse(BaseModel):
     preferred_times: List[str] = Field(..., description="活跃时间段")
     collaboration_pattern: str = Field(..., description="协作模式")
     suggestions: List[str] = Field(..., description="个性化建议")
+    profile: Optional[UserBehaviorProfile] = Field(None, description="行为特征")
 
 
 # AI配置 Schema
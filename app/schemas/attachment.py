@@ -0,0 +1,74 @@
+"""
+附件相关的Pydantic schemas
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+from app.models.attachment import AttachmentStatus
+
+
+class AttachmentUploadCreate(BaseModel):
+    """创建分片上传或预签名直传schema"""
+    file_name: str = Field(..., min_length=1, max_length=255)
+    content_type: str = Field("application/octet-stream", max_length=100)
+    size: Optional[int] = Field(None, ge=0, description="文件大小（字节）；预签名直传必须提供")
+
+
+class AttachmentHashCheck(BaseModel):
+    """秒传schema：上传前先用内容的 SHA-256 查询，用户能访问的相同内容已存在时直接完成"""
+    file_name: str = Field(..., min_length=1, max_length=255)
+    content_type: str = Field("application/octet-stream", max_length=100)
+    size: int = Field(..., ge=0)
+    sha256: str = Field(..., pattern=r"^[0-9a-f]{64}$", description="文件内容的 SHA-256（小写十六进制）")
+
+
+class AttachmentPreviewResponse(BaseModel):
+    """附件预览schema"""
+    variant: str
+    content_type: str
+    width: int
+    height: int
+    url: str
+
+
+class AttachmentResponse(BaseModel):
+    """附件响应schema"""
+    id: int
+    owner_id: int
+    file_name: str
+    content_type: str
+    size: Optional[int] = None
+    sha256: Optional[str] = None
+    status: AttachmentStatus
+    url: str
+    previews: List[AttachmentPreviewResponse] = Field([], validation_alias="preview_items")
+    created_at: datetime
+    completed_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+class UploadPartResponse(BaseModel):
+    """已上传分片schema"""
+    part_number: int
+    etag: str
+    size: int
+
+
+class UploadSessionResponse(BaseModel):
+    """分片上传状态schema（断点续传时跳过已上传的分片）"""
+    attachment: AttachmentResponse
+    part_size: int
+    parts: List[UploadPartResponse] = []
+
+
+class DirectUploadResponse(BaseModel):
+    """预签名直传schema：客户端按 method/url/headers 把文件直接上传到对象存储，然后调用完成接口"""
+    attachment: AttachmentResponse
+    method: str
+    url: str
+    headers: Dict[str, str] = {}
+    expires_at: datetime
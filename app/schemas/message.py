@@ -6,6 +6,7 @@ from typing import List, Optional
 
 from pydantic import BaseModel, Field
 
+from app.schemas.attachment import AttachmentPreviewResponse
 from app.schemas.user import UserProfile
 
 
@@ -22,6 +23,7 @@ class MessageCreate(MessageBase):
     attachment_type: Optional[str] = Field(None, max_length=50)
     attachment_name: Optional[str] = Field(None, max_length=255)
     attachment_size: Optional[int] = None
+    attachment_id: Optional[int] = Field(None, description="通过附件接口上传的文件ID")
 
 
 class MessageUpdate(BaseModel):
@@ -42,6 +44,8 @@ class MessageResponse(BaseModel):
     attachment_type: Optional[str] = None
     attachment_name: Optional[str] = None
     attachment_size: Optional[int] = None
+    attachment_id: Optional[int] = None
+    attachment_previews: List[AttachmentPreviewResponse] = []
     created_at: datetime
     updated_at: datetime
     author: UserProfile
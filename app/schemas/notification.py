@@ -18,6 +18,15 @@ class NotificationCreate(BaseModel):
     data: Optional[Dict[str, Any]] = None
 
 
+class NotificationFanOut(BaseModel):
+    """批量扇出通知schema（同一内容发送给多个接收者）"""
+    user_ids: List[int]
+    type: NotificationType
+    title: str
+    message: str
+    data: Optional[Dict[str, Any]] = None
+
+
 class NotificationUpdate(BaseModel):
     """更新通知schema"""
     is_read: Optional[bool] = None
@@ -88,6 +88,12 @@ class TeamMemberUpdate(BaseModel):
     role: TeamRole
 
 
+class TeamAnnouncementCreate(BaseModel):
+    """团队公告schema"""
+    title: str = Field(..., min_length=1, max_length=255)
+    message: str = Field(..., min_length=1)
+
+
 class TeamStats(BaseModel):
     """团队统计schema"""
     member_count: int
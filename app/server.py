@@ -0,0 +1,175 @@
+"""
+生产环境启动器
+
+主进程预加载应用、完成数据库结构检查并执行 gc.freeze()，然后 fork 出多个 worker
+共享同一个监听 socket。每个 worker 使用 uvloop + httptools 运行 uvicorn，
+预加载的模块和常驻对象在写时复制的内存页中共享，新 worker 冷启动只需执行 lifespan。
+"""
+import asyncio
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+from typing import Dict
+
+import uvicorn
+
+from app.utils.config import config
+from app.utils.metrics import metrics_registry
+from app.utils.profiling import request_profiles
+
+logger = logging.getLogger(__name__)
+
+# worker 异常退出后重新拉起前的等待时间，避免崩溃循环占满CPU
+RESPAWN_DELAY_SECONDS = 1.0
+
+
+def _bind_socket(host: str, port: int) -> socket.socket:
+    """在主进程中创建监听 socket，由所有 worker 继承"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _event_loop_impl() -> str:
+    try:
+        import uvloop  # noqa: F401
+        return "uvloop"
+    except ImportError:
+        return "asyncio"
+
+
+def _http_impl() -> str:
+    try:
+        import httptools  # noqa: F401
+        return "httptools"
+    except ImportError:
+        return "h11"
+
+
+async def _prepare_schema() -> None:
+    """在 fork 之前完成一次数据库结构检查"""
+    from app.database.database import async_engine, init_db
+
+    await init_db()
+    # 主进程中建立的连接不能被 worker 继承，检查完成后立即释放
+    await async_engine.dispose()
+
+
+def _run_worker(app, sock: socket.socket, slot: int) -> None:
+    """worker 进程入口，slot 为 worker 序号（重新拉起的 worker 沿用原序号）"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    if slot > 0:
+        # 内置的批量AI任务执行器只在第一个 worker 中运行，避免每个 worker 各自领取任务占用连接池
+        os.environ["AI_JOBS_EMBEDDED"] = "false"
+        config.ai_jobs.__dict__.pop("embedded", None)
+    # 不继承主进程预加载期间产生的计数（例如结构检查执行的语句）
+    metrics_registry.reset()
+
+    server = uvicorn.Server(uvicorn.Config(
+        app,
+        loop=_event_loop_impl(),
+        http=_http_impl(),
+        lifespan="on",
+        log_level="info",
+    ))
+    server.run(sockets=[sock])
+    if not server.started:
+        # 与 uvicorn 命令行一致，启动失败（例如 lifespan 启动出错）以退出码 3 退出
+        sys.exit(3)
+
+
+def serve() -> None:
+    """以预启动多进程模式运行服务"""
+    host = config.service.host
+    port = config.service.port
+    workers = max(1, config.service.workers)
+    if workers > 1 and not config.service.relay_url:
+        logger.warning("未配置 service.relay_url，WebSocket 消息、输入状态和通知推送只能送达同一 worker 上的连接")
+
+    if not hasattr(os, "fork"):
+        # 不支持 fork 的平台退回到 uvicorn 自带的多进程模式
+        uvicorn.run("app.main:app", host=host, port=port, workers=workers, log_level="info")
+        return
+
+    # 预加载应用：导入路由、模型、schemas 等只在主进程中做一次
+    from app.main import app
+
+    asyncio.run(_prepare_schema())
+    sock = _bind_socket(host, port)
+    # 各 worker 把指标写到同一目录，由响应 /metrics 的 worker 合并
+    metrics_registry.use_directory(config.monitoring.metrics_dir or tempfile.mkdtemp(prefix="huddle-metrics-"))
+    # 单请求分析结果同样写到共享目录，取回请求可以由任意 worker 处理
+    request_profiles.use_directory(tempfile.mkdtemp(prefix="huddle-profiles-"))
+
+    # 把预加载产生的对象移出 GC 跟踪，避免 worker 中的 GC 触碰这些内存页导致写时复制
+    gc.collect()
+    gc.freeze()
+
+    # pid -> worker 序号
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                _run_worker(app, sock, slot)
+                code = 0
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            except BaseException:
+                logger.exception(f"worker {os.getpid()} 运行出错")
+            finally:
+                # 子进程不能回到主进程的代码中继续执行；退出码让主进程区分崩溃和正常退出
+                os._exit(code)
+        children[pid] = slot
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for slot in range(workers):
+        spawn(slot)
+    logger.info(f"已启动 {workers} 个 worker，监听 {host}:{port}")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        slot = children.pop(pid, None)
+        if slot is None:
+            continue
+        if not stopping:
+            code = os.waitstatus_to_exitcode(status)
+            if code < 0:
+                reason = f"被信号 {-code} 终止"
+            elif code:
+                reason = f"异常退出（退出码 {code}）"
+            else:
+                reason = "意外退出（退出码 0）"
+            logger.warning(f"worker {pid} {reason}，正在重新启动")
+            time.sleep(RESPAWN_DELAY_SECONDS)
+            spawn(slot)
+
+    sock.close()
+    logger.info("所有 worker 已退出")
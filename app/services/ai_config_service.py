@@ -0,0 +1,145 @@
+"""
+用户AI配置服务
+
+每次生成建议都要读取用户的AI配置，因此配置按用户缓存在进程内。本进程修改配置时直接更新缓存，
+其他进程的修改在 CACHE_TTL 秒后生效。
+"""
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.ai_task import AIConfig
+from app.schemas.ai import AIConfigRequest
+
+CACHE_TTL = 60.0
+MAX_CACHED_USERS = 10000
+
+
+@dataclass(frozen=True)
+class AISettings:
+    """用户AI配置的只读快照"""
+    user_id: int
+    enable_suggestions: bool = True
+    enable_auto_summary: bool = True
+    enable_smart_search: bool = True
+    enable_behavior_analysis: bool = True
+    suggestion_sensitivity: float = 0.7
+    language_preference: str = "zh"
+    preferred_suggestion_style: str = "balanced"
+    max_suggestions_per_request: int = 3
+    # 用户还没有配置记录时为 None
+    updated_at: Optional[datetime] = None
+
+    @classmethod
+    def from_model(cls, ai_config: AIConfig) -> "AISettings":
+        return cls(
+            user_id=ai_config.user_id,
+            enable_suggestions=ai_config.enable_suggestions,
+            enable_auto_summary=ai_config.enable_auto_summary,
+            enable_smart_search=ai_config.enable_smart_search,
+            enable_behavior_analysis=ai_config.enable_behavior_analysis,
+            suggestion_sensitivity=ai_config.suggestion_sensitivity,
+            language_preference=ai_config.language_preference,
+            preferred_suggestion_style=ai_config.preferred_suggestion_style,
+            max_suggestions_per_request=ai_config.max_suggestions_per_request,
+            updated_at=ai_config.updated_at,
+        )
+
+
+class AIConfigCache:
+    """按用户缓存AI配置，条目过期或超过上限时淘汰"""
+
+    def __init__(self, ttl_seconds: float = CACHE_TTL, max_entries: int = MAX_CACHED_USERS):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # {user_id: (配置, 过期时间)}，按最近使用排序
+        self._entries: "OrderedDict[int, Tuple[AISettings, float]]" = OrderedDict()
+
+    def get(self, user_id: int) -> Optional[AISettings]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        settings, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return settings
+
+    def set(self, settings: AISettings) -> None:
+        self._entries[settings.user_id] = (settings, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(settings.user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+# 全局AI配置缓存实例
+ai_config_cache = AIConfigCache()
+
+
+class AIConfigService:
+    """用户AI配置服务"""
+
+    def __init__(self, db: AsyncSession, cache: Optional[AIConfigCache] = None):
+        self.db = db
+        self.cache = ai_config_cache if cache is None else cache
+
+    async def get_settings(self, user_id: int) -> AISettings:
+        """读取用户的AI配置；没有配置记录时返回默认配置（不写入数据库）"""
+        settings = self.cache.get(user_id)
+        if settings is None:
+            ai_config = await self._get_model(user_id)
+            settings = AISettings.from_model(ai_config) if ai_config else AISettings(user_id=user_id)
+            self.cache.set(settings)
+        return settings
+
+    async def get_or_create(self, user_id: int) -> AISettings:
+        """读取用户的AI配置；没有配置记录时创建默认配置"""
+        settings = await self.get_settings(user_id)
+        if settings.updated_at is not None:
+            return settings
+
+        ai_config = await self._get_model(user_id)
+        if ai_config is None:
+            ai_config = AIConfig(user_id=user_id)
+            self.db.add(ai_config)
+            await self.db.commit()
+            await self.db.refresh(ai_config)
+        settings = AISettings.from_model(ai_config)
+        self.cache.set(settings)
+        return settings
+
+    async def update(self, user_id: int, request: AIConfigRequest) -> AISettings:
+        """更新用户的AI配置，并刷新本进程的缓存"""
+        ai_config = await self._get_model(user_id)
+        if ai_config is None:
+            ai_config = AIConfig(user_id=user_id)
+            self.db.add(ai_config)
+
+        ai_config.enable_suggestions = request.enable_suggestions
+        ai_config.enable_auto_summary = request.enable_auto_summary
+        ai_config.enable_smart_search = request.enable_smart_search
+        ai_config.suggestion_sensitivity = request.suggestion_sensitivity
+        ai_config.language_preference = request.language_preference
+
+        await self.db.commit()
+        await self.db.refresh(ai_config)
+        settings = AISettings.from_model(ai_config)
+        self.cache.set(settings)
+        return settings
+
+    async def _get_model(self, user_id: int) -> Optional[AIConfig]:
+        query = select(AIConfig).where(AIConfig.user_id == user_id)
+        result = await self.db.execute(query)
+        return result.scalars().first()
@@ -0,0 +1,434 @@
+"""
+批量AI任务服务
+
+任务以 ai_tasks 表中的行作为持久化队列：
+- API 只负责写入 pending 任务；
+- 执行器（AIJobWorker）领取到期的任务并发执行，执行过程中定期写入心跳、进度和部分结果；
+- 失败后按指数退避重试，超过最大尝试次数标记为 failed；
+- 支持取消：pending 任务直接取消，执行中的任务由心跳检查后中断；
+- 心跳超时的执行中任务（执行器崩溃或重启）会重新排队。
+"""
+import asyncio
+import logging
+import os
+import random
+import socket
+import uuid
+from contextlib import suppress
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.database.database import AsyncSessionLocal
+from app.models.ai_task import AITask
+from app.schemas.ai import BatchProcessRequest
+from app.utils.config import config
+
+logger = logging.getLogger(__name__)
+
+BATCH_TASK_TYPE = "batch_process"
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class JobContext:
+    """任务执行上下文：提供任务参数，并负责写入进度和部分结果"""
+
+    def __init__(self, task: AITask, session_factory: async_sessionmaker):
+        self.task_pk = task.id
+        self.task_id = task.task_id
+        self.user_id = task.user_id
+        self.attempt = task.attempts
+        self.input_data: Dict[str, Any] = dict(task.input_data or {})
+        # 重试时保留上一次尝试已经写入的部分结果，处理器可以据此跳过已完成的部分
+        self.output_data: Dict[str, Any] = dict(task.output_data or {})
+        self.session_factory = session_factory
+        self._lock = asyncio.Lock()
+
+    async def report(self, progress: float, output_data: Optional[Dict[str, Any]] = None) -> None:
+        """写入进度和部分结果（同时刷新心跳）"""
+        if output_data is not None:
+            self.output_data = output_data
+        async with self._lock:
+            async with self.session_factory() as db:
+                await db.execute(
+                    update(AITask)
+                    .where(AITask.id == self.task_pk, AITask.status == "processing")
+                    .values(
+                        progress=min(max(progress, 0.0), 1.0),
+                        output_data=dict(self.output_data),
+                        heartbeat_at=_utcnow()
+                    )
+                )
+                await db.commit()
+
+
+JobHandler = Callable[[JobContext], Awaitable[Dict[str, Any]]]
+
+# 操作类型 -> 处理函数
+JOB_HANDLERS: Dict[str, JobHandler] = {}
+
+
+def job_handler(operation: str) -> Callable[[JobHandler], JobHandler]:
+    """注册批量任务处理函数"""
+    def decorator(func: JobHandler) -> JobHandler:
+        JOB_HANDLERS[operation] = func
+        return func
+    return decorator
+
+
+class AIJobService:
+    """批量AI任务的创建、查询和取消"""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def enqueue(self, request: BatchProcessRequest, user_id: int) -> AITask:
+        """创建批量任务"""
+        if request.operation not in JOB_HANDLERS:
+            raise ValueError(f"Unsupported operation: {request.operation}")
+
+        task = AITask(
+            task_id=str(uuid.uuid4()),
+            task_type=BATCH_TASK_TYPE,
+            status="pending",
+            user_id=user_id,
+            max_attempts=config.ai_jobs.max_attempts,
+            input_data=request.model_dump(mode="json"),
+        )
+        self.db.add(task)
+        await self.db.commit()
+        await self.db.refresh(task)
+
+        ai_job_worker.wake()
+        return task
+
+    async def get_task(self, task_id: str, user_id: int) -> Optional[AITask]:
+        """获取用户的任务"""
+        query = select(AITask).where(AITask.task_id == task_id, AITask.user_id == user_id)
+        result = await self.db.execute(query)
+        return result.scalar_one_or_none()
+
+    async def cancel(self, task_id: str, user_id: int) -> Optional[AITask]:
+        """取消任务：未开始的任务直接取消，执行中的任务由执行器在下一次心跳时中断"""
+        task = await self.get_task(task_id, user_id)
+        if not task:
+            return None
+
+        if task.status == "pending":
+            task.status = "cancelled"
+            task.completed_at = _utcnow()
+        elif task.status == "processing":
+            task.cancel_requested = True
+        else:
+            raise ValueError(f"Task already {task.status}")
+
+        await self.db.commit()
+        await self.db.refresh(task)
+        return task
+
+
+class AIJobWorker:
+    """
+    批量AI任务执行器
+
+    同时最多执行 concurrency 个任务。领取任务时在 PostgreSQL 上使用 FOR UPDATE SKIP LOCKED，
+    并以 status='pending' 作为更新条件，多个执行器进程可以安全地并行领取。
+    """
+
+    def __init__(
+        self,
+        session_factory: Optional[async_sessionmaker] = None,
+        concurrency: Optional[int] = None,
+        poll_interval: Optional[float] = None,
+        lease_seconds: Optional[float] = None,
+        retry_base_delay: Optional[float] = None
+    ):
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.concurrency = concurrency or config.ai_jobs.workers
+        self.poll_interval = poll_interval or config.ai_jobs.poll_interval
+        self.lease_seconds = lease_seconds or config.ai_jobs.lease_seconds
+        self.retry_base_delay = retry_base_delay if retry_base_delay is not None else config.ai_jobs.retry_base_delay
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running: Dict[int, asyncio.Task] = {}
+        self._cancelled: Set[int] = set()
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """启动执行器"""
+        if self.is_running:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"AI任务执行器已启动: {self.worker_id}，并发数 {self.concurrency}")
+
+    async def stop(self) -> None:
+        """停止执行器，执行中的任务释放后由下一个执行器继续"""
+        if not self.is_running:
+            return
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+
+        running = list(self._running.values())
+        for job in running:
+            job.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+    def wake(self) -> None:
+        """有新任务时立即领取，不必等到下一次轮询"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        last_recovery: Optional[float] = None
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            try:
+                if last_recovery is None or loop.time() - last_recovery >= self.lease_seconds / 2:
+                    await self.recover_stale_tasks()
+                    last_recovery = loop.time()
+
+                free_slots = self.concurrency - len(self._running)
+                if free_slots > 0:
+                    for task_pk in await self._claim(free_slots):
+                        job = asyncio.create_task(self._execute(task_pk))
+                        self._running[task_pk] = job
+                        job.add_done_callback(lambda _, pk=task_pk: self._on_job_done(pk))
+            except Exception as e:
+                logger.error(f"领取AI任务失败: {e}")
+
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+
+    def _on_job_done(self, task_pk: int) -> None:
+        self._running.pop(task_pk, None)
+        # 空出执行槽位后立即领取下一个任务
+        self.wake()
+
+    async def _claim(self, limit: int) -> List[int]:
+        """领取最多 limit 个到期的 pending 任务"""
+        now = _utcnow()
+        async with self.session_factory() as db:
+            candidates = (
+                select(AITask.id)
+                .where(
+                    AITask.status == "pending",
+                    or_(AITask.next_run_at == None, AITask.next_run_at <= now)
+                )
+                .order_by(AITask.created_at, AITask.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )
+            ids = list((await db.execute(candidates)).scalars().all())
+            if not ids:
+                return []
+
+            result = await db.execute(
+                update(AITask)
+                .where(AITask.id.in_(ids), AITask.status == "pending")
+                .values(
+                    status="processing",
+                    attempts=AITask.attempts + 1,
+                    locked_by=self.worker_id,
+                    heartbeat_at=now,
+                    started_at=now,
+                    next_run_at=None
+                )
+                .returning(AITask.id)
+                .execution_options(synchronize_session=False)
+            )
+            claimed = list(result.scalars().all())
+            await db.commit()
+            return claimed
+
+    async def recover_stale_tasks(self) -> int:
+        """把心跳超时的执行中任务重新排队（或在尝试次数用尽时标记失败）"""
+        deadline = _utcnow() - timedelta(seconds=self.lease_seconds)
+        async with self.session_factory() as db:
+            query = select(AITask).where(
+                AITask.status == "processing",
+                or_(AITask.heartbeat_at == None, AITask.heartbeat_at < deadline)
+            )
+            stale = (await db.execute(query)).scalars().all()
+            for task in stale:
+                logger.warning(f"AI任务 {task.task_id} 心跳超时（执行器 {task.locked_by}），重新排队")
+                task.locked_by = None
+                if task.cancel_requested:
+                    task.status = "cancelled"
+                    task.completed_at = _utcnow()
+                elif task.attempts >= task.max_attempts:
+                    task.status = "failed"
+                    task.error_message = "Worker lost while processing"
+                    task.completed_at = _utcnow()
+                else:
+                    task.status = "pending"
+            await db.commit()
+            return len(stale)
+
+    async def _execute(self, task_pk: int) -> None:
+        async with self.session_factory() as db:
+            task = await db.get(AITask, task_pk)
+        handler = JOB_HANDLERS.get((task.input_data or {}).get("operation"))
+        if handler is None:
+            await self._finish(task_pk, status="failed", error_message="Unsupported operation")
+            return
+
+        context = JobContext(task, self.session_factory)
+        job = asyncio.create_task(handler(context))
+        heartbeat = asyncio.create_task(self._heartbeat(task_pk, job))
+        try:
+            output_data = await job
+        except asyncio.CancelledError:
+            if task_pk in self._cancelled:
+                self._cancelled.discard(task_pk)
+                await self._finish(task_pk, status="cancelled", output_data=context.output_data)
+            else:
+                # 执行器停止：释放任务，由下一个执行器重新执行（不计入尝试次数）
+                job.cancel()
+                await self._release(task_pk)
+                raise
+        except Exception as e:
+            logger.error(f"AI任务 {task.task_id} 第 {task.attempts} 次执行失败: {e}")
+            await self._retry_or_fail(task, str(e), context.output_data)
+        else:
+            await self._finish(task_pk, status="completed", progress=1.0, output_data=output_data)
+        finally:
+            heartbeat.cancel()
+
+    async def _heartbeat(self, task_pk: int, job: asyncio.Task) -> None:
+        """定期刷新心跳并检查取消请求"""
+        interval = self.lease_seconds / 3
+        while True:
+            await asyncio.sleep(interval)
+            async with self.session_factory() as db:
+                await db.execute(
+                    update(AITask)
+                    .where(AITask.id == task_pk, AITask.locked_by == self.worker_id)
+                    .values(heartbeat_at=_utcnow())
+                )
+                cancel_requested = await db.scalar(select(AITask.cancel_requested).where(AITask.id == task_pk))
+                await db.commit()
+            if cancel_requested:
+                self._cancelled.add(task_pk)
+                job.cancel()
+                return
+
+    async def _retry_or_fail(self, task: AITask, error: str, output_data: Dict[str, Any]) -> None:
+        if task.attempts >= task.max_attempts:
+            await self._finish(task.id, status="failed", error_message=error, output_data=output_data)
+            return
+
+        # 指数退避并加入抖动，避免大量任务在同一时刻重试
+        delay = self.retry_base_delay * (2 ** (task.attempts - 1)) * random.uniform(0.8, 1.2)
+        async with self.session_factory() as db:
+            result = await db.execute(
+                update(AITask)
+                .where(AITask.id == task.id, AITask.locked_by == self.worker_id)
+                .values(
+                    status="pending",
+                    locked_by=None,
+                    error_message=error,
+                    output_data=output_data,
+                    next_run_at=_utcnow() + timedelta(seconds=delay)
+                )
+            )
+            await db.commit()
+        if not result.rowcount:
+            logger.warning(f"AI任务 {task.task_id} 的租约已失效，不再由本执行器重试")
+
+    async def _release(self, task_pk: int) -> None:
+        async with self.session_factory() as db:
+            await db.execute(
+                update(AITask)
+                .where(AITask.id == task_pk, AITask.status == "processing", AITask.locked_by == self.worker_id)
+                .values(status="pending", locked_by=None, attempts=AITask.attempts - 1)
+            )
+            await db.commit()
+
+    async def _finish(self, task_pk: int, status: str, **values: Any) -> bool:
+        """
+        写入任务的最终状态
+
+        只更新仍由本执行器持有的任务：心跳超时后任务可能已被重新排队并由其他执行器领取，
+        此时丢弃本执行器的结果（租约失效），返回 False
+        """
+        async with self.session_factory() as db:
+            result = await db.execute(
+                update(AITask)
+                .where(AITask.id == task_pk, AITask.locked_by == self.worker_id)
+                .values(status=status, locked_by=None, completed_at=_utcnow(), **values)
+            )
+            await db.commit()
+        if not result.rowcount:
+            logger.warning(f"AI任务 {task_pk} 的租约已失效，丢弃本执行器的结果")
+            return False
+        return True
+
+
+def _time_range(input_data: Dict[str, Any]) -> Tuple[datetime, datetime]:
+    """解析任务的时间范围，默认最近24小时"""
+    time_range = input_data.get("time_range") or {}
+    end = time_range.get("end_time") or time_range.get("end")
+    start = time_range.get("start_time") or time_range.get("start")
+    end_time = datetime.fromisoformat(end) if end else _utcnow()
+    start_time = datetime.fromisoformat(start) if start else end_time - timedelta(days=1)
+    return start_time, end_time
+
+
+@job_handler("summarize_all")
+async def summarize_channels(context: JobContext) -> Dict[str, Any]:
+    """批量生成频道摘要：各频道并发执行（最多 channel_concurrency 个），每完成一个频道写入一次进度"""
+    from app.models.channel_member import ChannelMember
+    from app.services.channel_service import ChannelService
+    from app.services.summary_service import SummaryService
+
+    input_data = context.input_data
+    parameters = input_data.get("parameters") or {}
+    summary_type = parameters.get("summary_type", "meeting")
+    start_time, end_time = _time_range(input_data)
+
+    channel_ids = input_data.get("target_channels")
+    if not channel_ids:
+        async with context.session_factory() as db:
+            query = select(ChannelMember.channel_id).where(ChannelMember.user_id == context.user_id)
+            channel_ids = list((await db.execute(query)).scalars().all())
+
+    output_data = dict(context.output_data)
+    summaries: Dict[str, Any] = dict(output_data.get("summaries") or {})
+    output_data["summaries"] = summaries
+    remaining = [channel_id for channel_id in channel_ids if str(channel_id) not in summaries]
+    total = len(channel_ids) or 1
+    # 每个频道在等待模型期间也占用一个数据库连接，限制并发数，避免占满连接池
+    semaphore = asyncio.Semaphore(config.ai_jobs.channel_concurrency)
+
+    async def summarize(channel_id: int) -> None:
+        # 每个频道使用独立的会话，才能真正并发执行
+        async with semaphore, context.session_factory() as db:
+            if not await ChannelService(db).can_user_access_channel(channel_id, context.user_id):
+                summaries[str(channel_id)] = {"error": "Access denied to this channel"}
+            else:
+                summary = await SummaryService(db).get_summary(
+                    channel_id, start_time, end_time, summary_type, context.user_id
+                )
+                summaries[str(channel_id)] = summary.model_dump()
+        await context.report(len(summaries) / total, output_data)
+
+    await asyncio.gather(*(summarize(channel_id) for channel_id in remaining))
+    return output_data
+
+
+# 全局任务执行器实例
+ai_job_worker = AIJobWorker()
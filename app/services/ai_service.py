@@ -31,22 +31,16 @@ class AIService:
         user_id: int
     ) -> MessageSuggestionResponse:
         """
-        智能消息建议（模拟版本）
+        智能消息建议
+        
+        以频道最近的消息为上下文，由模型生成候选回复
         """
         try:
-            # 模拟智能建议
-            suggestions = [
-                "我同意这个观点，我们可以进一步讨论具体实施方案。",
-                "这是个很棒的想法！让我补充一些细节。", 
-                "感谢分享，这对我们的项目很有帮助。"
-            ]
-            
-            return MessageSuggestionResponse(
-                suggestions=suggestions,
-                confidence=0.85,
-                context_used=5
-            )
+            from app.services.message_suggester import MessageSuggester
+            return await MessageSuggester(self.db).suggest(request, user_id)
             
+        except PermissionError:
+            return MessageSuggestionResponse(suggestions=[], confidence=0.0, context_used=0)
         except Exception as e:
             logger.error(f"获取消息建议失败: {e}")
             return MessageSuggestionResponse(
@@ -65,7 +59,9 @@ class AIService:
         user_id: int
     ) -> AutoSummaryResponse:
         """
-        自动会议纪要生成（模拟版本）
+        自动会议纪要生成
+        
+        流式读取时间窗口内的频道消息，分段并发摘要后合并；结果按时间窗口缓存并增量复用
         """
         try:
             # 验证用户权限
@@ -81,22 +77,14 @@ class AIService:
                     message_count=0
                 )
             
-            # 模拟摘要生成
-            return AutoSummaryResponse(
-                summary="本次讨论主要围绕产品功能优化和用户体验改进展开，团队成员积极参与并提出了多个建设性建议。",
-                key_points=[
-                    "用户界面需要进一步优化，提升易用性",
-                    "后端性能优化是下一阶段的重点",
-                    "需要加强用户反馈收集机制",
-                    "团队协作流程可以进一步标准化"
-                ],
-                action_items=[
-                    "UI团队下周完成界面原型设计",
-                    "后端团队进行性能测试和优化",
-                    "产品团队制定用户反馈收集方案"
-                ],
-                participants=["张三", "李四", "王五"],
-                message_count=25
+            from app.services.summary_service import SummaryService
+            summary_service = SummaryService(self.db)
+            return await summary_service.get_summary(
+                request.channel_id,
+                request.start_time,
+                request.end_time,
+                request.summary_type,
+                user_id
             )
             
         except Exception as e:
@@ -115,47 +103,31 @@ class AIService:
         user_id: int
     ) -> SmartSearchResponse:
         """
-        智能语义搜索（模拟版本）
+        智能搜索
+        
+        按 search_type 执行关键词、语义或混合检索，频道和时间范围在召回时过滤
         """
         try:
-            # 模拟搜索结果
-            results = [
-                {
-                    'message_id': 1,
-                    'content': f'这里是关于"{request.query}"的讨论内容，包含了相关的技术细节和实施方案。',
-                    'author': '张三',
-                    'channel_name': '产品讨论',
-                    'timestamp': '2024-01-15T10:30:00Z',
-                    'relevance_score': 0.95
-                },
-                {
-                    'message_id': 2,
-                    'content': f'关于{request.query}的补充说明，提供了更多的背景信息和参考资料。',
-                    'author': '李四',
-                    'channel_name': '技术分享',
-                    'timestamp': '2024-01-15T14:20:00Z',
-                    'relevance_score': 0.87
-                },
-                {
-                    'message_id': 3,
-                    'content': f'我们在{request.query}方面的最新进展和下一步计划。',
-                    'author': '王五',
-                    'channel_name': '项目进度',
-                    'timestamp': '2024-01-16T09:15:00Z',
-                    'relevance_score': 0.82
-                }
-            ]
+            from app.services.search_service import SearchService
+            
+            time_range = request.time_range or {}
+            results, total_count = await SearchService(self.db).search_page(
+                request.query,
+                user_id,
+                search_type=request.search_type,
+                channels=request.channels,
+                start_time=time_range.get("start"),
+                end_time=time_range.get("end"),
+                offset=request.offset,
+                limit=request.limit
+            )
             
             return SmartSearchResponse(
                 results=results,
-                total_count=len(results),
-                search_type="semantic",
+                total_count=total_count,
+                search_type=request.search_type,
                 query_understanding=f"您搜索的是关于'{request.query}'的相关内容",
-                suggestions=[
-                    f"您可能还想搜索: {request.query}相关技术",
-                    f"相关话题: {request.query}最佳实践",
-                    f"延伸阅读: {request.query}案例分析"
-                ]
+                suggestions=[]
             )
             
         except Exception as e:
@@ -0,0 +1,141 @@
+"""
+AI结果流式推送
+
+把消息建议和频道摘要的生成过程转换为事件流：
+- ("token", {"text": ...})：模型新生成的文本，上游每产出一段就立即转发；
+- ("result", {...})：最终的结构化结果，与非流式接口的响应一致；
+- ("error", {"message": ...})：生成失败。
+
+事件流可以通过 SSE 或 WebSocket 发送。消费方提前关闭事件流（客户端断开或取消）时，
+生成任务被取消，上游模型请求随之中断。
+
+流式响应的持续时间超过请求处理函数本身，生成过程使用独立的数据库会话。
+"""
+import asyncio
+import json
+import logging
+from contextlib import aclosing, suppress
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Tuple
+
+from pydantic import BaseModel, ValidationError
+
+from app.database.database import AsyncSessionLocal, bind_session_user
+from app.schemas.ai import AutoSummaryRequest, MessageSuggestionRequest
+
+logger = logging.getLogger(__name__)
+
+StreamEvent = Tuple[str, Dict[str, Any]]
+
+# 关闭反向代理缓冲，保证token及时到达客户端
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+_DONE = object()
+
+
+async def stream_events(produce: Callable[[Callable[[str], None]], Awaitable[BaseModel]]) -> AsyncIterator[StreamEvent]:
+    """
+    运行生成函数并产出事件
+
+    produce 接收一个 on_token 回调，返回最终的响应模型。
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    task = asyncio.create_task(produce(queue.put_nowait))
+    task.add_done_callback(lambda _: queue.put_nowait(_DONE))
+    try:
+        while (item := await queue.get()) is not _DONE:
+            yield "token", {"text": item}
+
+        try:
+            result = task.result()
+        except PermissionError as e:
+            yield "error", {"message": str(e)}
+        except Exception as e:
+            logger.error(f"AI流式生成失败: {e}")
+            yield "error", {"message": "生成失败，请稍后重试"}
+        else:
+            yield "result", result.model_dump(mode="json")
+    finally:
+        if not task.done():
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+
+
+def suggestion_events(request: MessageSuggestionRequest, user_id: int) -> AsyncIterator[StreamEvent]:
+    """流式生成消息建议"""
+    async def produce(on_token: Callable[[str], None]) -> BaseModel:
+        from app.services.message_suggester import MessageSuggester
+
+        async with AsyncSessionLocal() as db:
+            bind_session_user(db, user_id)
+            return await MessageSuggester(db).suggest(request, user_id, on_token)
+
+    return stream_events(produce)
+
+
+def summary_events(request: AutoSummaryRequest, user_id: int) -> AsyncIterator[StreamEvent]:
+    """流式生成频道摘要（命中缓存时只有最终结果）"""
+    async def produce(on_token: Callable[[str], None]) -> BaseModel:
+        from app.services.channel_service import ChannelService
+        from app.services.summary_service import SummaryService
+
+        async with AsyncSessionLocal() as db:
+            bind_session_user(db, user_id)
+            if not await ChannelService(db).can_user_access_channel(request.channel_id, user_id):
+                raise PermissionError("Access denied to this channel")
+            return await SummaryService(db).get_summary(
+                request.channel_id,
+                request.start_time,
+                request.end_time,
+                request.summary_type,
+                user_id,
+                on_token=on_token
+            )
+
+    return stream_events(produce)
+
+
+async def to_sse(events: AsyncIterator[StreamEvent]) -> AsyncIterator[str]:
+    """把事件流编码为 text/event-stream"""
+    async with aclosing(events):
+        async for event, data in events:
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+# WebSocket 消息类型 -> (请求模型, 事件流)
+WEBSOCKET_STREAMS = {
+    "ai_suggestions": (MessageSuggestionRequest, suggestion_events),
+    "ai_summary": (AutoSummaryRequest, summary_events),
+}
+
+
+async def run_websocket_stream(manager, user_id: int, message_type: str, request_id: str, data: dict) -> None:
+    """
+    通过 WebSocket 推送流式结果
+
+    依次发送 ai_token、ai_result 或 ai_error 消息，每条消息都带上客户端提供的 request_id。
+    """
+    async def send(event: str, payload: Dict[str, Any]) -> None:
+        await manager.send_personal_message(
+            {
+                "type": f"ai_{event}",
+                "data": {"request_id": request_id, **payload},
+                "timestamp": datetime.now().isoformat()
+            },
+            user_id
+        )
+
+    request_model, events_factory = WEBSOCKET_STREAMS[message_type]
+    try:
+        request = request_model(**data)
+    except ValidationError as e:
+        await send("error", {"message": f"Invalid request: {e.errors()[0]['msg']}"})
+        return
+
+    async with aclosing(events_factory(request, user_id)) as events:
+        async for event, payload in events:
+            await send(event, {"result": payload} if event == "result" else payload)
@@ -0,0 +1,86 @@
+"""
+附件下载缓存
+
+附件上传完成后内容不再变化，因此：
+
+- ObjectMetaCache：缓存对象的大小和 ETag，条件请求（If-None-Match）直接用缓存的元数据返回304，
+  不访问对象存储；
+- HotFileCache：头像、聊天中的图片等小文件会被反复下载，内容缓存在内存中，按总字节数限制，
+  最久未使用的先淘汰。
+"""
+from collections import OrderedDict
+from typing import Optional
+
+from app.services.object_store import ObjectInfo
+from app.utils.config import config
+
+MAX_CACHED_OBJECTS = 100000
+
+
+class ObjectMetaCache:
+    """按对象键缓存对象元数据"""
+
+    def __init__(self, max_entries: int = MAX_CACHED_OBJECTS):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, ObjectInfo]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[ObjectInfo]:
+        info = self._entries.get(key)
+        if info is not None:
+            self._entries.move_to_end(key)
+        return info
+
+    def set(self, key: str, info: ObjectInfo) -> None:
+        self._entries[key] = info
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class HotFileCache:
+    """小文件内容的内存缓存，总大小不超过 max_bytes"""
+
+    def __init__(self, max_bytes: int, max_file_size: int):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.size = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+
+    def accepts(self, size: int) -> bool:
+        return 0 < self.max_bytes and size <= min(self.max_file_size, self.max_bytes)
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+        return data
+
+    def set(self, key: str, data: bytes) -> None:
+        if not self.accepts(len(data)):
+            return
+        self.invalidate(key)
+        self._entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def invalidate(self, key: str) -> None:
+        data = self._entries.pop(key, None)
+        if data is not None:
+            self.size -= len(data)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+
+# 全局缓存实例
+object_meta_cache = ObjectMetaCache()
+hot_file_cache = HotFileCache(config.attachments.hot_cache_size, config.attachments.hot_file_max_size)
@@ -0,0 +1,340 @@
+"""
+附件预览生成
+
+图片和 PDF 上传完成后生成几个尺寸的 WebP 预览（PDF 取第一页），客户端渲染时间线时下载预览而不是原文件。
+
+- 预览按内容生成：内容去重后一个内容只生成一次，内容相同的附件共用预览（见 attachment_service）；
+- 解码和缩放是 CPU 密集的，在进程池中进行，不占用事件循环；
+- 上传完成时内容被标记为待生成（preview_status=pending），各进程的生成器从数据库领取任务，
+  同时最多处理进程数个，短时间内大量上传只会排队，不会拖慢请求处理。进程重启或生成超时的任务会被重新领取；
+- 只有渲染函数报错（文件损坏或格式不支持）时标记失败。渲染进程崩溃（内存耗尽、渲染库段错误）时换一个新的进程池，
+  对象存储或数据库的临时错误不改变状态，这些内容在领取超时后重新生成；同一内容多次导致渲染进程崩溃时才标记失败。
+
+渲染依赖 Pillow，PDF 还需要 pypdfium2；没有安装时对应类型的文件不生成预览。
+"""
+import asyncio
+import importlib.util
+import io
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+import aiofiles
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.database.database import AsyncSessionLocal
+from app.models.attachment import AttachmentBlob, AttachmentPreview, PreviewStatus
+from app.services.object_store import get_object_store
+from app.utils.config import config
+
+logger = logging.getLogger(__name__)
+
+# 预览尺寸档位：最长边的像素数
+PREVIEW_SIZES: Dict[str, int] = {"small": 160, "medium": 480, "large": 1280}
+PREVIEW_CONTENT_TYPE = "image/webp"
+
+# 同一内容在本进程中导致渲染进程崩溃的次数达到该值时标记失败
+MAX_RENDER_CRASHES = 3
+
+# 渲染结果：(档位, 宽, 高, WebP 数据)
+Rendition = Tuple[str, int, int, bytes]
+Renderer = Callable[[str, Dict[str, int], int], List[Rendition]]
+
+
+def available_preview_types() -> Tuple[str, ...]:
+    """已安装的渲染库支持的内容类型（前缀匹配）"""
+    if importlib.util.find_spec("PIL") is None:
+        return ()
+    if importlib.util.find_spec("pypdfium2") is None:
+        return ("image/",)
+    return ("image/", "application/pdf")
+
+
+def render_previews(path: str, sizes: Dict[str, int], quality: int) -> List[Rendition]:
+    """
+    生成各档位的预览（在子进程中运行）
+
+    不放大：原图小于某个档位时该档位与原图同尺寸，尺寸相同的档位只保留最小的一个。
+    """
+    from PIL import Image, ImageOps
+
+    with open(path, "rb") as f:
+        is_pdf = f.read(5) == b"%PDF-"
+    largest = max(sizes.values())
+    if is_pdf:
+        import pypdfium2
+
+        document = pypdfium2.PdfDocument(path)
+        try:
+            page = document[0]
+            width, height = page.get_size()
+            image = page.render(scale=largest / max(width, height)).to_pil()
+        finally:
+            document.close()
+    else:
+        image = Image.open(path)
+        # JPEG 可以在解码时直接缩小，大图解码快得多
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image)
+    image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+
+    renditions: List[Rendition] = []
+    seen = set()
+    for variant, size in sorted(sizes.items(), key=lambda item: item[1]):
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        if resized.size in seen:
+            continue
+        seen.add(resized.size)
+        buffer = io.BytesIO()
+        resized.save(buffer, "WEBP", quality=quality)
+        renditions.append((variant, resized.width, resized.height, buffer.getvalue()))
+    return renditions
+
+
+def preview_key(sha256: str, variant: str) -> str:
+    return f"previews/{sha256[:2]}/{sha256}/{variant}.webp"
+
+
+async def _once(data: bytes) -> AsyncIterator[bytes]:
+    yield data
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class _RenderFailed(Exception):
+    """渲染函数报错：文件损坏或格式不支持"""
+
+
+class PreviewGenerator:
+    """附件预览生成器"""
+
+    def __init__(
+        self,
+        renderer: Renderer = render_previews,
+        content_types: Optional[Sequence[str]] = None,
+        session_factory: Optional[async_sessionmaker] = None,
+        executor: Optional[Executor] = None,
+        workers: Optional[int] = None,
+        poll_interval: Optional[float] = None
+    ):
+        self.renderer = renderer
+        self.content_types = tuple(available_preview_types() if content_types is None else content_types)
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.workers = workers or config.attachments.preview_workers
+        self.poll_interval = poll_interval or config.attachments.preview_poll_interval
+        self._executor = executor
+        self._owns_executor = executor is None
+        # 本进程中各内容导致渲染进程崩溃的次数
+        self._crashes: Dict[int, int] = {}
+
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def accepts(self, content_type: str, size: int) -> bool:
+        """上传完成时调用：这个文件是否需要生成预览"""
+        if size > config.attachments.preview_max_source_size or content_type == "image/svg+xml":
+            return False
+        return any(content_type.startswith(prefix) for prefix in self.content_types)
+
+    def start(self) -> None:
+        if self.is_running:
+            return
+        if not self.content_types:
+            logger.warning("未安装 Pillow，附件不生成预览")
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self.is_running:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+        self._task = None
+        if self._owns_executor and self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def notify(self) -> None:
+        """有新的内容待生成预览时调用"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def _discard_executor(self, executor: Executor) -> None:
+        """进程池中有进程崩溃后整个进程池不再可用，丢弃它，下次使用时重新创建"""
+        if self._owns_executor and self._executor is executor:
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"附件预览生成失败: {e}")
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+
+    async def sync(self) -> int:
+        """领取并生成待生成的预览，直到没有待生成的内容，返回处理的数量"""
+        processed = 0
+        while True:
+            claimed = await self._claim(self.workers)
+            if not claimed:
+                return processed
+            crashed = await asyncio.gather(*(
+                self._generate(blob_id, key, sha256, alone=len(claimed) == 1) for blob_id, key, sha256 in claimed
+            ))
+            # 一个文件让渲染进程崩溃时同一批的内容都会收到 BrokenProcessPool，逐个重新生成，
+            # 只有单独渲染时仍然崩溃的内容才计入崩溃次数
+            for (blob_id, key, sha256), broken in zip(claimed, crashed):
+                if broken:
+                    await self._generate(blob_id, key, sha256)
+            processed += len(claimed)
+
+    async def _claim(self, limit: int) -> List[Tuple[int, str, str]]:
+        """领取最多 limit 个待生成（或生成超时）的内容"""
+        now = _utcnow()
+        expired = now - timedelta(seconds=config.attachments.preview_lease)
+        claimable = or_(
+            AttachmentBlob.preview_status == PreviewStatus.PENDING,
+            (AttachmentBlob.preview_status == PreviewStatus.PROCESSING) & (AttachmentBlob.preview_claimed_at < expired)
+        )
+        async with self.session_factory() as db:
+            candidates = (
+                select(AttachmentBlob.id)
+                .where(claimable)
+                .order_by(AttachmentBlob.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )
+            ids = list((await db.execute(candidates)).scalars().all())
+            if not ids:
+                return []
+            result = await db.execute(
+                update(AttachmentBlob)
+                .where(AttachmentBlob.id.in_(ids), claimable)
+                .values(preview_status=PreviewStatus.PROCESSING, preview_claimed_at=now)
+                .returning(AttachmentBlob.id, AttachmentBlob.storage_key, AttachmentBlob.sha256)
+                .execution_options(synchronize_session=False)
+            )
+            claimed = [tuple(row) for row in result.all()]
+            await db.commit()
+            return claimed
+
+    @asynccontextmanager
+    async def _source_file(self, storage_key: str) -> AsyncIterator[Path]:
+        """原文件的本地路径；不在本地的对象先下载到临时文件"""
+        store = get_object_store()
+        path = store.local_path(storage_key)
+        if path is not None:
+            yield path
+            return
+        fd, name = tempfile.mkstemp(prefix="preview-")
+        os.close(fd)
+        try:
+            async with aiofiles.open(name, "wb") as f:
+                async for chunk in store.read(storage_key):
+                    await f.write(chunk)
+            yield Path(name)
+        finally:
+            os.unlink(name)
+
+    async def _render(self, path: Path) -> List[Rendition]:
+        executor = self._get_executor()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, self.renderer, str(path), PREVIEW_SIZES, config.attachments.preview_quality
+            )
+        except BrokenProcessPool:
+            self._discard_executor(executor)
+            raise
+        except Exception as e:
+            raise _RenderFailed(e) from e
+
+    async def _generate(self, blob_id: int, storage_key: str, sha256: str, alone: bool = True) -> bool:
+        """
+        生成一个内容的预览
+
+        与其他内容同批渲染（alone 为 False）时渲染进程崩溃不计次数，返回 True，由调用方单独重新生成
+        """
+        store = get_object_store()
+        previews: List[AttachmentPreview] = []
+        try:
+            async with self._source_file(storage_key) as path:
+                renditions = await self._render(path)
+            for variant, width, height, data in renditions:
+                key = preview_key(sha256, variant)
+                await store.put(key, _once(data), PREVIEW_CONTENT_TYPE)
+                previews.append(AttachmentPreview(
+                    blob_id=blob_id, variant=variant, content_type=PREVIEW_CONTENT_TYPE,
+                    width=width, height=height, size=len(data), storage_key=key
+                ))
+            async with self.session_factory() as db:
+                # 超时后重新生成时替换上一次留下的记录
+                await db.execute(delete(AttachmentPreview).where(AttachmentPreview.blob_id == blob_id))
+                db.add_all(previews)
+                await db.execute(
+                    update(AttachmentBlob)
+                    .where(AttachmentBlob.id == blob_id)
+                    .values(preview_status=PreviewStatus.READY)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+            self._crashes.pop(blob_id, None)
+        except _RenderFailed as e:
+            # 文件损坏或格式不支持：标记失败，不再重试
+            logger.warning(f"附件内容 {sha256[:12]} 生成预览失败: {e.__cause__}")
+            await self._mark_failed(blob_id)
+        except BrokenProcessPool:
+            if not alone:
+                return True
+            crashes = self._crashes[blob_id] = self._crashes.get(blob_id, 0) + 1
+            if crashes < MAX_RENDER_CRASHES:
+                logger.warning(f"附件内容 {sha256[:12]} 生成预览时渲染进程崩溃，领取超时后重试")
+                return False
+            logger.warning(f"附件内容 {sha256[:12]} 生成预览时渲染进程崩溃 {crashes} 次，不再重试")
+            self._crashes.pop(blob_id)
+            await self._mark_failed(blob_id)
+        except Exception as e:
+            # 对象存储或数据库的临时错误：保持领取状态，领取超时后重新生成
+            logger.error(f"附件内容 {sha256[:12]} 生成预览出错，领取超时后重试: {e}")
+            with suppress(Exception):
+                await store.delete_many([preview.storage_key for preview in previews])
+        return False
+
+    async def _mark_failed(self, blob_id: int) -> None:
+        async with self.session_factory() as db:
+            await db.execute(
+                update(AttachmentBlob)
+                .where(AttachmentBlob.id == blob_id)
+                .values(preview_status=PreviewStatus.FAILED)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+
+# 全局预览生成器实例
+preview_generator = PreviewGenerator()
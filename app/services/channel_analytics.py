@@ -0,0 +1,285 @@
+"""
+频道活动分析
+
+一次查询按列读取频道在时间窗口内的消息（时间戳、作者、长度、回复对象），转成 NumPy 数组后
+向量化计算活跃度、按星期和小时的热力图、发言集中度和回复时间分布，不逐行构造 ORM 对象。
+结果按 (频道, 时间窗口) 缓存，过期前的重复请求不再查询数据库。
+"""
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import Float, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+from app.database.database import read_only
+from app.models.message import Message
+from app.schemas.ai import ChannelActivityStats, ChannelAnalysisResponse, ResponseTimeStats
+from app.services.vector_index import to_epoch
+
+logger = logging.getLogger(__name__)
+
+# 未指定时间范围时分析最近多少天
+DEFAULT_WINDOW_DAYS = 30
+# 服务端游标每次取回的行数
+STREAM_CHUNK_SIZE = 10000
+# 日均消息数达到多少算高/中活跃度
+HIGH_ACTIVITY_PER_DAY = 50
+MEDIUM_ACTIVITY_PER_DAY = 10
+PEAK_HOUR_COUNT = 3
+
+RESPONSE_TIME_BUCKETS = ("<1m", "1-5m", "5-60m", "1-24h", ">24h")
+# 各桶的上界（不含最后一个桶）
+RESPONSE_TIME_EDGES = np.array([60, 300, 3600, 86400])
+
+WEEKDAY_NAMES = ("周一", "周二", "周三", "周四", "周五", "周六", "周日")
+# 1970-01-01 是星期四（周一为0时是3）
+_EPOCH_WEEKDAY = 3
+
+
+class epoch_seconds(FunctionElement):
+    """时间列转为 epoch 秒（浮点），在数据库端完成，避免逐行转换 datetime"""
+    type = Float()
+    inherit_cache = True
+
+
+@compiles(epoch_seconds)
+def _compile_epoch_seconds(element, compiler, **kw):
+    return "CAST(EXTRACT(EPOCH FROM %s) AS DOUBLE PRECISION)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(epoch_seconds, "sqlite")
+def _compile_epoch_seconds_sqlite(element, compiler, **kw):
+    return "((julianday(%s) - 2440587.5) * 86400.0)" % compiler.process(element.clauses, **kw)
+
+
+@dataclass
+class MessageColumns:
+    """按时间升序排列的消息列"""
+    ids: np.ndarray
+    timestamps: np.ndarray
+    author_ids: np.ndarray
+    lengths: np.ndarray
+    # 没有回复对象时为 -1
+    parent_ids: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+def _response_times(values: np.ndarray) -> ResponseTimeStats:
+    if not len(values):
+        return ResponseTimeStats(count=0, buckets=dict.fromkeys(RESPONSE_TIME_BUCKETS, 0))
+    # 分桶边界只有几个，二分定位后计数，比 np.histogram 对整列排序快
+    counts = np.bincount(np.searchsorted(RESPONSE_TIME_EDGES, values, side="right"), minlength=len(RESPONSE_TIME_BUCKETS))
+    p50, p90 = np.percentile(values, [50, 90])
+    return ResponseTimeStats(
+        count=len(values),
+        p50_seconds=round(float(p50), 1),
+        p90_seconds=round(float(p90), 1),
+        buckets=dict(zip(RESPONSE_TIME_BUCKETS, counts.tolist()))
+    )
+
+
+def _gini(counts: np.ndarray) -> float:
+    """发言数的基尼系数：所有人发言一样多时为0"""
+    if len(counts) < 2:
+        return 0.0
+    ordered = np.sort(counts).astype(np.float64)
+    ranks = np.arange(1, len(ordered) + 1)
+    n = len(ordered)
+    return float((2 * np.dot(ranks, ordered) / (n * ordered.sum())) - (n + 1) / n)
+
+
+def compute_activity(columns: MessageColumns, window_seconds: float) -> Tuple[int, ChannelActivityStats]:
+    """计算活动统计，返回 (活跃用户数, 统计)"""
+    timestamps = columns.timestamps
+    author_counts = np.bincount(columns.author_ids) if len(columns) else columns.author_ids
+    author_counts = author_counts[author_counts > 0]
+
+    # 星期几*24+小时 等于 (epoch小时数 + 1970-01-01 的星期偏移) 对一周小时数取模
+    hours = (timestamps * (1 / 3600)).astype(np.int64)
+    heatmap = np.bincount((hours + _EPOCH_WEEKDAY * 24) % (7 * 24), minlength=7 * 24).reshape(7, 24)
+
+    peak_slots = np.argsort(heatmap, axis=None, kind="stable")[::-1][:PEAK_HOUR_COUNT]
+    peak_hours = [
+        f"{WEEKDAY_NAMES[slot // 24]} {slot % 24:02d}:00"
+        for slot in peak_slots if heatmap.flat[slot] > 0
+    ]
+
+    # 线程回复：在窗口内找到原消息的回复，计算两者的时间差。
+    # id 通常已按时间递增，不需要排序；原消息id先排序再二分查找，访存是顺序的
+    ids = columns.ids
+    order = None if np.all(ids[1:] >= ids[:-1]) else np.argsort(ids, kind="stable")
+    sorted_ids = ids if order is None else ids[order]
+    replies = np.flatnonzero(columns.parent_ids >= 0)
+    replies = replies[np.argsort(columns.parent_ids[replies])]
+    parents = columns.parent_ids[replies]
+    positions = np.minimum(np.searchsorted(sorted_ids, parents), max(len(sorted_ids) - 1, 0))
+    found = sorted_ids[positions] == parents if len(sorted_ids) else np.zeros(0, dtype=bool)
+    positions = positions[found] if order is None else order[positions[found]]
+    reply_times = timestamps[replies[found]] - timestamps[positions]
+
+    # 换人发言：相邻两条消息作者不同时的间隔
+    changed = columns.author_ids[1:] != columns.author_ids[:-1]
+    turn_times = np.diff(timestamps)[changed]
+
+    message_count = len(columns)
+    days = max(window_seconds / 86400, 1.0)
+    stats = ChannelActivityStats(
+        messages_per_day=round(message_count / days, 2),
+        heatmap=heatmap.tolist(),
+        peak_hours=peak_hours,
+        top_author_share=round(float(author_counts.max() / message_count), 4) if message_count else 0.0,
+        author_gini=round(_gini(author_counts), 4),
+        average_length=round(float(columns.lengths.mean()), 1) if message_count else 0.0,
+        reply_time=_response_times(reply_times[reply_times >= 0]),
+        turn_time=_response_times(turn_times),
+    )
+    return len(author_counts), stats
+
+
+def activity_level(messages_per_day: float) -> str:
+    if messages_per_day >= HIGH_ACTIVITY_PER_DAY:
+        return "high"
+    if messages_per_day >= MEDIUM_ACTIVITY_PER_DAY:
+        return "medium"
+    return "low"
+
+
+def recommendations(level: str, stats: ChannelActivityStats) -> List[str]:
+    """根据统计结果给出建议"""
+    if not stats.heatmap or not any(map(any, stats.heatmap)):
+        return ["该时间段内没有消息，可以发起一个话题带动讨论"]
+
+    result = []
+    if level == "low":
+        result.append("频道近期较为冷清，建议定期发起讨论话题")
+    elif level == "high":
+        result.append("频道讨论非常活跃，可以使用自动摘要跟进错过的内容")
+    if stats.top_author_share > 0.5:
+        result.append("讨论集中在少数成员，可以邀请其他成员发表意见")
+    if stats.reply_time.p50_seconds is not None and stats.reply_time.p50_seconds > 3600:
+        result.append("线程回复的中位时间超过1小时，重要问题可以直接@相关成员")
+    if stats.peak_hours:
+        result.append(f"频道在 {stats.peak_hours[0]}（UTC）最活跃，重要通知可以在这个时段发布")
+    return result
+
+
+class AnalysisCache:
+    """
+    频道分析结果缓存
+
+    按 (频道, 时间窗口) 缓存，条目过期后重新计算；条目数超过上限时淘汰最早写入的条目。
+    """
+
+    def __init__(self, ttl_seconds: float = 300.0, max_entries: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # {key: (结果, 过期时间)}
+        self._entries: Dict[Hashable, Tuple[ChannelAnalysisResponse, float]] = {}
+
+    def get(self, key: Hashable) -> Optional[ChannelAnalysisResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        result, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return None
+        return result
+
+    def set(self, key: Hashable, result: ChannelAnalysisResponse) -> None:
+        self._entries.pop(key, None)
+        while len(self._entries) >= self.max_entries:
+            del self._entries[next(iter(self._entries))]
+        self._entries[key] = (result, time.monotonic() + self.ttl_seconds)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+# 全局频道分析缓存实例
+channel_analysis_cache = AnalysisCache()
+
+
+class ChannelAnalyticsService:
+    """频道活动分析服务"""
+
+    def __init__(self, db: AsyncSession, cache: Optional[AnalysisCache] = None):
+        self.db = db
+        self.cache = channel_analysis_cache if cache is None else cache
+
+    async def analyze(
+        self,
+        channel_id: int,
+        analysis_type: str,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None
+    ) -> ChannelAnalysisResponse:
+        """
+        分析频道在时间窗口内的活动
+
+        未指定时间范围时分析最近 DEFAULT_WINDOW_DAYS 天；这类请求共用一个缓存条目，由过期时间保证新鲜度。
+        """
+        key = (channel_id, start_time, end_time)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached.model_copy(update={"analysis_type": analysis_type})
+
+        end = end_time or datetime.now(timezone.utc)
+        start = start_time or end - timedelta(days=DEFAULT_WINDOW_DAYS)
+        columns = await self.load_columns(channel_id, start, end)
+        active_users, stats = compute_activity(columns, to_epoch(end) - to_epoch(start))
+        level = activity_level(stats.messages_per_day)
+
+        result = ChannelAnalysisResponse(
+            channel_id=channel_id,
+            analysis_type=analysis_type,
+            message_count=len(columns),
+            active_users=active_users,
+            activity_level=level,
+            activity=stats,
+            recommendations=recommendations(level, stats)
+        )
+        self.cache.set(key, result)
+        return result
+
+    @read_only
+    async def load_columns(self, channel_id: int, start_time: datetime, end_time: datetime) -> MessageColumns:
+        """按列分块读取窗口内的消息，直接拼接为数组"""
+        query = (
+            select(
+                Message.id,
+                epoch_seconds(Message.created_at),
+                Message.author_id,
+                func.length(Message.content),
+                func.coalesce(Message.parent_id, -1),
+            )
+            .where(
+                Message.channel_id == channel_id,
+                Message.is_deleted == False,
+                Message.created_at >= start_time,
+                Message.created_at <= end_time
+            )
+            .order_by(Message.created_at, Message.id)
+            .execution_options(yield_per=STREAM_CHUNK_SIZE)
+        )
+        dtypes = (np.int64, np.float64, np.int64, np.int32, np.int64)
+        chunks: List[List[np.ndarray]] = [[] for _ in dtypes]
+
+        result = await self.db.stream(query)
+        async for rows in result.partitions():
+            for chunk, dtype, values in zip(chunks, dtypes, zip(*rows)):
+                chunk.append(np.fromiter(values, dtype=dtype, count=len(rows)))
+
+        ids, timestamps, author_ids, lengths, parent_ids = (
+            np.concatenate(chunk) if chunk else np.zeros(0, dtype=dtype)
+            for chunk, dtype in zip(chunks, dtypes)
+        )
+        return MessageColumns(ids, timestamps, author_ids, lengths, parent_ids)
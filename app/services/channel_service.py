@@ -3,10 +3,11 @@
 """
 from typing import List, Optional
 
-from sqlalchemy import select, func
+from sqlalchemy import select, func, or_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
+from app.database.database import read_only
 from app.models.channel import Channel, ChannelType
 from app.models.channel_member import ChannelMember, ChannelRole
 from app.models.team_member import TeamMember, TeamRole
@@ -98,6 +99,7 @@ class ChannelService:
         result = await self.db.execute(query)
         return result.scalar_one_or_none()
     
+    @read_only
     async def get_team_channels(self, team_id: int, user_id: int, include_archived: bool = False) -> List[Channel]:
         """获取团队频道列表（用户有权限访问的）"""
         # 首先检查用户是否是团队成员
@@ -129,6 +131,7 @@ class ChannelService:
         
         return accessible_channels
     
+    @read_only
     async def get_user_channels(self, user_id: int, skip: int = 0, limit: int = 100) -> List[Channel]:
         """获取用户参与的频道列表"""
         query = (
@@ -144,6 +147,28 @@ class ChannelService:
         result = await self.db.execute(query)
         return result.scalars().all()
     
+    @read_only
+    async def get_user_channel_ids(self, user_id: int) -> List[int]:
+        """获取用户可以访问的频道ID（所在团队的公开频道和参与的频道）"""
+        member_channels = (
+            select(ChannelMember.channel_id)
+            .where(ChannelMember.user_id == user_id)
+        )
+        team_public_channels = (
+            select(Channel.id)
+            .join(TeamMember, TeamMember.team_id == Channel.team_id)
+            .where(TeamMember.user_id == user_id)
+            .where(Channel.type == ChannelType.PUBLIC)
+        )
+        query = (
+            select(Channel.id)
+            .where(or_(Channel.id.in_(member_channels), Channel.id.in_(team_public_channels)))
+            .where(Channel.is_active == True)
+            .where(Channel.is_archived == False)
+        )
+        result = await self.db.execute(query)
+        return list(result.scalars().all())
+    
     async def update_channel(self, channel_id: int, channel_update: ChannelUpdate, user_id: int) -> Optional[Channel]:
         """更新频道信息"""
         # 检查权限
@@ -184,6 +209,18 @@ class ChannelService:
         
         channel.is_archived = True
         await self.db.commit()
+        
+        # 通知频道成员（批量扇出）
+        archiver = await self.db.get(User, user_id)
+        from app.services.notification_service import NotificationService
+        notification_service = NotificationService(self.db)
+        
+        await notification_service.notify_channel_archived(
+            channel_id=channel.id,
+            channel_name=channel.name,
+            archiver_id=user_id,
+            archiver_name=(archiver.full_name or archiver.username) if archiver else "管理员"
+        )
         return True
     
     async def delete_channel(self, channel_id: int, user_id: int) -> bool:
@@ -325,6 +362,7 @@ class ChannelService:
         
         return False
     
+    @read_only
     async def search_channels(self, team_id: int, user_id: int, query: str, limit: int = 10) -> List[Channel]:
         """搜索团队中的频道"""
         # 检查用户是否是团队成员
@@ -358,6 +396,7 @@ class ChannelService:
         
         return accessible_channels
     
+    @read_only
     async def get_channel_stats(self, channel_id: int) -> dict:
         """获取频道统计信息"""
         # 成员数量
@@ -0,0 +1,322 @@
+"""
+频道摘要生成
+
+按时间窗口分页读取频道消息，打包成token预算内的分段并发摘要（map），
+再把各段结果逐层合并（reduce）。内存占用只与分段大小和并发数有关，与窗口内的消息总数无关。
+
+消息按 (created_at, id) 键集分页，每页查询读完即关闭结果，等待模型期间不保留打开的游标。
+"""
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.message import Message
+from app.models.user import User
+from app.schemas.ai import AutoSummaryResponse
+from app.services.llm_client import LLMClient, estimate_tokens, get_llm_client
+from app.utils.config import config
+
+logger = logging.getLogger(__name__)
+
+# 每页读取的消息数
+PAGE_SIZE = 500
+
+SUMMARY_TYPE_NAMES = {
+    "meeting": "会议纪要",
+    "discussion": "讨论摘要",
+    "decision": "决策记录",
+}
+
+_OUTPUT_FORMAT = (
+    '只返回JSON对象，不要输出其他内容，格式为：'
+    '{"summary": "一段简要总结", "key_points": ["关键要点"], "action_items": ["行动项目"]}'
+)
+
+
+@dataclass
+class WindowStats:
+    """流式读取过程中累计的统计信息"""
+    message_count: int = 0
+    # 参与者 -> 发言数，保持首次发言顺序
+    participants: Dict[str, int] = field(default_factory=dict)
+
+
+class ChannelSummarizer:
+    """频道历史摘要（map-reduce）"""
+
+    def __init__(
+        self,
+        db: AsyncSession,
+        llm: Optional[LLMClient] = None,
+        segment_tokens: Optional[int] = None,
+        max_concurrency: Optional[int] = None
+    ):
+        self.db = db
+        self.llm = llm or get_llm_client()
+        self.segment_tokens = segment_tokens or config.llm.segment_tokens
+        self.max_concurrency = max_concurrency or config.llm.max_concurrency
+
+    async def summarize(
+        self,
+        channel_id: int,
+        start_time: datetime,
+        end_time: datetime,
+        summary_type: str = "meeting",
+        on_token: Optional[Callable[[str], None]] = None
+    ) -> AutoSummaryResponse:
+        """生成指定时间窗口内的频道摘要"""
+        result, stats = await self.summarize_window(channel_id, start_time, end_time, summary_type, on_token=on_token)
+        return to_summary_response(result, stats)
+
+    async def summarize_window(
+        self,
+        channel_id: int,
+        start_time: datetime,
+        end_time: datetime,
+        summary_type: str = "meeting",
+        previous: Optional[Dict[str, Any]] = None,
+        start_exclusive: bool = False,
+        on_token: Optional[Callable[[str], None]] = None
+    ) -> Tuple[Optional[Dict[str, Any]], WindowStats]:
+        """
+        摘要时间窗口内的消息，返回 (摘要结果, 统计信息)
+        
+        previous 为此前已生成的摘要（summary/key_points/action_items），会作为第一段参与合并，
+        用于只摘要新增的尾部消息；窗口内没有消息时直接返回 previous。
+        
+        指定 on_token 时，最后一次模型调用（单段摘要或最后一轮合并）流式生成，
+        摘要正文一边生成一边交给 on_token。
+        """
+        stats = WindowStats()
+        segments = self._segments(channel_id, start_time, end_time, stats, start_exclusive)
+
+        if on_token is not None and previous is None:
+            # 窗口只有一段时直接流式摘要这一段，不经过 map-reduce，首个token到达最快
+            first = await anext(segments, None)
+            if first is None:
+                return None, stats
+            second = await anext(segments, None)
+            if second is None:
+                _, result = await self._summarize_segment(0, first, summary_type, on_token)
+                return result, stats
+            segments = _prepend([first, second], segments)
+
+        partials = await self._map(segments, summary_type)
+
+        if not partials:
+            return previous, stats
+        if previous is not None:
+            partials.insert(0, previous)
+        return await self._reduce(partials, summary_type, on_token), stats
+
+    async def _stream_lines(
+        self, channel_id: int, start_time: datetime, end_time: datetime, stats: WindowStats, start_exclusive: bool
+    ) -> AsyncIterator[str]:
+        """
+        按时间顺序逐条产出格式化后的消息
+
+        调用方在两次取值之间会等待模型，所以不用服务端游标：每页单独查询并读完，下一页从上一页最后一条之后开始。
+        """
+        after_start = Message.created_at > start_time if start_exclusive else Message.created_at >= start_time
+        query = (
+            select(Message.id, Message.created_at, Message.content, User.username, User.full_name)
+            .join(User, Message.author_id == User.id)
+            .where(
+                Message.channel_id == channel_id,
+                Message.is_deleted == False,
+                after_start,
+                Message.created_at <= end_time
+            )
+            .order_by(Message.created_at, Message.id)
+            .limit(PAGE_SIZE)
+        )
+        page = query
+        while True:
+            rows = (await self.db.execute(page)).all()
+            for message_id, created_at, content, username, full_name in rows:
+                author = full_name or username
+                stats.message_count += 1
+                stats.participants[author] = stats.participants.get(author, 0) + 1
+                yield f"[{created_at:%m-%d %H:%M}] {author}: {content}"
+            if len(rows) < PAGE_SIZE:
+                return
+            last_id, last_created_at = rows[-1][0], rows[-1][1]
+            page = query.where(or_(
+                Message.created_at > last_created_at,
+                and_(Message.created_at == last_created_at, Message.id > last_id)
+            ))
+
+    async def _segments(
+        self, channel_id: int, start_time: datetime, end_time: datetime, stats: WindowStats, start_exclusive: bool
+    ) -> AsyncIterator[str]:
+        """把消息打包成不超过token预算的分段"""
+        lines: List[str] = []
+        tokens = 0
+        async for line in self._stream_lines(channel_id, start_time, end_time, stats, start_exclusive):
+            line_tokens = estimate_tokens(line)
+            if line_tokens > self.segment_tokens:
+                # 单条超长消息按比例截断，保证每段都在预算内
+                line = line[: max(1, len(line) * self.segment_tokens // line_tokens)]
+                line_tokens = self.segment_tokens
+
+            if lines and tokens + line_tokens > self.segment_tokens:
+                yield "\n".join(lines)
+                lines, tokens = [], 0
+            lines.append(line)
+            tokens += line_tokens
+
+        if lines:
+            yield "\n".join(lines)
+
+    async def _map(self, segments: AsyncIterator[str], summary_type: str) -> List[Dict[str, Any]]:
+        """并发摘要各分段，同时在途的请求不超过 max_concurrency"""
+        results: List[Tuple[int, Dict[str, Any]]] = []
+        pending: Set[asyncio.Task] = set()
+        try:
+            index = 0
+            async for segment in segments:
+                if len(pending) >= self.max_concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    results.extend(task.result() for task in done)
+                pending.add(asyncio.create_task(self._summarize_segment(index, segment, summary_type)))
+                index += 1
+
+            if pending:
+                done, pending = await asyncio.wait(pending)
+                results.extend(task.result() for task in done)
+        finally:
+            for task in pending:
+                task.cancel()
+
+        results.sort(key=lambda item: item[0])
+        return [partial for _, partial in results]
+
+    async def _summarize_segment(
+        self, index: int, segment: str, summary_type: str, on_token: Optional[Callable[[str], None]] = None
+    ) -> Tuple[int, Dict[str, Any]]:
+        type_name = SUMMARY_TYPE_NAMES.get(summary_type, "讨论摘要")
+        result = await self._chat_json([
+            {
+                "role": "system",
+                "content": f"你是团队协作助手，负责为频道聊天记录撰写{type_name}。{_OUTPUT_FORMAT}"
+            },
+            {
+                "role": "user",
+                "content": f"以下是频道聊天记录的一段，格式为“[时间] 作者: 内容”：\n{segment}"
+            },
+        ], on_token)
+        return index, _normalize(result)
+
+    async def _reduce(
+        self, partials: List[Dict[str, Any]], summary_type: str, on_token: Optional[Callable[[str], None]] = None
+    ) -> Dict[str, Any]:
+        """逐层合并分段摘要，每次合并的输入都在token预算内"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def merge(group: List[Dict[str, Any]]) -> Dict[str, Any]:
+            async with semaphore:
+                return await self._merge(group, summary_type)
+
+        while len(partials) > 1:
+            groups = self._group_partials(partials)
+            if on_token is not None and len(groups) == 1:
+                # 最后一轮合并流式生成
+                return await self._merge(groups[0], summary_type, on_token)
+            partials = list(await asyncio.gather(*(merge(group) for group in groups)))
+
+        if on_token is not None:
+            on_token(partials[0]["summary"])
+        return partials[0]
+
+    def _group_partials(self, partials: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """按token预算把相邻的分段摘要分组（每组至少两个，保证每轮都在收敛）"""
+        groups: List[List[Dict[str, Any]]] = []
+        group: List[Dict[str, Any]] = []
+        tokens = 0
+        for partial in partials:
+            partial_tokens = estimate_tokens(json.dumps(partial, ensure_ascii=False))
+            if len(group) >= 2 and tokens + partial_tokens > self.segment_tokens:
+                groups.append(group)
+                group, tokens = [], 0
+            group.append(partial)
+            tokens += partial_tokens
+
+        if len(group) == 1 and groups:
+            groups[-1].append(group[0])
+        elif group:
+            groups.append(group)
+        return groups
+
+    async def _merge(
+        self, partials: List[Dict[str, Any]], summary_type: str, on_token: Optional[Callable[[str], None]] = None
+    ) -> Dict[str, Any]:
+        if len(partials) == 1:
+            return partials[0]
+
+        type_name = SUMMARY_TYPE_NAMES.get(summary_type, "讨论摘要")
+        result = await self._chat_json([
+            {
+                "role": "system",
+                "content": f"你是团队协作助手，负责把多段{type_name}合并为一份，去除重复的要点和行动项目。{_OUTPUT_FORMAT}"
+            },
+            {
+                "role": "user",
+                "content": "以下是同一频道按时间顺序排列的多段摘要：\n"
+                           + "\n".join(json.dumps(partial, ensure_ascii=False) for partial in partials)
+            },
+        ], on_token)
+        return _normalize(result)
+
+    async def _chat_json(
+        self, messages: List[Dict[str, str]], on_token: Optional[Callable[[str], None]]
+    ) -> Dict[str, Any]:
+        if on_token is None:
+            return await self.llm.chat_json(messages, feature="summary")
+        return await self.llm.chat_json_stream(messages, "summary", on_token, feature="summary")
+
+
+async def _prepend(items: List[str], rest: AsyncIterator[str]) -> AsyncIterator[str]:
+    for item in items:
+        yield item
+    async for item in rest:
+        yield item
+
+
+def _normalize(result: Dict[str, Any]) -> Dict[str, Any]:
+    """把模型输出整理为固定结构"""
+    def as_list(value: Any) -> List[str]:
+        if isinstance(value, list):
+            return [str(item) for item in value if item]
+        return [str(value)] if value else []
+
+    return {
+        "summary": str(result.get("summary") or ""),
+        "key_points": as_list(result.get("key_points")),
+        "action_items": as_list(result.get("action_items")),
+    }
+
+
+def to_summary_response(result: Optional[Dict[str, Any]], stats: WindowStats) -> AutoSummaryResponse:
+    """把摘要结果和统计信息组装为接口响应"""
+    if result is None:
+        return AutoSummaryResponse(
+            summary="该时间范围内没有消息。",
+            key_points=[],
+            action_items=[],
+            participants=[],
+            message_count=0
+        )
+
+    return AutoSummaryResponse(
+        summary=result["summary"],
+        key_points=result["key_points"],
+        action_items=result["action_items"],
+        participants=sorted(stats.participants, key=stats.participants.get, reverse=True),
+        message_count=stats.message_count
+    )
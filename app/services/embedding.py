@@ -0,0 +1,104 @@
+"""
+文本向量化
+
+- HashingEmbedder: 本地特征哈希，结果确定、无需网络，用于离线环境和测试；
+- OpenAIEmbedder: 调用 OpenAI 兼容的 embeddings 接口。
+
+所有向量化器返回 L2 归一化后的 float32 矩阵，余弦相似度即为内积。
+"""
+import asyncio
+import hashlib
+import re
+from typing import List, Optional, Protocol
+
+import numpy as np
+from openai import AsyncOpenAI
+
+from app.utils.config import config
+
+_WORD_PATTERN = re.compile(r"[a-z0-9_]+")
+_CJK_RUN_PATTERN = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]+")
+
+# 超过该数量的文本放到线程中计算，避免阻塞事件循环
+_THREAD_THRESHOLD = 64
+
+
+class Embedder(Protocol):
+    """向量化器接口"""
+    dim: int
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        ...
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """按行做L2归一化（零向量保持为零）"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+
+class HashingEmbedder:
+    """特征哈希向量化：英文按词、中日韩文字按单字和相邻二字组合计特征"""
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def tokenize(self, text: str) -> List[str]:
+        text = text.lower()
+        tokens = _WORD_PATTERN.findall(text)
+        for run in _CJK_RUN_PATTERN.findall(text):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        return tokens
+
+    def embed_sync(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in self.tokenize(text):
+                digest = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "little")
+                # 低位决定维度，最高位决定符号，减少哈希冲突带来的偏差
+                vectors[row, digest % self.dim] += 1.0 if digest >> 63 else -1.0
+        return normalize(vectors)
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        if len(texts) > _THREAD_THRESHOLD:
+            return await asyncio.to_thread(self.embed_sync, texts)
+        return self.embed_sync(texts)
+
+
+class OpenAIEmbedder:
+    """OpenAI 兼容 embeddings 接口"""
+
+    def __init__(self, model: str, dim: int, endpoint: Optional[str] = None, api_key: Optional[str] = None):
+        self.model = model
+        self.dim = dim
+        self._client = AsyncOpenAI(
+            base_url=endpoint or config.llm.endpoint,
+            api_key=api_key or config.llm.api_key,
+            timeout=config.llm.timeout,
+        )
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        response = await self._client.embeddings.create(model=self.model, input=texts)
+        data = sorted(response.data, key=lambda item: item.index)
+        vectors = np.asarray([item.embedding for item in data], dtype=np.float32)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension mismatch: expected {self.dim}, got {vectors.shape[1]}")
+        return normalize(vectors)
+
+
+def create_embedder() -> Embedder:
+    """根据 [search] 配置创建向量化器"""
+    provider = config.search.embedding_provider
+    if provider == "hashing":
+        return HashingEmbedder(config.search.embedding_dim)
+    if provider == "openai":
+        return OpenAIEmbedder(
+            model=config.search.embedding_model,
+            dim=config.search.embedding_dim,
+            endpoint=config.search.embedding_endpoint or None,
+        )
+    raise ValueError(f"Unsupported embedding provider: {provider}")
@@ -0,0 +1,661 @@
+"""
+大模型客户端
+
+封装 config.llm 配置的 OpenAI 兼容接口，进程内所有功能共用一个客户端：
+- 复用 keep-alive 连接池，避免每次请求重新建连；
+- 令牌桶按服务商配额限制每分钟请求数和token数；
+- 并发上限按 AIMD 自适应：请求成功时缓慢增加，遇到 429/5xx/超时时减半，并按 Retry-After 退避重试；
+- 完全相同的对话请求只向上游发送一次（single-flight），结果共享给所有调用方；
+- 共享同一段上下文的小请求（例如同一频道多个用户的回复建议）可以合并为一次上游调用；
+- 按功能统计请求数、延迟和token用量。
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import re
+import time
+from collections import deque
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import httpx
+from openai import APIConnectionError, APIStatusError, APITimeoutError, AsyncOpenAI, DefaultAsyncHttpxClient
+
+from app.utils.config import config
+from app.utils.metrics import AI_UPSTREAM_DURATION
+
+logger = logging.getLogger(__name__)
+
+# 模型有时会用 ```json ... ``` 包裹输出
+_JSON_FENCE_PATTERN = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+_CJK_PATTERN = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯]")
+
+# 未指定 max_tokens 时，按这个回复长度预占token配额
+DEFAULT_COMPLETION_TOKENS = 512
+# 自适应并发的下限
+MIN_CONCURRENCY = 1
+# 重试退避：首次等待秒数和最长等待秒数
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30.0
+# 每个功能保留最近多少次请求的延迟用于计算分位数
+LATENCY_SAMPLES = 1000
+
+_BATCH_INSTRUCTION = (
+    "上下文之后有 {count} 个相互独立的请求，请分别完成。"
+    "只返回JSON对象，键为请求编号，值为对应请求的完整回复文本，不要输出其他内容。"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中日韩字符按一个token计，其余按4个字符一个token计"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+def parse_json_object(content: str) -> Dict[str, Any]:
+    """把模型回复解析为JSON对象"""
+    text = _JSON_FENCE_PATTERN.sub("", content.strip())
+    try:
+        result = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"LLM returned invalid JSON: {content[:200]}") from e
+    if not isinstance(result, dict):
+        raise ValueError("LLM returned JSON that is not an object")
+    return result
+
+
+class JSONStringFieldReader:
+    """
+    从流式输出的JSON文本中增量读取某个字符串字段的值
+
+    每次 feed 一段模型输出，返回该字段新解码出的文本，用于在完整JSON生成之前把正文转发给用户。
+    """
+
+    def __init__(self, field: str):
+        self._start_pattern = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._buffer = ""
+        self._position: Optional[int] = None
+        self.done = False
+
+    def feed(self, chunk: str) -> str:
+        self._buffer += chunk
+        if self.done:
+            return ""
+        if self._position is None:
+            match = self._start_pattern.search(self._buffer)
+            if match is None:
+                return ""
+            self._position = match.end()
+
+        text = self._buffer
+        end = self._position
+        while end < len(text):
+            char = text[end]
+            if char == '"':
+                self.done = True
+                break
+            if char == "\\":
+                length = self._escape_length(text, end)
+                # 转义序列不完整时等下一段
+                if length is None:
+                    break
+                end += length
+            else:
+                end += 1
+
+        raw = text[self._position:end]
+        self._position = end
+        return json.loads(f'"{raw}"') if raw else ""
+
+    @staticmethod
+    def _escape_length(text: str, start: int) -> Optional[int]:
+        """text[start] 处转义序列的长度；代理对的两个 \\u 转义需要一起解码"""
+        if start + 2 > len(text):
+            return None
+        if text[start + 1] != "u":
+            return 2
+        code = text[start + 2:start + 6]
+        if len(code) < 4:
+            return None
+        length = 12 if 0xD800 <= int(code, 16) <= 0xDBFF else 6
+        return length if start + length <= len(text) else None
+
+
+def _process_share(quota: int, processes: int) -> int:
+    """单个进程分到的配额（0表示不限制）"""
+    if not quota:
+        return 0
+    return max(1, quota // processes)
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多积攒 capacity 个；等待的请求按先来后到获得令牌"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        # 单次需求超过桶容量时按容量计，否则永远等不到
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self._tokens < amount:
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= amount
+
+    def adjust(self, amount: float) -> None:
+        """按实际用量修正预占的令牌：amount 为正时补扣（余额可以为负），为负时退还"""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens - amount)
+
+
+# 上游请求耗时：{outcome: 直方图}
+_UPSTREAM_DURATIONS = {outcome: AI_UPSTREAM_DURATION.labels(outcome) for outcome in ("ok", "overload", "error")}
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD 自适应并发上限
+
+    每个请求成功后上限增加 1/上限（约每轮增加1），上游过载（429、5xx、超时）时上限减半。
+    同一时刻已发出的请求可能一起失败，只有在上次减半之后发出的请求失败才会再次减半。
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = MIN_CONCURRENCY):
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_backoff = 0.0
+
+    async def acquire(self) -> float:
+        """获取一个并发名额，返回获取时间（释放时传回）"""
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return time.monotonic()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 名额已经分配给了这个请求，交还给下一个
+                self.in_flight -= 1
+                self._wake()
+            else:
+                self._waiters.remove(waiter)
+            raise
+        return time.monotonic()
+
+    def release(self, started_at: float, outcome: str = "ok") -> None:
+        """释放名额；outcome 为 ok（成功）、overload（上游过载）或 error（其他错误，不调整上限）"""
+        self.in_flight -= 1
+        _UPSTREAM_DURATIONS[outcome].observe(time.monotonic() - started_at)
+        if outcome == "ok":
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+        elif outcome == "overload" and started_at >= self._last_backoff:
+            self.limit = max(float(self.min_limit), self.limit / 2)
+            self._last_backoff = time.monotonic()
+            logger.warning(f"大模型接口过载，并发上限降为 {int(self.limit)}")
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+
+@dataclass
+class FeatureStats:
+    """单个功能的调用统计"""
+    requests: int = 0
+    upstream_requests: int = 0
+    coalesced: int = 0
+    batched: int = 0
+    retries: int = 0
+    errors: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=LATENCY_SAMPLES))
+
+    def snapshot(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+
+        def percentile(q: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 1)
+
+        return {
+            "requests": self.requests,
+            "upstream_requests": self.upstream_requests,
+            "coalesced": self.coalesced,
+            "batched": self.batched,
+            "retries": self.retries,
+            "errors": self.errors,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "latency_p50_ms": percentile(0.5),
+            "latency_p95_ms": percentile(0.95),
+        }
+
+
+class LLMMetrics:
+    """按功能（feature）统计的大模型调用指标"""
+
+    def __init__(self):
+        self.features: Dict[str, FeatureStats] = {}
+
+    def feature(self, name: str) -> FeatureStats:
+        stats = self.features.get(name)
+        if stats is None:
+            stats = self.features[name] = FeatureStats()
+        return stats
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {name: stats.snapshot() for name, stats in self.features.items()}
+
+
+@dataclass
+class _Flight:
+    """进行中的上游请求及等待它的调用方数量"""
+    task: asyncio.Task
+    waiters: int = 0
+
+
+@dataclass
+class _PendingBatch:
+    """等待合并发送的一组小请求"""
+    items: List[str] = field(default_factory=list)
+    futures: List[asyncio.Future] = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, APIConnectionError)
+
+
+def _is_overload(error: Exception) -> bool:
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, APITimeoutError)
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """优先使用上游返回的 Retry-After，否则指数退避并加随机抖动"""
+    if isinstance(error, APIStatusError):
+        retry_after = error.response.headers.get("retry-after")
+        try:
+            return min(RETRY_MAX_DELAY, max(0.0, float(retry_after)))
+        except (TypeError, ValueError):
+            pass
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt * (0.5 + random.random()))
+
+
+class LLMClient:
+    """OpenAI 兼容接口客户端"""
+
+    def __init__(
+        self,
+        endpoint: Optional[str] = None,
+        model: Optional[str] = None,
+        api_key: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        timeout: Optional[float] = None,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        batch_wait: Optional[float] = None
+    ):
+        self.model = model or config.llm.model
+        max_concurrency = max_concurrency or config.llm.max_concurrency
+        pool_size = max(config.llm.pool_size, max_concurrency)
+        self._client = AsyncOpenAI(
+            base_url=endpoint or config.llm.endpoint,
+            api_key=api_key or config.llm.api_key,
+            timeout=timeout or config.llm.timeout,
+            # 重试由本客户端处理，以便把 429/5xx 反馈给自适应并发
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=pool_size,
+                    keepalive_expiry=config.llm.keepalive_expiry,
+                ),
+            ),
+        )
+        self.limiter = AdaptiveConcurrencyLimiter(max_concurrency)
+
+        # 配置中的配额由所有进程共享，每个进程只使用其中一份
+        processes = config.llm.quota_processes or max(1, config.service.workers)
+        if requests_per_minute is None:
+            requests_per_minute = _process_share(config.llm.requests_per_minute, processes)
+        if tokens_per_minute is None:
+            tokens_per_minute = _process_share(config.llm.tokens_per_minute, processes)
+        # 配额为0表示不限制；桶容量为一分钟的配额，允许短时突发
+        self._request_bucket = TokenBucket(requests_per_minute / 60, requests_per_minute) if requests_per_minute else None
+        self._token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute else None
+
+        self.max_retries = config.llm.max_retries if max_retries is None else max_retries
+        self.batch_size = batch_size or config.llm.batch_size
+        self.batch_wait = config.llm.batch_wait if batch_wait is None else batch_wait
+        self.metrics = LLMMetrics()
+        self._flights: Dict[str, _Flight] = {}
+        self._batches: Dict[Tuple, _PendingBatch] = {}
+        self._background: Set[asyncio.Task] = set()
+
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.2,
+        max_tokens: Optional[int] = None,
+        feature: str = "default"
+    ) -> str:
+        """发送对话请求，返回模型回复文本；与进行中的相同请求合并为一次上游调用"""
+        stats = self.metrics.feature(feature)
+        stats.requests += 1
+        key = hashlib.sha256(
+            json.dumps([self.model, messages, temperature, max_tokens], ensure_ascii=False, sort_keys=True).encode()
+        ).hexdigest()
+
+        flight = self._flights.get(key)
+        if flight is None:
+            task = asyncio.create_task(self._complete(messages, temperature, max_tokens, stats))
+            flight = self._flights[key] = _Flight(task)
+            task.add_done_callback(lambda _: self._flights.pop(key, None))
+        else:
+            stats.coalesced += 1
+
+        started = time.monotonic()
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.latencies.append(time.monotonic() - started)
+            flight.waiters -= 1
+            # 所有调用方都放弃等待时才取消上游请求
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+
+    async def _complete(
+        self, messages: List[Dict[str, str]], temperature: float, max_tokens: Optional[int], stats: FeatureStats
+    ) -> str:
+        for attempt in range(self.max_retries + 1):
+            reserved = await self._admit(messages, max_tokens)
+            started = await self.limiter.acquire()
+            outcome = "error"
+            stats.upstream_requests += 1
+            try:
+                response = await self._client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                )
+                outcome = "ok"
+            except (APIStatusError, APIConnectionError) as e:
+                if _is_overload(e):
+                    outcome = "overload"
+                if not _is_retryable(e) or attempt == self.max_retries:
+                    raise
+                error = e
+            finally:
+                self.limiter.release(started, outcome)
+
+            if outcome == "ok":
+                content = response.choices[0].message.content or ""
+                self._record_usage(stats, response.usage, messages, content, reserved)
+                return content
+
+            stats.retries += 1
+            delay = _retry_delay(error, attempt)
+            logger.warning(f"大模型请求失败（第{attempt + 1}次），{delay:.1f}秒后重试: {error}")
+            await asyncio.sleep(delay)
+
+    async def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.2,
+        max_tokens: Optional[int] = None,
+        feature: str = "default"
+    ) -> AsyncIterator[str]:
+        """
+        流式对话请求，按上游生成的顺序逐段产出回复文本
+
+        调用方提前关闭迭代器或任务被取消时，会关闭上游连接，模型不再继续生成。
+        只有在还没产出任何文本时才会重试。
+        """
+        stats = self.metrics.feature(feature)
+        stats.requests += 1
+        request_started = time.monotonic()
+        parts: List[str] = []
+        try:
+            for attempt in range(self.max_retries + 1):
+                reserved = await self._admit(messages, max_tokens)
+                started = await self.limiter.acquire()
+                outcome = "error"
+                usage = None
+                stats.upstream_requests += 1
+                try:
+                    stream = await self._client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        stream=True,
+                    )
+                    try:
+                        async for chunk in stream:
+                            usage = chunk.usage or usage
+                            if chunk.choices and chunk.choices[0].delta.content:
+                                parts.append(chunk.choices[0].delta.content)
+                                yield chunk.choices[0].delta.content
+                    finally:
+                        await stream.close()
+                    outcome = "ok"
+                except (APIStatusError, APIConnectionError) as e:
+                    if _is_overload(e):
+                        outcome = "overload"
+                    if parts or not _is_retryable(e) or attempt == self.max_retries:
+                        raise
+                    error = e
+                finally:
+                    self.limiter.release(started, outcome)
+
+                if outcome == "ok":
+                    self._record_usage(stats, usage, messages, "".join(parts), reserved)
+                    return
+
+                stats.retries += 1
+                delay = _retry_delay(error, attempt)
+                logger.warning(f"大模型流式请求失败（第{attempt + 1}次），{delay:.1f}秒后重试: {error}")
+                await asyncio.sleep(delay)
+        except (GeneratorExit, asyncio.CancelledError):
+            raise
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.latencies.append(time.monotonic() - request_started)
+
+    async def chat_json(self, messages: List[Dict[str, str]], **kwargs) -> Dict[str, Any]:
+        """发送对话请求并把回复解析为JSON对象"""
+        content = await self.chat(messages, **kwargs)
+        return parse_json_object(content)
+
+    async def chat_json_stream(
+        self,
+        messages: List[Dict[str, str]],
+        field: str,
+        on_token: Callable[[str], None],
+        **kwargs
+    ) -> Dict[str, Any]:
+        """流式请求JSON对象：生成过程中把 field 字段的文本交给 on_token，结束后返回解析后的对象"""
+        reader = JSONStringFieldReader(field)
+        parts: List[str] = []
+        async with aclosing(self.chat_stream(messages, **kwargs)) as stream:
+            async for chunk in stream:
+                parts.append(chunk)
+                text = reader.feed(chunk)
+                if text:
+                    on_token(text)
+        return parse_json_object("".join(parts))
+
+    async def chat_batched(
+        self,
+        system: str,
+        context: str,
+        prompt: str,
+        temperature: float = 0.2,
+        feature: str = "default"
+    ) -> str:
+        """
+        合并发送共享上下文的小请求
+
+        system 和 context 相同的请求在 batch_wait 秒内最多攒 batch_size 个，上下文只发送一次，
+        模型按编号分别回答；只有一个请求时按普通对话发送。返回本请求对应的回复文本。
+        """
+        key = (system, context, temperature, feature)
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = _PendingBatch()
+            batch.timer = asyncio.get_running_loop().call_later(self.batch_wait, self._flush_batch, key, batch)
+
+        future = asyncio.get_running_loop().create_future()
+        batch.items.append(prompt)
+        batch.futures.append(future)
+        if len(batch.items) >= self.batch_size:
+            self._flush_batch(key, batch)
+        return await future
+
+    def _flush_batch(self, key: Tuple, batch: _PendingBatch) -> None:
+        if self._batches.get(key) is not batch:
+            return
+        del self._batches[key]
+        batch.timer.cancel()
+        system, context, temperature, feature = key
+        task = asyncio.create_task(self._run_batch(system, context, temperature, feature, batch))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _run_batch(self, system: str, context: str, temperature: float, feature: str, batch: _PendingBatch) -> None:
+        def single(prompt: str) -> List[Dict[str, str]]:
+            return [
+                {"role": "system", "content": system},
+                {"role": "user", "content": f"{context}\n\n{prompt}" if context else prompt},
+            ]
+
+        async def answer(index: int) -> None:
+            try:
+                result = await self.chat(single(batch.items[index]), temperature=temperature, feature=feature)
+            except Exception as e:
+                if not batch.futures[index].done():
+                    batch.futures[index].set_exception(e)
+            else:
+                if not batch.futures[index].done():
+                    batch.futures[index].set_result(result)
+
+        if len(batch.items) == 1:
+            await answer(0)
+            return
+
+        requests = "\n\n".join(f"【请求{i}】\n{prompt}" for i, prompt in enumerate(batch.items, start=1))
+        messages = [
+            {"role": "system", "content": f"{system}\n\n{_BATCH_INSTRUCTION.format(count=len(batch.items))}"},
+            {"role": "user", "content": f"{context}\n\n{requests}" if context else requests},
+        ]
+        try:
+            answers = await self.chat_json(messages, temperature=temperature, feature=feature)
+        except ValueError:
+            logger.warning(f"合并请求的回复无法解析，逐个重新发送 {len(batch.items)} 个请求")
+            answers = {}
+        except Exception as e:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        missing = []
+        for index, future in enumerate(batch.futures):
+            value = answers.get(str(index + 1))
+            if isinstance(value, list):
+                value = "\n".join(str(item) for item in value)
+            if not isinstance(value, str):
+                missing.append(index)
+            elif not future.done():
+                future.set_result(value)
+        self.metrics.feature(feature).batched += len(batch.items) - len(missing)
+        # 模型漏答的请求单独补发
+        await asyncio.gather(*(answer(index) for index in missing))
+
+    async def _admit(self, messages: List[Dict[str, str]], max_tokens: Optional[int]) -> int:
+        """等待请求数和token配额，返回预占的token数"""
+        reserved = sum(estimate_tokens(message["content"]) for message in messages)
+        reserved += max_tokens or DEFAULT_COMPLETION_TOKENS
+        if self._request_bucket:
+            await self._request_bucket.acquire()
+        if self._token_bucket:
+            await self._token_bucket.acquire(reserved)
+        return reserved
+
+    def _record_usage(self, stats: FeatureStats, usage, messages: List[Dict[str, str]], content: str, reserved: int) -> None:
+        """记录token用量；上游没有返回用量时按文本估算。用实际用量修正预占的token配额"""
+        if usage is not None:
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+        else:
+            prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+            completion_tokens = estimate_tokens(content)
+        stats.prompt_tokens += prompt_tokens
+        stats.completion_tokens += completion_tokens
+        if self._token_bucket:
+            self._token_bucket.adjust(prompt_tokens + completion_tokens - reserved)
+
+    async def close(self) -> None:
+        for task in list(self._background):
+            task.cancel()
+        await self._client.close()
+
+
+_llm_client: Optional[LLMClient] = None
+
+
+def get_llm_client() -> LLMClient:
+    """获取进程内共享的大模型客户端"""
+    global _llm_client
+    if _llm_client is None:
+        _llm_client = LLMClient()
+    return _llm_client
+
+
+async def close_llm_client() -> None:
+    """关闭共享客户端的连接池"""
+    global _llm_client
+    if _llm_client is not None:
+        await _llm_client.close()
+        _llm_client = None
@@ -1,6 +1,7 @@
 """
 消息服务
 """
+import re
 from datetime import datetime
 from typing import List, Optional
 
@@ -8,11 +9,19 @@ from sqlalchemy import select, func, desc, or_, and_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
+from app.database.database import read_only
 from app.models.message import Message
 from app.models.channel import Channel
 from app.models.user import User
 from app.schemas.message import MessageCreate, MessageUpdate
 from app.services.channel_service import ChannelService
+from app.services.suggestion_context import suggestion_context
+from app.services.summary_service import invalidate_channel_summaries
+from app.services.user_profiles import user_profiler
+from app.services.vector_index import message_indexer
+
+# 频道级提及：@channel 通知全部成员，@here 只通知当前在线的成员
+CHANNEL_MENTION_PATTERN = re.compile(r"(?<!\w)@(channel|here)\b")
 
 
 class MessageService:
@@ -51,12 +60,49 @@ class MessageService:
             attachment_size=message_create.attachment_size,
         )
         
+        # 引用附件服务上传的文件时，附件信息以上传记录为准
+        if message_create.attachment_id is not None:
+            from app.services.attachment_service import AttachmentService
+            attachment_service = AttachmentService(self.db)
+            attachment = await attachment_service.get_attachment_for_message(
+                message_create.attachment_id, author_id
+            )
+            await attachment_service.add_reference(attachment)
+            db_message.attachment_id = attachment.id
+            db_message.attachment_url = attachment.url
+            db_message.attachment_type = attachment.content_type[:50]
+            db_message.attachment_name = attachment.file_name
+            db_message.attachment_size = attachment.size
+        
         self.db.add(db_message)
         await self.db.commit()
         await self.db.refresh(db_message)
+        message_indexer.notify()
+        user_profiler.notify()
         
         # 重新查询以获取完整的关系数据
-        return await self.get_message_by_id(db_message.id)
+        message = await self.get_message_by_id(db_message.id)
+        suggestion_context.append(
+            channel.id, message.id, message.author.full_name or message.author.username, message.content,
+            message.updated_at
+        )
+        
+        mentions = set(CHANNEL_MENTION_PATTERN.findall(message_create.content))
+        if mentions:
+            from app.services.notification_service import NotificationService
+            notification_service = NotificationService(self.db)
+            
+            author = message.author
+            await notification_service.notify_channel_mention(
+                channel_id=channel.id,
+                channel_name=channel.name,
+                message_id=message.id,
+                author_id=author_id,
+                author_name=author.full_name or author.username,
+                here_only="channel" not in mentions
+            )
+        
+        return message
     
     async def get_message_by_id(self, message_id: int) -> Optional[Message]:
         """根据ID获取消息"""
@@ -73,6 +119,7 @@ class MessageService:
         result = await self.db.execute(query)
         return result.scalar_one_or_none()
     
+    @read_only
     async def get_channel_messages(
         self, 
         channel_id: int, 
@@ -124,6 +171,7 @@ class MessageService:
         
         return messages
     
+    @read_only
     async def get_message_replies(self, parent_message_id: int, user_id: int) -> List[Message]:
         """获取消息的回复"""
         # 首先检查父消息是否存在以及用户权限
@@ -164,8 +212,12 @@ class MessageService:
         message.content = message_update.content
         message.is_edited = True
         
+        # 覆盖这条消息的缓存摘要已过期
+        await invalidate_channel_summaries(self.db, message.channel_id, message.created_at)
         await self.db.commit()
         await self.db.refresh(message)
+        message_indexer.notify()
+        suggestion_context.invalidate(message.channel_id)
         return message
     
     async def delete_message(self, message_id: int, user_id: int) -> bool:
@@ -191,9 +243,16 @@ class MessageService:
             raise PermissionError("Insufficient permissions to delete message")
         
         message.is_deleted = True
+        if message.attachment_id is not None:
+            from app.services.attachment_service import AttachmentService
+            await AttachmentService(self.db).release_reference(message.attachment_id)
+        await invalidate_channel_summaries(self.db, message.channel_id, message.created_at)
         await self.db.commit()
+        message_indexer.notify()
+        suggestion_context.invalidate(message.channel_id)
         return True
     
+    @read_only
     async def search_messages(
         self, 
         query: str, 
@@ -242,6 +301,7 @@ class MessageService:
         result = await self.db.execute(search_query)
         return result.scalars().all()
     
+    @read_only
     async def get_user_mentions(self, user_id: int, skip: int = 0, limit: int = 50) -> List[Message]:
         """获取用户被提及的消息"""
         # 这里简化实现，实际应该解析消息内容中的@用户名
@@ -272,6 +332,7 @@ class MessageService:
         result = await self.db.execute(query)
         return result.scalars().all()
     
+    @read_only
     async def get_message_stats(self, channel_id: int) -> dict:
         """获取频道消息统计"""
         # 总消息数
@@ -310,6 +371,7 @@ class MessageService:
             "attachment_messages": attachment_messages,
         }
     
+    @read_only
     async def get_recent_messages(self, user_id: int, limit: int = 10) -> List[Message]:
         """获取用户最近的消息"""
         channel_service = ChannelService(self.db)
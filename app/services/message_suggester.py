@@ -0,0 +1,117 @@
+"""
+智能回复建议
+
+以频道最近的消息（在token预算内，见 suggestion_context）为上下文，请模型以当前用户的口吻给出几条候选回复；
+条数、语言和生成的多样性取自用户的AI配置。
+非流式请求中，同一频道、同一段上下文的多个用户的请求会合并为一次模型调用。
+"""
+import logging
+import re
+from contextlib import aclosing
+from typing import Callable, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.user import User
+from app.schemas.ai import MessageSuggestionRequest, MessageSuggestionResponse
+from app.services.ai_config_service import AIConfigService, AISettings
+from app.services.channel_service import ChannelService
+from app.services.llm_client import LLMClient, get_llm_client
+from app.services.suggestion_context import suggestion_context
+
+logger = logging.getLogger(__name__)
+
+SUGGESTION_COUNT = 3
+# 用户配置的建议条数上限
+MAX_SUGGESTION_COUNT = 10
+
+LANGUAGE_NAMES = {"zh": "中文", "en": "英文", "ja": "日文", "ko": "韩文"}
+
+# 模型有时会给每条建议加上编号或列表符号
+_LIST_MARKER_PATTERN = re.compile(r"^\s*(?:[-*•]|\d+\s*[.、)）])\s*")
+
+_SYSTEM_PROMPT = (
+    "你是团队协作助手。根据聊天记录，以用户的口吻给出简短的候选回复，"
+    "每行一条，不要编号，不要输出其他内容。"
+)
+
+
+def parse_suggestions(text: str, limit: int = SUGGESTION_COUNT) -> List[str]:
+    """把模型输出按行拆分为建议列表（去掉编号和空行）"""
+    suggestions = []
+    for line in text.splitlines():
+        line = _LIST_MARKER_PATTERN.sub("", line).strip().strip('"“”')
+        if line and line not in suggestions:
+            suggestions.append(line)
+    return suggestions[:limit]
+
+
+class MessageSuggester:
+    """智能回复建议生成"""
+
+    def __init__(self, db: AsyncSession, llm: Optional[LLMClient] = None):
+        self.db = db
+        self.llm = llm or get_llm_client()
+
+    async def suggest(
+        self,
+        request: MessageSuggestionRequest,
+        user_id: int,
+        on_token: Optional[Callable[[str], None]] = None
+    ) -> MessageSuggestionResponse:
+        """生成回复建议；指定 on_token 时流式生成，模型输出的文本一边生成一边交给 on_token"""
+        channel_service = ChannelService(self.db)
+        if not await channel_service.can_user_access_channel(request.channel_id, user_id):
+            raise PermissionError("Access denied to this channel")
+
+        settings = await AIConfigService(self.db).get_settings(user_id)
+        if not settings.enable_suggestions:
+            raise PermissionError("AI suggestions are disabled")
+
+        context = await suggestion_context.build(self.db, request.channel_id)
+        user = await self.db.get(User, user_id)
+        history = "频道最近的聊天记录：\n" + "\n".join(context) if context else ""
+        count = min(max(settings.max_suggestions_per_request, 1), MAX_SUGGESTION_COUNT)
+        prompt = self._build_prompt(request, user.full_name or user.username, settings, count)
+        # 敏感度越高，建议越多样；取一位小数，使默认配置的用户可以合并请求
+        temperature = round(min(max(settings.suggestion_sensitivity, 0.1), 1.0), 1)
+
+        if on_token is None:
+            text = await self.llm.chat_batched(
+                _SYSTEM_PROMPT, history, prompt, temperature=temperature, feature="suggestions"
+            )
+        else:
+            messages = [
+                {"role": "system", "content": _SYSTEM_PROMPT},
+                {"role": "user", "content": f"{history}\n\n{prompt}" if history else prompt},
+            ]
+            parts = []
+            async with aclosing(self.llm.chat_stream(messages, temperature=temperature, feature="suggestions")) as stream:
+                async for chunk in stream:
+                    parts.append(chunk)
+                    on_token(chunk)
+            text = "".join(parts)
+
+        suggestions = parse_suggestions(text, count)
+        if not suggestions:
+            raise ValueError("LLM returned no suggestions")
+
+        return MessageSuggestionResponse(
+            suggestions=suggestions,
+            # 上下文越多，建议越贴合当前对话
+            confidence=round(min(0.9, 0.4 + 0.025 * len(context)), 2),
+            context_used=len(context)
+        )
+
+    def _build_prompt(self, request: MessageSuggestionRequest, author: str, settings: AISettings, count: int) -> str:
+        """当前用户相关的部分；聊天记录作为共享上下文单独发送"""
+        prompt = [f"我是 {author}。"]
+        if request.topic:
+            prompt.append(f"当前话题：{request.topic}")
+        if request.context:
+            prompt.append(f"补充说明：{request.context}")
+        prompt.append(f"请给出{count}条候选回复。")
+        if settings.language_preference != "zh":
+            language = LANGUAGE_NAMES.get(settings.language_preference, settings.language_preference)
+            prompt.append(f"请用{language}回复。")
+        return "\n".join(prompt)
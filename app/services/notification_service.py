@@ -1,15 +1,104 @@
 """
 通知服务
 """
-from typing import List, Optional
+import asyncio
+import base64
+import logging
+import time
+from contextlib import suppress
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
 
-from sqlalchemy import select, func
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import delete, insert, select, func, tuple_
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from sqlalchemy.orm import selectinload
 
+from app.database.database import AsyncSessionLocal, read_only
+from app.models.channel_member import ChannelMember
 from app.models.notification import Notification, NotificationType
+from app.models.team_member import TeamMember
 from app.models.user import User
-from app.schemas.notification import NotificationCreate, NotificationUpdate
+from app.schemas.notification import (
+    NotificationCreate, NotificationFanOut, NotificationResponse, NotificationUpdate
+)
+from app.services.websocket_manager import connection_manager
+from app.services.websocket_relay import websocket_relay
+from app.utils.config import config
+
+logger = logging.getLogger(__name__)
+
+
+class UnreadCountCache:
+    """
+    用户未读通知数量缓存
+    
+    计数在创建、标记已读、全部已读和删除时增量维护；缓存是进程内的，
+    多 worker 部署时修改计数的 worker 通过 websocket_relay 通知其他 worker 丢弃缓存的计数。
+    每个条目仍带有过期时间，转发消息丢失时过期后重新从数据库计数。
+    """
+    
+    def __init__(self, ttl_seconds: float = 60.0):
+        self.ttl_seconds = ttl_seconds
+        # {user_id: (未读数量, 过期时间)}
+        self._counts: Dict[int, Tuple[int, float]] = {}
+    
+    def get(self, user_id: int) -> Optional[int]:
+        entry = self._counts.get(user_id)
+        if entry is None:
+            return None
+        count, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._counts[user_id]
+            return None
+        return count
+    
+    def set(self, user_id: int, count: int) -> None:
+        self._counts[user_id] = (max(0, count), time.monotonic() + self.ttl_seconds)
+    
+    def adjust(self, user_id: int, delta: int) -> None:
+        """调整已缓存的计数；未缓存的用户等下次读取时再从数据库计数"""
+        count = self.get(user_id)
+        if count is not None:
+            self._counts[user_id] = (max(0, count + delta), self._counts[user_id][1])
+    
+    def invalidate(self, user_id: int) -> None:
+        self._counts.pop(user_id, None)
+    
+    def clear(self) -> None:
+        self._counts.clear()
+
+
+# 全局未读数量缓存实例
+unread_count_cache = UnreadCountCache()
+
+
+def _invalidate_unread_counts(event: dict) -> None:
+    """其他 worker 修改了这些用户的未读数量"""
+    for user_id in event["user_ids"]:
+        unread_count_cache.invalidate(user_id)
+
+
+websocket_relay.on("unread_count", _invalidate_unread_counts)
+
+
+async def _publish_unread_changes(user_ids: List[int]) -> None:
+    await websocket_relay.publish("unread_count", user_ids=user_ids)
+
+
+def encode_notification_cursor(notification: Notification) -> str:
+    """把通知的 (created_at, id) 编码为分页游标"""
+    raw = f"{notification.created_at.isoformat()}|{notification.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_notification_cursor(cursor: str) -> Tuple[datetime, int]:
+    """解析分页游标"""
+    try:
+        created_at, notification_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(notification_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Invalid cursor") from e
 
 
 class NotificationService:
@@ -31,18 +120,170 @@ class NotificationService:
         self.db.add(notification)
         await self.db.commit()
         await self.db.refresh(notification)
+        
+        unread_count_cache.adjust(notification.user_id, 1)
+        await _publish_unread_changes([notification.user_id])
+        await self._push_notification(notification)
         return notification
     
-    async def get_user_notifications(self, user_id: int, skip: int = 0, limit: int = 50, unread_only: bool = False) -> List[Notification]:
-        """获取用户通知列表"""
+    async def _push_notification(self, notification: Notification) -> None:
+        """把新通知推送到用户的在线连接"""
+        if not connection_manager.is_user_online(notification.user_id):
+            return
+        
+        unread_count = await self.get_unread_count(notification.user_id)
+        await connection_manager.send_personal_message(
+            {
+                "type": "notification",
+                "data": NotificationResponse.model_validate(notification).model_dump(mode="json"),
+                "unread_count": unread_count,
+                "timestamp": datetime.now().isoformat()
+            },
+            notification.user_id
+        )
+    
+    async def create_notifications_bulk(self, fan_out: NotificationFanOut) -> int:
+        """为一组接收者创建同一条通知：一次多行插入、一次提交，然后分批推送"""
+        inserted = await self._insert_fan_out(fan_out)
+        if not inserted:
+            return 0
+        
+        await self.db.commit()
+        await self._after_fan_out(fan_out, inserted)
+        return len(inserted)
+    
+    async def fan_out(self, fan_out: NotificationFanOut) -> None:
+        """扇出通知：发件箱运行时入队由后台写入，否则在当前会话中直接批量写入"""
+        if notification_outbox.is_running:
+            notification_outbox.enqueue(fan_out)
+        else:
+            await self.create_notifications_bulk(fan_out)
+    
+    async def _insert_fan_out(self, fan_out: NotificationFanOut) -> Sequence[Row]:
+        """多行插入扇出通知（不提交），返回 (id, user_id, created_at)"""
+        user_ids = list(dict.fromkeys(fan_out.user_ids))
+        if not user_ids:
+            return []
+        
+        rows = [
+            {
+                "user_id": user_id,
+                "type": fan_out.type,
+                "title": fan_out.title,
+                "message": fan_out.message,
+                "data": fan_out.data,
+            }
+            for user_id in user_ids
+        ]
+        stmt = insert(Notification).returning(Notification.id, Notification.user_id, Notification.created_at)
+        result = await self.db.execute(stmt, rows)
+        return result.all()
+    
+    async def _after_fan_out(self, fan_out: NotificationFanOut, inserted: Sequence[Row]) -> None:
+        """扇出提交后更新未读缓存并推送给在线接收者"""
+        for row in inserted:
+            unread_count_cache.adjust(row.user_id, 1)
+        await _publish_unread_changes([row.user_id for row in inserted])
+        
+        online_rows = [row for row in inserted if connection_manager.is_user_online(row.user_id)]
+        if not online_rows:
+            return
+        
+        unread_counts = await self._get_unread_counts([row.user_id for row in online_rows])
+        timestamp = datetime.now().isoformat()
+        notification_type = NotificationType(fan_out.type).value
+        messages = [
+            (
+                row.user_id,
+                {
+                    "type": "notification",
+                    "data": {
+                        "id": row.id,
+                        "type": notification_type,
+                        "title": fan_out.title,
+                        "message": fan_out.message,
+                        "is_read": False,
+                        "data": fan_out.data,
+                        "created_at": row.created_at.isoformat(),
+                    },
+                    "unread_count": unread_counts.get(row.user_id, 0),
+                    "timestamp": timestamp
+                }
+            )
+            for row in online_rows
+        ]
+        await connection_manager.send_personal_messages(messages)
+    
+    async def _get_unread_counts(self, user_ids: List[int]) -> Dict[int, int]:
+        """批量获取未读数量：缓存未命中的用户用一次分组查询补齐"""
+        counts: Dict[int, int] = {}
+        missing: List[int] = []
+        for user_id in user_ids:
+            cached = unread_count_cache.get(user_id)
+            if cached is None:
+                missing.append(user_id)
+            else:
+                counts[user_id] = cached
+        
+        if missing:
+            query = (
+                select(Notification.user_id, func.count(Notification.id))
+                .where(Notification.user_id.in_(missing), Notification.is_read == False)
+                .group_by(Notification.user_id)
+            )
+            result = await self.db.execute(query)
+            fetched = dict(result.all())
+            for user_id in missing:
+                counts[user_id] = fetched.get(user_id, 0)
+                unread_count_cache.set(user_id, counts[user_id])
+        
+        return counts
+    
+    async def _push_unread_count(self, user_id: int) -> None:
+        """把最新的未读数量推送到用户的在线连接"""
+        if not connection_manager.is_user_online(user_id):
+            return
+        
+        unread_count = await self.get_unread_count(user_id)
+        await connection_manager.send_personal_message(
+            {
+                "type": "notification_count",
+                "data": {"unread_count": unread_count},
+                "timestamp": datetime.now().isoformat()
+            },
+            user_id
+        )
+    
+    @read_only
+    async def get_user_notifications(
+        self,
+        user_id: int,
+        skip: int = 0,
+        limit: int = 50,
+        unread_only: bool = False,
+        cursor: Optional[str] = None
+    ) -> List[Notification]:
+        """
+        获取用户通知列表
+        
+        按 (created_at, id) 倒序排列。传入 cursor 时从游标位置之后继续读取（忽略 skip），
+        查询沿 (user_id, created_at, id) 索引定位，不随翻页深度变慢。
+        """
         query = (
             select(Notification)
             .where(Notification.user_id == user_id)
-            .order_by(Notification.created_at.desc())
-            .offset(skip)
+            .order_by(Notification.created_at.desc(), Notification.id.desc())
             .limit(limit)
         )
         
+        if cursor:
+            created_at, notification_id = decode_notification_cursor(cursor)
+            query = query.where(
+                tuple_(Notification.created_at, Notification.id) < tuple_(created_at, notification_id)
+            )
+        else:
+            query = query.offset(skip)
+        
         if unread_only:
             query = query.where(Notification.is_read == False)
             
@@ -61,8 +302,15 @@ class NotificationService:
         if not notification or notification.user_id != user_id:
             return None
         
+        if notification.is_read:
+            return notification
+        
         notification.is_read = True
         await self.db.commit()
+        
+        unread_count_cache.adjust(user_id, -1)
+        await _publish_unread_changes([user_id])
+        await self._push_unread_count(user_id)
         return notification
     
     async def mark_all_notifications_as_read(self, user_id: int) -> int:
@@ -77,16 +325,27 @@ class NotificationService:
         
         result = await self.db.execute(stmt)
         await self.db.commit()
+        
+        unread_count_cache.set(user_id, 0)
+        await _publish_unread_changes([user_id])
+        await self._push_unread_count(user_id)
         return result.rowcount
     
     async def get_unread_count(self, user_id: int) -> int:
-        """获取用户未读通知数量"""
+        """获取用户未读通知数量（优先读缓存）"""
+        cached = unread_count_cache.get(user_id)
+        if cached is not None:
+            return cached
+        
+        # 通知大多由其他用户的操作产生，接收者不在复制延迟保护窗口内，因此这里固定读主库
         query = (
             select(func.count(Notification.id))
             .where(Notification.user_id == user_id, Notification.is_read == False)
         )
         result = await self.db.execute(query)
-        return result.scalar() or 0
+        count = result.scalar() or 0
+        unread_count_cache.set(user_id, count)
+        return count
     
     async def delete_notification(self, notification_id: int, user_id: int) -> bool:
         """删除通知"""
@@ -94,10 +353,44 @@ class NotificationService:
         if not notification or notification.user_id != user_id:
             return False
         
+        was_unread = not notification.is_read
         await self.db.delete(notification)
         await self.db.commit()
+        
+        if was_unread:
+            unread_count_cache.adjust(user_id, -1)
+            await _publish_unread_changes([user_id])
+            await self._push_unread_count(user_id)
         return True
     
+    async def purge_read_notifications(self, older_than: datetime, batch_size: int = 1000) -> int:
+        """
+        分批删除早于 older_than 的已读通知
+        
+        每批单独提交，单个事务只锁住 batch_size 行，批与批之间让出事件循环。
+        """
+        total = 0
+        while True:
+            batch_ids = (
+                select(Notification.id)
+                .where(Notification.is_read == True, Notification.created_at < older_than)
+                .order_by(Notification.created_at)
+                .limit(batch_size)
+                .scalar_subquery()
+            )
+            stmt = (
+                delete(Notification)
+                .where(Notification.id.in_(batch_ids))
+                .execution_options(synchronize_session=False)
+            )
+            result = await self.db.execute(stmt)
+            await self.db.commit()
+            
+            total += result.rowcount
+            if result.rowcount < batch_size:
+                return total
+            await asyncio.sleep(0)
+    
     async def create_team_invite_notification(self, user_id: int, team_id: int, team_name: str, inviter_id: int, inviter_name: str, role: str) -> Notification:
         """创建团队邀请通知"""
         notification_data = NotificationCreate(
@@ -221,4 +514,230 @@ class NotificationService:
                 "action_type": "team_removal"
             }
         )
-        return await self.create_notification(notification_data) 
\ No newline at end of file
+        return await self.create_notification(notification_data)
+    
+    async def _get_channel_member_ids(self, channel_id: int) -> List[int]:
+        """获取频道全部成员ID"""
+        query = select(ChannelMember.user_id).where(ChannelMember.channel_id == channel_id)
+        result = await self.db.execute(query)
+        return list(result.scalars().all())
+    
+    async def notify_channel_mention(self, channel_id: int, channel_name: str, message_id: int, author_id: int, author_name: str, here_only: bool) -> None:
+        """
+        @channel / @here 提及通知（@here 只通知当前在线的成员）
+        
+        多 worker 部署时在线状态由 websocket_relay 共享（最多晚一个续期间隔）；
+        未启用转发时只能看到本 worker 上的连接，@here 只是尽力而为。
+        """
+        user_ids = [
+            user_id for user_id in await self._get_channel_member_ids(channel_id)
+            if user_id != author_id and (not here_only or connection_manager.is_user_online(user_id))
+        ]
+        mention = "@here" if here_only else "@channel"
+        await self.fan_out(NotificationFanOut(
+            user_ids=user_ids,
+            type=NotificationType.MESSAGE_MENTION,
+            title="频道提及",
+            message=f"{author_name} 在 #{channel_name} 中使用了 {mention}",
+            data={
+                "channel_id": channel_id,
+                "channel_name": channel_name,
+                "message_id": message_id,
+                "author_id": author_id,
+                "author_name": author_name,
+                "mention": mention
+            }
+        ))
+    
+    async def notify_team_announcement(
+        self, team_id: int, team_name: str, sender_id: int, sender_name: str, title: str, message: str
+    ) -> int:
+        """团队公告通知（发给除发送者外的全部团队成员），返回接收者数量"""
+        query = select(TeamMember.user_id).where(TeamMember.team_id == team_id, TeamMember.user_id != sender_id)
+        user_ids = list((await self.db.execute(query)).scalars().all())
+        await self.fan_out(NotificationFanOut(
+            user_ids=user_ids,
+            type=NotificationType.SYSTEM,
+            title=title,
+            message=message,
+            data={
+                "team_id": team_id,
+                "team_name": team_name,
+                "sender_id": sender_id,
+                "sender_name": sender_name,
+                "action_type": "team_announcement"
+            }
+        ))
+        return len(user_ids)
+    
+    async def notify_channel_archived(self, channel_id: int, channel_name: str, archiver_id: int, archiver_name: str) -> None:
+        """频道归档通知"""
+        user_ids = [
+            user_id for user_id in await self._get_channel_member_ids(channel_id)
+            if user_id != archiver_id
+        ]
+        await self.fan_out(NotificationFanOut(
+            user_ids=user_ids,
+            type=NotificationType.SYSTEM,
+            title="频道归档通知",
+            message=f"📦 频道 #{channel_name} 已被 {archiver_name} 归档",
+            data={
+                "channel_id": channel_id,
+                "channel_name": channel_name,
+                "archiver_id": archiver_id,
+                "archiver_name": archiver_name,
+                "action_type": "channel_archived"
+            }
+        ))
+
+
+class NotificationOutbox:
+    """
+    通知发件箱
+    
+    扇出请求先进入内存队列，由后台任务合并处理：一批扇出在一个事务中多行插入，
+    提交后再分批推送，请求路径上只剩一次入队操作。合并写入失败时逐个重试，只丢弃本身写不进去的扇出。
+    
+    投递是尽力而为的：stop() 会先把队列中剩余的请求写完，但进程崩溃或被强制终止时队列中的请求会丢失
+    （被取消时记录丢失的数量）。不能丢的通知应直接调用 create_notifications_bulk 在请求的事务中写入。
+    """
+    
+    def __init__(self, max_batch_rows: int = 5000):
+        self.max_batch_rows = max_batch_rows
+        self._session_factory: Optional[async_sessionmaker] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    def start(self, session_factory: Optional[async_sessionmaker] = None) -> None:
+        """启动后台写入任务"""
+        if self.is_running:
+            return
+        self._session_factory = session_factory or AsyncSessionLocal
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        """写完队列中剩余的请求后停止"""
+        if not self.is_running:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+    
+    def enqueue(self, fan_out: NotificationFanOut) -> None:
+        """把扇出请求放入队列"""
+        if not self.is_running:
+            raise RuntimeError("Notification outbox is not running")
+        self._queue.put_nowait(fan_out)
+    
+    async def _run(self) -> None:
+        batch: List[NotificationFanOut] = []
+        try:
+            while True:
+                batch = []
+                batch.append(await self._queue.get())
+                rows = len(batch[0].user_ids)
+                # 合并队列中已经积压的请求，直到达到单事务的行数上限
+                while rows < self.max_batch_rows and not self._queue.empty():
+                    fan_out = self._queue.get_nowait()
+                    batch.append(fan_out)
+                    rows += len(fan_out.user_ids)
+                
+                try:
+                    await self._write(batch)
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+        except asyncio.CancelledError:
+            dropped = len(batch) + self._queue.qsize()
+            if dropped:
+                logger.warning(f"通知发件箱停止，丢弃了 {dropped} 个未写入完成的扇出")
+            raise
+    
+    async def _write(self, batch: List[NotificationFanOut]) -> None:
+        """写入一批扇出；合并写入失败时逐个重试"""
+        try:
+            await self._flush(batch)
+            return
+        except Exception as e:
+            if len(batch) == 1:
+                logger.error(f"写入扇出通知失败，丢弃 {len(batch[0].user_ids)} 条通知（{batch[0].title}）: {e}")
+                return
+            logger.warning(f"合并写入 {len(batch)} 个扇出失败，逐个重试: {e}")
+        for fan_out in batch:
+            await self._write([fan_out])
+    
+    async def _flush(self, batch: List[NotificationFanOut]) -> None:
+        async with self._session_factory() as db:
+            service = NotificationService(db)
+            inserted = [await service._insert_fan_out(fan_out) for fan_out in batch]
+            await db.commit()
+            
+            # 已经提交，推送失败不能再重试写入，否则会重复插入
+            for fan_out, rows in zip(batch, inserted):
+                try:
+                    await service._after_fan_out(fan_out, rows)
+                except Exception as e:
+                    logger.error(f"推送扇出通知失败（{fan_out.title}）: {e}")
+
+
+# 全局通知发件箱实例
+notification_outbox = NotificationOutbox()
+
+
+class NotificationRetentionJob:
+    """
+    已读通知保留期清理任务
+    
+    按 config.notification 的配置周期性删除超过保留天数的已读通知。
+    """
+    
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    def start(self, session_factory: Optional[async_sessionmaker] = None) -> None:
+        """启动后台清理任务（保留天数为 0 时不启动）"""
+        if self.is_running or config.notification.retention_days <= 0:
+            return
+        self._task = asyncio.create_task(self._run(session_factory or AsyncSessionLocal))
+    
+    async def stop(self) -> None:
+        if not self.is_running:
+            return
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+    
+    async def run_once(self, session_factory: async_sessionmaker) -> int:
+        """执行一轮清理，返回删除的行数"""
+        cutoff = datetime.now(timezone.utc) - timedelta(days=config.notification.retention_days)
+        async with session_factory() as db:
+            return await NotificationService(db).purge_read_notifications(
+                cutoff, batch_size=config.notification.retention_batch_size
+            )
+    
+    async def _run(self, session_factory: async_sessionmaker) -> None:
+        while True:
+            try:
+                deleted = await self.run_once(session_factory)
+                if deleted:
+                    logger.info(f"已清理 {deleted} 条过期的已读通知")
+            except Exception as e:
+                logger.error(f"清理已读通知失败: {e}")
+            await asyncio.sleep(config.notification.retention_interval)
+
+
+# 全局通知清理任务实例
+notification_retention_job = NotificationRetentionJob()
+
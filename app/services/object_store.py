@@ -0,0 +1,665 @@
+"""
+附件对象存储
+
+- LocalObjectStore：文件保存在本地目录，用于开发和测试。预签名上传地址指向本服务的
+  /attachments/local 接口，用 HMAC 签名校验；
+- S3ObjectStore：S3 兼容的对象存储（MinIO 等），通过 httpx 调用 S3 REST API，请求使用 AWS Signature V4 签名。
+
+上传都是流式的：本地存储边接收边写入文件；S3 存储按分片大小缓冲，超过一个分片时自动改为分片上传，
+内存占用不超过一个分片。
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import shutil
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import AsyncIterable, AsyncIterator, Dict, List, Optional
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+
+import aiofiles
+import httpx
+
+from app.utils.config import config
+
+# 读取文件时每次读取的字节数
+READ_CHUNK_SIZE = 64 * 1024
+MAX_PART_NUMBER = 10000
+
+
+@dataclass
+class ObjectInfo:
+    size: int
+    etag: str
+
+
+@dataclass
+class PartInfo:
+    part_number: int
+    etag: str
+    size: int
+
+
+@dataclass
+class PresignedRequest:
+    """客户端直接上传到对象存储所用的请求"""
+    url: str
+    method: str
+    expires_at: datetime
+    # 客户端必须原样带上的请求头
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+class ObjectStore(ABC):
+    """对象存储接口"""
+
+    @abstractmethod
+    async def put(self, key: str, chunks: AsyncIterable[bytes], content_type: Optional[str] = None) -> ObjectInfo:
+        """流式写入对象"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def create_multipart(self, key: str, content_type: Optional[str] = None) -> str:
+        """开始分片上传，返回上传id"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def put_part(
+        self, key: str, upload_id: str, part_number: int, chunks: AsyncIterable[bytes], length: Optional[int] = None
+    ) -> PartInfo:
+        """上传（或重新上传）一个分片"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def list_parts(self, key: str, upload_id: str) -> List[PartInfo]:
+        """已上传的分片（断点续传时客户端据此跳过已完成的分片）"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def complete_multipart(self, key: str, upload_id: str, parts: List[PartInfo]) -> ObjectInfo:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def abort_multipart(self, key: str, upload_id: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def stat(self, key: str) -> Optional[ObjectInfo]:
+        """对象不存在时返回 None"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def read(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """读取 [start, end] 字节（包含 end；end 为 None 时读到末尾）"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    async def delete_many(self, keys: List[str]) -> None:
+        """批量删除对象"""
+        for key in keys:
+            await self.delete(key)
+
+    @abstractmethod
+    async def move(self, source: str, destination: str) -> None:
+        """把对象移动到新的键，目标已存在时覆盖"""
+        raise NotImplementedError
+
+    async def sha256(self, key: str) -> str:
+        """读取整个对象计算 SHA-256，哈希计算放在线程中，不占用事件循环"""
+        hasher = hashlib.sha256()
+        async for chunk in self.read(key):
+            await asyncio.to_thread(hasher.update, chunk)
+        return hasher.hexdigest()
+
+    @abstractmethod
+    def presign(
+        self,
+        method: str,
+        key: str,
+        expires: int,
+        content_type: Optional[str] = None,
+        now: Optional[datetime] = None,
+        content_length: Optional[int] = None
+    ) -> PresignedRequest:
+        """
+        生成预签名请求，客户端凭它直接读写对象，不经过API进程
+
+        now 是签名时间（默认当前时间）；同一时间签出的地址相同，浏览器可以缓存地址对应的内容。
+        content_length 参与签名，上传的请求体必须正好是这么多字节，客户端不能凭地址写入更大的对象。
+        """
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """对象在本地文件系统中的路径，可以直接交给服务器发送文件；不在本地时返回 None"""
+        return None
+
+    async def close(self) -> None:
+        pass
+
+
+def _file_etag(stat: os.stat_result) -> str:
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
+class LocalObjectStore(ObjectStore):
+    """本地目录对象存储"""
+
+    def __init__(self, root: str, base_url: str = "/api/v1/attachments/local", secret: Optional[str] = None):
+        from app.auth.auth import SECRET_KEY
+
+        self.root = Path(root)
+        self.base_url = base_url
+        self.secret = (secret or SECRET_KEY).encode()
+
+    def path(self, key: str) -> Path:
+        path = (self.root / key).resolve()
+        if not path.is_relative_to(self.root.resolve()):
+            raise ValueError(f"Invalid object key: {key}")
+        return path
+
+    def local_path(self, key: str) -> Optional[Path]:
+        return self.path(key)
+
+    def _upload_dir(self, upload_id: str) -> Path:
+        return self.root / ".uploads" / upload_id
+
+    async def _write(self, path: Path, chunks: AsyncIterable[bytes]) -> int:
+        """写入临时文件后原子替换，写入中途失败不会留下不完整的对象"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        size = 0
+        try:
+            async with aiofiles.open(temporary, "wb") as f:
+                async for chunk in chunks:
+                    await f.write(chunk)
+                    size += len(chunk)
+            os.replace(temporary, path)
+        except BaseException:
+            temporary.unlink(missing_ok=True)
+            raise
+        return size
+
+    async def put(self, key: str, chunks: AsyncIterable[bytes], content_type: Optional[str] = None) -> ObjectInfo:
+        path = self.path(key)
+        await self._write(path, chunks)
+        return ObjectInfo(size=path.stat().st_size, etag=_file_etag(path.stat()))
+
+    async def create_multipart(self, key: str, content_type: Optional[str] = None) -> str:
+        upload_id = uuid.uuid4().hex
+        self._upload_dir(upload_id).mkdir(parents=True)
+        return upload_id
+
+    async def put_part(
+        self, key: str, upload_id: str, part_number: int, chunks: AsyncIterable[bytes], length: Optional[int] = None
+    ) -> PartInfo:
+        directory = self._upload_dir(upload_id)
+        if not directory.is_dir():
+            raise ValueError("Upload not found")
+        path = directory / f"{part_number:05d}"
+        size = await self._write(path, chunks)
+        return PartInfo(part_number=part_number, etag=_file_etag(path.stat()), size=size)
+
+    async def list_parts(self, key: str, upload_id: str) -> List[PartInfo]:
+        directory = self._upload_dir(upload_id)
+        if not directory.is_dir():
+            raise ValueError("Upload not found")
+        parts = []
+        for path in sorted(directory.glob("[0-9]" * 5)):
+            stat = path.stat()
+            parts.append(PartInfo(part_number=int(path.name), etag=_file_etag(stat), size=stat.st_size))
+        return parts
+
+    async def complete_multipart(self, key: str, upload_id: str, parts: List[PartInfo]) -> ObjectInfo:
+        directory = self._upload_dir(upload_id)
+
+        def concatenate() -> None:
+            path = self.path(key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temporary = path.with_name(f".{path.name}.{upload_id}.tmp")
+            with open(temporary, "wb") as output:
+                for part in parts:
+                    with open(directory / f"{part.part_number:05d}", "rb") as f:
+                        shutil.copyfileobj(f, output, READ_CHUNK_SIZE * 16)
+            os.replace(temporary, path)
+            shutil.rmtree(directory)
+
+        await asyncio.to_thread(concatenate)
+        return await self.stat(key)
+
+    async def abort_multipart(self, key: str, upload_id: str) -> None:
+        await asyncio.to_thread(shutil.rmtree, self._upload_dir(upload_id), True)
+
+    async def stat(self, key: str) -> Optional[ObjectInfo]:
+        try:
+            stat = self.path(key).stat()
+        except FileNotFoundError:
+            return None
+        return ObjectInfo(size=stat.st_size, etag=_file_etag(stat))
+
+    async def read(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        remaining = None if end is None else end - start + 1
+        async with aiofiles.open(self.path(key), "rb") as f:
+            await f.seek(start)
+            while remaining is None or remaining > 0:
+                chunk = await f.read(READ_CHUNK_SIZE if remaining is None else min(READ_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    async def delete(self, key: str) -> None:
+        self.path(key).unlink(missing_ok=True)
+
+    async def move(self, source: str, destination: str) -> None:
+        path = self.path(destination)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(self.path(source), path)
+
+    async def sha256(self, key: str) -> str:
+        def digest() -> str:
+            with open(self.path(key), "rb") as f:
+                return hashlib.file_digest(f, "sha256").hexdigest()
+
+        return await asyncio.to_thread(digest)
+
+    def _signature(
+        self, method: str, key: str, expires: int, content_type: Optional[str], content_length: Optional[int]
+    ) -> str:
+        message = f"{method}\n{key}\n{expires}\n{content_type or ''}\n{'' if content_length is None else content_length}"
+        return hmac.new(self.secret, message.encode(), hashlib.sha256).hexdigest()
+
+    def presign(
+        self,
+        method: str,
+        key: str,
+        expires: int,
+        content_type: Optional[str] = None,
+        now: Optional[datetime] = None,
+        content_length: Optional[int] = None
+    ) -> PresignedRequest:
+        expires_at = int(now.timestamp() if now else time.time()) + expires
+        signature = self._signature(method, key, expires_at, content_type, content_length)
+        return PresignedRequest(
+            url=f"{self.base_url}/{quote(key)}?expires={expires_at}&signature={signature}",
+            method=method,
+            expires_at=datetime.fromtimestamp(expires_at, tz=timezone.utc),
+            headers={"Content-Type": content_type} if content_type else {}
+        )
+
+    def verify(
+        self,
+        method: str,
+        key: str,
+        expires: int,
+        signature: str,
+        content_type: Optional[str] = None,
+        content_length: Optional[int] = None
+    ) -> bool:
+        """校验预签名请求；签名时指定了 content_length 的，请求的 Content-Length 必须与之相同"""
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(self._signature(method, key, expires, content_type, content_length), signature)
+
+
+# ---- AWS Signature V4 ----
+
+_SIGNING_ALGORITHM = "AWS4-HMAC-SHA256"
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+
+
+def _uri_encode(value: str, safe: str = "-_.~") -> str:
+    return quote(value, safe=safe)
+
+
+def _hmac(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode(), hashlib.sha256).digest()
+
+
+def _signing_key(secret_key: str, date: str, region: str, service: str) -> bytes:
+    key = _hmac(f"AWS4{secret_key}".encode(), date)
+    key = _hmac(key, region)
+    key = _hmac(key, service)
+    return _hmac(key, "aws4_request")
+
+
+def sign_v4(
+    method: str,
+    path: str,
+    query: Dict[str, str],
+    headers: Dict[str, str],
+    payload_hash: str,
+    access_key: str,
+    secret_key: str,
+    region: str,
+    now: datetime,
+    service: str = "s3"
+) -> str:
+    """
+    计算 SigV4 签名
+
+    headers 中参与签名的请求头（键为小写）必须包含 host；path 是已编码的路径。
+    """
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    scope = f"{now:%Y%m%d}/{region}/{service}/aws4_request"
+    canonical_query = "&".join(
+        f"{_uri_encode(name)}={_uri_encode(value)}" for name, value in sorted(query.items())
+    )
+    signed_headers = ";".join(sorted(headers))
+    canonical_headers = "".join(f"{name}:{headers[name].strip()}\n" for name in sorted(headers))
+    canonical_request = "\n".join([
+        method, path, canonical_query, canonical_headers, signed_headers, payload_hash
+    ])
+    string_to_sign = "\n".join([
+        _SIGNING_ALGORITHM, amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest()
+    ])
+    return hmac.new(
+        _signing_key(secret_key, f"{now:%Y%m%d}", region, service), string_to_sign.encode(), hashlib.sha256
+    ).hexdigest()
+
+
+def presign_v4(
+    method: str,
+    host: str,
+    path: str,
+    access_key: str,
+    secret_key: str,
+    region: str,
+    expires: int,
+    now: datetime,
+    query: Optional[Dict[str, str]] = None,
+    headers: Optional[Dict[str, str]] = None
+) -> Dict[str, str]:
+    """
+    生成预签名 URL 的查询参数
+
+    除 host 外，headers 中的请求头（键为小写，例如 content-length）也参与签名，请求必须带上相同的值。
+    """
+    signed = {**(headers or {}), "host": host}
+    params = dict(query or {})
+    params.update({
+        "X-Amz-Algorithm": _SIGNING_ALGORITHM,
+        "X-Amz-Credential": f"{access_key}/{now:%Y%m%d}/{region}/s3/aws4_request",
+        "X-Amz-Date": now.strftime("%Y%m%dT%H%M%SZ"),
+        "X-Amz-Expires": str(expires),
+        "X-Amz-SignedHeaders": ";".join(sorted(signed)),
+    })
+    params["X-Amz-Signature"] = sign_v4(
+        method, path, params, signed, UNSIGNED_PAYLOAD, access_key, secret_key, region, now
+    )
+    return params
+
+
+class S3ObjectStore(ObjectStore):
+    """S3 兼容对象存储（路径风格地址：/{bucket}/{key}）"""
+
+    def __init__(
+        self,
+        endpoint: str,
+        access_key: str,
+        secret_key: str,
+        bucket: str,
+        region: str = "us-east-1",
+        secure: bool = False,
+        part_size: int = 8 * 1024 ** 2,
+        timeout: float = 60.0
+    ):
+        self.host = endpoint
+        self.base_url = f"{'https' if secure else 'http'}://{endpoint}"
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.bucket = bucket
+        self.region = region
+        self.part_size = part_size
+        self._client = httpx.AsyncClient(base_url=self.base_url, timeout=timeout)
+
+    def _path(self, key: str) -> str:
+        if not key:
+            return f"/{_uri_encode(self.bucket)}"
+        return f"/{_uri_encode(self.bucket)}/{_uri_encode(key, safe='/-_.~')}"
+
+    def _headers(self, method: str, path: str, query: Dict[str, str], headers: Dict[str, str]) -> Dict[str, str]:
+        """给请求加上 SigV4 签名头；请求体不参与签名（UNSIGNED-PAYLOAD），以便流式发送"""
+        now = datetime.now(timezone.utc)
+        signed = {name.lower(): value for name, value in headers.items()}
+        signed.update({
+            "host": self.host,
+            "x-amz-date": now.strftime("%Y%m%dT%H%M%SZ"),
+            "x-amz-content-sha256": UNSIGNED_PAYLOAD,
+        })
+        signature = sign_v4(
+            method, path, query, signed, UNSIGNED_PAYLOAD, self.access_key, self.secret_key, self.region, now
+        )
+        signed["authorization"] = (
+            f"{_SIGNING_ALGORITHM} Credential={self.access_key}/{now:%Y%m%d}/{self.region}/s3/aws4_request, "
+            f"SignedHeaders={';'.join(sorted(name for name in signed))}, Signature={signature}"
+        )
+        del signed["host"]
+        return signed
+
+    def _build(
+        self, method: str, key: str, query: Optional[Dict[str, str]] = None,
+        headers: Optional[Dict[str, str]] = None, content=None
+    ) -> httpx.Request:
+        path = self._path(key)
+        query = query or {}
+        return self._client.build_request(
+            method,
+            path,
+            params=query,
+            headers=self._headers(method, path, query, headers or {}),
+            content=content
+        )
+
+    async def _send(self, request: httpx.Request, stream: bool = False) -> httpx.Response:
+        response = await self._client.send(request, stream=stream)
+        if response.status_code >= 400:
+            body = await response.aread()
+            raise RuntimeError(f"Object store error {response.status_code}: {body[:200]!r}")
+        return response
+
+    async def put(self, key: str, chunks: AsyncIterable[bytes], content_type: Optional[str] = None) -> ObjectInfo:
+        # 先缓冲一个分片：文件不超过一个分片时直接上传，否则改为分片上传
+        buffer = bytearray()
+        iterator = chunks.__aiter__()
+        async for chunk in iterator:
+            buffer += chunk
+            if len(buffer) >= self.part_size:
+                break
+        else:
+            headers = {"Content-Type": content_type} if content_type else {}
+            response = await self._send(self._build("PUT", key, headers=headers, content=bytes(buffer)))
+            return ObjectInfo(size=len(buffer), etag=response.headers.get("etag", "").strip('"'))
+
+        upload_id = await self.create_multipart(key, content_type)
+        try:
+            parts = []
+            while buffer:
+                data, buffer = bytes(buffer[:self.part_size]), buffer[self.part_size:]
+                parts.append(await self._put_part_bytes(key, upload_id, len(parts) + 1, data))
+                async for chunk in iterator:
+                    buffer += chunk
+                    if len(buffer) >= self.part_size:
+                        break
+            return await self.complete_multipart(key, upload_id, parts)
+        except BaseException:
+            await self.abort_multipart(key, upload_id)
+            raise
+
+    async def create_multipart(self, key: str, content_type: Optional[str] = None) -> str:
+        headers = {"Content-Type": content_type} if content_type else {}
+        response = await self._send(self._build("POST", key, query={"uploads": ""}, headers=headers))
+        return _xml_text(response.content, "UploadId")
+
+    async def _put_part_bytes(self, key: str, upload_id: str, part_number: int, data: bytes) -> PartInfo:
+        query = {"partNumber": str(part_number), "uploadId": upload_id}
+        response = await self._send(self._build("PUT", key, query=query, content=data))
+        return PartInfo(part_number=part_number, etag=response.headers["etag"].strip('"'), size=len(data))
+
+    async def put_part(
+        self, key: str, upload_id: str, part_number: int, chunks: AsyncIterable[bytes], length: Optional[int] = None
+    ) -> PartInfo:
+        if length is None:
+            data = bytearray()
+            async for chunk in chunks:
+                data += chunk
+            return await self._put_part_bytes(key, upload_id, part_number, bytes(data))
+        # 已知长度时直接转发请求体
+        query = {"partNumber": str(part_number), "uploadId": upload_id}
+        request = self._build("PUT", key, query=query, headers={"Content-Length": str(length)}, content=chunks)
+        response = await self._send(request)
+        return PartInfo(part_number=part_number, etag=response.headers["etag"].strip('"'), size=length)
+
+    async def list_parts(self, key: str, upload_id: str) -> List[PartInfo]:
+        parts = []
+        marker = "0"
+        while True:
+            query = {"uploadId": upload_id, "part-number-marker": marker}
+            response = await self._send(self._build("GET", key, query=query))
+            root = _strip_namespaces(ET.fromstring(response.content))
+            for part in root.iter("Part"):
+                parts.append(PartInfo(
+                    part_number=int(part.findtext("PartNumber")),
+                    etag=part.findtext("ETag").strip('"'),
+                    size=int(part.findtext("Size"))
+                ))
+            if root.findtext("IsTruncated") != "true":
+                return parts
+            marker = root.findtext("NextPartNumberMarker")
+
+    async def complete_multipart(self, key: str, upload_id: str, parts: List[PartInfo]) -> ObjectInfo:
+        body = "<CompleteMultipartUpload>" + "".join(
+            f"<Part><PartNumber>{part.part_number}</PartNumber><ETag>\"{part.etag}\"</ETag></Part>" for part in parts
+        ) + "</CompleteMultipartUpload>"
+        response = await self._send(self._build("POST", key, query={"uploadId": upload_id}, content=body.encode()))
+        # 合并失败时 S3 也可能返回 200，错误在响应体中
+        root = _strip_namespaces(ET.fromstring(response.content))
+        if root.tag == "Error":
+            raise RuntimeError(f"Object store error: {root.findtext('Message')}")
+        return ObjectInfo(size=sum(part.size for part in parts), etag=root.findtext("ETag", "").strip('"'))
+
+    async def abort_multipart(self, key: str, upload_id: str) -> None:
+        await self._send(self._build("DELETE", key, query={"uploadId": upload_id}))
+
+    async def stat(self, key: str) -> Optional[ObjectInfo]:
+        response = await self._client.send(self._build("HEAD", key))
+        if response.status_code == 404:
+            return None
+        if response.status_code >= 400:
+            raise RuntimeError(f"Object store error {response.status_code}")
+        return ObjectInfo(size=int(response.headers["content-length"]), etag=response.headers.get("etag", "").strip('"'))
+
+    async def read(self, key: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        headers = {}
+        if start or end is not None:
+            headers["Range"] = f"bytes={start}-{'' if end is None else end}"
+        response = await self._send(self._build("GET", key, headers=headers), stream=True)
+        try:
+            async for chunk in response.aiter_bytes(READ_CHUNK_SIZE):
+                yield chunk
+        finally:
+            await response.aclose()
+
+    async def delete(self, key: str) -> None:
+        await self._send(self._build("DELETE", key))
+
+    async def delete_many(self, keys: List[str]) -> None:
+        # DeleteObjects 每次最多删除 1000 个对象，请求必须带 Content-MD5
+        for start in range(0, len(keys), 1000):
+            body = ("<Delete><Quiet>true</Quiet>" + "".join(
+                f"<Object><Key>{escape(key)}</Key></Object>" for key in keys[start:start + 1000]
+            ) + "</Delete>").encode()
+            headers = {"Content-MD5": base64.b64encode(hashlib.md5(body).digest()).decode()}
+            response = await self._send(self._build("POST", "", query={"delete": ""}, headers=headers, content=body))
+            errors = _strip_namespaces(ET.fromstring(response.content)).findall("Error")
+            if errors:
+                raise RuntimeError(f"Object store failed to delete {len(errors)} objects: {errors[0].findtext('Message')}")
+
+    async def move(self, source: str, destination: str) -> None:
+        # S3 没有重命名，服务端复制后删除原对象（单次复制最大 5 GiB）
+        headers = {"x-amz-copy-source": self._path(source)}
+        response = await self._send(self._build("PUT", destination, headers=headers))
+        root = _strip_namespaces(ET.fromstring(response.content))
+        if root.tag == "Error":
+            raise RuntimeError(f"Object store error: {root.findtext('Message')}")
+        await self.delete(source)
+
+    def presign(
+        self,
+        method: str,
+        key: str,
+        expires: int,
+        content_type: Optional[str] = None,
+        now: Optional[datetime] = None,
+        content_length: Optional[int] = None
+    ) -> PresignedRequest:
+        now = now or datetime.now(timezone.utc)
+        path = self._path(key)
+        signed = {} if content_length is None else {"content-length": str(content_length)}
+        params = presign_v4(
+            method, self.host, path, self.access_key, self.secret_key, self.region, expires, now, headers=signed
+        )
+        query = "&".join(f"{_uri_encode(name)}={_uri_encode(value)}" for name, value in params.items())
+        return PresignedRequest(
+            url=f"{self.base_url}{path}?{query}",
+            method=method,
+            expires_at=datetime.fromtimestamp(now.timestamp() + expires, tz=timezone.utc),
+            headers={"Content-Type": content_type} if content_type else {}
+        )
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def _strip_namespaces(root: ET.Element) -> ET.Element:
+    for element in root.iter():
+        element.tag = element.tag.rpartition("}")[2]
+    return root
+
+
+def _xml_text(content: bytes, tag: str) -> str:
+    root = _strip_namespaces(ET.fromstring(content))
+    value = root.findtext(tag) if root.tag != tag else root.text
+    if value is None:
+        raise RuntimeError(f"Object store response missing {tag}")
+    return value
+
+
+_object_store: Optional[ObjectStore] = None
+
+
+def get_object_store() -> ObjectStore:
+    """获取全局对象存储实例"""
+    global _object_store
+    if _object_store is None:
+        if config.attachments.backend == "minio":
+            _object_store = S3ObjectStore(
+                endpoint=config.minio.endpoint,
+                access_key=config.minio.access_key,
+                secret_key=config.minio.secret_key,
+                bucket=config.minio.bucket,
+                region=config.minio.region,
+                secure=config.minio.secure,
+                part_size=config.attachments.part_size
+            )
+        else:
+            _object_store = LocalObjectStore(config.attachments.local_dir)
+    return _object_store
+
+
+async def close_object_store() -> None:
+    global _object_store
+    if _object_store is not None:
+        await _object_store.close()
+        _object_store = None
@@ -0,0 +1,292 @@
+"""
+消息混合检索
+
+- keyword: 数据库关键词召回，按命中的查询词数排序；
+- semantic: 向量索引召回，按余弦相似度排序；
+- mixed: 两路召回并发执行，用倒数排名融合（RRF）合并。
+
+融合后的分数再按消息新旧和用户在频道中的活跃度加权。频道和时间范围过滤在两路召回内部完成，
+每路只召回到当前页为止需要的候选数；高亮片段只为最终返回的一页生成。
+
+关键词召回的 ILIKE '%词%' 由 PostgreSQL 的 pg_trgm GIN 索引加速，但少于 3 个字符的词提取不出三元组，
+无法使用索引。因此：
+- 没有空格分隔的中日韩文本按重叠的三字片段切分，每段都能使用索引，命中的片段越多排名越靠前；
+- 查询中有 3 个字符以上的词时，只用这些词筛选候选，短词（例如两个字的中文词）只参与排序和高亮；
+- 查询只有短词时无法使用三元组索引，只能在用户可访问频道的消息中逐条匹配，频道消息很多时会较慢。
+"""
+import asyncio
+import html
+import re
+from datetime import datetime, timedelta, timezone
+from functools import reduce
+from operator import add
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import case, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from app.database.database import read_only
+from app.models.message import Message
+from app.schemas.ai import SearchResult
+from app.services.channel_service import ChannelService
+
+SEARCH_TYPES = ("semantic", "keyword", "mixed")
+
+# 倒数排名融合的平滑常数
+RRF_K = 60
+# 新消息加权：半衰期（天）和最大加成
+RECENCY_HALF_LIFE_DAYS = 14
+RECENCY_WEIGHT = 0.5
+# 频道活跃度加权：统计用户最近发言的天数和最大加成
+AFFINITY_WINDOW_DAYS = 30
+AFFINITY_WEIGHT = 0.3
+
+MAX_QUERY_TERMS = 8
+SNIPPET_CHARS = 120
+# pg_trgm 索引能加速的最短查询词
+MIN_INDEXED_TERM_CHARS = 3
+
+_LIKE_ESCAPE = str.maketrans({"\\": "\\\\", "%": "\\%", "_": "\\_"})
+# 中日韩文字（汉字、假名、谚文）
+_CJK = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+")
+
+
+def _segment(term: str) -> List[str]:
+    """较长的纯中日韩文本切分为重叠的三字片段（中文不用空格分词，整句作为一个词几乎不会命中）"""
+    size = MIN_INDEXED_TERM_CHARS
+    if len(term) <= size or not _CJK.fullmatch(term):
+        return [term]
+    return [term[i:i + size] for i in range(len(term) - size + 1)]
+
+
+def extract_terms(query: str) -> List[str]:
+    """拆分查询词（按空白分隔，中日韩文本再切分为三字片段，去重，最多 MAX_QUERY_TERMS 个）"""
+    terms: List[str] = []
+    for token in query.lower().split():
+        for term in _segment(token):
+            if term not in terms:
+                terms.append(term)
+    return terms[:MAX_QUERY_TERMS]
+
+
+def highlight(content: str, terms: List[str], width: int = SNIPPET_CHARS) -> Optional[str]:
+    """截取第一个命中词附近的片段，转义后用 <mark> 标记命中词；没有命中时返回 None"""
+    if not terms:
+        return None
+    pattern = re.compile("|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    match = pattern.search(content)
+    if match is None:
+        return None
+
+    start = max(0, match.start() - width // 3)
+    end = min(len(content), start + width)
+    start = max(0, end - width)
+    snippet = content[start:end]
+
+    parts = []
+    position = 0
+    for hit in pattern.finditer(snippet):
+        parts.append(html.escape(snippet[position:hit.start()]))
+        parts.append(f"<mark>{html.escape(hit.group())}</mark>")
+        position = hit.end()
+    parts.append(html.escape(snippet[position:]))
+
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(content) else ""
+    return prefix + "".join(parts) + suffix
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[int]], k: int = RRF_K) -> Dict[int, float]:
+    """倒数排名融合：每个列表中排名 r（从1开始）贡献 1 / (k + r)"""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, message_id in enumerate(ranking, start=1):
+            scores[message_id] = scores.get(message_id, 0.0) + 1.0 / (k + rank)
+    return scores
+
+
+async def _nothing() -> list:
+    return []
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class SearchService:
+    """消息混合检索服务"""
+
+    def __init__(self, db: AsyncSession, indexer=None):
+        self.db = db
+        self._indexer = indexer
+
+    @property
+    def indexer(self):
+        if self._indexer is None:
+            from app.services.vector_index import message_indexer
+            self._indexer = message_indexer
+        return self._indexer
+
+    async def search(
+        self,
+        query: str,
+        user_id: int,
+        search_type: str = "mixed",
+        channels: Optional[List[int]] = None,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        offset: int = 0,
+        limit: int = 20
+    ) -> List[SearchResult]:
+        """按检索模式召回、融合、加权，返回 [offset, offset + limit) 这一页的结果"""
+        results, _ = await self.search_page(query, user_id, search_type, channels, start_time, end_time, offset, limit)
+        return results
+
+    async def search_page(
+        self,
+        query: str,
+        user_id: int,
+        search_type: str = "mixed",
+        channels: Optional[List[int]] = None,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        offset: int = 0,
+        limit: int = 20
+    ) -> Tuple[List[SearchResult], int]:
+        """
+        返回 (这一页的结果, 融合后的候选总数)
+
+        每路召回 offset + limit + 1 条，候选总数大于 offset + limit 时说明还有下一页
+        """
+        if search_type not in SEARCH_TYPES:
+            raise ValueError(f"Unsupported search type: {search_type}")
+
+        channel_ids = set(await ChannelService(self.db).get_user_channel_ids(user_id))
+        if channels:
+            channel_ids &= set(channels)
+        terms = extract_terms(query)
+        if not channel_ids or not terms:
+            return [], 0
+
+        # 两路召回并发执行；向量召回不使用数据库会话，两者不会在同一会话上并发查询
+        depth = offset + limit + 1
+        use_keyword = search_type in ("keyword", "mixed")
+        use_vector = search_type in ("semantic", "mixed")
+        keyword_rows, vector_hits = await asyncio.gather(
+            self._keyword_candidates(terms, channel_ids, start_time, end_time, depth)
+            if use_keyword else _nothing(),
+            self.indexer.search(query, channel_ids, k=depth, start_time=start_time, end_time=end_time)
+            if use_vector else _nothing(),
+        )
+
+        metadata = {message_id: (channel_id, created_at) for message_id, channel_id, created_at in keyword_rows}
+        missing = [message_id for message_id, _ in vector_hits if message_id not in metadata]
+        if missing:
+            # 向量索引可能落后于删除操作，补充频道和时间信息时一并排除已删除的消息
+            metadata.update(await self._load_metadata(missing))
+
+        fused = reciprocal_rank_fusion([
+            [message_id for message_id, _, _ in keyword_rows],
+            [message_id for message_id, _ in vector_hits if message_id in metadata],
+        ])
+        affinity = await self._channel_affinity(user_id, {channel_id for channel_id, _ in metadata.values()})
+
+        now = datetime.now(timezone.utc)
+        scores = {}
+        for message_id, score in fused.items():
+            channel_id, created_at = metadata[message_id]
+            age_days = max(0.0, (now - _as_utc(created_at)).total_seconds() / 86400)
+            recency = 0.5 ** (age_days / RECENCY_HALF_LIFE_DAYS)
+            boost = (1 + RECENCY_WEIGHT * recency) * (1 + AFFINITY_WEIGHT * affinity.get(channel_id, 0.0))
+            scores[message_id] = score * boost
+
+        ranked = sorted(scores, key=lambda message_id: (-scores[message_id], -message_id))
+        page = ranked[offset:offset + limit]
+        return await self._build_results(page, scores, terms), len(ranked)
+
+    @read_only
+    async def _keyword_candidates(
+        self,
+        terms: List[str],
+        channel_ids: Set[int],
+        start_time: Optional[datetime],
+        end_time: Optional[datetime],
+        limit: int
+    ) -> List[Tuple[int, int, datetime]]:
+        """
+        关键词召回：命中任意查询词，按命中词数和时间排序
+
+        有能使用三元组索引的词时只用它们筛选，短词只计入命中词数（见模块说明）。
+        """
+        matches = {term: Message.content.ilike(f"%{term.translate(_LIKE_ESCAPE)}%", escape="\\") for term in terms}
+        hits = reduce(add, [case((match, 1), else_=0) for match in matches.values()])
+        indexed = [match for term, match in matches.items() if len(term) >= MIN_INDEXED_TERM_CHARS]
+
+        query = (
+            select(Message.id, Message.channel_id, Message.created_at)
+            .where(Message.is_deleted == False)
+            .where(Message.channel_id.in_(channel_ids))
+            .where(or_(*(indexed or matches.values())))
+            .order_by(hits.desc(), Message.created_at.desc(), Message.id.desc())
+            .limit(limit)
+        )
+        if start_time:
+            query = query.where(Message.created_at >= start_time)
+        if end_time:
+            query = query.where(Message.created_at <= end_time)
+
+        result = await self.db.execute(query)
+        return [tuple(row) for row in result.all()]
+
+    @read_only
+    async def _load_metadata(self, message_ids: List[int]) -> Dict[int, Tuple[int, datetime]]:
+        result = await self.db.execute(
+            select(Message.id, Message.channel_id, Message.created_at)
+            .where(Message.id.in_(message_ids))
+            .where(Message.is_deleted == False)
+        )
+        return {row.id: (row.channel_id, row.created_at) for row in result.all()}
+
+    @read_only
+    async def _channel_affinity(self, user_id: int, channel_ids: Set[int]) -> Dict[int, float]:
+        """用户最近在各频道的发言数，按最活跃的频道归一化到 [0, 1]"""
+        if not channel_ids:
+            return {}
+        since = datetime.now(timezone.utc) - timedelta(days=AFFINITY_WINDOW_DAYS)
+        result = await self.db.execute(
+            select(Message.channel_id, func.count(Message.id))
+            .where(Message.author_id == user_id)
+            .where(Message.channel_id.in_(channel_ids))
+            .where(Message.created_at >= since)
+            .group_by(Message.channel_id)
+        )
+        counts = dict(result.all())
+        top = max(counts.values(), default=0)
+        return {channel_id: count / top for channel_id, count in counts.items()} if top else {}
+
+    @read_only
+    async def _build_results(self, page: List[int], scores: Dict[int, float], terms: List[str]) -> List[SearchResult]:
+        """一次查询加载最终一页的消息、作者和频道，并生成高亮片段"""
+        if not page:
+            return []
+        result = await self.db.execute(
+            select(Message)
+            .options(selectinload(Message.author), selectinload(Message.channel))
+            .where(Message.id.in_(page))
+        )
+        messages = {message.id: message for message in result.scalars().all()}
+
+        return [
+            SearchResult(
+                message_id=message.id,
+                content=message.content,
+                author=message.author.full_name or message.author.username,
+                channel_name=message.channel.name,
+                timestamp=message.created_at.isoformat(),
+                relevance_score=round(scores[message.id], 6),
+                highlight=highlight(message.content, terms)
+            )
+            for message in (messages.get(message_id) for message_id in page)
+            if message is not None
+        ]
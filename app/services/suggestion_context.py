@@ -0,0 +1,220 @@
+"""
+回复建议的频道上下文
+
+每个频道在内存中保留最近 WINDOW_MESSAGES 条消息，token数在消息进入窗口时估算一次。
+本进程发送的消息直接追加到窗口；每隔 REFRESH_INTERVAL 秒用一次查询增量读取：
+- 从数据库读到的最大消息id之后的消息（本进程追加的消息不推进这个位置，其他进程写入的更小id不会被跳过）；
+- 窗口内 updated_at 晚于上次读到的版本（减去 CHANGE_OVERLAP 秒）的消息，发现被其他进程编辑或删除时整体重新加载。
+本进程编辑和删除消息时直接使窗口失效。窗口超过 MAX_WINDOW_AGE 秒后整体重新加载，以纠正增量读取可能遗漏的消息。
+
+组装上下文时从最新的消息往前累加token数，直到用完预算。每次输入触发的建议请求都不用重新查询或估算历史消息。
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Deque, Iterable, List, Optional
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database.database import replica_reads
+from app.models.message import Message
+from app.models.user import User
+from app.services.llm_client import estimate_tokens
+
+# 每个频道保留的消息数
+WINDOW_MESSAGES = 200
+# 上下文的token预算
+CONTEXT_TOKEN_BUDGET = 1500
+REFRESH_INTERVAL = 2.0
+MAX_WINDOW_AGE = 300.0
+MAX_CHANNELS = 1024
+# updated_at 取的是事务开始时间，晚提交的编辑可能早于已读到的版本；检查变更时往前多看的秒数
+CHANGE_OVERLAP = 5.0
+
+
+@dataclass
+class _Entry:
+    message_id: int
+    line: str
+    tokens: int
+    updated_at: Optional[datetime] = None
+
+
+def _entry(message_id: int, author: str, content: str, updated_at: Optional[datetime] = None) -> _Entry:
+    line = f"{author}: {content}"
+    # 加上换行符
+    return _Entry(message_id, line, estimate_tokens(line) + 1, updated_at)
+
+
+class _ChannelWindow:
+    """一个频道最近的消息（按id升序）"""
+
+    def __init__(self, size: int):
+        self.entries: Deque[_Entry] = deque(maxlen=size)
+        # 从数据库读到的最大消息id
+        self.synced_id = 0
+        # 从数据库读到的最新 updated_at
+        self.version: Optional[datetime] = None
+        self.loaded_at = 0.0
+        self.refreshed_at = 0.0
+        self.lock = asyncio.Lock()
+
+    @property
+    def last_id(self) -> int:
+        return self.entries[-1].message_id if self.entries else 0
+
+    def reset(self) -> None:
+        self.entries.clear()
+        self.synced_id = 0
+        self.version = None
+
+    def append(self, message_id: int, author: str, content: str, updated_at: Optional[datetime] = None) -> None:
+        if message_id <= self.last_id:
+            return
+        self.entries.append(_entry(message_id, author, content, updated_at))
+
+    def merge(self, entries: Iterable[_Entry]) -> None:
+        """按id顺序合并数据库读到的消息；窗口中已有的消息只补上 updated_at"""
+        entries = list(entries)
+        if all(entry.message_id > self.last_id for entry in entries):
+            self.entries.extend(entries)
+            return
+        by_id = {entry.message_id: entry for entry in self.entries}
+        for entry in entries:
+            existing = by_id.get(entry.message_id)
+            if existing is None:
+                by_id[entry.message_id] = entry
+            elif existing.updated_at is None:
+                existing.updated_at = entry.updated_at
+        merged = sorted(by_id.values(), key=lambda entry: entry.message_id)
+        self.entries = deque(merged[-self.entries.maxlen:], maxlen=self.entries.maxlen)
+
+    def is_stale(self, message_id: int, updated_at: datetime, is_deleted: bool) -> bool:
+        """窗口内的消息被编辑或删除（本进程追加的消息第一次读到时只记录版本）"""
+        for entry in self.entries:
+            if entry.message_id == message_id:
+                if is_deleted:
+                    return True
+                if entry.updated_at is None:
+                    entry.updated_at = updated_at
+                    return False
+                return updated_at != entry.updated_at
+        return False
+
+
+class SuggestionContextBuilder:
+    """按频道维护消息窗口，并按token预算组装上下文"""
+
+    def __init__(
+        self,
+        window_messages: int = WINDOW_MESSAGES,
+        refresh_interval: float = REFRESH_INTERVAL,
+        max_age: float = MAX_WINDOW_AGE,
+        max_channels: int = MAX_CHANNELS
+    ):
+        self.window_messages = window_messages
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.max_channels = max_channels
+        self._windows: "OrderedDict[int, _ChannelWindow]" = OrderedDict()
+
+    async def build(self, db: AsyncSession, channel_id: int, token_budget: int = CONTEXT_TOKEN_BUDGET) -> List[str]:
+        """按时间顺序返回频道最近的消息，总token数不超过预算"""
+        window = await self._window(db, channel_id)
+        lines = []
+        used = 0
+        for entry in reversed(window.entries):
+            if used + entry.tokens > token_budget:
+                break
+            used += entry.tokens
+            lines.append(entry.line)
+        lines.reverse()
+        return lines
+
+    def append(
+        self, channel_id: int, message_id: int, author: str, content: str, updated_at: Optional[datetime] = None
+    ) -> None:
+        """本进程发送了新消息；频道窗口未加载时忽略"""
+        window = self._windows.get(channel_id)
+        if window is not None:
+            window.append(message_id, author, content, updated_at)
+
+    def invalidate(self, channel_id: int) -> None:
+        """本进程编辑或删除了消息，下次使用时重新加载窗口（其他进程在下次刷新时发现）"""
+        self._windows.pop(channel_id, None)
+
+    def clear(self) -> None:
+        self._windows.clear()
+
+    async def _window(self, db: AsyncSession, channel_id: int) -> _ChannelWindow:
+        window = self._windows.get(channel_id)
+        if window is None:
+            window = self._windows[channel_id] = _ChannelWindow(self.window_messages)
+            while len(self._windows) > self.max_channels:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(channel_id)
+
+        if time.monotonic() - window.refreshed_at < self.refresh_interval:
+            return window
+        async with window.lock:
+            now = time.monotonic()
+            if now - window.loaded_at >= self.max_age or not await self._refresh(db, window, channel_id):
+                window.reset()
+                await self._load(db, window, channel_id)
+                window.loaded_at = now
+            window.refreshed_at = now
+        return window
+
+    def _query(self, channel_id: int):
+        return (
+            select(Message.id, Message.content, Message.updated_at, Message.is_deleted, User.username, User.full_name)
+            .join(User, Message.author_id == User.id)
+            .where(Message.channel_id == channel_id)
+        )
+
+    async def _fetch(self, db: AsyncSession, query) -> list:
+        with replica_reads(db):
+            result = await db.execute(query.order_by(Message.id.desc()).limit(self.window_messages))
+            return list(reversed(result.all()))
+
+    def _track(self, window: _ChannelWindow, rows: list) -> None:
+        for row in rows:
+            window.synced_id = max(window.synced_id, row.id)
+            if window.version is None or row.updated_at > window.version:
+                window.version = row.updated_at
+
+    async def _load(self, db: AsyncSession, window: _ChannelWindow, channel_id: int) -> None:
+        """读取频道最近的消息"""
+        rows = await self._fetch(db, self._query(channel_id).where(Message.is_deleted == False))
+        self._track(window, rows)
+        window.merge(_entry(row.id, row.full_name or row.username, row.content, row.updated_at) for row in rows)
+
+    async def _refresh(self, db: AsyncSession, window: _ChannelWindow, channel_id: int) -> bool:
+        """
+        一次查询读取新消息和窗口内最近变更过的消息并合并；窗口内的消息被编辑或删除时返回 False
+
+        最近变更过的消息也包括id更小但提交得更晚的新消息，它们同样合并到窗口中。
+        """
+        changed = Message.id > window.synced_id
+        if window.entries and window.version is not None:
+            changed = or_(changed, and_(
+                Message.id >= window.entries[0].message_id,
+                Message.updated_at > window.version - timedelta(seconds=CHANGE_OVERLAP)
+            ))
+        rows = await self._fetch(db, self._query(channel_id).where(changed))
+        self._track(window, rows)
+        if any(window.is_stale(row.id, row.updated_at, row.is_deleted) for row in rows):
+            return False
+        window.merge(
+            _entry(row.id, row.full_name or row.username, row.content, row.updated_at)
+            for row in rows if not row.is_deleted
+        )
+        return True
+
+
+# 全局上下文实例
+suggestion_context = SuggestionContextBuilder()
@@ -0,0 +1,229 @@
+"""
+频道摘要缓存服务
+
+摘要结果保存在 channel_summaries 表中，按 (频道, 摘要类型, 时间窗口) 复用：
+- 窗口起点向前取整到 llm.summary_window_bucket 秒，起点相近的滚动窗口落在同一个起点上；
+- 完全相同的窗口直接返回缓存；
+- 起点相同、终点更晚的窗口只摘要新增的尾部消息，再与缓存结果合并，合并后的结果替换原来较短的窗口；
+- 同一进程内相同的并发请求只计算一次（single-flight）；
+- 窗口内的消息被编辑或删除时，相关缓存失效。
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.ai_task import ChannelSummary
+from app.schemas.ai import AutoSummaryResponse
+from app.services.channel_summarizer import (
+    SUMMARY_TYPE_NAMES,
+    ChannelSummarizer,
+    WindowStats,
+    to_summary_response,
+)
+from app.utils.config import config
+
+logger = logging.getLogger(__name__)
+
+SummaryKey = Tuple[int, str, datetime, datetime]
+
+# 正在计算中的摘要：相同请求共享同一个 Future
+_inflight: Dict[SummaryKey, asyncio.Future] = {}
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _bucket_start(value: datetime, seconds: int) -> datetime:
+    """把窗口起点向前取整到 seconds 的整数倍（无时区时按UTC）"""
+    if seconds <= 0:
+        return value
+    timestamp = _as_utc(value).timestamp()
+    floored = datetime.fromtimestamp(timestamp - timestamp % seconds, tz=timezone.utc)
+    return floored if value.tzinfo else floored.replace(tzinfo=None)
+
+
+def _now_like(value: datetime) -> datetime:
+    """返回与 value 时区形式一致的当前时间（无时区时按UTC，与数据库默认时间一致）"""
+    now = datetime.now(timezone.utc)
+    return now if value.tzinfo else now.replace(tzinfo=None)
+
+
+class SummaryService:
+    """频道摘要缓存服务"""
+
+    def __init__(self, db: AsyncSession, summarizer: Optional[ChannelSummarizer] = None):
+        self.db = db
+        self.summarizer = summarizer or ChannelSummarizer(db)
+
+    async def get_summary(
+        self,
+        channel_id: int,
+        start_time: datetime,
+        end_time: datetime,
+        summary_type: str,
+        user_id: int,
+        on_token: Optional[Callable[[str], None]] = None
+    ) -> AutoSummaryResponse:
+        """
+        获取频道摘要，优先复用缓存
+        
+        on_token 用于流式接收摘要正文；命中缓存或加入其他请求正在进行的计算时只返回最终结果。
+        start_time 向前取整到 llm.summary_window_bucket 秒，摘要可能包含起点前不超过该时长的消息。
+        """
+        start_time = _bucket_start(start_time, config.llm.summary_window_bucket)
+        key = (channel_id, summary_type, start_time, end_time)
+        future = _inflight.get(key)
+        if future is not None:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # 负责计算的请求被取消时重新发起，当前请求自身被取消则照常抛出
+                if not future.cancelled():
+                    raise
+                return await self.get_summary(channel_id, start_time, end_time, summary_type, user_id, on_token)
+
+        future = asyncio.get_running_loop().create_future()
+        _inflight[key] = future
+        try:
+            result = await self._get_or_create(channel_id, start_time, end_time, summary_type, user_id, on_token)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            del _inflight[key]
+
+    async def _get_or_create(
+        self,
+        channel_id: int,
+        start_time: datetime,
+        end_time: datetime,
+        summary_type: str,
+        user_id: int,
+        on_token: Optional[Callable[[str], None]] = None
+    ) -> AutoSummaryResponse:
+        # 未来的时间还可能有新消息，只缓存到当前时刻为止
+        end_time = min(end_time, _now_like(end_time))
+        cached = await self._find_cached(channel_id, start_time, end_time, summary_type)
+
+        if cached and _as_utc(cached.summary_end_time) == _as_utc(end_time):
+            return self._to_response(cached)
+
+        if cached:
+            previous = {
+                "summary": cached.summary_content,
+                "key_points": cached.key_points,
+                "action_items": cached.action_items,
+            }
+            result, tail_stats = await self.summarizer.summarize_window(
+                channel_id, cached.summary_end_time, end_time, summary_type,
+                previous=previous, start_exclusive=True, on_token=on_token
+            )
+            stats = WindowStats(
+                message_count=cached.message_count + tail_stats.message_count,
+                participants=dict(cached.participants)
+            )
+            for name, count in tail_stats.participants.items():
+                stats.participants[name] = stats.participants.get(name, 0) + count
+            if not tail_stats.message_count:
+                return to_summary_response(result, stats)
+        else:
+            result, stats = await self.summarizer.summarize_window(
+                channel_id, start_time, end_time, summary_type, on_token=on_token
+            )
+
+        if result is not None:
+            await self._store(channel_id, start_time, end_time, summary_type, user_id, result, stats)
+        return to_summary_response(result, stats)
+
+    async def _find_cached(
+        self, channel_id: int, start_time: datetime, end_time: datetime, summary_type: str
+    ) -> Optional[ChannelSummary]:
+        """查找起点相同、终点不晚于 end_time 的最长缓存窗口"""
+        query = (
+            select(ChannelSummary)
+            .where(
+                ChannelSummary.channel_id == channel_id,
+                ChannelSummary.summary_type == summary_type,
+                ChannelSummary.summary_start_time == start_time,
+                ChannelSummary.summary_end_time <= end_time
+            )
+            .order_by(ChannelSummary.summary_end_time.desc())
+            .limit(1)
+        )
+        result = await self.db.execute(query)
+        return result.scalar_one_or_none()
+
+    async def _store(
+        self,
+        channel_id: int,
+        start_time: datetime,
+        end_time: datetime,
+        summary_type: str,
+        user_id: int,
+        result: Dict[str, Any],
+        stats: WindowStats
+    ) -> None:
+        type_name = SUMMARY_TYPE_NAMES.get(summary_type, "讨论摘要")
+        # 起点相同的较短窗口已经被新结果覆盖，查找缓存时总是取最长的窗口，不再需要它们
+        await self.db.execute(
+            delete(ChannelSummary)
+            .where(
+                ChannelSummary.channel_id == channel_id,
+                ChannelSummary.summary_type == summary_type,
+                ChannelSummary.summary_start_time == start_time,
+                ChannelSummary.summary_end_time < end_time
+            )
+            .execution_options(synchronize_session=False)
+        )
+        self.db.add(ChannelSummary(
+            channel_id=channel_id,
+            generated_by=user_id,
+            summary_type=summary_type,
+            title=f"{type_name} {start_time:%Y-%m-%d %H:%M} - {end_time:%Y-%m-%d %H:%M}",
+            summary_content=result["summary"],
+            key_points=result["key_points"],
+            action_items=result["action_items"],
+            message_count=stats.message_count,
+            participant_count=len(stats.participants),
+            participants=stats.participants,
+            summary_start_time=start_time,
+            summary_end_time=end_time,
+        ))
+        await self.db.commit()
+
+    def _to_response(self, summary: ChannelSummary) -> AutoSummaryResponse:
+        stats = WindowStats(message_count=summary.message_count, participants=dict(summary.participants))
+        return to_summary_response(
+            {
+                "summary": summary.summary_content,
+                "key_points": summary.key_points,
+                "action_items": summary.action_items,
+            },
+            stats
+        )
+
+
+async def invalidate_channel_summaries(db: AsyncSession, channel_id: int, message_time: datetime) -> None:
+    """删除覆盖指定消息时间的缓存摘要（不提交，随调用方的事务一起提交）"""
+    stmt = (
+        delete(ChannelSummary)
+        .where(
+            ChannelSummary.channel_id == channel_id,
+            ChannelSummary.summary_start_time <= message_time,
+            ChannelSummary.summary_end_time >= message_time
+        )
+        .execution_options(synchronize_session=False)
+    )
+    await db.execute(stmt)
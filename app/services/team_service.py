@@ -5,8 +5,9 @@ from typing import List, Optional
 
 from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import aliased, selectinload
 
+from app.database.database import read_only
 from app.models.team import Team
 from app.models.team_member import TeamMember, TeamRole
 from app.models.user import User
@@ -69,6 +70,7 @@ class TeamService:
         result = await self.db.execute(query)
         return result.scalar_one_or_none()
     
+    @read_only
     async def get_user_teams(self, user_id: int, skip: int = 0, limit: int = 100) -> List[Team]:
         """获取用户所属的团队列表"""
         query = (
@@ -83,6 +85,7 @@ class TeamService:
         result = await self.db.execute(query)
         return result.scalars().all()
     
+    @read_only
     async def get_public_teams(self, skip: int = 0, limit: int = 100) -> List[Team]:
         """获取公开团队列表"""
         query = (
@@ -251,6 +254,21 @@ class TeamService:
         
         return True
     
+    async def announce(self, team_id: int, sender_id: int, title: str, message: str) -> Optional[int]:
+        """向全体团队成员发送公告通知（批量扇出），返回接收者数量；团队不存在时返回 None"""
+        team = await self.get_team_by_id(team_id)
+        if not team:
+            return None
+        
+        if not await self.check_team_permission(team_id, sender_id, [TeamRole.OWNER, TeamRole.ADMIN]):
+            raise PermissionError("Only team owner and admins can send announcements")
+        
+        sender = await self.db.get(User, sender_id)
+        from app.services.notification_service import NotificationService
+        return await NotificationService(self.db).notify_team_announcement(
+            team_id, team.name, sender_id, sender.full_name or sender.username, title, message
+        )
+    
     async def update_member_role(self, team_id: int, user_id: int, new_role: TeamRole, updater_id: int) -> Optional[TeamMember]:
         """更新成员角色"""
         # 只有团队所有者可以更改角色
@@ -297,6 +315,19 @@ class TeamService:
         result = await self.db.execute(query)
         return result.scalars().all()
     
+    async def shares_team(self, user_id: int, other_user_id: int) -> bool:
+        """两个用户是否同属某个团队"""
+        other = aliased(TeamMember)
+        query = (
+            select(TeamMember.team_id)
+            .join(other, other.team_id == TeamMember.team_id)
+            .where(TeamMember.user_id == user_id)
+            .where(other.user_id == other_user_id)
+            .limit(1)
+        )
+        result = await self.db.execute(query)
+        return result.first() is not None
+    
     async def check_team_permission(self, team_id: int, user_id: int, required_roles: List[TeamRole]) -> bool:
         """检查用户是否有团队权限"""
         member = await self.get_team_member(team_id, user_id)
@@ -304,6 +335,7 @@ class TeamService:
             return False
         return member.role in required_roles
     
+    @read_only
     async def search_teams(self, query: str, limit: int = 10) -> List[Team]:
         """搜索公开团队"""
         search_query = (
@@ -320,6 +352,7 @@ class TeamService:
         result = await self.db.execute(search_query)
         return result.scalars().all()
     
+    @read_only
     async def get_team_stats(self, team_id: int) -> dict:
         """获取团队统计信息"""
         # 成员数量
@@ -0,0 +1,637 @@
+"""
+用户行为画像
+
+每个用户的行为特征保存为紧凑的计数数组：按星期和小时的发言数、消息长度分布、回复他人消息的时间分布，
+以及在各频道的发言数。特征只由新消息累加得到，编辑不改变历史行为。
+
+- UserProfiler 按消息 id 水位增量读取新消息，向量化累加到进程内的 ProfileStore 并定期写入快照，
+  接口读取画像时不查询数据库；
+- rebuild_profiles 按频道分区、分块读取全部历史，在进程池中并行计算后合并，
+  用于首次上线、大租户或特征算法调整后的全量重算。
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import suppress
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import aliased
+
+from app.database.database import AsyncSessionLocal
+from app.models.message import Message
+from app.schemas.ai import UserBehaviorAnalysisResponse, UserBehaviorProfile
+from app.services.channel_analytics import RESPONSE_TIME_BUCKETS, RESPONSE_TIME_EDGES, epoch_seconds
+from app.utils.config import config
+
+logger = logging.getLogger(__name__)
+
+HOURS_PER_WEEK = 7 * 24
+# 1970-01-01 是星期四（周一为0时是3）
+_EPOCH_WEEK_OFFSET_HOURS = 3 * 24
+
+LENGTH_BUCKETS = ("<10", "10-30", "30-100", "100-300", ">=300")
+LENGTH_EDGES = np.array([10, 30, 100, 300])
+
+# 同一频道上一条他人消息之后多久内发言算作回复（秒）
+REPLY_WINDOW_SECONDS = 86400
+# 增量读取时回看的消息id数：较晚提交的事务可能写入比水位更小的id
+ID_OVERLAP = 1000
+TOP_CHANNEL_COUNT = 5
+
+SNAPSHOT_FILE = "profiles.npz"
+
+
+@dataclass
+class MessageBatch:
+    """一批消息的列"""
+    ids: np.ndarray
+    author_ids: np.ndarray
+    channel_ids: np.ndarray
+    timestamps: np.ndarray
+    lengths: np.ndarray
+    # 线程回复的原消息时间和作者，不是线程回复时为 -1
+    parent_timestamps: np.ndarray
+    parent_author_ids: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+_BATCH_DTYPES = (np.int64, np.int64, np.int64, np.float64, np.int32, np.float64, np.int64)
+
+
+def _message_columns():
+    """画像需要的消息列（线程回复带上原消息的时间和作者）"""
+    parent = aliased(Message)
+    return (
+        select(
+            Message.id,
+            Message.author_id,
+            Message.channel_id,
+            epoch_seconds(Message.created_at),
+            func.length(Message.content),
+            func.coalesce(epoch_seconds(parent.created_at), -1.0),
+            func.coalesce(parent.author_id, -1),
+        )
+        .outerjoin(parent, Message.parent_id == parent.id)
+        .where(Message.is_deleted == False)
+    )
+
+
+def _to_batch(rows) -> MessageBatch:
+    if not rows:
+        return MessageBatch(*(np.zeros(0, dtype=dtype) for dtype in _BATCH_DTYPES))
+    return MessageBatch(*(
+        np.fromiter(values, dtype=dtype, count=len(rows))
+        for dtype, values in zip(_BATCH_DTYPES, zip(*rows))
+    ))
+
+
+def reply_latencies(batch: MessageBatch, last_in_channel: Dict[int, Tuple[int, int, float]]) -> np.ndarray:
+    """
+    每条消息回复他人的时间（秒），不算回复时为 NaN
+
+    线程回复按原消息计算；其他消息按同一频道上一条他人的消息计算（间隔超过 REPLY_WINDOW_SECONDS 不算）。
+    last_in_channel 记录各频道已处理的最后一条消息 (id, 作者, 时间)，用于衔接上一批，并在这里更新。
+    """
+    n = len(batch)
+    if n == 0:
+        return np.zeros(0)
+    order = np.lexsort((batch.ids, batch.channel_ids))
+    ids, channels = batch.ids[order], batch.channel_ids[order]
+    authors, timestamps = batch.author_ids[order], batch.timestamps[order]
+
+    prev_authors = np.empty_like(authors)
+    prev_timestamps = np.empty_like(timestamps)
+    prev_authors[1:], prev_timestamps[1:] = authors[:-1], timestamps[:-1]
+    first = np.ones(n, dtype=bool)
+    first[1:] = channels[1:] != channels[:-1]
+    for i in np.flatnonzero(first):
+        state = last_in_channel.get(int(channels[i]))
+        if state is not None and state[0] < ids[i]:
+            prev_authors[i], prev_timestamps[i] = state[1], state[2]
+        else:
+            prev_authors[i] = authors[i]
+
+    latencies = np.where(prev_authors != authors, timestamps - prev_timestamps, np.nan)
+    latencies[latencies > REPLY_WINDOW_SECONDS] = np.nan
+
+    parent_authors = batch.parent_author_ids[order]
+    threaded = parent_authors >= 0
+    latencies[threaded] = np.where(
+        parent_authors[threaded] != authors[threaded],
+        timestamps[threaded] - batch.parent_timestamps[order][threaded],
+        np.nan
+    )
+    latencies[latencies < 0] = np.nan
+
+    last = np.ones(n, dtype=bool)
+    last[:-1] = channels[:-1] != channels[1:]
+    for i in np.flatnonzero(last):
+        state = last_in_channel.get(int(channels[i]))
+        if state is None or state[0] < ids[i]:
+            last_in_channel[int(channels[i])] = (int(ids[i]), int(authors[i]), float(timestamps[i]))
+
+    result = np.empty(n)
+    result[order] = latencies
+    return result
+
+
+def _scatter_add(matrix: np.ndarray, rows: np.ndarray, columns: np.ndarray) -> None:
+    """matrix[rows[i], columns[i]] += 1（重复的位置先合并计数）"""
+    if not len(rows):
+        return
+    flat, counts = np.unique(rows * matrix.shape[1] + columns, return_counts=True)
+    matrix.reshape(-1)[flat] += counts.astype(matrix.dtype)
+
+
+@dataclass
+class UserProfile:
+    """单个用户的行为特征计数"""
+    hour_counts: np.ndarray
+    length_counts: np.ndarray
+    latency_counts: np.ndarray
+    channels: Dict[int, int]
+    last_active: float
+
+
+class ProfileStore:
+    """
+    全部用户的行为特征
+
+    每个用户占矩阵中的一行；用户数超过容量时按倍数扩容。频道分布较稀疏，按用户保存为字典。
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._slots: Dict[int, int] = {}
+        self.user_ids = np.zeros(capacity, dtype=np.int64)
+        self.hours = np.zeros((capacity, HOURS_PER_WEEK), dtype=np.int32)
+        self.lengths = np.zeros((capacity, len(LENGTH_BUCKETS)), dtype=np.int32)
+        self.latencies = np.zeros((capacity, len(RESPONSE_TIME_BUCKETS)), dtype=np.int32)
+        self.last_active = np.zeros(capacity, dtype=np.float64)
+        self.channels: Dict[int, Dict[int, int]] = {}
+        # 已处理的最大消息id
+        self.watermark = 0
+        # 回看区间 (watermark - ID_OVERLAP, watermark] 内已处理的消息id，随快照保存，重启后不会重复累加
+        self.seen: Set[int] = set()
+        # 每次全量重算加一，运行中的进程据此发现更新的快照
+        self.generation = 0
+        self.dirty = False
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def _grow(self, size: int) -> None:
+        capacity = len(self.user_ids)
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2)
+        for name in ("user_ids", "hours", "lengths", "latencies", "last_active"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _slots_for(self, user_ids: np.ndarray) -> np.ndarray:
+        new_users = [user_id for user_id in user_ids.tolist() if user_id not in self._slots]
+        if new_users:
+            self._grow(len(self._slots) + len(new_users))
+            for user_id in new_users:
+                slot = self._slots[user_id] = len(self._slots)
+                self.user_ids[slot] = user_id
+        return np.fromiter((self._slots[user_id] for user_id in user_ids.tolist()), dtype=np.int64, count=len(user_ids))
+
+    def add(self, batch: MessageBatch, latencies: np.ndarray) -> None:
+        """把一批消息累加到作者的特征中"""
+        if not len(batch):
+            return
+        users, inverse = np.unique(batch.author_ids, return_inverse=True)
+        slots = self._slots_for(users)[inverse]
+
+        hours = (batch.timestamps * (1 / 3600)).astype(np.int64)
+        _scatter_add(self.hours, slots, (hours + _EPOCH_WEEK_OFFSET_HOURS) % HOURS_PER_WEEK)
+        _scatter_add(self.lengths, slots, np.searchsorted(LENGTH_EDGES, batch.lengths, side="right"))
+        replied = ~np.isnan(latencies)
+        _scatter_add(self.latencies, slots[replied], np.searchsorted(RESPONSE_TIME_EDGES, latencies[replied], side="right"))
+        np.maximum.at(self.last_active, slots, batch.timestamps)
+
+        pairs, counts = np.unique(np.stack([batch.author_ids, batch.channel_ids], axis=1), axis=0, return_counts=True)
+        for (user_id, channel_id), count in zip(pairs.tolist(), counts.tolist()):
+            user_channels = self.channels.setdefault(user_id, {})
+            user_channels[channel_id] = user_channels.get(channel_id, 0) + count
+
+        self.watermark = max(self.watermark, int(batch.ids.max()))
+        self._remember(batch.ids)
+        self.dirty = True
+
+    def _remember(self, ids) -> None:
+        horizon = self.watermark - ID_OVERLAP
+        self.seen.update(int(message_id) for message_id in ids if message_id > horizon)
+        self.seen = {message_id for message_id in self.seen if message_id > horizon}
+
+    def merge(self, other: "ProfileStore") -> None:
+        """合并另一份特征（全量重算时合并各分区的结果）"""
+        if not len(other):
+            self.watermark = max(self.watermark, other.watermark)
+            self._remember(other.seen)
+            return
+        size = len(other)
+        slots = self._slots_for(other.user_ids[:size])
+        self.hours[slots] += other.hours[:size]
+        self.lengths[slots] += other.lengths[:size]
+        self.latencies[slots] += other.latencies[:size]
+        self.last_active[slots] = np.maximum(self.last_active[slots], other.last_active[:size])
+        for user_id, user_channels in other.channels.items():
+            merged = self.channels.setdefault(user_id, {})
+            for channel_id, count in user_channels.items():
+                merged[channel_id] = merged.get(channel_id, 0) + count
+        self.watermark = max(self.watermark, other.watermark)
+        self._remember(other.seen)
+        self.dirty = True
+
+    def get(self, user_id: int) -> Optional[UserProfile]:
+        slot = self._slots.get(user_id)
+        if slot is None:
+            return None
+        return UserProfile(
+            hour_counts=self.hours[slot].copy(),
+            length_counts=self.lengths[slot].copy(),
+            latency_counts=self.latencies[slot].copy(),
+            channels=dict(self.channels.get(user_id, {})),
+            last_active=float(self.last_active[slot]),
+        )
+
+    def save(self, directory: str) -> None:
+        """写入快照（先写临时文件再原子替换）"""
+        path = Path(directory)
+        path.mkdir(parents=True, exist_ok=True)
+        size = len(self)
+        channel_rows = [
+            (user_id, channel_id, count)
+            for user_id, user_channels in self.channels.items()
+            for channel_id, count in user_channels.items()
+        ]
+        channel_array = np.array(channel_rows, dtype=np.int64).reshape(-1, 3)
+
+        temporary = path / f".{SNAPSHOT_FILE}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            np.savez(
+                f,
+                user_ids=self.user_ids[:size],
+                hours=self.hours[:size],
+                lengths=self.lengths[:size],
+                latencies=self.latencies[:size],
+                last_active=self.last_active[:size],
+                channels=channel_array,
+                meta=np.array([self.watermark, self.generation], dtype=np.int64),
+                seen=np.array(sorted(self.seen), dtype=np.int64),
+            )
+        os.replace(temporary, path / SNAPSHOT_FILE)
+        self.dirty = False
+
+    @classmethod
+    def load(cls, directory: str) -> "ProfileStore":
+        """加载快照；没有快照时返回空的特征集"""
+        path = Path(directory) / SNAPSHOT_FILE
+        if not path.exists():
+            return cls()
+        with np.load(path) as data:
+            size = len(data["user_ids"])
+            store = cls(capacity=max(size, 1024))
+            store._slots_for(data["user_ids"])
+            store.hours[:size] = data["hours"]
+            store.lengths[:size] = data["lengths"]
+            store.latencies[:size] = data["latencies"]
+            store.last_active[:size] = data["last_active"]
+            for user_id, channel_id, count in data["channels"].tolist():
+                store.channels.setdefault(user_id, {})[channel_id] = count
+            store.watermark, store.generation = (int(value) for value in data["meta"])
+            if "seen" in data.files:
+                store.seen = set(data["seen"].tolist())
+            else:
+                # 旧快照没有保存回看区间：视为区间内的消息都已处理，宁可漏掉晚提交的少数消息也不重复累加
+                store.seen = set(range(max(0, store.watermark - ID_OVERLAP) + 1, store.watermark + 1))
+        return store
+
+    @staticmethod
+    def read_generation(directory: str) -> int:
+        """只读取快照的代数（npz 按需加载各数组）"""
+        path = Path(directory) / SNAPSHOT_FILE
+        if not path.exists():
+            return 0
+        with np.load(path) as data:
+            return int(data["meta"][1])
+
+
+def _preferred_times(hour_counts: np.ndarray, limit: int = 3) -> List[str]:
+    """把发言数不低于峰值一半的相邻小时合并为时间段，按发言数从多到少返回"""
+    if not hour_counts.any():
+        return []
+    active = hour_counts >= hour_counts.max() / 2
+    ranges = []
+    start = None
+    for hour in range(25):
+        if hour < 24 and active[hour]:
+            start = hour if start is None else start
+        elif start is not None:
+            ranges.append((int(hour_counts[start:hour].sum()), start, hour))
+            start = None
+    ranges.sort(key=lambda item: (-item[0], item[1]))
+    return [f"{start:02d}:00-{end:02d}:00" for _, start, end in ranges[:limit]]
+
+
+def _median_bucket(counts: np.ndarray) -> Optional[int]:
+    total = counts.sum()
+    if not total:
+        return None
+    return int(np.searchsorted(np.cumsum(counts), total / 2))
+
+
+def describe_profile(
+    user_id: int, profile: Optional[UserProfile], visible_channels: Optional[Iterable[int]] = None
+) -> UserBehaviorAnalysisResponse:
+    """根据特征计数生成行为分析结果；指定 visible_channels 时 top_channels 只列出其中的频道"""
+    message_count = int(profile.hour_counts.sum()) if profile is not None else 0
+    if not message_count:
+        return UserBehaviorAnalysisResponse(
+            user_id=user_id,
+            message_count=0,
+            active_channels=0,
+            communication_style="暂无数据",
+            preferred_times=[],
+            collaboration_pattern="暂无数据",
+            suggestions=["发送一些消息后即可生成行为分析"]
+        )
+
+    by_weekday_hour = profile.hour_counts.reshape(7, 24)
+    hour_histogram = by_weekday_hour.sum(axis=0)
+    preferred_times = _preferred_times(hour_histogram)
+
+    length_bucket = _median_bucket(profile.length_counts)
+    if length_bucket <= 1:
+        style = "简洁直接"
+    elif length_bucket == 2:
+        style = "表达清晰完整"
+    else:
+        style = "详细周到"
+
+    replies = int(profile.latency_counts.sum())
+    reply_ratio = replies / message_count
+    reply_bucket = _median_bucket(profile.latency_counts)
+    if reply_ratio >= 0.5 and reply_bucket is not None and reply_bucket <= 1:
+        pattern = "积极响应，经常快速回复他人"
+    elif reply_ratio >= 0.3:
+        pattern = "主动参与讨论"
+    else:
+        pattern = "以发起话题和分享信息为主"
+
+    suggestions = []
+    if preferred_times:
+        suggestions.append(f"您最活跃的时段是 {preferred_times[0]}（UTC），重要讨论可以安排在这个时段")
+    if style == "简洁直接":
+        suggestions.append("消息较为简短，讨论复杂问题时可以补充更多背景信息")
+    elif style == "详细周到":
+        suggestions.append("消息较长，可以先给出结论再展开细节")
+    if reply_ratio < 0.3:
+        suggestions.append("多回复同事的消息有助于推进协作")
+    if len(profile.channels) == 1:
+        suggestions.append("可以关注更多相关频道，了解其他团队的进展")
+
+    top_channels = sorted(profile.channels, key=lambda channel_id: (-profile.channels[channel_id], channel_id))
+    if visible_channels is not None:
+        visible = set(visible_channels)
+        top_channels = [channel_id for channel_id in top_channels if channel_id in visible]
+    return UserBehaviorAnalysisResponse(
+        user_id=user_id,
+        message_count=message_count,
+        active_channels=len(profile.channels),
+        communication_style=style,
+        preferred_times=preferred_times,
+        collaboration_pattern=pattern,
+        suggestions=suggestions,
+        profile=UserBehaviorProfile(
+            hour_histogram=hour_histogram.tolist(),
+            weekday_histogram=by_weekday_hour.sum(axis=1).tolist(),
+            top_channels=top_channels[:TOP_CHANNEL_COUNT],
+            length_distribution=dict(zip(LENGTH_BUCKETS, profile.length_counts.tolist())),
+            reply_latency=dict(zip(RESPONSE_TIME_BUCKETS, profile.latency_counts.tolist())),
+            typical_reply_time=RESPONSE_TIME_BUCKETS[reply_bucket] if reply_bucket is not None else None,
+            last_active=datetime.fromtimestamp(profile.last_active, tz=timezone.utc)
+        )
+    )
+
+
+class UserProfiler:
+    """用户行为画像增量维护"""
+
+    def __init__(
+        self,
+        session_factory: Optional[async_sessionmaker] = None,
+        profile_dir: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        poll_interval: Optional[float] = None,
+        save_interval: Optional[float] = None
+    ):
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.profile_dir = profile_dir or config.profiles.profile_dir
+        self.batch_size = batch_size or config.profiles.batch_size
+        self.poll_interval = poll_interval or config.profiles.poll_interval
+        self.save_interval = save_interval or config.profiles.save_interval
+        self.store: Optional[ProfileStore] = None
+
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._lock = asyncio.Lock()
+        # 各频道已处理的最后一条消息，用于计算回复时间
+        self._last_in_channel: Dict[int, Tuple[int, int, float]] = {}
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def load(self) -> ProfileStore:
+        """加载快照（只加载一次）"""
+        if self.store is None:
+            self.store = await asyncio.to_thread(ProfileStore.load, self.profile_dir)
+            logger.info(f"用户行为画像已加载: {len(self.store)} 个用户")
+        return self.store
+
+    async def start(self) -> None:
+        """加载快照并启动增量更新"""
+        if self.is_running:
+            return
+        await self.load()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止增量更新，并在有未保存的变更时写入快照"""
+        if not self.is_running:
+            return
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+        await self.checkpoint()
+
+    def notify(self) -> None:
+        """有新消息时调用，立即触发一次增量更新"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        last_save = time.monotonic()
+        while True:
+            self._wakeup.clear()
+            try:
+                await self.sync()
+                if time.monotonic() - last_save >= self.save_interval:
+                    await self.checkpoint()
+                    last_save = time.monotonic()
+            except Exception as e:
+                logger.error(f"用户行为画像更新失败: {e}")
+
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+
+    async def checkpoint(self) -> None:
+        """磁盘上有全量重算生成的更新快照时加载它（之后从它的水位继续），否则保存本进程的特征"""
+        async with self._lock:
+            store = await self.load()
+            if await asyncio.to_thread(ProfileStore.read_generation, self.profile_dir) > store.generation:
+                self.store = await asyncio.to_thread(ProfileStore.load, self.profile_dir)
+                logger.info(f"已加载全量重算的用户行为画像: 第{self.store.generation}代")
+            elif store.dirty:
+                await asyncio.to_thread(store.save, self.profile_dir)
+
+    async def sync(self) -> int:
+        """处理水位之后的新消息，返回处理的消息数"""
+        processed = 0
+        async with self._lock:
+            store = await self.load()
+            cursor = max(0, store.watermark - ID_OVERLAP)
+            while True:
+                rows = await self._fetch(cursor)
+                if not rows:
+                    return processed
+
+                batch = _to_batch([row for row in rows if row[0] not in store.seen])
+                if len(batch):
+                    store.add(batch, reply_latencies(batch, self._last_in_channel))
+                    processed += len(batch)
+
+                cursor = rows[-1][0]
+
+                if len(rows) < self.batch_size:
+                    return processed
+
+    async def _fetch(self, after_id: int) -> list:
+        query = _message_columns().where(Message.id > after_id).order_by(Message.id).limit(self.batch_size)
+        async with self.session_factory() as db:
+            result = await db.execute(query)
+            return result.all()
+
+    async def get_profile(self, user_id: int) -> Optional[UserProfile]:
+        """读取用户的特征；增量更新未在后台运行时（例如独立脚本中）先同步一次"""
+        if not self.is_running:
+            await self.sync()
+        store = await self.load()
+        return store.get(user_id)
+
+    async def analyze(self, user_id: int, visible_channels: Optional[Iterable[int]] = None) -> UserBehaviorAnalysisResponse:
+        return describe_profile(user_id, await self.get_profile(user_id), visible_channels)
+
+
+def _create_engine(database_url: str):
+    """同步引擎；PostgreSQL 连接使用配置的 schema"""
+    connect_args = {}
+    if database_url.startswith("postgresql"):
+        connect_args["options"] = f"-csearch_path={config.database.schema}"
+    return create_engine(database_url, connect_args=connect_args)
+
+
+def _rebuild_partition(database_url: str, partition: int, partitions: int, max_id: int, chunk_size: int) -> ProfileStore:
+    """在子进程中重算一个频道分区：按 (频道, id) 顺序分块读取，逐块向量化累加"""
+    engine = _create_engine(database_url)
+
+    store = ProfileStore()
+    last_in_channel: Dict[int, Tuple[int, int, float]] = {}
+    query = (
+        _message_columns()
+        .where(Message.channel_id % partitions == partition, Message.id <= max_id)
+        .order_by(Message.channel_id, Message.id)
+    )
+    try:
+        with engine.connect() as conn:
+            result = conn.execution_options(yield_per=chunk_size).execute(query)
+            for rows in result.partitions():
+                batch = _to_batch(rows)
+                store.add(batch, reply_latencies(batch, last_in_channel))
+    finally:
+        engine.dispose()
+    store.watermark = max_id
+    return store
+
+
+async def rebuild_profiles(
+    workers: Optional[int] = None,
+    database_url: Optional[str] = None,
+    profile_dir: Optional[str] = None,
+    chunk_size: Optional[int] = None
+) -> ProfileStore:
+    """
+    全量重算全部用户的行为特征并写入快照
+
+    频道按 id 取模分成若干分区（比进程数多，平衡频道大小不均），每个分区在进程池中独立计算，
+    结果合并后作为新一代快照保存。workers 为 1 时在线程中计算。
+    """
+    workers = workers or config.profiles.rebuild_workers
+    database_url = database_url or config.database.url
+    profile_dir = profile_dir or config.profiles.profile_dir
+    chunk_size = chunk_size or config.profiles.rebuild_chunk_size
+
+    # 只重算开始时已有的消息，之后的新消息由增量更新处理
+    engine = _create_engine(database_url)
+    try:
+        with engine.connect() as conn:
+            max_id = conn.execute(select(func.max(Message.id))).scalar() or 0
+    finally:
+        engine.dispose()
+
+    partitions = workers * 4 if workers > 1 else 1
+    store = ProfileStore()
+    started = time.monotonic()
+    if workers > 1:
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [
+                loop.run_in_executor(pool, _rebuild_partition, database_url, partition, partitions, max_id, chunk_size)
+                for partition in range(partitions)
+            ]
+            for future in asyncio.as_completed(futures):
+                store.merge(await future)
+    else:
+        store.merge(await asyncio.to_thread(_rebuild_partition, database_url, 0, 1, max_id, chunk_size))
+
+    store.watermark = max_id
+    store._remember(store.seen)
+    store.generation = ProfileStore.read_generation(profile_dir) + 1
+    await asyncio.to_thread(store.save, profile_dir)
+    logger.info(
+        f"用户行为画像全量重算完成: {len(store)} 个用户，水位 {max_id}，"
+        f"耗时 {time.monotonic() - started:.1f} 秒"
+    )
+    return store
+
+
+# 全局用户行为画像实例
+user_profiler = UserProfiler()
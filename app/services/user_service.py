@@ -7,7 +7,7 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
-from app.utils.password import get_password_hash
+from app.utils.password import get_password_hash_async
 from app.models.user import User
 from app.schemas.user import UserCreate, UserUpdate
 
@@ -31,7 +31,7 @@ class UserService:
             raise ValueError("Email already exists")
         
         # 创建用户
-        hashed_password = get_password_hash(user_create.password)
+        hashed_password = await get_password_hash_async(user_create.password)
         db_user = User(
             username=user_create.username,
             email=user_create.email,
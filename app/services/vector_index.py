@@ -0,0 +1,569 @@
+"""
+消息向量索引
+
+向量按频道分区保存在连续的 float32 矩阵中，检索时只计算用户可访问频道的分区：
+一次矩阵乘法得到一批查询对所有候选的余弦相似度，再用 argpartition 取 top-k。
+
+索引快照保存为几个扁平的 .npy 文件，启动时以内存映射方式加载，各分区是映射数组上的切片，
+不需要把整个索引读入内存；分区第一次被修改时才复制到进程内存中（写时复制）。
+
+MessageIndexer 按 (updated_at, id) 水位增量同步消息的新增、编辑和删除：本进程内的消息变更
+会立即唤醒同步，其他进程产生的变更在下一次轮询时同步。
+
+多进程部署时同一索引目录只有一个写入进程：持有目录下 writer.lock 文件锁的进程负责向量化和保存快照，
+其他进程只跟随 CURRENT 加载写入进程保存的快照（新消息在写入进程下一次保存快照后可检索）。
+写入进程退出后文件锁自动释放，由下一个轮询到的进程接替。
+"""
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+from contextlib import suppress
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.database.database import AsyncSessionLocal
+from app.models.message import Message
+from app.services.embedding import Embedder, create_embedder
+from app.utils.config import config
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows 不支持 fork，只有单进程，每个进程都是写入进程
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_CURRENT_FILE = "CURRENT"
+_WRITER_LOCK_FILE = "writer.lock"
+
+# 增量同步时回看的秒数
+WATERMARK_OVERLAP = 5.0
+
+
+def to_epoch(value: datetime) -> float:
+    """数据库时间转为 epoch 秒（无时区的值按UTC处理）"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _version(row) -> Tuple[float, bool, int]:
+    """消息版本标识：updated_at 精度可能只有秒，同一秒内的编辑靠内容区分"""
+    return to_epoch(row.updated_at), row.is_deleted, hash(row.content)
+
+
+class ChannelPartition:
+    """
+    单个频道的向量分区
+
+    检索在线程中执行，读取的是最近一次发布的视图（数组和行数）。写入只追加到视图之外的行，
+    需要改动视图内的行（覆盖或删除）时先复制数组，改完再一次性发布新视图，不修改检索线程可能正在读取的数组。
+    """
+
+    def __init__(
+        self,
+        dim: int,
+        ids: Optional[np.ndarray] = None,
+        vectors: Optional[np.ndarray] = None,
+        timestamps: Optional[np.ndarray] = None
+    ):
+        self.dim = dim
+        if ids is None:
+            ids = np.zeros(0, dtype=np.int64)
+            vectors = np.zeros((0, dim), dtype=np.float32)
+            timestamps = np.zeros(0, dtype=np.float64)
+        self.ids = ids
+        self.vectors = vectors
+        self.timestamps = timestamps
+        self.size = len(ids)
+        # 加载自快照的分区是只读的内存映射切片，第一次修改时复制
+        self._owned = False
+        self._rows: Optional[Dict[int, int]] = None
+        self._publish()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _row_map(self) -> Dict[int, int]:
+        if self._rows is None:
+            self._rows = {int(message_id): row for row, message_id in enumerate(self.ids[:self.size])}
+        return self._rows
+
+    def _publish(self) -> None:
+        # 一次赋值，检索线程读到的要么是旧视图要么是新视图
+        self._view = (self.ids, self.vectors, self.timestamps, self.size)
+
+    def view(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """当前发布的 (ids, vectors, timestamps)，可以在其他线程中读取"""
+        ids, vectors, timestamps, size = self._view
+        return ids[:size], vectors[:size], timestamps[:size]
+
+    def _reserve(self, extra: int, copy: bool = False) -> None:
+        """确保有 extra 行空位；copy 为 True 时总是换成新数组"""
+        needed = self.size + extra
+        if self._owned and not copy and needed <= len(self.ids):
+            return
+        capacity = max(needed, 2 * len(self.ids), 64)
+        ids = np.zeros(capacity, dtype=np.int64)
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        timestamps = np.zeros(capacity, dtype=np.float64)
+        ids[:self.size] = self.ids[:self.size]
+        vectors[:self.size] = self.vectors[:self.size]
+        timestamps[:self.size] = self.timestamps[:self.size]
+        self.ids, self.vectors, self.timestamps = ids, vectors, timestamps
+        self._owned = True
+
+    def upsert(self, ids: np.ndarray, vectors: np.ndarray, timestamps: np.ndarray) -> None:
+        """新增或覆盖向量"""
+        rows = self._row_map()
+        message_ids = ids.tolist()
+        self._reserve(len(message_ids), copy=any(message_id in rows for message_id in message_ids))
+        for message_id, vector, timestamp in zip(message_ids, vectors, timestamps.tolist()):
+            row = rows.get(message_id)
+            if row is None:
+                row = self.size
+                rows[message_id] = row
+                self.ids[row] = message_id
+                self.size += 1
+            self.vectors[row] = vector
+            self.timestamps[row] = timestamp
+        self._publish()
+
+    def remove(self, ids: Iterable[int]) -> None:
+        """删除向量（在复制的数组上用最后一行填补空位）"""
+        rows = self._row_map()
+        message_ids = {int(message_id) for message_id in ids if int(message_id) in rows}
+        if not message_ids:
+            return
+        self._reserve(0, copy=True)
+        for message_id in message_ids:
+            row = rows.pop(message_id)
+            last = self.size - 1
+            if row != last:
+                moved_id = int(self.ids[last])
+                self.ids[row] = moved_id
+                self.vectors[row] = self.vectors[last]
+                self.timestamps[row] = self.timestamps[last]
+                rows[moved_id] = row
+            self.size = last
+        self._publish()
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int,
+        start_ts: Optional[float] = None,
+        end_ts: Optional[float] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """返回每个查询的 (scores, ids)，形状均为 (查询数, <=k)"""
+        # 检索在线程中执行，只读取发布的视图
+        ids, vectors, timestamps = self.view()
+        size = len(ids)
+
+        if start_ts is not None or end_ts is not None:
+            mask = np.ones(size, dtype=bool)
+            if start_ts is not None:
+                mask &= timestamps >= start_ts
+            if end_ts is not None:
+                mask &= timestamps <= end_ts
+            selected = np.flatnonzero(mask)
+            # 只计算时间范围内的行
+            ids, vectors = ids[selected], vectors[selected]
+
+        if len(ids) == 0:
+            empty = np.zeros((len(queries), 0))
+            return empty.astype(np.float32), empty.astype(np.int64)
+
+        scores = queries @ vectors.T
+        if len(ids) > k:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            return np.take_along_axis(scores, top, axis=1), ids[top]
+        return scores, np.broadcast_to(ids, scores.shape)
+
+
+class VectorIndex:
+    """按频道分区的消息向量索引"""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.partitions: Dict[int, ChannelPartition] = {}
+        # 增量同步水位：最后处理的 (updated_at epoch, message id)
+        self.watermark: Optional[Tuple[float, int]] = None
+        # 加载自哪个快照目录
+        self.snapshot: Optional[str] = None
+        self.dirty = False
+
+    def __len__(self) -> int:
+        return sum(len(partition) for partition in self.partitions.values())
+
+    def upsert(self, channel_id: int, ids: np.ndarray, vectors: np.ndarray, timestamps: np.ndarray) -> None:
+        partition = self.partitions.get(channel_id)
+        if partition is None:
+            partition = self.partitions[channel_id] = ChannelPartition(self.dim)
+        partition.upsert(ids, vectors, timestamps)
+        self.dirty = True
+
+    def remove(self, channel_id: int, ids: Iterable[int]) -> None:
+        partition = self.partitions.get(channel_id)
+        if partition is not None:
+            partition.remove(ids)
+            self.dirty = True
+
+    def search(
+        self,
+        queries: np.ndarray,
+        channel_ids: Iterable[int],
+        k: int = 20,
+        start_ts: Optional[float] = None,
+        end_ts: Optional[float] = None
+    ) -> List[List[Tuple[int, float]]]:
+        """
+        批量 top-k 余弦相似度检索
+
+        queries 为归一化后的查询向量 (查询数, dim)，只检索 channel_ids 中的分区。
+        返回每个查询按相似度降序排列的 [(message_id, score), ...]。
+        """
+        queries = np.atleast_2d(queries).astype(np.float32, copy=False)
+        score_parts: List[np.ndarray] = []
+        id_parts: List[np.ndarray] = []
+        for channel_id in set(channel_ids):
+            partition = self.partitions.get(channel_id)
+            if partition is None or not len(partition):
+                continue
+            scores, ids = partition.search(queries, k, start_ts, end_ts)
+            if scores.shape[1]:
+                score_parts.append(scores)
+                id_parts.append(ids)
+
+        if not score_parts:
+            return [[] for _ in range(len(queries))]
+
+        scores = np.concatenate(score_parts, axis=1)
+        ids = np.concatenate(id_parts, axis=1)
+        if scores.shape[1] > k:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            scores = np.take_along_axis(scores, top, axis=1)
+            ids = np.take_along_axis(ids, top, axis=1)
+
+        order = np.argsort(-scores, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+        ids = np.take_along_axis(ids, order, axis=1)
+        return [
+            list(zip(row_ids.tolist(), row_scores.tolist()))
+            for row_ids, row_scores in zip(ids, scores)
+        ]
+
+    def save(self, directory: str) -> Path:
+        """把索引写入新的快照目录，并原子地切换 CURRENT 指向它"""
+        root = Path(directory)
+        root.mkdir(parents=True, exist_ok=True)
+        snapshot = root / f"snapshot-{int(time.time() * 1000)}-{os.getpid()}"
+        snapshot.mkdir()
+
+        views = {channel_id: partition.view() for channel_id, partition in self.partitions.items()}
+        channel_ids = sorted(channel_id for channel_id, view in views.items() if len(view[0]))
+        sizes = [len(views[channel_id][0]) for channel_id in channel_ids]
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        total = int(offsets[-1])
+
+        # 直接写入内存映射文件，避免在内存中拼接整个索引
+        ids = np.lib.format.open_memmap(snapshot / "ids.npy", mode="w+", dtype=np.int64, shape=(total,))
+        vectors = np.lib.format.open_memmap(snapshot / "vectors.npy", mode="w+", dtype=np.float32, shape=(total, self.dim))
+        timestamps = np.lib.format.open_memmap(snapshot / "timestamps.npy", mode="w+", dtype=np.float64, shape=(total,))
+        for channel_id, start, end in zip(channel_ids, offsets[:-1], offsets[1:]):
+            ids[start:end], vectors[start:end], timestamps[start:end] = views[channel_id]
+        for array in (ids, vectors, timestamps):
+            array.flush()
+        del ids, vectors, timestamps
+
+        np.save(snapshot / "channels.npy", np.asarray(channel_ids, dtype=np.int64))
+        np.save(snapshot / "offsets.npy", offsets)
+        (snapshot / "meta.json").write_text(json.dumps({"dim": self.dim, "watermark": self.watermark}))
+
+        pointer = root / f"{_CURRENT_FILE}.{os.getpid()}.tmp"
+        pointer.write_text(snapshot.name)
+        os.replace(pointer, root / _CURRENT_FILE)
+        self.snapshot = snapshot.name
+        self.dirty = False
+
+        # 只保留最新的两个快照：跟随的进程可能正在加载上一个快照；
+        # 已映射的快照文件被删除后映射仍然有效，直到进程加载下一个快照
+
+        snapshots = sorted(root.glob("snapshot-*"), key=lambda path: path.stat().st_mtime)
+        for old in snapshots[:-2]:
+            shutil.rmtree(old, ignore_errors=True)
+        return snapshot
+
+    @staticmethod
+    def current_snapshot(directory: str) -> Optional[str]:
+        """CURRENT 指向的快照目录名，没有快照时返回 None"""
+        pointer = Path(directory) / _CURRENT_FILE
+        if not pointer.exists():
+            return None
+        return pointer.read_text().strip()
+
+    @classmethod
+    def load(cls, directory: str, dim: int) -> "VectorIndex":
+        """以内存映射方式加载最新快照；没有快照或维度不一致时返回空索引"""
+        index = cls(dim)
+        name = cls.current_snapshot(directory)
+        if name is None:
+            return index
+
+        snapshot = Path(directory) / name
+        meta = json.loads((snapshot / "meta.json").read_text())
+        if meta["dim"] != dim:
+            logger.warning(f"向量索引维度 {meta['dim']} 与配置 {dim} 不一致，重新建立索引")
+            return index
+
+        ids = np.load(snapshot / "ids.npy", mmap_mode="r")
+        vectors = np.load(snapshot / "vectors.npy", mmap_mode="r")
+        timestamps = np.load(snapshot / "timestamps.npy", mmap_mode="r")
+        channel_ids = np.load(snapshot / "channels.npy")
+        offsets = np.load(snapshot / "offsets.npy")
+        for channel_id, start, end in zip(channel_ids.tolist(), offsets[:-1].tolist(), offsets[1:].tolist()):
+            index.partitions[channel_id] = ChannelPartition(
+                dim, ids[start:end], vectors[start:end], timestamps[start:end]
+            )
+
+        watermark = meta.get("watermark")
+        index.watermark = (watermark[0], watermark[1]) if watermark else None
+        index.snapshot = name
+        return index
+
+
+class MessageIndexer:
+    """消息向量增量索引器"""
+
+    def __init__(
+        self,
+        embedder: Optional[Embedder] = None,
+        session_factory: Optional[async_sessionmaker] = None,
+        index_dir: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        poll_interval: Optional[float] = None,
+        save_interval: Optional[float] = None
+    ):
+        self._embedder = embedder
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.index_dir = index_dir or config.search.index_dir
+        self.batch_size = batch_size or config.search.index_batch_size
+        self.poll_interval = poll_interval or config.search.index_poll_interval
+        self.save_interval = save_interval or config.search.index_save_interval
+        self.index: Optional[VectorIndex] = None
+
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._lock = asyncio.Lock()
+        # 持有写入锁时为锁文件，否则本进程只跟随其他进程保存的快照
+        self._writer_lock = None
+        # 重叠区间内已处理的消息版本: message_id -> (updated_at, is_deleted, 内容哈希)
+        self._seen: Dict[int, Tuple[float, bool, int]] = {}
+
+    @property
+    def embedder(self) -> Embedder:
+        if self._embedder is None:
+            self._embedder = create_embedder()
+        return self._embedder
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def is_writer(self) -> bool:
+        return self._writer_lock is not None
+
+    async def load(self) -> VectorIndex:
+        """加载索引快照（只加载一次）"""
+        if self.index is None:
+            self.index = await asyncio.to_thread(VectorIndex.load, self.index_dir, self.embedder.dim)
+            logger.info(f"向量索引已加载: {len(self.index)} 条消息")
+        return self.index
+
+    async def start(self) -> None:
+        """加载快照并启动增量同步（没有取得写入锁时只跟随快照）"""
+        if self.is_running:
+            return
+        await self.load()
+        self._acquire_writer()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """停止同步，写入进程在有未保存的变更时写入快照"""
+        if not self.is_running:
+            return
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+        if self.is_writer and self.index is not None and self.index.dirty:
+            await asyncio.to_thread(self.index.save, self.index_dir)
+        self._release_writer()
+
+    def _acquire_writer(self) -> bool:
+        """尝试取得索引目录的写入锁（不等待），返回本进程是否为写入进程"""
+        if self._writer_lock is not None:
+            return True
+        Path(self.index_dir).mkdir(parents=True, exist_ok=True)
+        lock_file = open(Path(self.index_dir) / _WRITER_LOCK_FILE, "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        self._writer_lock = lock_file
+        logger.info(f"向量索引写入进程: pid {os.getpid()}")
+        return True
+
+    def _release_writer(self) -> None:
+        if self._writer_lock is not None:
+            # 关闭文件即释放锁
+            self._writer_lock.close()
+            self._writer_lock = None
+
+    async def follow(self) -> bool:
+        """CURRENT 指向新的快照时加载它替换当前索引，返回是否已替换"""
+        name = await asyncio.to_thread(VectorIndex.current_snapshot, self.index_dir)
+        if name is None or self.index is None or name == self.index.snapshot:
+            return False
+        try:
+            index = await asyncio.to_thread(VectorIndex.load, self.index_dir, self.embedder.dim)
+        except FileNotFoundError:
+            # 读取 CURRENT 之后快照已被写入进程清理，下次轮询再加载
+            return False
+        self.index = index
+        self._seen.clear()
+        return True
+
+    def notify(self) -> None:
+        """有消息新增、编辑或删除时调用，立即触发一次同步"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        last_save = time.monotonic()
+        while True:
+            self._wakeup.clear()
+            try:
+                if not self.is_writer:
+                    # 写入进程退出后由本进程接替：先加载它最后保存的快照，再从快照的水位继续同步
+                    self._acquire_writer()
+                    await self.follow()
+                if self.is_writer:
+                    await self.sync()
+                    if self.index.dirty and time.monotonic() - last_save >= self.save_interval:
+                        await asyncio.to_thread(self.index.save, self.index_dir)
+                        last_save = time.monotonic()
+            except Exception as e:
+                logger.error(f"向量索引同步失败: {e}")
+
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+
+    async def sync(self) -> int:
+        """同步水位之后的全部消息变更，返回处理的消息数"""
+        index = await self.load()
+        processed = 0
+        async with self._lock:
+            # 从水位之前 WATERMARK_OVERLAP 秒开始扫描：updated_at 取的是事务开始时间，
+            # 较晚提交的长事务可能写入比水位更早的时间戳
+            cursor = None
+            if index.watermark is not None:
+                cursor = (index.watermark[0] - WATERMARK_OVERLAP, 0)
+            while True:
+                rows = await self._fetch_changes(cursor)
+                if not rows:
+                    return processed
+
+                # 重叠区间内已处理过的版本不再重复向量化
+                changed = [row for row in rows if self._seen.get(row.id) != _version(row)]
+                if changed:
+                    await self._apply(index, changed)
+                    processed += len(changed)
+
+                last = rows[-1]
+                cursor = (to_epoch(last.updated_at), last.id)
+                if index.watermark is None or cursor > index.watermark:
+                    index.watermark = cursor
+                    index.dirty = True
+
+                horizon = index.watermark[0] - WATERMARK_OVERLAP
+                self._seen.update((row.id, _version(row)) for row in changed)
+                self._seen = {
+                    message_id: version for message_id, version in self._seen.items() if version[0] >= horizon
+                }
+
+                if len(rows) < self.batch_size:
+                    return processed
+
+    async def _fetch_changes(self, cursor: Optional[Tuple[float, int]]) -> list:
+        query = (
+            select(
+                Message.id, Message.channel_id, Message.content,
+                Message.created_at, Message.updated_at, Message.is_deleted
+            )
+            .order_by(Message.updated_at, Message.id)
+            .limit(self.batch_size)
+        )
+        if cursor is not None:
+            updated_at = datetime.fromtimestamp(cursor[0], tz=timezone.utc)
+            query = query.where(tuple_(Message.updated_at, Message.id) > tuple_(updated_at, cursor[1]))
+        async with self.session_factory() as db:
+            result = await db.execute(query)
+            return result.all()
+
+    async def _apply(self, index: VectorIndex, rows: list) -> None:
+        live = [row for row in rows if not row.is_deleted]
+        vectors = await self.embedder.embed([row.content for row in live]) if live else None
+
+        by_channel: Dict[int, List[int]] = {}
+        for position, row in enumerate(live):
+            by_channel.setdefault(row.channel_id, []).append(position)
+        for channel_id, positions in by_channel.items():
+            index.upsert(
+                channel_id,
+                np.asarray([live[p].id for p in positions], dtype=np.int64),
+                vectors[positions],
+                np.asarray([to_epoch(live[p].created_at) for p in positions], dtype=np.float64),
+            )
+
+        for row in rows:
+            if row.is_deleted:
+                index.remove(row.channel_id, [row.id])
+
+    async def search(
+        self,
+        query: str,
+        channel_ids: Iterable[int],
+        k: int = 20,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None
+    ) -> List[Tuple[int, float]]:
+        """语义检索：返回 [(message_id, score), ...]"""
+        index = await self.load()
+        query_vector = await self.embedder.embed([query])
+        # 矩阵运算会释放GIL，放到线程中执行，不阻塞事件循环上的其他请求
+        results = await asyncio.to_thread(
+            index.search,
+            query_vector,
+            list(channel_ids),
+            k,
+            to_epoch(start_time) if start_time else None,
+            to_epoch(end_time) if end_time else None,
+        )
+        return results[0]
+
+
+# 全局消息索引器实例
+message_indexer = MessageIndexer()
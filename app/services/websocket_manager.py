@@ -1,13 +1,23 @@
 """
 WebSocket 连接管理器
 处理 WebSocket 连接、断开和消息广播
+
+每个进程只持有自己接受的连接。多 worker 部署时由 websocket_relay 把广播和个人消息转发给其他 worker，
+并共享在线状态；未启用转发时只能送达本进程的连接。
 """
+import asyncio
 import json
 import logging
-from typing import Dict, List, Set, Optional, Any
+import time
+from typing import Dict, List, Set, Optional, Any, Tuple
 from fastapi import WebSocket, WebSocketDisconnect
 from datetime import datetime
 
+from app.utils.metrics import (
+    BROADCAST_DURATION, BROADCAST_RECIPIENTS, WEBSOCKET_ACTIVE_CHANNELS, WEBSOCKET_CONNECTIONS,
+    WEBSOCKET_DROPPED_FRAMES, WEBSOCKET_PENDING_SENDS, WEBSOCKET_SUBSCRIPTIONS, metrics_registry
+)
+
 logger = logging.getLogger(__name__)
 
 
@@ -23,6 +33,10 @@ class ConnectionManager:
         self.channel_users: Dict[int, Set[int]] = {}
         # 用户信息缓存: {user_id: user_info}
         self.user_info_cache: Dict[int, Dict[str, Any]] = {}
+        # 进行中的AI流式生成: {(user_id, request_id): task}
+        self.ai_streams: Dict[Tuple[int, str], asyncio.Task] = {}
+        # 跨 worker 转发（WebSocketRelay 启动时设置，未启用时为 None）
+        self.relay = None
     
     async def connect(self, websocket: WebSocket, user_id: int, channel_id: Optional[int] = None):
         """建立 WebSocket 连接（不调用accept，由路由处理）"""
@@ -32,6 +46,8 @@ class ConnectionManager:
         if user_id not in self.active_connections:
             self.active_connections[user_id] = {}
             self.user_channels[user_id] = set()
+            if self.relay is not None:
+                await self.relay.mark_online(user_id)
         
         # 如果指定了频道，将用户加入频道
         if channel_id:
@@ -112,6 +128,13 @@ class ConnectionManager:
                 if user_id in self.user_info_cache:
                     del self.user_info_cache[user_id]
                 
+                # 连接已断开，中止该用户所有进行中的AI生成
+                for key in [key for key in self.ai_streams if key[0] == user_id]:
+                    self.ai_streams.pop(key).cancel()
+                
+                if self.relay is not None:
+                    await self.relay.mark_offline(user_id)
+                
                 logger.info(f"用户 {user_id} 断开所有连接")
 
     async def handle_message(self, user_id: int, message: dict):
@@ -178,29 +201,105 @@ class ConnectionManager:
                     exclude_user=user_id
                 )
         
+        elif message_type in ("ai_suggestions", "ai_summary"):
+            self.start_ai_stream(user_id, message_type, data)
+        
+        elif message_type == "ai_cancel":
+            self.cancel_ai_stream(user_id, str(data.get("request_id", "")))
+        
         logger.info(f"处理用户 {user_id} 的消息: {message_type}")
     
+    def start_ai_stream(self, user_id: int, message_type: str, data: dict):
+        """在后台任务中流式生成AI结果，接收循环可以继续处理取消请求"""
+        from app.services.ai_stream import run_websocket_stream
+        
+        request_id = str(data.pop("request_id", ""))
+        key = (user_id, request_id)
+        # 同一个 request_id 重复发起时，以最新的请求为准
+        self.cancel_ai_stream(user_id, request_id)
+        
+        task = asyncio.create_task(run_websocket_stream(self, user_id, message_type, request_id, data))
+        self.ai_streams[key] = task
+        
+        def _cleanup(finished: asyncio.Task):
+            if self.ai_streams.get(key) is finished:
+                del self.ai_streams[key]
+            if not finished.cancelled() and finished.exception():
+                logger.error(f"用户 {user_id} 的AI流式生成失败: {finished.exception()}")
+        
+        task.add_done_callback(_cleanup)
+    
+    def cancel_ai_stream(self, user_id: int, request_id: str):
+        """取消进行中的AI生成，上游模型请求随之中断"""
+        task = self.ai_streams.pop((user_id, request_id), None)
+        if task is not None:
+            task.cancel()
+            logger.info(f"用户 {user_id} 取消了AI生成 {request_id}")
+    
     async def send_personal_message(self, message: dict, user_id: int, channel_id: Optional[int] = None):
-        """发送个人消息"""
+        """发送个人消息（启用转发时同时送达用户在其他 worker 上的连接）"""
+        await self.deliver_personal_message(message, user_id, channel_id)
+        if self.relay is not None:
+            await self.relay.publish_personal([(user_id, message)], channel_id)
+    
+    async def deliver_personal_message(self, message: dict, user_id: int, channel_id: Optional[int] = None):
+        """发送个人消息给本进程的连接"""
         if user_id in self.active_connections:
             if channel_id and channel_id in self.active_connections[user_id]:
                 websocket = self.active_connections[user_id][channel_id]
                 try:
-                    await websocket.send_text(json.dumps(message))
+                    await self._send_text(websocket, json.dumps(message))
                 except Exception as e:
                     logger.error(f"发送消息给用户 {user_id} 失败: {e}")
-                    self.disconnect(user_id, channel_id)
+                    WEBSOCKET_DROPPED_FRAMES.inc()
+                    await self.disconnect(user_id, channel_id)
             elif 0 in self.active_connections[user_id]:
                 # 发送到全局连接
                 websocket = self.active_connections[user_id][0]
                 try:
-                    await websocket.send_text(json.dumps(message))
+                    await self._send_text(websocket, json.dumps(message))
                 except Exception as e:
                     logger.error(f"发送消息给用户 {user_id} 失败: {e}")
-                    self.disconnect(user_id)
+                    WEBSOCKET_DROPPED_FRAMES.inc()
+                    await self.disconnect(user_id)
+    
+    @staticmethod
+    async def _send_text(websocket: WebSocket, text: str) -> None:
+        # 没有显式的发送队列，以已交给连接但尚未写完的帧数作为积压深度
+        WEBSOCKET_PENDING_SENDS.inc()
+        try:
+            await websocket.send_text(text)
+        finally:
+            WEBSOCKET_PENDING_SENDS.dec()
+    
+    async def send_personal_messages(self, messages: List[Tuple[int, dict]], batch_size: int = 500):
+        """
+        批量发送个人消息
+        
+        messages 为 (user_id, message) 列表。每批并发发送，批与批之间让出事件循环，
+        避免一次大规模扇出长时间占用事件循环。启用转发时每批作为一条消息发布给其他 worker。
+        """
+        for start in range(0, len(messages), batch_size):
+            batch = messages[start:start + batch_size]
+            await self.deliver_personal_messages(batch)
+            if self.relay is not None:
+                await self.relay.publish_personal(batch)
+            await asyncio.sleep(0)
+    
+    async def deliver_personal_messages(self, messages: List[Tuple[int, dict]], channel_id: Optional[int] = None):
+        """并发发送一批个人消息给本进程的连接"""
+        await asyncio.gather(
+            *(self.deliver_personal_message(message, user_id, channel_id) for user_id, message in messages)
+        )
     
     async def broadcast_to_channel(self, channel_id: int, message: dict, exclude_user: Optional[int] = None):
-        """广播消息到频道内所有用户"""
+        """广播消息到频道内所有用户（启用转发时同时送达其他 worker 上的连接）"""
+        await self.deliver_to_channel(channel_id, message, exclude_user)
+        if self.relay is not None:
+            await self.relay.publish_channel(channel_id, message, exclude_user)
+    
+    async def deliver_to_channel(self, channel_id: int, message: dict, exclude_user: Optional[int] = None):
+        """广播消息给本进程中频道内的用户"""
         logger.info(f"尝试向频道 {channel_id} 广播消息，类型: {message.get('type')}")
         
         # 获取频道内的用户，包括全局连接的用户
@@ -221,6 +320,9 @@ class ConnectionManager:
             return
         
         logger.info(f"准备向频道 {channel_id} 的 {len(users_to_broadcast)} 个用户广播消息")
+        started = time.perf_counter()
+        # 所有接收者收到的内容相同，只序列化一次
+        text = json.dumps(message)
         disconnect_users = []
         broadcast_count = 0
         
@@ -243,15 +345,19 @@ class ConnectionManager:
             
             if websocket:
                 try:
-                    await websocket.send_text(json.dumps(message))
+                    await self._send_text(websocket, text)
                     broadcast_count += 1
                     logger.info(f"成功向用户 {user_id} 广播消息")
                 except Exception as e:
                     logger.error(f"广播消息到用户 {user_id} 失败: {e}")
+                    WEBSOCKET_DROPPED_FRAMES.inc()
                     disconnect_users.append(user_id)
             else:
                 logger.warning(f"用户 {user_id} 没有可用的WebSocket连接")
         
+        BROADCAST_RECIPIENTS.observe(broadcast_count)
+        BROADCAST_DURATION.observe(time.perf_counter() - started)
+        
         # 清理断开的连接
         for user_id in disconnect_users:
             await self.disconnect(user_id, channel_id)
@@ -275,9 +381,9 @@ class ConnectionManager:
         return list(self.user_channels.get(user_id, set()))
     
     def is_user_online(self, user_id: int, channel_id: Optional[int] = None) -> bool:
-        """检查用户是否在线"""
+        """检查用户是否在线；不指定频道且启用转发时包括其他 worker 上的连接"""
         if user_id not in self.active_connections:
-            return False
+            return channel_id is None and self.relay is not None and self.relay.is_online(user_id)
         
         if channel_id:
             return channel_id in self.active_connections[user_id]
@@ -325,6 +431,32 @@ class ConnectionManager:
         logger.info(f"用户 {user_id} 已添加到频道 {channel_id}")
         logger.info(f"频道 {channel_id} 现在有用户: {list(self.channel_users[channel_id])}")
     
+    async def close_all(self, code: int = 1001, reason: str = "Server shutting down", timeout: float = 5.0):
+        """关闭所有连接（服务停止时使用）"""
+        # 同一个 websocket 可能以多个频道为键出现，按对象去重
+        websockets = {
+            id(websocket): websocket
+            for connections in self.active_connections.values()
+            for websocket in connections.values()
+        }
+        if websockets:
+            logger.info(f"正在关闭 {len(websockets)} 个WebSocket连接")
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(
+                        *(websocket.close(code=code, reason=reason) for websocket in websockets.values()),
+                        return_exceptions=True
+                    ),
+                    timeout=timeout
+                )
+            except asyncio.TimeoutError:
+                logger.warning(f"关闭WebSocket连接超时（{timeout}秒）")
+        
+        self.active_connections.clear()
+        self.user_channels.clear()
+        self.channel_users.clear()
+        self.user_info_cache.clear()
+    
     def remove_user_from_channel(self, user_id: int, channel_id: int):
         """从频道中移除用户"""
         # 移除用户频道映射
@@ -347,4 +479,13 @@ class ConnectionManager:
 
 
 # 全局连接管理器实例
-connection_manager = ConnectionManager() 
\ No newline at end of file
+connection_manager = ConnectionManager()
+
+
+def _collect_connection_metrics() -> None:
+    WEBSOCKET_CONNECTIONS.set(sum(len(connections) for connections in connection_manager.active_connections.values()))
+    WEBSOCKET_SUBSCRIPTIONS.set(sum(len(users) for users in connection_manager.channel_users.values()))
+    WEBSOCKET_ACTIVE_CHANNELS.set(len(connection_manager.channel_users))
+
+
+metrics_registry.register_collector(_collect_connection_metrics) 
\ No newline at end of file
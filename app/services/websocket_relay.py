@@ -0,0 +1,196 @@
+"""
+WebSocket 跨 worker 转发
+
+预启动多进程模式下每个 worker 只持有自己接受的 WebSocket 连接。配置 service.relay_url 后：
+- 频道广播和个人消息先投递给本 worker 的连接，再发布到 Redis 频道，其他 worker 收到后投递给各自的连接；
+- 其他模块可以发布自定义事件（例如进程内缓存失效），由各 worker 上用 on() 注册的处理函数处理；
+- 在线状态保存在 Redis 有序集合中，成员为 "用户id:worker"，分数为最近一次续期的时间。各 worker 每隔
+  presence_interval 秒续期本地在线的用户并读回全部在线用户，超过 presence_ttl 秒未续期的成员
+  （例如崩溃的 worker 上的用户）视为离线。其他 worker 上的上线和离线最多晚一个续期间隔才可见。
+
+转发是尽力而为的：Redis 不可用时只记录日志，本 worker 上的投递不受影响。
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import redis.asyncio as redis
+
+from app.services.websocket_manager import connection_manager
+from app.utils.config import config
+
+logger = logging.getLogger(__name__)
+
+RELAY_CHANNEL = "huddle:websocket"
+PRESENCE_KEY = "huddle:presence"
+# 订阅断开后重新订阅前的等待时间
+RECONNECT_DELAY_SECONDS = 1.0
+
+
+class WebSocketRelay:
+    """通过 Redis 发布订阅在 worker 之间转发 WebSocket 消息，并共享在线状态"""
+
+    def __init__(
+        self,
+        manager,
+        client: Optional[redis.Redis] = None,
+        presence_ttl: Optional[float] = None,
+        presence_interval: Optional[float] = None
+    ):
+        self.manager = manager
+        # 本 worker 的标识，收到自己发布的消息时跳过
+        self.origin = uuid.uuid4().hex
+        self.presence_ttl = presence_ttl
+        self.presence_interval = presence_interval
+        # 全部 worker 上在线的用户（最近一次续期时读回）
+        self.online: Set[int] = set()
+        self._client = client
+        self._owns_client = client is None
+        self._pubsub = None
+        self._tasks: List[asyncio.Task] = []
+        # 自定义事件的处理函数: {kind: handler}
+        self._handlers: Dict[str, Callable[[dict], None]] = {}
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self) -> None:
+        """订阅转发频道并开始续期在线状态，之后连接管理器的广播和个人消息会发布给其他 worker"""
+        if self.is_running:
+            return
+        if self._client is None:
+            self._client = redis.from_url(config.service.relay_url, decode_responses=True)
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(RELAY_CHANNEL)
+        await self.sync_presence()
+        self._tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._renew())]
+        self.manager.relay = self
+        logger.info(f"WebSocket 跨 worker 转发已启动（worker {self.origin}）")
+
+    async def stop(self) -> None:
+        if self.manager.relay is self:
+            self.manager.relay = None
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._client is None:
+            return
+        try:
+            members = [self._member(user_id) for user_id in self.manager.active_connections]
+            if members:
+                await self._client.zrem(PRESENCE_KEY, *members)
+        except Exception as e:
+            logger.warning(f"清理在线状态失败: {e}")
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        if self._owns_client:
+            await self._client.aclose()
+            self._client = None
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self.online
+
+    def _member(self, user_id: int) -> str:
+        return f"{user_id}:{self.origin}"
+
+    async def publish_channel(self, channel_id: int, message: dict, exclude_user: Optional[int] = None) -> None:
+        await self._publish({"kind": "channel", "channel_id": channel_id, "message": message, "exclude_user": exclude_user})
+
+    async def publish_personal(self, messages: List[Tuple[int, dict]], channel_id: Optional[int] = None) -> None:
+        await self._publish({"kind": "personal", "messages": messages, "channel_id": channel_id})
+
+    def on(self, kind: str, handler: Callable[[dict], None]) -> None:
+        """注册其他 worker 发布的自定义事件的处理函数"""
+        self._handlers[kind] = handler
+
+    async def publish(self, kind: str, **data) -> None:
+        """向其他 worker 发布自定义事件；未启用转发时忽略"""
+        if self.is_running:
+            await self._publish({"kind": kind, **data})
+
+    async def _publish(self, event: dict) -> None:
+        try:
+            await self._client.publish(RELAY_CHANNEL, json.dumps({"origin": self.origin, **event}))
+        except Exception as e:
+            logger.error(f"WebSocket 消息转发失败: {e}")
+
+    async def mark_online(self, user_id: int) -> None:
+        """本 worker 上的用户建立连接，立即写入在线状态"""
+        self.online.add(user_id)
+        try:
+            await self._client.zadd(PRESENCE_KEY, {self._member(user_id): time.time()})
+        except Exception as e:
+            logger.error(f"写入在线状态失败: {e}")
+
+    async def mark_offline(self, user_id: int) -> None:
+        """本 worker 上的用户断开全部连接；用户在其他 worker 上仍有连接时，下次续期后仍是在线"""
+        try:
+            await self._client.zrem(PRESENCE_KEY, self._member(user_id))
+        except Exception as e:
+            logger.error(f"清理在线状态失败: {e}")
+
+    async def sync_presence(self) -> None:
+        """续期本 worker 上在线的用户，清理过期成员，读回全部在线用户"""
+        now = time.time()
+        ttl = self.presence_ttl or config.service.presence_ttl
+        members = {self._member(user_id): now for user_id in self.manager.active_connections}
+        async with self._client.pipeline(transaction=False) as pipe:
+            if members:
+                pipe.zadd(PRESENCE_KEY, members)
+            pipe.zremrangebyscore(PRESENCE_KEY, "-inf", now - ttl)
+            pipe.zrange(PRESENCE_KEY, 0, -1)
+            results = await pipe.execute()
+        online = set()
+        for member in results[-1]:
+            if isinstance(member, bytes):
+                member = member.decode()
+            online.add(int(member.split(":", 1)[0]))
+        self.online = online
+
+    async def _renew(self) -> None:
+        interval = self.presence_interval or config.service.presence_interval
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sync_presence()
+            except Exception as e:
+                logger.error(f"续期在线状态失败: {e}")
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async for item in self._pubsub.listen():
+                    if item["type"] == "message":
+                        await self._deliver(item["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"WebSocket 转发订阅中断，稍后重试: {e}")
+                await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+
+    async def _deliver(self, data) -> None:
+        """把其他 worker 发布的消息投递给本 worker 的连接"""
+        try:
+            event = json.loads(data)
+            if event.get("origin") == self.origin:
+                return
+            if event["kind"] == "channel":
+                await self.manager.deliver_to_channel(event["channel_id"], event["message"], event.get("exclude_user"))
+            elif event["kind"] == "personal":
+                await self.manager.deliver_personal_messages(
+                    [(user_id, message) for user_id, message in event["messages"]], event.get("channel_id")
+                )
+            elif event["kind"] in self._handlers:
+                self._handlers[event["kind"]](event)
+        except Exception as e:
+            logger.error(f"投递转发的 WebSocket 消息失败: {e}")
+
+
+# 全局转发实例
+websocket_relay = WebSocketRelay(connection_manager)
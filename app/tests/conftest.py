@@ -2,7 +2,12 @@
 pytest配置文件和测试固定装置
 """
 import asyncio
+import json
+import re
 import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from typing import AsyncGenerator, Generator
 from unittest.mock import AsyncMock, MagicMock
 
@@ -16,7 +21,38 @@ from sqlalchemy.orm import sessionmaker
 
 from app.database.database import Base, get_db
 from app.main import app
+from app.models.channel import Channel, ChannelType
+from app.models.channel_member import ChannelMember
+from app.models.team import Team
+from app.models.team_member import TeamMember, TeamRole
 from app.models.user import User
+from app.services.llm_client import LLMClient
+from app.utils.loop_watchdog import forbid_blocking
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--max-loop-block-ms", type=float, default=0,
+        help="异步测试阻塞事件循环超过该毫秒数时失败（0 为不检查）"
+    )
+
+
+class LoopBlockingCheck:
+    """--max-loop-block-ms 开启时注册：每个异步测试都在 forbid_blocking() 中运行"""
+
+    def __init__(self, max_ms: float):
+        self.max_ms = max_ms
+
+    @pytest_asyncio.fixture(autouse=True)
+    async def forbid_loop_blocking(self):
+        with forbid_blocking(self.max_ms):
+            yield
+
+
+def pytest_configure(config):
+    max_ms = config.getoption("--max-loop-block-ms")
+    if max_ms:
+        config.pluginmanager.register(LoopBlockingCheck(max_ms), "loop-blocking-check")
 
 
 @pytest.fixture(scope="session")
@@ -54,6 +90,158 @@ async def test_db() -> AsyncGenerator[AsyncSession, None]:
     await engine.dispose()
 
 
+class StubLLMServer:
+    """
+    OpenAI 兼容的 chat/completions 桩服务
+
+    记录请求数和最大并发数；stream 请求按 SSE 分块返回，客户端中途断开时计入 aborted。
+    failures 中的状态码依次用于之后的请求（带 Retry-After: 0），用于模拟限流和上游故障。
+    """
+
+    def __init__(self, stream_delay: float = 0.0):
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.aborted = 0
+        self.stream_delay = stream_delay
+        self.failures = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/v1"
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reply(self, messages) -> str:
+        system, user = messages[0]["content"], messages[1]["content"]
+        if "候选回复" in system:
+            suggestions = "1. 好的，我来跟进\n2. 收到，今天处理\n- 没问题"
+            indexes = re.findall(r"【请求(\d+)】", user)
+            if indexes:
+                return json.dumps({index: suggestions for index in indexes}, ensure_ascii=False)
+            return suggestions
+        if "合并" in system:
+            partials = [json.loads(line) for line in user.splitlines()[1:]]
+            result = {
+                "summary": "合并摘要",
+                "key_points": [point for partial in partials for point in partial["key_points"]],
+                "action_items": [item for partial in partials for item in partial["action_items"]],
+            }
+        else:
+            lines = user.splitlines()[1:]
+            result = {
+                "summary": f"{len(lines)} 条消息",
+                "key_points": [lines[0].split(": ", 1)[1]],
+                "action_items": [],
+            }
+        return json.dumps(result, ensure_ascii=False)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with stub._lock:
+                    stub.requests.append(body)
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                    status = stub.failures.pop(0) if stub.failures else None
+                try:
+                    if status is not None:
+                        time.sleep(0.01)
+                        self._fail(status)
+                        return
+                    content = stub.reply(body["messages"])
+                    if body.get("stream"):
+                        self._stream(body, content)
+                    else:
+                        time.sleep(0.05)
+                        self._complete(body, content)
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+
+            def _complete(self, body, content):
+                payload = json.dumps({
+                    "id": "stub",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": body["model"],
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }],
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _fail(self, status):
+                payload = json.dumps({"error": {"message": "stub failure", "type": "stub"}}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.send_header("Retry-After", "0")
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, body, content):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                try:
+                    for i in range(0, len(content), 3):
+                        self._send_chunk(body, {"content": content[i:i + 3]})
+                        time.sleep(stub.stream_delay)
+                    self._send_chunk(body, {}, finish_reason="stop")
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    with stub._lock:
+                        stub.aborted += 1
+
+            def _send_chunk(self, body, delta, finish_reason=None):
+                chunk = json.dumps({
+                    "id": "stub",
+                    "object": "chat.completion.chunk",
+                    "created": 0,
+                    "model": body["model"],
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }, ensure_ascii=False)
+                self.wfile.write(f"data: {chunk}\n\n".encode())
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+@pytest.fixture
+def llm_server():
+    server = StubLLMServer()
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def llm(llm_server):
+    return LLMClient(endpoint=llm_server.url, model="stub", api_key="test", max_concurrency=8)
+
+
 @pytest.fixture(scope="function")
 async def client(test_db: AsyncSession) -> AsyncGenerator[AsyncClient, None]:
     """创建测试客户端"""
@@ -118,6 +306,20 @@ async def test_user_2(test_db: AsyncSession) -> User:
     return user
 
 
+@pytest.fixture
+async def channel(test_db: AsyncSession, test_user: User) -> Channel:
+    """test_user 创建的团队及其中的公开频道，test_user 是团队所有者和频道成员"""
+    team = Team(name="团队", slug="team", owner_id=test_user.id)
+    test_db.add(team)
+    await test_db.flush()
+    channel = Channel(name="general", type=ChannelType.PUBLIC, team_id=team.id, created_by=test_user.id)
+    test_db.add_all([channel, TeamMember(team_id=team.id, user_id=test_user.id, role=TeamRole.OWNER)])
+    await test_db.flush()
+    test_db.add(ChannelMember(channel_id=channel.id, user_id=test_user.id))
+    await test_db.commit()
+    return channel
+
+
 @pytest.fixture
 def mock_config():
     """模拟配置"""
@@ -219,4 +421,17 @@ schema = test_schema
         f.write(config_content)
         f.flush()
         monkeypatch.setattr("app.utils.config.Path", lambda x: type('MockPath', (), {'exists': lambda: True})())
-        monkeypatch.setattr("app.utils.config.ConfigParser.read", lambda self, path: self.read_string(config_content)) 
\ No newline at end of file
+        monkeypatch.setattr("app.utils.config.ConfigParser.read", lambda self, path: self.read_string(config_content)) 
+
+@pytest.fixture(autouse=True)
+def reset_process_caches():
+    """清空进程内缓存：每个测试使用新的内存数据库，频道和用户id会重复"""
+    from app.services.ai_config_service import ai_config_cache
+    from app.services.attachment_cache import hot_file_cache, object_meta_cache
+    from app.services.suggestion_context import suggestion_context
+
+    yield
+    ai_config_cache.clear()
+    suggestion_context.clear()
+    object_meta_cache.clear()
+    hot_file_cache.clear()
@@ -0,0 +1,253 @@
+"""
+批量AI任务执行器测试
+
+执行器为每次状态更新使用独立会话，测试使用本地SQLite文件数据库。
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from app.database.database import Base
+from app.models.ai_task import AITask
+from app.schemas.ai import BatchProcessRequest
+from app.services import ai_job_service
+from app.services.ai_job_service import AIJobService, AIJobWorker, JOB_HANDLERS, JobContext, summarize_channels
+from app.services.channel_service import ChannelService
+from app.services.summary_service import SummaryService
+from app.utils.config import config
+
+
+@pytest.fixture
+async def session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'jobs.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    yield async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    await engine.dispose()
+
+
+@pytest.fixture
+def handlers(monkeypatch):
+    """注册测试用的任务处理函数"""
+    monkeypatch.setattr(ai_job_service, "JOB_HANDLERS", dict(JOB_HANDLERS))
+    return ai_job_service.JOB_HANDLERS
+
+
+@pytest.fixture
+async def worker(session_factory):
+    worker = AIJobWorker(
+        session_factory=session_factory,
+        concurrency=2,
+        poll_interval=0.05,
+        lease_seconds=0.3,
+        retry_base_delay=0
+    )
+    worker.start()
+    yield worker
+    await worker.stop()
+
+
+async def _enqueue(session_factory, operation: str) -> str:
+    async with session_factory() as db:
+        task = await AIJobService(db).enqueue(BatchProcessRequest(operation=operation), user_id=1)
+        return task.task_id
+
+
+async def _wait_for_status(session_factory, task_id: str, statuses, timeout: float = 5.0) -> AITask:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        async with session_factory() as db:
+            task = await AIJobService(db).get_task(task_id, 1)
+        if task.status in statuses:
+            return task
+        assert asyncio.get_running_loop().time() < deadline, f"task stuck in {task.status}"
+        await asyncio.sleep(0.05)
+
+
+class TestAIJobWorker:
+    """批量AI任务执行器测试"""
+
+    @pytest.mark.asyncio
+    async def test_job_reports_progress_and_completes(self, session_factory, handlers, worker):
+        """测试任务写入部分结果并最终完成"""
+        release = asyncio.Event()
+
+        async def two_steps(context):
+            await context.report(0.5, {"steps": ["first"]})
+            await release.wait()
+            return {"steps": ["first", "second"]}
+
+        handlers["two_steps"] = two_steps
+        task_id = await _enqueue(session_factory, "two_steps")
+
+        deadline = asyncio.get_running_loop().time() + 5
+        while True:
+            async with session_factory() as db:
+                task = await AIJobService(db).get_task(task_id, 1)
+            if task.progress == 0.5:
+                break
+            assert asyncio.get_running_loop().time() < deadline
+            await asyncio.sleep(0.05)
+        assert task.status == "processing"
+        assert task.output_data == {"steps": ["first"]}
+
+        release.set()
+        task = await _wait_for_status(session_factory, task_id, {"completed"})
+        assert task.progress == 1.0
+        assert task.output_data == {"steps": ["first", "second"]}
+
+    @pytest.mark.asyncio
+    async def test_failed_job_is_retried(self, session_factory, handlers, worker):
+        """测试失败后重试，并保留上一次的部分结果"""
+        seen_outputs = []
+
+        async def flaky(context):
+            seen_outputs.append(dict(context.output_data))
+            if context.attempt == 1:
+                await context.report(0.5, {"done": [1]})
+                raise RuntimeError("upstream timeout")
+            return {"done": context.output_data["done"] + [2]}
+
+        handlers["flaky"] = flaky
+        task_id = await _enqueue(session_factory, "flaky")
+
+        task = await _wait_for_status(session_factory, task_id, {"completed", "failed"})
+        assert task.status == "completed"
+        assert task.attempts == 2
+        assert task.output_data == {"done": [1, 2]}
+        assert seen_outputs == [{}, {"done": [1]}]
+
+    @pytest.mark.asyncio
+    async def test_job_fails_after_max_attempts(self, session_factory, handlers, worker):
+        """测试超过最大尝试次数后标记失败"""
+        async def broken(context):
+            raise RuntimeError("boom")
+
+        handlers["broken"] = broken
+        task_id = await _enqueue(session_factory, "broken")
+
+        task = await _wait_for_status(session_factory, task_id, {"failed"})
+        assert task.attempts == task.max_attempts
+        assert task.error_message == "boom"
+
+    @pytest.mark.asyncio
+    async def test_cancel_running_job(self, session_factory, handlers, worker):
+        """测试取消执行中的任务"""
+        started = asyncio.Event()
+
+        async def endless(context):
+            started.set()
+            await asyncio.Event().wait()
+
+        handlers["endless"] = endless
+        task_id = await _enqueue(session_factory, "endless")
+        await asyncio.wait_for(started.wait(), timeout=5)
+
+        async with session_factory() as db:
+            task = await AIJobService(db).cancel(task_id, 1)
+        assert task.cancel_requested
+
+        task = await _wait_for_status(session_factory, task_id, {"cancelled"})
+        assert task.completed_at is not None
+
+    @pytest.mark.asyncio
+    async def test_stale_processing_job_is_recovered(self, session_factory, handlers):
+        """测试心跳超时的执行中任务在执行器启动后重新执行"""
+        async def quick(context):
+            return {"ok": True}
+
+        handlers["quick"] = quick
+        async with session_factory() as db:
+            db.add(AITask(
+                task_id="orphan",
+                task_type="batch_process",
+                status="processing",
+                user_id=1,
+                attempts=1,
+                locked_by="dead-worker",
+                heartbeat_at=datetime.now(timezone.utc) - timedelta(hours=1),
+                input_data={"operation": "quick"},
+            ))
+            await db.commit()
+
+        worker = AIJobWorker(session_factory=session_factory, poll_interval=0.05, lease_seconds=0.3)
+        worker.start()
+        try:
+            task = await _wait_for_status(session_factory, "orphan", {"completed"})
+        finally:
+            await worker.stop()
+
+        assert task.attempts == 2
+        assert task.output_data == {"ok": True}
+
+    @pytest.mark.asyncio
+    async def test_lost_lease_does_not_overwrite(self, session_factory, handlers, worker):
+        """测试租约失效后任务被其他执行器领取，原执行器完成时不覆盖新执行器的状态"""
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def slow(context):
+            started.set()
+            await release.wait()
+            return {"owner": "old"}
+
+        handlers["slow"] = slow
+        task_id = await _enqueue(session_factory, "slow")
+        await asyncio.wait_for(started.wait(), timeout=5)
+
+        # 模拟心跳超时后任务被重新排队并由另一个执行器领取
+        async with session_factory() as db:
+            task = await AIJobService(db).get_task(task_id, 1)
+            task.locked_by = "new-worker"
+            task.heartbeat_at = datetime.now(timezone.utc) + timedelta(hours=1)
+            await db.commit()
+        release.set()
+        await asyncio.sleep(0.3)
+
+        async with session_factory() as db:
+            task = await AIJobService(db).get_task(task_id, 1)
+        assert task.status == "processing" and task.locked_by == "new-worker"
+        assert task.output_data != {"owner": "old"}
+
+    @pytest.mark.asyncio
+    async def test_unsupported_operation_rejected(self, session_factory):
+        """测试不支持的操作类型"""
+        with pytest.raises(ValueError):
+            await _enqueue(session_factory, "unknown")
+
+
+class TestSummarizeChannels:
+    """批量频道摘要测试"""
+
+    @pytest.mark.asyncio
+    async def test_channel_concurrency_is_bounded(self, session_factory, monkeypatch):
+        """测试同时生成摘要的频道数不超过 channel_concurrency，避免占满连接池"""
+        monkeypatch.setitem(config.ai_jobs.__dict__, "channel_concurrency", 2)
+        running, peak = 0, 0
+
+        async def can_access(self, channel_id, user_id):
+            return True
+
+        async def get_summary(self, channel_id, *args):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.02)
+            running -= 1
+            return SimpleNamespace(model_dump=lambda: {"channel_id": channel_id})
+
+        monkeypatch.setattr(ChannelService, "can_user_access_channel", can_access)
+        monkeypatch.setattr(SummaryService, "get_summary", get_summary)
+        task = SimpleNamespace(
+            id=1, task_id="t", user_id=1, attempts=1,
+            input_data={"target_channels": [1, 2, 3, 4, 5]}, output_data=None
+        )
+
+        output = await summarize_channels(JobContext(task, session_factory))
+
+        assert peak == 2
+        assert sorted(output["summaries"]) == ["1", "2", "3", "4", "5"]
@@ -0,0 +1,241 @@
+"""
+AI流式推送测试
+
+使用本地的 OpenAI 兼容桩服务（见 conftest.py）代替真实模型。
+"""
+import asyncio
+import json
+from contextlib import aclosing
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.main import app
+from app.models.message import Message
+from app.schemas.ai import AutoSummaryRequest, MessageSuggestionRequest
+from app.services import ai_stream, llm_client
+from app.services.ai_stream import suggestion_events, summary_events
+from app.services.channel_summarizer import ChannelSummarizer
+from app.services.llm_client import JSONStringFieldReader
+from app.services.message_suggester import parse_suggestions
+from app.services.websocket_manager import ConnectionManager
+
+
+WINDOW_START = datetime(2025, 3, 2, 9, 0)
+SUGGESTIONS = ["好的，我来跟进", "收到，今天处理", "没问题"]
+
+
+@pytest.fixture(autouse=True)
+def stream_env(test_db, llm, monkeypatch):
+    """流式生成使用测试数据库和桩模型"""
+    monkeypatch.setattr(
+        ai_stream, "AsyncSessionLocal",
+        async_sessionmaker(test_db.bind, class_=AsyncSession, expire_on_commit=False)
+    )
+    monkeypatch.setattr(llm_client, "_llm_client", llm)
+
+
+@pytest.fixture
+async def messages(test_db, channel, test_user):
+    """channel 中 WINDOW_START 起每分钟一条的5条消息"""
+    messages = [
+        Message(
+            content=f"消息{i}", author_id=test_user.id, channel_id=channel.id,
+            created_at=WINDOW_START + timedelta(minutes=i)
+        )
+        for i in range(5)
+    ]
+    test_db.add_all(messages)
+    await test_db.commit()
+    return messages
+
+
+async def _collect(events):
+    async with aclosing(events):
+        return [event async for event in events]
+
+
+class FakeWebSocket:
+    """记录发送的消息"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text: str):
+        self.sent.append(json.loads(text))
+
+
+class TestStreamingHelpers:
+    """流式解析测试"""
+
+    def test_json_field_reader_decodes_across_chunks(self):
+        """测试跨分块的转义字符和代理对都能正确解码"""
+        summary = '第一行\n"引号" \\ 😀 end'
+        content = json.dumps({"summary": summary, "key_points": ["不输出"]})
+
+        for size in (1, 2, 5):
+            reader = JSONStringFieldReader("summary")
+            text = "".join(reader.feed(content[i:i + size]) for i in range(0, len(content), size))
+            assert text == summary
+
+    def test_parse_suggestions(self):
+        """测试去掉编号、列表符号和空行"""
+        assert parse_suggestions("1. 好的，我来跟进\n\n2、收到，今天处理\n- 没问题\n4) 多余") == SUGGESTIONS
+
+
+@pytest.mark.usefixtures("messages")
+class TestAIStream:
+    """流式建议与摘要测试"""
+
+    @pytest.mark.asyncio
+    async def test_suggestions_stream_tokens_then_result(self, test_user, channel, llm_server):
+        """测试先转发模型生成的文本，最后发送结构化结果"""
+        request = MessageSuggestionRequest(channel_id=channel.id)
+        events = await _collect(suggestion_events(request, test_user.id))
+
+        tokens = [data["text"] for event, data in events if event == "token"]
+        assert len(tokens) > 1
+        assert parse_suggestions("".join(tokens)) == SUGGESTIONS
+        assert events[-1] == ("result", {"suggestions": SUGGESTIONS, "confidence": 0.53, "context_used": 5})
+        assert llm_server.requests[0]["stream"] is True
+        assert "消息4" in llm_server.requests[0]["messages"][1]["content"]
+
+    @pytest.mark.asyncio
+    async def test_summary_stream_and_cache(self, test_user, channel, llm_server):
+        """测试流式摘要正文与最终结果一致，结果写入缓存后不再调用模型"""
+        request = AutoSummaryRequest(
+            channel_id=channel.id, start_time=WINDOW_START, end_time=WINDOW_START + timedelta(hours=1)
+        )
+        events = await _collect(summary_events(request, test_user.id))
+
+        event, result = events[-1]
+        assert event == "result"
+        assert result["message_count"] == 5
+        assert "".join(data["text"] for event, data in events if event == "token") == result["summary"]
+
+        calls = len(llm_server.requests)
+        assert await _collect(summary_events(request, test_user.id)) == [("result", result)]
+        assert len(llm_server.requests) == calls
+
+    @pytest.mark.asyncio
+    async def test_multi_segment_summary_streams_final_merge(self, test_db, channel, llm, llm_server):
+        """测试多段摘要只流式生成最后一轮合并"""
+        tokens = []
+        summarizer = ChannelSummarizer(test_db, llm=llm, segment_tokens=15)
+        result = await summarizer.summarize(
+            channel.id, WINDOW_START, WINDOW_START + timedelta(hours=1), on_token=tokens.append
+        )
+
+        assert result.summary == "合并摘要"
+        assert "".join(tokens) == "合并摘要"
+        assert [request.get("stream", False) for request in llm_server.requests].count(True) == 1
+
+    @pytest.mark.asyncio
+    async def test_no_access_yields_error(self, test_user_2, channel):
+        """测试无权访问频道时返回错误事件"""
+        events = await _collect(suggestion_events(MessageSuggestionRequest(channel_id=channel.id), test_user_2.id))
+
+        assert events == [("error", {"message": "Access denied to this channel"})]
+
+    @pytest.mark.asyncio
+    async def test_closing_stream_aborts_upstream(self, test_user, channel, llm_server):
+        """测试客户端提前关闭事件流时中断上游请求"""
+        llm_server.stream_delay = 0.05
+        events = suggestion_events(MessageSuggestionRequest(channel_id=channel.id), test_user.id)
+
+        async with aclosing(events):
+            event, _ = await anext(events)
+            assert event == "token"
+
+        for _ in range(40):
+            if llm_server.aborted:
+                break
+            await asyncio.sleep(0.05)
+        assert llm_server.aborted == 1
+
+
+@pytest.mark.usefixtures("messages")
+class TestWebSocketAIStream:
+    """WebSocket 流式推送测试"""
+
+    @pytest.mark.asyncio
+    async def test_websocket_stream_and_cancel(self, test_user, channel, llm_server):
+        """测试通过 WebSocket 推送token和结果，以及取消进行中的生成"""
+        manager = ConnectionManager()
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, test_user.id)
+
+        await manager.handle_message(
+            test_user.id, {"type": "ai_suggestions", "data": {"request_id": "r1", "channel_id": channel.id}}
+        )
+        await asyncio.wait_for(manager.ai_streams[(test_user.id, "r1")], timeout=5)
+
+        types = [message["type"] for message in websocket.sent]
+        assert types[-1] == "ai_result" and set(types[:-1]) == {"ai_token"}
+        assert websocket.sent[-1]["data"]["request_id"] == "r1"
+        assert websocket.sent[-1]["data"]["result"]["suggestions"] == SUGGESTIONS
+        assert not manager.ai_streams
+
+        llm_server.stream_delay = 0.05
+        websocket.sent.clear()
+        await manager.handle_message(
+            test_user.id, {"type": "ai_suggestions", "data": {"request_id": "r2", "channel_id": channel.id}}
+        )
+        while not websocket.sent:
+            await asyncio.sleep(0.01)
+        await manager.handle_message(test_user.id, {"type": "ai_cancel", "data": {"request_id": "r2"}})
+        await asyncio.sleep(0.3)
+
+        assert "ai_result" not in [message["type"] for message in websocket.sent]
+        assert llm_server.aborted == 1
+
+    @pytest.mark.asyncio
+    async def test_websocket_invalid_request(self, test_user):
+        """测试请求参数不合法时返回 ai_error"""
+        manager = ConnectionManager()
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, test_user.id)
+
+        await manager.handle_message(test_user.id, {"type": "ai_summary", "data": {"request_id": "bad"}})
+        await asyncio.wait_for(manager.ai_streams[(test_user.id, "bad")], timeout=5)
+
+        assert [message["type"] for message in websocket.sent] == ["ai_error"]
+
+
+@pytest.mark.usefixtures("messages")
+class TestSSEEndpoint:
+    """SSE 接口测试"""
+
+    @pytest.mark.asyncio
+    async def test_suggestions_sse(self, client, auth_headers, channel):
+        """测试 SSE 响应格式"""
+        response = await client.post(
+            app.url_path_for("stream_message_suggestions"), json={"channel_id": channel.id}, headers=auth_headers
+        )
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        frames = [frame for frame in response.text.split("\n\n") if frame]
+        assert frames[0].startswith("event: token\ndata: ")
+        event, data = frames[-1].split("\n")
+        assert event == "event: result"
+        assert json.loads(data.removeprefix("data: "))["suggestions"] == SUGGESTIONS
+
+    @pytest.mark.asyncio
+    async def test_sse_forbidden_channel(self, client, test_user_2, channel):
+        """测试无权访问频道时直接返回403"""
+        from app.auth.auth import create_access_token
+
+        token = create_access_token(data={"sub": test_user_2.username})
+        response = await client.post(
+            app.url_path_for("stream_auto_summary"),
+            json={
+                "channel_id": channel.id,
+                "start_time": WINDOW_START.isoformat(),
+                "end_time": (WINDOW_START + timedelta(hours=1)).isoformat(),
+            },
+            headers={"Authorization": f"Bearer {token}"}
+        )
+
+        assert response.status_code == 403
@@ -0,0 +1,257 @@
+"""
+附件预览生成测试
+
+渲染函数替换为不依赖图像库的假实现，在线程池中执行。
+"""
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.main import app
+from app.models.attachment import AttachmentBlob, PreviewStatus
+from app.schemas.message import MessageCreate, MessageResponse
+from app.services import attachment_previews, object_store
+from app.services.attachment_previews import PREVIEW_SIZES, PreviewGenerator, render_previews
+from app.services.attachment_service import AttachmentService
+from app.services.message_service import MessageService
+from app.services.object_store import LocalObjectStore
+
+
+class FakeRenderer:
+    """按档位返回固定尺寸的“图片”，记录被调用的次数"""
+
+    def __init__(self, fail: bool = False, crash: bool = False):
+        self.fail = fail
+        self.crash = crash
+        self.calls = []
+
+    def __call__(self, path, sizes, quality):
+        with open(path, "rb") as f:
+            data = f.read()
+        self.calls.append(data)
+        if self.fail:
+            raise OSError("cannot identify image file")
+        if self.crash:
+            # 进程池中的渲染进程崩溃时，等待结果的一方收到的异常
+            raise BrokenProcessPool("A process in the process pool was terminated abruptly")
+        return [(variant, size, size // 2, f"{variant}:".encode() + data) for variant, size in sizes.items()]
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    local = LocalObjectStore(str(tmp_path / "store"))
+    monkeypatch.setattr(object_store, "_object_store", local)
+    return local
+
+
+@pytest.fixture
+def make_generator(test_db, monkeypatch):
+    executors = []
+
+    def make(renderer):
+        executor = ThreadPoolExecutor(max_workers=2)
+        executors.append(executor)
+        generator = PreviewGenerator(
+            renderer=renderer,
+            content_types=("image/", "application/pdf"),
+            session_factory=async_sessionmaker(test_db.bind, class_=AsyncSession, expire_on_commit=False),
+            executor=executor,
+            workers=2
+        )
+        monkeypatch.setattr(attachment_previews, "preview_generator", generator)
+        return generator
+
+    yield make
+    for executor in executors:
+        executor.shutdown()
+
+
+async def _upload(client, auth_headers, name, content_type, content):
+    response = await client.post(
+        app.url_path_for("upload_attachment"), params={"name": name}, content=content,
+        headers={**auth_headers, "Content-Type": content_type}
+    )
+    return response.json()
+
+
+class TestPreviewGeneration:
+    """预览生成测试"""
+
+    @pytest.mark.asyncio
+    async def test_previews_generated_once_per_content(
+        self, client, auth_headers, test_db, test_user, store, make_generator, channel
+    ):
+        """测试相同内容只生成一次预览，预览随附件和消息返回并可以下载"""
+        renderer = FakeRenderer()
+        generator = make_generator(renderer)
+        first = await _upload(client, auth_headers, "a.png", "image/png", b"png!")
+        second = await _upload(client, auth_headers, "b.png", "image/png", b"png!")
+        await _upload(client, auth_headers, "notes.txt", "text/plain", b"text")
+
+        assert await generator.sync() == 1
+        assert renderer.calls == [b"png!"]
+        assert await generator.sync() == 0
+
+        response = await client.get(app.url_path_for("get_attachment", attachment_id=str(second["id"])), headers=auth_headers)
+        previews = response.json()["previews"]
+        assert [preview["variant"] for preview in previews] == sorted(PREVIEW_SIZES, key=PREVIEW_SIZES.get)
+        assert previews[0] == {
+            "variant": "small", "content_type": "image/webp", "width": 160, "height": 80,
+            "url": f"/api/v1/attachments/{second['id']}/previews/small"
+        }
+
+        response = await client.get(previews[1]["url"], headers=auth_headers)
+        assert response.status_code == 200 and response.content == b"medium:png!"
+        assert response.headers["content-type"] == "image/webp"
+        response = await client.get(f"/api/v1/attachments/{first['id']}/previews/huge", headers=auth_headers)
+        assert response.status_code == 404
+
+        message = await MessageService(test_db).create_message(
+            MessageCreate(content="图片", channel_id=channel.id, attachment_id=first["id"]), test_user.id
+        )
+        payload = MessageResponse.model_validate(message)
+        assert [preview.url for preview in payload.attachment_previews] == [
+            f"/api/v1/attachments/{first['id']}/previews/{variant}" for variant in ("small", "medium", "large")
+        ]
+
+    @pytest.mark.asyncio
+    async def test_failed_render_is_not_retried(self, client, auth_headers, test_db, store, make_generator):
+        """测试渲染失败时标记失败，不再重复生成"""
+        renderer = FakeRenderer(fail=True)
+        generator = make_generator(renderer)
+        await _upload(client, auth_headers, "broken.jpg", "image/jpeg", b"not a jpeg")
+
+        assert await generator.sync() == 1
+        assert await generator.sync() == 0
+        blob = (await test_db.execute(select(AttachmentBlob))).scalar_one()
+        assert blob.preview_status == PreviewStatus.FAILED
+        assert len(renderer.calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_render_crash_is_retried(self, client, auth_headers, test_db, store, make_generator):
+        """测试渲染进程崩溃时换新的进程池、内容保持可重新领取，多次崩溃后才标记失败"""
+        renderer = FakeRenderer(crash=True)
+        generator = make_generator(renderer)
+        await _upload(client, auth_headers, "bomb.png", "image/png", b"png!")
+
+        for attempt in range(attachment_previews.MAX_RENDER_CRASHES):
+            pool = ThreadPoolExecutor(max_workers=1)
+            generator._executor, generator._owns_executor = pool, True
+            assert await generator.sync() == 1
+            # 崩溃的进程池被丢弃，下次使用时重新创建
+            assert generator._executor is None
+            blob = (await test_db.execute(select(AttachmentBlob))).scalar_one()
+            await test_db.refresh(blob)
+            if attempt < attachment_previews.MAX_RENDER_CRASHES - 1:
+                assert blob.preview_status == PreviewStatus.PROCESSING
+                await test_db.execute(update(AttachmentBlob).values(
+                    preview_claimed_at=datetime.now(timezone.utc) - timedelta(hours=1)
+                ))
+                await test_db.commit()
+
+        assert blob.preview_status == PreviewStatus.FAILED
+        assert len(renderer.calls) == attachment_previews.MAX_RENDER_CRASHES
+
+    @pytest.mark.asyncio
+    async def test_batch_crash_only_counts_alone(self, client, auth_headers, test_db, store, make_generator, monkeypatch):
+        """测试同一批中一个文件让进程池崩溃时，其他内容单独重新生成成功，只有崩溃的内容计入次数"""
+        generator = make_generator(FakeRenderer())
+        await _upload(client, auth_headers, "bomb.png", "image/png", b"bomb")
+        await _upload(client, auth_headers, "good.png", "image/png", b"good")
+        rendering = set()
+        crashed = set()
+        calls = []
+
+        async def render(path):
+            data = path.read_bytes()
+            calls.append(data)
+            rendering.add(data)
+            # 等同一批的其他内容也开始渲染；bomb 让整个进程池崩溃，正在渲染的内容都收到 BrokenProcessPool
+            await asyncio.sleep(0.01)
+            if b"bomb" in rendering:
+                crashed.update(rendering)
+            broken = data in crashed
+            rendering.discard(data)
+            crashed.discard(data)
+            if broken:
+                raise BrokenProcessPool("A process in the process pool was terminated abruptly")
+            return [(variant, size, size // 2, data) for variant, size in PREVIEW_SIZES.items()]
+
+        monkeypatch.setattr(generator, "_render", render)
+        assert await generator.sync() == 2
+
+        bomb, good = (await test_db.execute(select(AttachmentBlob).order_by(AttachmentBlob.id))).scalars().all()
+        assert good.preview_status == PreviewStatus.READY
+        assert bomb.preview_status == PreviewStatus.PROCESSING
+        assert generator._crashes == {bomb.id: 1}
+        assert sorted(calls) == [b"bomb", b"bomb", b"good", b"good"]
+
+    @pytest.mark.asyncio
+    async def test_store_error_is_not_marked_failed(self, client, auth_headers, test_db, store, make_generator, monkeypatch):
+        """测试写入预览时对象存储出错不标记失败，领取超时后重新生成"""
+        generator = make_generator(FakeRenderer())
+        await _upload(client, auth_headers, "a.png", "image/png", b"png!")
+
+        async def unavailable(*args, **kwargs):
+            raise ConnectionError("object store unavailable")
+
+        with monkeypatch.context() as patch:
+            patch.setattr(store, "put", unavailable)
+            assert await generator.sync() == 1
+        blob = (await test_db.execute(select(AttachmentBlob))).scalar_one()
+        assert blob.preview_status == PreviewStatus.PROCESSING
+
+        await test_db.execute(update(AttachmentBlob).values(
+            preview_claimed_at=datetime.now(timezone.utc) - timedelta(hours=1)
+        ))
+        await test_db.commit()
+        assert await generator.sync() == 1
+        await test_db.refresh(blob)
+        assert blob.preview_status == PreviewStatus.READY
+
+    @pytest.mark.asyncio
+    async def test_expired_claim_is_reclaimed(self, client, auth_headers, test_db, store, make_generator):
+        """测试生成超时（进程退出）的任务被重新领取，替换上次留下的预览"""
+        renderer = FakeRenderer()
+        generator = make_generator(renderer)
+        attachment = await _upload(client, auth_headers, "doc.pdf", "application/pdf", b"%PDF-1.7")
+        assert await generator.sync() == 1
+
+        await test_db.execute(update(AttachmentBlob).values(
+            preview_status=PreviewStatus.PROCESSING,
+            preview_claimed_at=datetime.now(timezone.utc) - timedelta(hours=1)
+        ))
+        await test_db.commit()
+
+        assert await generator.sync() == 1
+        response = await client.get(app.url_path_for("get_attachment", attachment_id=str(attachment["id"])), headers=auth_headers)
+        assert len(response.json()["previews"]) == len(PREVIEW_SIZES)
+
+    @pytest.mark.asyncio
+    async def test_garbage_collection_removes_previews(self, client, auth_headers, test_db, store, make_generator):
+        """测试内容被垃圾回收时预览一起删除"""
+        generator = make_generator(FakeRenderer())
+        await _upload(client, auth_headers, "a.png", "image/png", b"png!")
+        await generator.sync()
+
+        assert await AttachmentService(test_db).collect_garbage(grace_seconds=0) == 1
+        assert not [path for path in store.root.rglob("*") if path.is_file()]
+
+    def test_render_previews(self, tmp_path):
+        """测试用 Pillow 生成各档位的 WebP 预览，不放大小图"""
+        image_module = pytest.importorskip("PIL.Image")
+        path = tmp_path / "photo.png"
+        image_module.new("RGB", (1000, 500), "red").save(path)
+
+        renditions = render_previews(str(path), PREVIEW_SIZES, 80)
+
+        assert [(variant, width, height) for variant, width, height, _ in renditions] == [
+            ("small", 160, 80), ("medium", 480, 240), ("large", 1000, 500)
+        ]
+        assert image_module.open(io.BytesIO(renditions[0][3])).format == "WEBP"
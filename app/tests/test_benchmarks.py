@@ -0,0 +1,133 @@
+"""
+基准测试工具测试
+
+只验证合成数据的形状、计时统计和退化判断，不断言具体耗时。
+"""
+import pytest
+from sqlalchemy import func, select
+
+from app.database.database import create_routing_sessionmaker, get_db
+from app.main import app
+from app.models.channel import Channel, ChannelType
+from app.models.message import Message
+from app.models.notification import Notification
+from app.services.websocket_manager import connection_manager
+from benchmarks.harness import build_report, compare, run_suite, summarize
+from benchmarks.services import build_cases
+from benchmarks.websocket import run_scaling
+from benchmarks.workspace import PRESETS, generate_workspace, load_workspace
+
+
+@pytest.fixture
+async def workspace(test_db):
+    return await generate_workspace(test_db.bind, PRESETS["tiny"], create_schema=False)
+
+
+class TestWorkspaceGenerator:
+    """合成工作区测试"""
+
+    @pytest.mark.asyncio
+    async def test_generated_workspace(self, test_db, workspace):
+        """测试生成的数据量、频道规模的长尾分布和线程回复"""
+        spec = workspace.spec
+        assert await test_db.scalar(select(func.count()).select_from(Message)) == spec.messages
+        assert await test_db.scalar(select(func.count()).select_from(Channel)) == spec.teams * spec.channels_per_team
+        assert await test_db.scalar(select(func.count()).select_from(Notification)) == spec.users * spec.notifications_per_user
+
+        sizes = sorted(workspace.channel_sizes, reverse=True)
+        assert sizes[0] > 3 * sizes[len(sizes) // 2]
+
+        parent = Message.__table__.alias("parent")
+        replies = await test_db.scalar(select(func.count()).select_from(Message).where(Message.parent_id.is_not(None)))
+        assert 0 < replies < spec.messages * 0.3
+        mismatched = await test_db.scalar(
+            select(func.count()).select_from(Message)
+            .join(parent, parent.c.id == Message.parent_id)
+            .where((parent.c.channel_id != Message.channel_id) | (parent.c.id >= Message.id))
+        )
+        assert mismatched == 0
+
+    @pytest.mark.asyncio
+    async def test_load_workspace(self, test_db, workspace):
+        """测试从已生成的库读回工作区"""
+        loaded = await load_workspace(test_db.bind, workspace.spec)
+
+        assert loaded.channel_ids == workspace.channel_ids
+        assert loaded.channel_sizes == workspace.channel_sizes
+        assert loaded.team_members == workspace.team_members
+        assert {channel_id: sorted(members) for channel_id, members in loaded.channel_members.items()} == \
+            workspace.channel_members
+        assert loaded.words[0] == workspace.words[0]
+
+        private = await test_db.scalar(
+            select(func.count()).select_from(Channel).where(Channel.type == ChannelType.PRIVATE)
+        )
+        assert private == len(workspace.channel_members)
+
+    @pytest.mark.asyncio
+    async def test_generate_requires_empty_database(self, test_db, workspace):
+        """测试不会往已有数据的库里重复生成"""
+        with pytest.raises(ValueError):
+            await generate_workspace(test_db.bind, PRESETS["tiny"], create_schema=False)
+
+
+class TestBenchmarkHarness:
+    """计时与比较测试"""
+
+    @pytest.mark.asyncio
+    async def test_run_all_cases(self, test_db, workspace):
+        """测试所有用例都能在合成数据上运行"""
+        cases = build_cases(workspace)
+        results = await run_suite(create_routing_sessionmaker(test_db.bind), cases, iterations=2, warmup=1)
+
+        assert list(results) == [case.name for case in cases]
+        assert all(result["iterations"] == 2 and result["p95_ms"] > 0 for result in results.values())
+        assert await test_db.scalar(select(func.count()).select_from(Message)) == workspace.spec.messages + 3
+
+    def test_summarize(self):
+        """测试百分位数和吞吐的计算"""
+        result = summarize([0.001 * n for n in range(1, 101)])
+
+        assert result["p50_ms"] == 51.0 and result["p95_ms"] == 95.0 and result["p99_ms"] == 99.0
+        assert result["ops_per_sec"] == round(100 / 5.05, 1)
+
+    def test_compare_flags_regressions(self):
+        """测试超过阈值的变慢被判为退化，微小的绝对差和新增用例不算"""
+        baseline = build_report({
+            "slow": {"p95_ms": 10.0}, "fast": {"p95_ms": 0.2}, "stable": {"p95_ms": 10.0}
+        })
+        current = build_report({
+            "slow": {"p95_ms": 12.5}, "fast": {"p95_ms": 0.4}, "stable": {"p95_ms": 11.0}, "new": {"p95_ms": 99.0}
+        })
+
+        regressions = compare(current, baseline, threshold=0.2)
+
+        assert [(regression.name, regression.ratio) for regression in regressions] == [("slow", 1.25)]
+        assert compare(current, baseline, threshold=0.3) == []
+
+
+class TestWebSocketLoad:
+    """WebSocket 扇出负载测试"""
+
+    @pytest.mark.asyncio
+    async def test_run_scaling(self, test_db, workspace):
+        """测试逐级增加连接数回放事件，统计投递延迟和扇出"""
+        session_factory = create_routing_sessionmaker(test_db.bind)
+
+        async def override_get_db():
+            async with session_factory() as session:
+                yield session
+
+        app.dependency_overrides[get_db] = override_get_db
+        try:
+            results = await run_scaling(app, workspace, [5, 10], duration=0.3, rate=100)
+        finally:
+            app.dependency_overrides.pop(get_db, None)
+
+        assert list(results) == ["connections=5", "connections=10"]
+        result = results["connections=10"]
+        assert result["events"] > 0 and result["frames"] > 0
+        assert 0 < result["recipients_per_event"] <= 10
+        assert result["p95_ms"] > 0 and result["memory_per_connection_kb"] > 0
+        assert set(result["by_event"]) <= {"typing", "send_message", "join_channel", "leave_channel"}
+        assert not connection_manager.active_connections
@@ -0,0 +1,163 @@
+"""
+频道活动分析测试
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.main import app
+from app.models.message import Message
+from app.services.channel_analytics import (
+    AnalysisCache, ChannelAnalyticsService, MessageColumns, compute_activity
+)
+from app.services.vector_index import to_epoch
+
+
+# 2025-03-03 是星期一
+MONDAY = datetime(2025, 3, 3, 9, 0)
+
+
+def _columns(rows):
+    """rows: [(id, 距 MONDAY 的秒数, 作者, 长度, 回复对象)]"""
+    ids, offsets, authors, lengths, parents = zip(*rows)
+    return MessageColumns(
+        ids=np.array(ids),
+        timestamps=to_epoch(MONDAY) + np.array(offsets, dtype=np.float64),
+        author_ids=np.array(authors),
+        lengths=np.array(lengths),
+        parent_ids=np.array(parents),
+    )
+
+
+async def _add_messages(test_db, channel, rows):
+    """rows: [(作者, 内容, 距 MONDAY 的分钟数, 回复对象)]"""
+    messages = []
+    for author, content, minutes, parent in rows:
+        created_at = MONDAY + timedelta(minutes=minutes)
+        message = Message(
+            content=content, author_id=author.id, channel_id=channel.id,
+            parent_id=parent.id if parent else None, created_at=created_at, updated_at=created_at
+        )
+        test_db.add(message)
+        messages.append(message)
+    await test_db.commit()
+    return messages
+
+
+class TestComputeActivity:
+    """向量化统计测试"""
+
+    def test_heatmap_concentration_and_response_times(self):
+        """测试热力图、发言集中度、线程回复时间和换人发言间隔"""
+        columns = _columns([
+            (1, 0, 10, 5, -1),
+            (2, 30, 10, 7, -1),
+            (3, 120, 20, 3, 1),
+            (4, 86400 + 600, 10, 5, 99),
+        ])
+
+        active_users, stats = compute_activity(columns, window_seconds=7 * 86400)
+
+        assert active_users == 2
+        assert stats.heatmap[0][9] == 3 and stats.heatmap[1][9] == 1 and sum(map(sum, stats.heatmap)) == 4
+        assert stats.peak_hours[:2] == ["周一 09:00", "周二 09:00"]
+        assert stats.top_author_share == 0.75
+        assert stats.author_gini == pytest.approx(0.25)
+        assert stats.average_length == 5.0
+        assert stats.messages_per_day == pytest.approx(4 / 7, abs=0.01)
+        # 只有 3 回复了窗口内的 1；4 的原消息不在窗口内
+        assert stats.reply_time.count == 1 and stats.reply_time.p50_seconds == 120
+        assert stats.turn_time.count == 2
+        assert stats.turn_time.buckets == {"<1m": 0, "1-5m": 1, "5-60m": 0, "1-24h": 0, ">24h": 1}
+
+    def test_empty_window(self):
+        """测试窗口内没有消息"""
+        empty = np.zeros(0, dtype=np.int64)
+        columns = MessageColumns(empty, empty.astype(np.float64), empty, empty, empty)
+
+        active_users, stats = compute_activity(columns, window_seconds=86400)
+
+        assert active_users == 0
+        assert stats.peak_hours == [] and stats.reply_time.count == 0 and stats.top_author_share == 0.0
+
+
+class TestChannelAnalyticsService:
+    """频道分析服务测试"""
+
+    @pytest.mark.asyncio
+    async def test_load_columns(self, test_db, test_user, test_user_2, channel):
+        """测试按列读取窗口内未删除的消息，时间戳在数据库端转为 epoch 秒"""
+        [root] = await _add_messages(test_db, channel, [(test_user, "部署", 0, None)])
+        reply, deleted, _ = await _add_messages(test_db, channel, [
+            (test_user_2, "收到", 5, root),
+            (test_user, "已删除", 6, None),
+            (test_user, "窗口外", 60 * 24, None),
+        ])
+        deleted.is_deleted = True
+        await test_db.commit()
+
+        columns = await ChannelAnalyticsService(test_db).load_columns(
+            channel.id, MONDAY, MONDAY + timedelta(hours=1)
+        )
+
+        assert columns.ids.tolist() == [root.id, reply.id]
+        assert columns.timestamps.tolist() == pytest.approx([to_epoch(MONDAY), to_epoch(MONDAY) + 300])
+        assert columns.author_ids.tolist() == [test_user.id, test_user_2.id]
+        assert columns.lengths.tolist() == [2, 2]
+        assert columns.parent_ids.tolist() == [-1, root.id]
+
+    @pytest.mark.asyncio
+    async def test_analyze_is_cached_per_window(self, test_db, test_user, channel):
+        """测试同一窗口的结果被缓存，不同窗口单独计算"""
+        await _add_messages(test_db, channel, [(test_user, f"消息{i}", i, None) for i in range(3)])
+        service = ChannelAnalyticsService(test_db, cache=AnalysisCache())
+        end = MONDAY + timedelta(days=1)
+
+        first = await service.analyze(channel.id, "activity", MONDAY, end)
+        await _add_messages(test_db, channel, [(test_user, "新消息", 10, None)])
+        cached = await service.analyze(channel.id, "productivity", MONDAY, end)
+        other = await service.analyze(channel.id, "activity", MONDAY, end + timedelta(days=1))
+
+        assert first.message_count == cached.message_count == 3
+        assert cached.analysis_type == "productivity"
+        assert other.message_count == 4
+        assert first.activity_level == "low" and first.recommendations
+
+
+class TestChannelAnalysisEndpoint:
+    """频道分析接口测试"""
+
+    @pytest.mark.asyncio
+    async def test_analyze_channel(self, client, auth_headers, test_db, test_user, channel):
+        """测试接口返回真实统计"""
+        await _add_messages(test_db, channel, [(test_user, "你好", 0, None)])
+
+        response = await client.post(
+            app.url_path_for("analyze_channel"),
+            json={
+                "channel_id": channel.id,
+                "analysis_type": "activity",
+                "time_range": {"start": MONDAY.isoformat(), "end": (MONDAY + timedelta(days=1)).isoformat()},
+            },
+            headers=auth_headers
+        )
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["message_count"] == 1 and data["active_users"] == 1
+        assert data["activity"]["heatmap"][0][9] == 1
+
+    @pytest.mark.asyncio
+    async def test_forbidden_channel(self, client, test_user_2, channel):
+        """测试无权访问频道时返回403"""
+        from app.auth.auth import create_access_token
+
+        token = create_access_token(data={"sub": test_user_2.username})
+        response = await client.post(
+            app.url_path_for("analyze_channel"),
+            json={"channel_id": channel.id, "analysis_type": "activity"},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+
+        assert response.status_code == 403
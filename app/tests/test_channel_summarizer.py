@@ -0,0 +1,172 @@
+"""
+频道摘要与摘要缓存测试
+
+使用本地的 OpenAI 兼容桩服务（见 conftest.py）代替真实模型。
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+from app.models.ai_task import ChannelSummary
+from app.models.message import Message
+from app.schemas.message import MessageUpdate
+from app.services import channel_summarizer
+from app.services.channel_summarizer import ChannelSummarizer, estimate_tokens
+from app.services.message_service import MessageService
+from app.services.summary_service import SummaryService
+
+
+WINDOW_START = datetime(2025, 3, 2, 9, 0)
+
+
+def _map_requests(llm_server):
+    return [r for r in llm_server.requests if "合并" not in r["messages"][0]["content"]]
+
+
+async def _seed_messages(test_db, channel, authors, count: int):
+    for i in range(count):
+        test_db.add(Message(
+            content=f"消息{i:02d} " + "内容" * 20,
+            author_id=authors[i % len(authors)].id,
+            channel_id=channel.id,
+            created_at=WINDOW_START + timedelta(minutes=i),
+        ))
+    # 窗口之外的消息不参与摘要
+    test_db.add(Message(
+        content="窗口外",
+        author_id=authors[0].id,
+        channel_id=channel.id,
+        created_at=WINDOW_START - timedelta(days=1),
+    ))
+    await test_db.commit()
+
+
+class TestChannelSummarizer:
+    """频道摘要测试"""
+
+    @pytest.mark.asyncio
+    async def test_map_reduce_over_window(self, test_db, test_user, test_user_2, channel, llm, llm_server, monkeypatch):
+        """测试分页读取消息后分段并发摘要，并按时间顺序合并"""
+        monkeypatch.setattr(channel_summarizer, "PAGE_SIZE", 7)
+        await _seed_messages(test_db, channel, [test_user, test_user, test_user_2], 30)
+
+        summarizer = ChannelSummarizer(test_db, llm=llm, segment_tokens=200, max_concurrency=2)
+        result = await summarizer.summarize(channel.id, WINDOW_START, WINDOW_START + timedelta(hours=1))
+
+        assert result.message_count == 30
+        assert result.participants == ["Test User", "Test User 2"]
+        assert result.summary == "合并摘要"
+
+        map_requests = _map_requests(llm_server)
+        assert len(map_requests) > 2
+        assert llm_server.max_in_flight <= 2
+        # 每段的第一条消息都出现在最终要点中，且保持时间顺序
+        assert len(result.key_points) == len(map_requests)
+        assert result.key_points[0].startswith("消息00")
+        assert result.key_points == sorted(result.key_points)
+        # 跨页的消息不重复也不遗漏
+        segments = "\n".join(request["messages"][1]["content"] for request in map_requests)
+        assert all(segments.count(f"消息{i:02d} ") == 1 for i in range(30))
+
+    @pytest.mark.asyncio
+    async def test_empty_window_skips_llm(self, test_db, test_user, channel, llm, llm_server):
+        """测试窗口内没有消息时不调用模型"""
+        await _seed_messages(test_db, channel, [test_user], 3)
+
+        summarizer = ChannelSummarizer(test_db, llm=llm)
+        result = await summarizer.summarize(channel.id, WINDOW_START + timedelta(days=1), WINDOW_START + timedelta(days=2))
+
+        assert result.message_count == 0
+        assert llm_server.requests == []
+
+    def test_estimate_tokens(self):
+        """测试token估算"""
+        assert estimate_tokens("你好世界") == 5
+        assert estimate_tokens("a" * 40) == 11
+
+
+class TestSummaryCache:
+    """摘要缓存测试"""
+
+    @pytest.mark.asyncio
+    async def test_identical_request_hits_cache(self, test_db, test_user, channel, llm, llm_server):
+        """测试相同窗口直接返回缓存"""
+        await _seed_messages(test_db, channel, [test_user], 10)
+        service = SummaryService(test_db, ChannelSummarizer(test_db, llm=llm))
+        end = WINDOW_START + timedelta(hours=1)
+
+        first = await service.get_summary(channel.id, WINDOW_START, end, "meeting", test_user.id)
+        calls = len(llm_server.requests)
+        second = await service.get_summary(channel.id, WINDOW_START, end, "meeting", test_user.id)
+
+        assert second == first
+        assert len(llm_server.requests) == calls
+
+    @pytest.mark.asyncio
+    async def test_longer_window_summarizes_only_tail(self, test_db, test_user, channel, llm, llm_server):
+        """测试起点相同的更长窗口只摘要新增的尾部消息"""
+        await _seed_messages(test_db, channel, [test_user], 10)
+        service = SummaryService(test_db, ChannelSummarizer(test_db, llm=llm, segment_tokens=10000))
+
+        await service.get_summary(channel.id, WINDOW_START, WINDOW_START + timedelta(minutes=4), "meeting", test_user.id)
+        llm_server.requests.clear()
+        result = await service.get_summary(channel.id, WINDOW_START, WINDOW_START + timedelta(hours=1), "meeting", test_user.id)
+
+        map_requests = _map_requests(llm_server)
+        assert len(map_requests) == 1
+        tail = map_requests[0]["messages"][1]["content"]
+        assert "消息05" in tail and "消息04" not in tail
+        assert result.message_count == 10
+        assert result.key_points[0].startswith("消息00")
+        # 较短的窗口被合并后的结果替换
+        assert await test_db.scalar(select(func.count(ChannelSummary.id))) == 1
+
+    @pytest.mark.asyncio
+    async def test_rolling_window_reuses_cache(self, test_db, test_user, channel, llm, llm_server):
+        """测试起点落在同一取整区间内的滚动窗口复用缓存"""
+        await _seed_messages(test_db, channel, [test_user], 10)
+        service = SummaryService(test_db, ChannelSummarizer(test_db, llm=llm, segment_tokens=10000))
+
+        first = await service.get_summary(
+            channel.id, WINDOW_START + timedelta(minutes=2), WINDOW_START + timedelta(hours=1), "meeting", test_user.id
+        )
+        calls = len(llm_server.requests)
+        second = await service.get_summary(
+            channel.id, WINDOW_START + timedelta(minutes=5), WINDOW_START + timedelta(hours=1), "meeting", test_user.id
+        )
+
+        assert second == first
+        assert len(llm_server.requests) == calls
+        assert first.message_count == 10
+
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_single_flight(self, test_db, test_user, channel, llm, llm_server):
+        """测试相同的并发请求只计算一次"""
+        await _seed_messages(test_db, channel, [test_user], 10)
+        service = SummaryService(test_db, ChannelSummarizer(test_db, llm=llm, segment_tokens=10000))
+        end = WINDOW_START + timedelta(hours=1)
+
+        results = await asyncio.gather(*(
+            service.get_summary(channel.id, WINDOW_START, end, "meeting", test_user.id) for _ in range(3)
+        ))
+
+        assert results[0] == results[1] == results[2]
+        assert len(llm_server.requests) == 1
+
+    @pytest.mark.asyncio
+    async def test_edit_invalidates_cache(self, test_db, test_user, channel, llm, llm_server):
+        """测试编辑窗口内的消息后缓存失效"""
+        await _seed_messages(test_db, channel, [test_user], 3)
+        service = SummaryService(test_db, ChannelSummarizer(test_db, llm=llm))
+        await service.get_summary(channel.id, WINDOW_START, WINDOW_START + timedelta(hours=1), "meeting", test_user.id)
+
+        message = (await test_db.execute(
+            select(Message).where(Message.channel_id == channel.id).order_by(Message.created_at.desc())
+        )).scalars().first()
+        await MessageService(test_db).update_message(message.id, MessageUpdate(content="已修改"), test_user.id)
+
+        count = await test_db.scalar(select(func.count(ChannelSummary.id)))
+        assert count == 0
+
@@ -3,6 +3,7 @@
 """
 import os
 import tempfile
+from configparser import ConfigParser
 from pathlib import Path
 from unittest.mock import patch, mock_open
 import pytest
@@ -114,6 +115,28 @@ class TestConfigValue:
                     
                     assert result == expected, f"Value '{value}' should be {expected}"
     
+    def test_config_value_shared_parser(self, monkeypatch):
+        """测试复用已解析的配置文件，不再重复读取"""
+        monkeypatch.delenv("TEST_SHARED_KEY", raising=False)
+        parser = ConfigParser()
+        parser.read_string("[test]\nshared_key = shared_value\n")
+        
+        with patch('app.utils.config.Path') as mock_path:
+            mock_path.return_value.exists.return_value = False
+            config_val = ConfigValue("test", parser=parser)
+            
+            assert config_val.get_value("shared_key", str) == "shared_value"
+    
+    def test_config_value_fallback(self, monkeypatch):
+        """测试配置项缺失时使用默认值"""
+        monkeypatch.delenv("TEST_MISSING_KEY", raising=False)
+        parser = ConfigParser()
+        parser.read_string("[test]\n")
+        
+        config_val = ConfigValue("test", parser=parser)
+        
+        assert config_val.get_value("missing_key", int, fallback=8) == 8
+    
     def test_config_value_missing_file(self):
         """测试配置文件不存在"""
         with patch('app.utils.config.Path') as mock_path:
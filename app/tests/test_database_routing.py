@@ -0,0 +1,140 @@
+"""
+读写分离路由测试
+
+使用两个本地SQLite数据库分别模拟主库和只读副本。
+"""
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.database import database
+from app.database.database import (
+    Base,
+    bind_session_user,
+    create_routing_sessionmaker,
+    mark_user_write,
+)
+from app.models.team import Team
+from app.models.user import User
+from app.services.team_service import TeamService
+
+
+@pytest.fixture
+async def engines(tmp_path):
+    """创建主库和副本两个数据库"""
+    primary = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'primary.db'}")
+    replica = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}")
+    for engine in (primary, replica):
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    yield primary, replica
+
+    database._recent_writers.clear()
+    await primary.dispose()
+    await replica.dispose()
+
+
+async def _seed_public_team(session_factory, slug: str) -> None:
+    async with session_factory() as session:
+        owner = User(
+            username=f"owner-{slug}",
+            email=f"{slug}@example.com",
+            full_name="Owner",
+            hashed_password="hashed",
+        )
+        session.add(owner)
+        await session.flush()
+        session.add(Team(name=slug, slug=slug, is_public=True, owner_id=owner.id))
+        await session.commit()
+
+
+class TestReadReplicaRouting:
+    """读写分离路由测试"""
+
+    @pytest.mark.asyncio
+    async def test_read_only_methods_use_replica(self, engines):
+        """测试只读方法路由到副本，其余查询走主库"""
+        primary, replica = engines
+        await _seed_public_team(create_routing_sessionmaker(primary), "on-primary")
+        await _seed_public_team(create_routing_sessionmaker(replica), "on-replica")
+
+        session_factory = create_routing_sessionmaker(primary, replica)
+        async with session_factory() as session:
+            team_service = TeamService(session)
+
+            teams = await team_service.get_public_teams()
+            assert [team.slug for team in teams] == ["on-replica"]
+
+            # 未标记只读的方法仍然读主库
+            assert await team_service.get_team_by_slug("on-primary") is not None
+            assert await team_service.get_team_by_slug("on-replica") is None
+
+    @pytest.mark.asyncio
+    async def test_recent_writer_reads_from_primary(self, engines):
+        """测试写入后的复制延迟保护窗口"""
+        primary, replica = engines
+        session_factory = create_routing_sessionmaker(primary, replica)
+
+        async with session_factory() as session:
+            bind_session_user(session, 42)
+            owner = User(
+                username="writer",
+                email="writer@example.com",
+                full_name="Writer",
+                hashed_password="hashed",
+            )
+            session.add(owner)
+            await session.flush()
+            session.add(Team(name="fresh", slug="fresh", is_public=True, owner_id=owner.id))
+            await session.commit()
+
+        assert database.is_recent_writer(42)
+
+        async with session_factory() as session:
+            bind_session_user(session, 42)
+            teams = await TeamService(session).get_public_teams()
+            assert [team.slug for team in teams] == ["fresh"]
+
+        # 其他用户仍然从副本读取（副本尚未复制到数据）
+        async with session_factory() as session:
+            bind_session_user(session, 7)
+            assert await TeamService(session).get_public_teams() == []
+
+    @pytest.mark.asyncio
+    async def test_lag_window_expires(self, engines, monkeypatch):
+        """测试保护窗口过期后恢复读副本"""
+        primary, replica = engines
+        await _seed_public_team(create_routing_sessionmaker(primary), "on-primary")
+        session_factory = create_routing_sessionmaker(primary, replica)
+
+        monkeypatch.setattr(database.time, "monotonic", lambda: 1000.0)
+        mark_user_write(42)
+        monkeypatch.setattr(database.time, "monotonic", lambda: 1000.0 + 3600)
+
+        async with session_factory() as session:
+            bind_session_user(session, 42)
+            assert await TeamService(session).get_public_teams() == []
+        assert not database.is_recent_writer(42)
+
+    def test_expired_writers_are_pruned(self, monkeypatch):
+        """测试记录新的写操作时清理保护窗口已过期的用户"""
+        monkeypatch.setattr(database, "_recent_writers", {})
+        monkeypatch.setattr(database, "_last_pruned", 0.0)
+        monkeypatch.setattr(database.time, "monotonic", lambda: 1000.0)
+        for user_id in range(100):
+            mark_user_write(user_id)
+
+        monkeypatch.setattr(database.time, "monotonic", lambda: 1000.0 + 3600)
+        mark_user_write(42)
+
+        assert database._recent_writers == {42: 1000.0 + 3600}
+
+    @pytest.mark.asyncio
+    async def test_without_replica_everything_uses_primary(self, engines):
+        """测试未配置副本时只读方法也走主库"""
+        primary, _ = engines
+        await _seed_public_team(create_routing_sessionmaker(primary), "on-primary")
+
+        async with create_routing_sessionmaker(primary)() as session:
+            teams = await TeamService(session).get_public_teams()
+            assert [team.slug for team in teams] == ["on-primary"]
@@ -0,0 +1,238 @@
+"""
+大模型客户端测试
+
+限流、自适应并发、请求合并和重试使用本地的 OpenAI 兼容桩服务（见 conftest.py）验证。
+"""
+import asyncio
+import time
+
+import pytest
+from openai import BadRequestError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.models.channel import Channel, ChannelType
+from app.models.message import Message
+from app.models.team import Team
+from app.models.team_member import TeamMember
+from app.schemas.ai import MessageSuggestionRequest
+from app.services.llm_client import AdaptiveConcurrencyLimiter, LLMClient, TokenBucket
+from app.services.message_suggester import MessageSuggester
+from app.utils.config import config
+
+
+def _messages(text: str):
+    return [{"role": "system", "content": "测试"}, {"role": "user", "content": f"频道消息\n{text}: 内容"}]
+
+
+@pytest.fixture
+def make_llm(llm_server):
+    def make(**kwargs):
+        kwargs.setdefault("max_concurrency", 8)
+        return LLMClient(endpoint=llm_server.url, model="stub", api_key="test", **kwargs)
+
+    return make
+
+
+class TestTokenBucket:
+    """令牌桶测试"""
+
+    @pytest.mark.asyncio
+    async def test_waits_for_refill(self):
+        """测试桶内令牌用完后按速率等待"""
+        bucket = TokenBucket(rate=20, capacity=2)
+        started = time.monotonic()
+        for _ in range(4):
+            await bucket.acquire()
+
+        assert time.monotonic() - started >= 0.09
+
+    @pytest.mark.asyncio
+    async def test_adjust_charges_actual_usage(self):
+        """测试按实际用量补扣后，下一个请求要等余额恢复"""
+        bucket = TokenBucket(rate=100, capacity=100)
+        await bucket.acquire(50)
+        bucket.adjust(60)
+
+        started = time.monotonic()
+        await bucket.acquire(10)
+        assert time.monotonic() - started >= 0.08
+
+
+class TestAdaptiveConcurrencyLimiter:
+    """AIMD 并发上限测试"""
+
+    @pytest.mark.asyncio
+    async def test_backs_off_once_per_window(self):
+        """测试同一批请求一起过载只减半一次，之后成功时逐步回升"""
+        limiter = AdaptiveConcurrencyLimiter(max_limit=8)
+        starts = [await limiter.acquire() for _ in range(4)]
+
+        for started in starts:
+            limiter.release(started, "overload")
+        assert limiter.limit == 4
+
+        limiter.release(await limiter.acquire(), "overload")
+        assert limiter.limit == 2
+
+        for _ in range(3):
+            limiter.release(await limiter.acquire(), "ok")
+        assert 3 < limiter.limit < 4
+
+    @pytest.mark.asyncio
+    async def test_waiters_get_slots_in_order(self):
+        """测试超过上限的请求排队，名额释放后按顺序放行"""
+        limiter = AdaptiveConcurrencyLimiter(max_limit=1)
+        started = await limiter.acquire()
+        order = []
+
+        async def worker(name):
+            slot = await limiter.acquire()
+            order.append(name)
+            limiter.release(slot, "error")
+
+        tasks = [asyncio.create_task(worker(name)) for name in "abc"]
+        await asyncio.sleep(0.01)
+        assert order == []
+
+        limiter.release(started, "error")
+        await asyncio.gather(*tasks)
+        assert order == ["a", "b", "c"]
+        assert limiter.in_flight == 0
+
+
+class TestLLMClient:
+    """大模型客户端测试"""
+
+    @pytest.mark.asyncio
+    async def test_identical_requests_are_coalesced(self, make_llm, llm_server):
+        """测试并发的相同请求只向上游发送一次"""
+        llm = make_llm()
+
+        results = await asyncio.gather(*(llm.chat(_messages("甲"), feature="test") for _ in range(5)))
+
+        assert len(set(results)) == 1
+        assert len(llm_server.requests) == 1
+        stats = llm.metrics.snapshot()["test"]
+        assert stats["requests"] == 5 and stats["upstream_requests"] == 1 and stats["coalesced"] == 4
+        assert stats["latency_p50_ms"] > 0 and stats["completion_tokens"] > 0
+
+    @pytest.mark.asyncio
+    async def test_concurrency_limit(self, make_llm, llm_server):
+        """测试同时发往上游的请求数不超过并发上限"""
+        llm = make_llm(max_concurrency=2)
+
+        await asyncio.gather(*(llm.chat(_messages(f"用户{i}")) for i in range(6)))
+
+        assert len(llm_server.requests) == 6
+        assert llm_server.max_in_flight <= 2
+
+    @pytest.mark.asyncio
+    async def test_retries_on_rate_limit_and_backs_off(self, make_llm, llm_server):
+        """测试 429/503 按 Retry-After 重试，并降低并发上限"""
+        llm = make_llm()
+        llm_server.failures = [429, 503]
+
+        assert await llm.chat(_messages("甲"), feature="test")
+
+        assert len(llm_server.requests) == 3
+        assert llm.metrics.snapshot()["test"]["retries"] == 2
+        assert llm.limiter.limit < 8
+
+    @pytest.mark.asyncio
+    async def test_client_errors_are_not_retried(self, make_llm, llm_server):
+        """测试 4xx 错误直接抛出，不重试也不降低并发上限"""
+        llm = make_llm()
+        llm_server.failures = [400]
+
+        with pytest.raises(BadRequestError):
+            await llm.chat(_messages("甲"), feature="test")
+
+        assert len(llm_server.requests) == 1
+        assert llm.metrics.snapshot()["test"]["errors"] == 1
+        assert llm.limiter.limit == 8
+
+    @pytest.mark.asyncio
+    async def test_stream_retries_before_first_token(self, make_llm, llm_server):
+        """测试流式请求在产出文本之前失败时重试"""
+        llm = make_llm()
+        llm_server.failures = [502]
+
+        chunks = [chunk async for chunk in llm.chat_stream(_messages("甲"))]
+
+        assert "".join(chunks) == llm_server.reply(_messages("甲"))
+        assert len(llm_server.requests) == 2
+
+    @pytest.mark.asyncio
+    async def test_small_prompts_are_batched(self, make_llm, llm_server):
+        """测试共享上下文的小请求合并为一次上游调用，上下文只发送一次"""
+        llm = make_llm()
+        system = "给出3条候选回复"
+
+        results = await asyncio.gather(*(
+            llm.chat_batched(system, "聊天记录", f"我是 用户{i}。", feature="suggestions") for i in range(3)
+        ))
+
+        assert len(llm_server.requests) == 1
+        assert llm_server.requests[0]["messages"][1]["content"].count("聊天记录") == 1
+        assert all(result.startswith("1. 好的") for result in results)
+        assert llm.metrics.snapshot()["suggestions"]["batched"] == 3
+
+    @pytest.mark.asyncio
+    async def test_missing_answers_are_sent_individually(self, make_llm, llm_server):
+        """测试合并请求的回复中缺少某个编号时，该请求单独重新发送"""
+        llm = make_llm()
+        prompts = [f"用户{i}: 提问\n用户{i}: 补充" for i in range(2)]
+
+        results = await asyncio.gather(*(llm.chat_batched("测试", "", prompt) for prompt in prompts))
+
+        assert len(llm_server.requests) == 3
+        assert results == [
+            llm_server.reply([{"content": "测试"}, {"content": prompt}]) for prompt in prompts
+        ]
+
+    @pytest.mark.asyncio
+    async def test_quota_is_split_between_processes(self, make_llm, monkeypatch):
+        """测试配置的服务商配额按共享配额的进程数平分"""
+        monkeypatch.setitem(config.llm.__dict__, "requests_per_minute", 120)
+        monkeypatch.setitem(config.llm.__dict__, "tokens_per_minute", 90000)
+        monkeypatch.setitem(config.llm.__dict__, "quota_processes", 0)
+        monkeypatch.setitem(config.service.__dict__, "workers", 4)
+
+        llm = make_llm()
+        assert llm._request_bucket.capacity == 30 and llm._token_bucket.capacity == 22500
+
+        monkeypatch.setitem(config.llm.__dict__, "quota_processes", 5)
+        llm = make_llm()
+        assert llm._request_bucket.capacity == 24 and llm._token_bucket.capacity == 18000
+
+
+class TestSuggestionBatching:
+    """回复建议合并测试"""
+
+    @pytest.mark.asyncio
+    async def test_users_in_same_channel_share_one_call(self, test_db, test_user, test_user_2, make_llm, llm_server):
+        """测试同一频道多个用户同时请求建议时只调用一次模型"""
+        team = Team(name="团队", slug="batch", owner_id=test_user.id)
+        test_db.add(team)
+        await test_db.flush()
+        channel = Channel(name="general", type=ChannelType.PUBLIC, team_id=team.id, created_by=test_user.id)
+        test_db.add_all([
+            channel,
+            TeamMember(team_id=team.id, user_id=test_user.id),
+            TeamMember(team_id=team.id, user_id=test_user_2.id),
+        ])
+        await test_db.flush()
+        test_db.add(Message(content="今天发布吗", author_id=test_user.id, channel_id=channel.id))
+        await test_db.commit()
+
+        llm = make_llm()
+        request = MessageSuggestionRequest(channel_id=channel.id)
+        sessions = async_sessionmaker(test_db.bind, class_=AsyncSession, expire_on_commit=False)
+        async with sessions() as db_1, sessions() as db_2:
+            results = await asyncio.gather(
+                MessageSuggester(db_1, llm=llm).suggest(request, test_user.id),
+                MessageSuggester(db_2, llm=llm).suggest(request, test_user_2.id),
+            )
+
+        assert len(llm_server.requests) == 1
+        assert results[0].suggestions == results[1].suggestions == ["好的，我来跟进", "收到，今天处理", "没问题"]
@@ -0,0 +1,79 @@
+"""
+事件循环看门狗测试
+"""
+import asyncio
+import logging
+import time
+
+import pytest
+
+from app.auth.auth import authenticate_user
+from app.utils.loop_watchdog import LoopBlocked, LoopWatchdog, forbid_blocking
+from app.utils.metrics import LOOP_BLOCKED, LOOP_LAG
+
+
+def _block(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+class TestLoopWatchdog:
+    """事件循环延迟与阻塞检测测试"""
+
+    @pytest.mark.asyncio
+    async def test_blocking_call_reported_with_stack(self, caplog):
+        """测试阻塞事件循环的调用被记录，附带阻塞期间的调用栈"""
+        blocked_before = LOOP_BLOCKED.labels().value
+        watchdog = LoopWatchdog(threshold=0.05, interval=0.01)
+
+        with caplog.at_level(logging.WARNING, logger="app.utils.loop_watchdog"):
+            watchdog.start()
+            try:
+                await asyncio.sleep(0.05)
+                _block(0.25)
+                await asyncio.sleep(0.05)
+            finally:
+                watchdog.stop()
+
+        [call] = watchdog.blocked
+        assert call.duration >= 0.1
+        assert "in _block" in call.stack
+        assert LOOP_BLOCKED.labels().value == blocked_before + 1
+        assert any("事件循环被阻塞" in record.getMessage() for record in caplog.records)
+
+    @pytest.mark.asyncio
+    async def test_lag_measured_without_blocking(self):
+        """测试空闲时持续测量事件循环延迟，不误报阻塞"""
+        lag = LOOP_LAG.labels()
+        observed_before = sum(lag.counts)
+        watchdog = LoopWatchdog(threshold=0.05, interval=0.01)
+
+        watchdog.start()
+        try:
+            await asyncio.sleep(0.2)
+        finally:
+            watchdog.stop()
+
+        assert sum(lag.counts) - observed_before >= 5
+        assert not watchdog.blocked
+
+    @pytest.mark.asyncio
+    async def test_forbid_blocking(self):
+        """测试阻塞超过限制时失败，只 await 的代码通过"""
+        with forbid_blocking(50):
+            await asyncio.sleep(0.1)
+
+        with pytest.raises(LoopBlocked, match="limit 50ms"):
+            with forbid_blocking(50):
+                await asyncio.sleep(0.02)
+                _block(0.2)
+                await asyncio.sleep(0.02)
+
+    @pytest.mark.asyncio
+    async def test_authenticate_user_does_not_block(self, test_db, test_user):
+        """测试登录时 bcrypt 校验在线程中执行，不阻塞事件循环"""
+        with forbid_blocking(100):
+            user = await authenticate_user(test_db, "testuser", "password123")
+            rejected = await authenticate_user(test_db, "testuser", "wrong-password")
+
+        assert user is not None and user.id == test_user.id
+        assert rejected is None
@@ -0,0 +1,152 @@
+"""
+Prometheus 指标测试
+"""
+import json
+import os
+
+import pytest
+from fastapi import APIRouter, FastAPI
+from httpx import ASGITransport, AsyncClient
+
+from app.services.websocket_manager import connection_manager
+from app.utils.metrics import (
+    BROADCAST_RECIPIENTS, Counter, Gauge, Histogram, MetricsMiddleware, MetricsRegistry, _render, _route_children,
+    metrics_registry
+)
+
+
+class _FakeWebSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def send_text(self, text: str) -> None:
+        self.frames.append(text)
+
+
+def _text(registry: MetricsRegistry) -> str:
+    return _render([(True, registry.collect())])
+
+
+def _sample(text: str, prefix: str) -> float:
+    [line] = [line for line in text.splitlines() if line.startswith(prefix + " ")]
+    return float(line.rsplit(" ", 1)[1])
+
+
+class TestMetrics:
+    """指标记录和导出测试"""
+
+    def test_exposition_format(self):
+        """测试计数器和直方图的文本格式，直方图分桶为累计值"""
+        registry = MetricsRegistry()
+        requests = Counter("requests_total", "Requests", ["status"], registry=registry)
+        latency = Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0), registry=registry)
+        requests.labels("2xx").inc()
+        requests.labels("2xx").inc(2)
+        for value in (0.05, 0.5, 5.0):
+            latency.observe(value)
+
+        text = _text(registry)
+
+        assert "# TYPE requests_total counter" in text
+        assert _sample(text, 'requests_total{status="2xx"}') == 3
+        assert _sample(text, 'latency_seconds_bucket{le="0.1"}') == 1
+        assert _sample(text, 'latency_seconds_bucket{le="1.0"}') == 2
+        assert _sample(text, 'latency_seconds_bucket{le="+Inf"}') == 3
+        assert _sample(text, "latency_seconds_count") == 3
+        assert _sample(text, "latency_seconds_sum") == pytest.approx(5.55)
+
+    def test_reset_in_place(self):
+        """测试清零后已保存的子指标仍然有效"""
+        registry = MetricsRegistry()
+        gauge = Gauge("connections", "Connections", ["engine"], registry=registry)
+        child = gauge.labels("primary")
+        child.set(5)
+
+        registry.reset()
+        child.inc()
+
+        assert _sample(_text(registry), 'connections{engine="primary"}') == 1
+
+    @pytest.mark.asyncio
+    async def test_merge_worker_files(self, tmp_path):
+        """测试合并多个 worker 的指标文件：计数器累加所有 worker，仪表只计仍在运行的 worker"""
+        registry = MetricsRegistry()
+        requests = Counter("requests_total", "Requests", registry=registry)
+        connections = Gauge("connections", "Connections", registry=registry)
+        registry.use_directory(str(tmp_path))
+        requests.inc(2)
+        connections.set(3)
+
+        # 已退出的 worker 留下的文件
+        dead_pid = 2 ** 22 + 1
+        (tmp_path / f"{dead_pid}.json").write_text(json.dumps({"pid": dead_pid, "metrics": {
+            "requests_total": {"type": "counter", "help": "Requests", "samples": [["", [], 5.0]]},
+            "connections": {"type": "gauge", "help": "Connections", "samples": [["", [], 7.0]]},
+        }}))
+
+        text = await registry.render()
+
+        assert _sample(text, "requests_total") == 7
+        assert _sample(text, "connections") == 3
+        assert (tmp_path / f"{os.getpid()}.json").exists()
+
+    @pytest.mark.asyncio
+    async def test_metrics_endpoint(self, client, auth_headers):
+        """测试 /metrics 按路由模板统计请求，不把路径参数当作标签"""
+        await client.get("/api/v1/channels/123456", headers=auth_headers)
+
+        response = await client.get("/metrics")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert 'http_request_duration_seconds_count{method="GET",route="/api/v1/channels/{channel_id}"}' in response.text
+        assert "/api/v1/channels/123456" not in response.text
+        assert 'db_pool_checked_out_connections{engine="primary"}' in response.text
+
+    @pytest.mark.asyncio
+    async def test_nested_router_templates(self):
+        """测试多级包含的路由器、path 类型参数和空路径的路由都按完整模板统计"""
+        inner = APIRouter()
+
+        @inner.get("")
+        async def list_items():
+            return []
+
+        @inner.get("/{item_id}")
+        async def get_item(item_id: int):
+            return item_id
+
+        @inner.get("/files/{key:path}")
+        async def get_file(key: str):
+            return key
+
+        outer = APIRouter()
+        outer.include_router(inner, prefix="/items")
+        app = FastAPI()
+        app.include_router(outer, prefix="/nested")
+        app.add_middleware(MetricsMiddleware)
+
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            for path in ("/nested/items", "/nested/items/7", "/nested/items/files/a/b.txt", "/missing"):
+                await client.get(path)
+
+        for template in ("/nested/items", "/nested/items/{item_id}", "/nested/items/files/{key}", "unmatched"):
+            assert ("GET", template) in _route_children
+        assert not [route for _, route in _route_children if route.startswith("/nested/items/7")]
+
+    @pytest.mark.asyncio
+    async def test_broadcast_metrics(self):
+        """测试广播记录接收者数量，在线连接数由采集函数导出"""
+        websocket = _FakeWebSocket()
+        recipients = BROADCAST_RECIPIENTS.labels()
+        before = recipients.counts[:]
+        await connection_manager.connect(websocket, 1, 0)
+        try:
+            await connection_manager.broadcast_to_channel(99, {"type": "typing"})
+            text = await metrics_registry.render()
+        finally:
+            await connection_manager.disconnect(1, 0)
+
+        assert len(websocket.frames) == 1
+        assert recipients.counts[0] == before[0] + 1
+        assert _sample(text, "websocket_connections") == 1
@@ -0,0 +1,300 @@
+"""
+通知服务测试
+"""
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.models.channel_member import ChannelMember, ChannelRole
+from app.models.notification import Notification, NotificationType
+from app.models.team_member import TeamMember, TeamRole
+from app.schemas.message import MessageCreate
+from app.schemas.notification import NotificationCreate, NotificationFanOut
+from app.services.message_service import MessageService
+from app.services.notification_service import (
+    NotificationOutbox,
+    NotificationService,
+    encode_notification_cursor,
+    unread_count_cache,
+)
+from app.services.team_service import TeamService
+from app.services.websocket_manager import connection_manager
+
+
+class FakeWebSocket:
+    """记录发送内容的WebSocket替身"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text: str):
+        self.sent.append(json.loads(text))
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def reset_notification_state():
+    """每个测试前后清理缓存和连接"""
+    unread_count_cache.clear()
+    yield
+    unread_count_cache.clear()
+    connection_manager.active_connections.clear()
+    connection_manager.user_channels.clear()
+    connection_manager.channel_users.clear()
+
+
+@pytest.fixture
+async def second_member(test_db, channel, test_user_2):
+    """test_user_2 以普通成员加入 channel 所在的团队和频道"""
+    test_db.add_all([
+        TeamMember(team_id=channel.team_id, user_id=test_user_2.id, role=TeamRole.MEMBER),
+        ChannelMember(channel_id=channel.id, user_id=test_user_2.id, role=ChannelRole.MEMBER),
+    ])
+    await test_db.commit()
+    return test_user_2
+
+
+def _notification(user_id: int, title: str = "标题") -> NotificationCreate:
+    return NotificationCreate(
+        user_id=user_id,
+        type=NotificationType.SYSTEM,
+        title=title,
+        message="内容",
+    )
+
+
+class TestNotificationPush:
+    """通知推送测试"""
+
+    @pytest.mark.asyncio
+    async def test_create_notification_pushes_to_online_user(self, test_db, test_user):
+        """测试创建通知时推送到在线用户"""
+        websocket = FakeWebSocket()
+        await connection_manager.connect(websocket, test_user.id)
+
+        service = NotificationService(test_db)
+        notification = await service.create_notification(_notification(test_user.id))
+
+        assert len(websocket.sent) == 1
+        frame = websocket.sent[0]
+        assert frame["type"] == "notification"
+        assert frame["data"]["id"] == notification.id
+        assert frame["unread_count"] == 1
+
+    @pytest.mark.asyncio
+    async def test_offline_user_is_not_pushed(self, test_db, test_user):
+        """测试离线用户不推送也不计数"""
+        service = NotificationService(test_db)
+        await service.create_notification(_notification(test_user.id))
+
+        assert unread_count_cache.get(test_user.id) is None
+
+    @pytest.mark.asyncio
+    async def test_mark_read_pushes_count(self, test_db, test_user):
+        """测试标记已读时推送最新未读数量"""
+        service = NotificationService(test_db)
+        first = await service.create_notification(_notification(test_user.id, "一"))
+        await service.create_notification(_notification(test_user.id, "二"))
+
+        websocket = FakeWebSocket()
+        await connection_manager.connect(websocket, test_user.id)
+
+        await service.mark_notification_as_read(first.id, test_user.id)
+        # 重复标记不会再次减少计数
+        await service.mark_notification_as_read(first.id, test_user.id)
+
+        assert [frame["type"] for frame in websocket.sent] == ["notification_count"]
+        assert websocket.sent[0]["data"]["unread_count"] == 1
+
+
+class TestUnreadCountCache:
+    """未读数量缓存测试"""
+
+    @pytest.mark.asyncio
+    async def test_count_maintained_without_requery(self, test_db, test_user):
+        """测试计数在各类操作中增量维护"""
+        service = NotificationService(test_db)
+        assert await service.get_unread_count(test_user.id) == 0
+
+        first = await service.create_notification(_notification(test_user.id, "一"))
+        second = await service.create_notification(_notification(test_user.id, "二"))
+        assert unread_count_cache.get(test_user.id) == 2
+
+        await service.mark_notification_as_read(first.id, test_user.id)
+        assert unread_count_cache.get(test_user.id) == 1
+
+        await service.delete_notification(second.id, test_user.id)
+        assert unread_count_cache.get(test_user.id) == 0
+
+        await service.create_notification(_notification(test_user.id, "三"))
+        await service.mark_all_notifications_as_read(test_user.id)
+        assert await service.get_unread_count(test_user.id) == 0
+
+    @pytest.mark.asyncio
+    async def test_cache_expires(self, test_db, test_user, monkeypatch):
+        """测试缓存过期后重新计数"""
+        from app.services import notification_service as module
+
+        now = [1000.0]
+        monkeypatch.setattr(module.time, "monotonic", lambda: now[0])
+        unread_count_cache.set(test_user.id, 5)
+        assert unread_count_cache.get(test_user.id) == 5
+
+        now[0] += unread_count_cache.ttl_seconds + 1
+        assert unread_count_cache.get(test_user.id) is None
+        assert await NotificationService(test_db).get_unread_count(test_user.id) == 0
+
+
+class TestNotificationFanOut:
+    """批量扇出通知测试"""
+
+    @pytest.mark.asyncio
+    async def test_bulk_create_single_commit(self, test_db, test_user, test_user_2, monkeypatch):
+        """测试扇出只提交一次，并推送给在线用户"""
+        commits = []
+        original_commit = test_db.commit
+
+        async def counting_commit():
+            commits.append(1)
+            await original_commit()
+
+        monkeypatch.setattr(test_db, "commit", counting_commit)
+
+        websocket = FakeWebSocket()
+        await connection_manager.connect(websocket, test_user_2.id)
+
+        service = NotificationService(test_db)
+        created = await service.create_notifications_bulk(NotificationFanOut(
+            user_ids=[test_user.id, test_user_2.id, test_user.id],
+            type=NotificationType.SYSTEM,
+            title="公告",
+            message="内容",
+        ))
+
+        assert created == 2
+        assert len(commits) == 1
+        result = await test_db.execute(select(Notification.user_id))
+        assert sorted(result.scalars().all()) == sorted([test_user.id, test_user_2.id])
+
+        assert len(websocket.sent) == 1
+        assert websocket.sent[0]["data"]["title"] == "公告"
+        assert websocket.sent[0]["unread_count"] == 1
+
+    @pytest.mark.asyncio
+    @pytest.mark.usefixtures("second_member")
+    async def test_channel_mention_fans_out(self, test_db, test_user, test_user_2, channel):
+        """测试 @channel 通知除作者外的全部成员，@here 只通知在线成员"""
+        message_service = MessageService(test_db)
+        notification_service = NotificationService(test_db)
+
+        await message_service.create_message(
+            MessageCreate(content="@here 开会", channel_id=channel.id), test_user.id
+        )
+        assert await notification_service.get_unread_count(test_user_2.id) == 0
+
+        await message_service.create_message(
+            MessageCreate(content="大家好 @channel", channel_id=channel.id), test_user.id
+        )
+        assert await notification_service.get_unread_count(test_user_2.id) == 1
+        assert await notification_service.get_unread_count(test_user.id) == 0
+
+    @pytest.mark.asyncio
+    @pytest.mark.usefixtures("second_member")
+    async def test_team_announcement_fans_out(self, test_db, test_user, test_user_2, channel):
+        """测试团队公告通知除发送者外的全部成员，普通成员不能发送，团队不存在时返回 None"""
+        team_service = TeamService(test_db)
+        notification_service = NotificationService(test_db)
+
+        with pytest.raises(PermissionError):
+            await team_service.announce(channel.team_id, test_user_2.id, "公告", "内容")
+        assert await team_service.announce(channel.team_id + 100, test_user_2.id, "公告", "内容") is None
+        assert await team_service.announce(channel.team_id, test_user.id, "公告", "明天放假") == 1
+
+        assert await notification_service.get_unread_count(test_user_2.id) == 1
+        assert await notification_service.get_unread_count(test_user.id) == 0
+
+    @pytest.mark.asyncio
+    async def test_outbox_retries_failed_batch_individually(self, test_db, test_user, test_user_2, monkeypatch):
+        """测试合并写入失败时逐个重试，只丢弃本身写不进去的扇出"""
+        original_insert = NotificationService._insert_fan_out
+
+        async def insert_fan_out(service, fan_out):
+            if fan_out.title == "坏":
+                raise RuntimeError("insert failed")
+            return await original_insert(service, fan_out)
+
+        monkeypatch.setattr(NotificationService, "_insert_fan_out", insert_fan_out)
+        outbox = NotificationOutbox()
+        outbox.start(async_sessionmaker(test_db.bind, class_=AsyncSession, expire_on_commit=False))
+        for title, user_id in (("好1", test_user.id), ("坏", test_user.id), ("好2", test_user_2.id)):
+            outbox.enqueue(NotificationFanOut(
+                user_ids=[user_id], type=NotificationType.SYSTEM, title=title, message="内容"
+            ))
+        await outbox.stop()
+
+        result = await test_db.execute(select(Notification.title).order_by(Notification.title))
+        assert result.scalars().all() == ["好1", "好2"]
+
+
+async def _seed_notifications(test_db, user_id: int, count: int, start: datetime, is_read: bool = False):
+    for i in range(count):
+        test_db.add(Notification(
+            user_id=user_id,
+            type=NotificationType.SYSTEM,
+            title=f"通知{i}",
+            message="内容",
+            is_read=is_read,
+            created_at=start + timedelta(minutes=i),
+        ))
+    await test_db.commit()
+
+
+class TestNotificationInbox:
+    """通知收件箱分页与清理测试"""
+
+    @pytest.mark.asyncio
+    async def test_cursor_pagination(self, test_db, test_user):
+        """测试游标分页按时间倒序、无重复地遍历全部通知"""
+        await _seed_notifications(test_db, test_user.id, 5, datetime(2026, 1, 1))
+        service = NotificationService(test_db)
+
+        first_page = await service.get_user_notifications(test_user.id, limit=2)
+        assert [n.title for n in first_page] == ["通知4", "通知3"]
+
+        titles = [n.title for n in first_page]
+        cursor = encode_notification_cursor(first_page[-1])
+        while True:
+            page = await service.get_user_notifications(test_user.id, limit=2, cursor=cursor)
+            titles.extend(n.title for n in page)
+            if len(page) < 2:
+                break
+            cursor = encode_notification_cursor(page[-1])
+
+        assert titles == ["通知4", "通知3", "通知2", "通知1", "通知0"]
+
+    @pytest.mark.asyncio
+    async def test_invalid_cursor(self, test_db, test_user):
+        """测试非法游标"""
+        with pytest.raises(ValueError):
+            await NotificationService(test_db).get_user_notifications(test_user.id, cursor="not-a-cursor")
+
+    @pytest.mark.asyncio
+    async def test_purge_read_notifications_in_batches(self, test_db, test_user):
+        """测试只分批清理过期的已读通知"""
+        await _seed_notifications(test_db, test_user.id, 5, datetime(2025, 1, 1), is_read=True)
+        await _seed_notifications(test_db, test_user.id, 2, datetime(2025, 1, 1), is_read=False)
+        await _seed_notifications(test_db, test_user.id, 1, datetime(2026, 6, 1), is_read=True)
+
+        service = NotificationService(test_db)
+        deleted = await service.purge_read_notifications(datetime(2026, 1, 1), batch_size=2)
+
+        assert deleted == 5
+        remaining = await service.get_user_notifications(test_user.id)
+        assert len(remaining) == 3
+        assert sum(1 for n in remaining if n.is_read) == 1
+
@@ -0,0 +1,130 @@
+"""
+在线性能分析测试
+"""
+import asyncio
+import pstats
+import time
+import tracemalloc
+
+import pytest
+
+from app.main import app
+from app.utils.config import config
+from app.utils.profiling import RequestProfiles, request_profiles
+
+
+@pytest.fixture
+def profiling_admin(test_user, monkeypatch):
+    monkeypatch.setitem(config.monitoring.__dict__, "profiling_admins", frozenset({test_user.username}))
+    return test_user
+
+
+def _busy_loop(seconds: float) -> None:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+class TestProfiling:
+    """性能分析接口测试"""
+
+    @pytest.mark.asyncio
+    async def test_requires_admin(self, client, auth_headers):
+        """测试非管理员不能使用分析接口，X-Profile 请求头被忽略"""
+        response = await client.get(app.url_path_for("profile_cpu"), params={"seconds": 0.1}, headers=auth_headers)
+        assert response.status_code == 403
+
+        response = await client.get("/api/v1/auth/me", headers={**auth_headers, "X-Profile": "1"})
+        assert response.status_code == 200
+        assert "x-profile-id" not in response.headers
+
+    @pytest.mark.asyncio
+    async def test_cpu_profile(self, client, auth_headers, profiling_admin):
+        """测试采样期间阻塞事件循环的函数出现在折叠栈中"""
+        async def block_loop():
+            await asyncio.sleep(0.1)
+            _busy_loop(0.2)
+
+        response, _ = await asyncio.gather(
+            client.get(app.url_path_for("profile_cpu"), params={"seconds": 0.5, "interval": 0.002}, headers=auth_headers),
+            block_loop(),
+        )
+
+        assert response.status_code == 200
+        lines = response.text.splitlines()
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+        assert any("_busy_loop" in line.split(";")[-1] for line in lines)
+
+    @pytest.mark.asyncio
+    async def test_cpu_profile_duration_limit(self, client, auth_headers, profiling_admin, monkeypatch):
+        """测试采样时长超过上限时拒绝"""
+        monkeypatch.setitem(config.monitoring.__dict__, "profile_max_seconds", 1.0)
+
+        response = await client.get(app.url_path_for("profile_cpu"), params={"seconds": 5}, headers=auth_headers)
+
+        assert response.status_code == 400
+
+    @pytest.mark.asyncio
+    async def test_request_profile(self, client, auth_headers, profiling_admin, tmp_path):
+        """测试带 X-Profile 请求头的请求被分析，可取回文本报告和 pstats 文件"""
+        response = await client.get("/api/v1/auth/me", headers={**auth_headers, "X-Profile": "1"})
+        assert response.status_code == 200
+        profile_id = response.headers["x-profile-id"]
+
+        url = app.url_path_for("get_request_profile", profile_id=profile_id)
+        report = await client.get(url, params={"sort": "tottime", "limit": 10}, headers=auth_headers)
+        assert report.status_code == 200
+        assert "function calls" in report.text
+
+        dump = await client.get(url, params={"format": "pstats"}, headers=auth_headers)
+        assert dump.status_code == 200
+        path = tmp_path / "request.pstats"
+        path.write_bytes(dump.content)
+        assert pstats.Stats(str(path)).total_calls > 0
+
+        missing = await client.get(app.url_path_for("get_request_profile", profile_id="missing"), headers=auth_headers)
+        assert missing.status_code == 404
+
+    @pytest.mark.asyncio
+    async def test_request_profile_shared_between_workers(self, client, auth_headers, profiling_admin, tmp_path, monkeypatch):
+        """测试共享目录中的分析结果可由其他 worker 取回"""
+        monkeypatch.setattr(request_profiles, "_directory", None)
+        request_profiles.use_directory(str(tmp_path / "profiles"))
+
+        response = await client.get("/api/v1/auth/me", headers={**auth_headers, "X-Profile": "1"})
+        profile_id = response.headers["x-profile-id"]
+
+        # fork 出的其他 worker 继承主进程指定的目录
+        other_worker = RequestProfiles()
+        other_worker._directory = request_profiles.directory
+        assert b"function calls" in await other_worker.render(profile_id)
+        with pytest.raises(ValueError):
+            other_worker.get("../profiles")
+
+    @pytest.mark.asyncio
+    async def test_memory_growth(self, client, auth_headers, profiling_admin):
+        """测试一个请求内完成追踪，结果包含追踪期间新增且未释放的分配"""
+        retained = []
+
+        async def allocate():
+            await asyncio.sleep(0.1)
+            retained.extend(bytearray(1024) for _ in range(1000))
+
+        response, _ = await asyncio.gather(
+            client.get(app.url_path_for("profile_memory"), params={"seconds": 0.3, "limit": 5}, headers=auth_headers),
+            allocate(),
+        )
+
+        assert response.status_code == 200
+        [growth] = [row for row in response.json()["diff"] if "test_profiling.py" in row["location"]]
+        assert growth["size_diff_kb"] >= 1000 and growth["count_diff"] >= 1000
+        assert len(retained) == 1000
+        assert not tracemalloc.is_tracing()
+
+    @pytest.mark.asyncio
+    async def test_memory_duration_limit(self, client, auth_headers, profiling_admin):
+        """测试追踪时长超过上限时拒绝"""
+        seconds = config.monitoring.profile_max_seconds + 1
+        response = await client.get(app.url_path_for("profile_memory"), params={"seconds": seconds}, headers=auth_headers)
+
+        assert response.status_code == 422
@@ -0,0 +1,111 @@
+"""
+SQL 语句统计测试
+"""
+import logging
+
+import pytest
+from sqlalchemy import select
+
+from app.database.instrumentation import QueryBudgetExceeded, query_budget, track_command, track_queries
+from app.main import app
+from app.models.channel import Channel, ChannelType
+from app.models.team import Team
+from app.models.team_member import TeamMember
+from app.services.channel_service import ChannelService
+from app.utils.config import config
+
+
+@pytest.fixture
+async def team(test_db, test_user):
+    team = Team(name="团队", slug="query-stats", owner_id=test_user.id)
+    test_db.add(team)
+    await test_db.flush()
+    test_db.add(TeamMember(team_id=team.id, user_id=test_user.id))
+    test_db.add_all([
+        Channel(name=f"channel-{index}", type=ChannelType.PUBLIC, team_id=team.id, created_by=test_user.id)
+        for index in range(6)
+    ])
+    await test_db.commit()
+    return team
+
+
+async def _first_channel_id(db) -> int:
+    return (await db.execute(select(Channel.id).order_by(Channel.id))).scalars().first()
+
+
+class TestQueryStats:
+    """语句统计测试"""
+
+    @pytest.mark.asyncio
+    async def test_repeated_statements_reported_as_n_plus_one(self, test_db, test_user, team, monkeypatch):
+        """测试逐个频道检查权限时，重复执行的语句被报告为疑似 N+1"""
+        monkeypatch.setitem(config.monitoring.__dict__, "n_plus_one_threshold", 5)
+
+        with track_queries("get_team_channels") as stats:
+            channels = await ChannelService(test_db).get_team_channels(team.id, test_user.id)
+
+        assert len(channels) == 6
+        assert stats.count == sum(statement.count for statement in stats.statements.values())
+        assert stats.duration > 0
+        suspects = stats.n_plus_one_suspects()
+        assert suspects and suspects[0][1].count >= 6
+        assert "疑似 N+1" in stats.report()
+
+    @pytest.mark.asyncio
+    async def test_server_timing_header(self, client, auth_headers, team):
+        """测试响应头中返回数据库耗时和语句数"""
+        with track_queries("test") as stats:
+            response = await client.get(
+                app.url_path_for("get_channels"), params={"team_id": str(team.id)}, headers=auth_headers
+            )
+
+        assert response.status_code == 200
+        db_timing, total_timing = response.headers["server-timing"].split(", ")
+        assert db_timing.startswith("db;dur=") and f'desc="{stats.count} queries"' in db_timing
+        assert total_timing.startswith("total;dur=")
+
+    @pytest.mark.asyncio
+    async def test_query_budget(self, client, auth_headers, team):
+        """测试超过语句预算时失败，并列出执行的语句"""
+        with query_budget(40):
+            await client.get(app.url_path_for("get_channels"), params={"team_id": str(team.id)}, headers=auth_headers)
+
+        with pytest.raises(QueryBudgetExceeded, match="Expected at most 3 queries"):
+            with query_budget(3):
+                await client.get(
+                    app.url_path_for("get_channels"), params={"team_id": str(team.id)}, headers=auth_headers
+                )
+
+    @pytest.mark.asyncio
+    async def test_slow_request_logged(self, client, auth_headers, team, monkeypatch, caplog):
+        """测试慢请求记录日志，附带耗时最多的语句"""
+        monkeypatch.setitem(config.monitoring.__dict__, "slow_request", 0.0)
+
+        with caplog.at_level(logging.WARNING, logger="app.database.instrumentation"):
+            await client.get(app.url_path_for("get_channels"), params={"team_id": str(team.id)}, headers=auth_headers)
+
+        [record] = [record for record in caplog.records if record.name == "app.database.instrumentation"]
+        assert record.getMessage().startswith("慢请求 GET /api/v1/channels")
+        assert "SELECT" in record.getMessage()
+
+    @pytest.mark.asyncio
+    async def test_websocket_command(self, test_db, test_user, team, monkeypatch, caplog):
+        """测试 WebSocket 命令按命令统计语句"""
+        monkeypatch.setitem(config.monitoring.__dict__, "slow_request", 0.0)
+
+        with caplog.at_level(logging.WARNING, logger="app.database.instrumentation"):
+            with track_command("ws join_channel") as stats:
+                await ChannelService(test_db).can_user_access_channel(await _first_channel_id(test_db), test_user.id)
+
+        assert stats.count > 0
+        assert any(record.getMessage().startswith("慢请求 ws join_channel") for record in caplog.records)
+
+    @pytest.mark.asyncio
+    async def test_disabled(self, test_db, test_user, team, monkeypatch):
+        """测试关闭统计后 WebSocket 命令不再统计"""
+        monkeypatch.setitem(config.monitoring.__dict__, "query_stats", False)
+
+        with track_command("ws typing") as stats:
+            await ChannelService(test_db).can_user_access_channel(await _first_channel_id(test_db), test_user.id)
+
+        assert stats is None
@@ -0,0 +1,204 @@
+"""
+消息混合检索测试
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.models.channel import Channel, ChannelType
+from app.models.message import Message
+from app.models.team import Team
+from app.models.team_member import TeamMember
+from app.services.embedding import HashingEmbedder
+from app.services.search_service import SearchService, extract_terms, highlight, reciprocal_rank_fusion
+from app.services.vector_index import MessageIndexer
+
+
+NOW = datetime.now(timezone.utc).replace(microsecond=0)
+
+
+@pytest.fixture
+def indexer(test_db, tmp_path):
+    return MessageIndexer(
+        embedder=HashingEmbedder(dim=64),
+        session_factory=async_sessionmaker(test_db.bind, class_=AsyncSession, expire_on_commit=False),
+        index_dir=str(tmp_path / "index")
+    )
+
+
+@pytest.fixture
+async def channels(test_db, test_user, test_user_2):
+    """两个公开频道和一个 test_user_2 无权访问的私有频道"""
+    team = Team(name="团队", slug="hybrid", owner_id=test_user.id)
+    test_db.add(team)
+    await test_db.flush()
+    general = Channel(name="general", type=ChannelType.PUBLIC, team_id=team.id, created_by=test_user.id)
+    random = Channel(name="random", type=ChannelType.PUBLIC, team_id=team.id, created_by=test_user.id)
+    secret = Channel(name="secret", type=ChannelType.PRIVATE, team_id=team.id, created_by=test_user.id)
+    test_db.add_all([
+        general, random, secret,
+        TeamMember(team_id=team.id, user_id=test_user.id),
+        TeamMember(team_id=team.id, user_id=test_user_2.id),
+    ])
+    await test_db.commit()
+    return general, random, secret
+
+
+async def _add_messages(test_db, author, rows):
+    """rows: [(channel, content, 距今小时数)]"""
+    messages = []
+    for channel, content, hours_ago in rows:
+        created_at = NOW - timedelta(hours=hours_ago)
+        message = Message(
+            content=content, author_id=author.id, channel_id=channel.id,
+            created_at=created_at, updated_at=created_at
+        )
+        test_db.add(message)
+        messages.append(message)
+    await test_db.commit()
+    return messages
+
+
+class TestSearchHelpers:
+    """检索辅助函数测试"""
+
+    def test_reciprocal_rank_fusion(self):
+        """测试两路都靠前的结果融合后排第一"""
+        scores = reciprocal_rank_fusion([[1, 2, 3], [2, 4]], k=60)
+
+        assert max(scores, key=scores.get) == 2
+        assert scores[1] == pytest.approx(1 / 61)
+        assert scores[2] == pytest.approx(1 / 62 + 1 / 61)
+
+    def test_extract_terms_segments_cjk(self):
+        """测试没有空格的中文按重叠的三字片段切分，短词和英文保持原样"""
+        assert extract_terms("项目评审会 Deploy 会议") == ["项目评", "目评审", "评审会", "deploy", "会议"]
+
+    def test_highlight_escapes_and_marks(self):
+        """测试高亮片段转义HTML并标记所有命中词"""
+        content = "x" * 200 + "<b>部署</b> Deploy 完成 deploy"
+
+        snippet = highlight(content, ["deploy", "部署"], width=60)
+
+        assert snippet.startswith("…")
+        assert "&lt;b&gt;<mark>部署</mark>&lt;/b&gt;" in snippet
+        assert "<mark>Deploy</mark>" in snippet and "<mark>deploy</mark>" in snippet
+        assert highlight("没有命中", ["deploy"]) is None
+
+
+class TestSearchService:
+    """混合检索测试"""
+
+    @pytest.mark.asyncio
+    async def test_keyword_mode_pushes_down_filters(self, test_db, test_user, test_user_2, channels, indexer):
+        """测试关键词检索只返回可访问频道和时间范围内的消息，命中词多的排前面"""
+        general, random, secret = channels
+        await _add_messages(test_db, test_user, [
+            (general, "deploy 周五进行", 1),
+            (general, "deploy rollback 预案", 2),
+            (random, "deploy 很久以前", 24 * 10),
+            (secret, "deploy rollback 内部", 1),
+        ])
+
+        results = await SearchService(test_db, indexer).search(
+            "deploy rollback", test_user_2.id, search_type="keyword", start_time=NOW - timedelta(days=1)
+        )
+
+        assert [result.content for result in results] == ["deploy rollback 预案", "deploy 周五进行"]
+        assert results[0].highlight == "<mark>deploy</mark> <mark>rollback</mark> 预案"
+
+    @pytest.mark.asyncio
+    async def test_short_terms_only_rank(self, test_db, test_user, test_user_2, channels, indexer):
+        """测试有长词时只用长词筛选，短词只参与排序；只有短词时照常筛选"""
+        general, _, _ = channels
+        await _add_messages(test_db, test_user, [
+            (general, "deploy 周五进行", 1),
+            (general, "会议 deploy", 2),
+            (general, "会议纪要", 3),
+        ])
+        service = SearchService(test_db, indexer)
+
+        results = await service.search("deploy 会议", test_user_2.id, search_type="keyword")
+        assert [result.content for result in results] == ["会议 deploy", "deploy 周五进行"]
+
+        results = await service.search("会议", test_user_2.id, search_type="keyword")
+        assert [result.content for result in results] == ["会议 deploy", "会议纪要"]
+
+    @pytest.mark.asyncio
+    async def test_mixed_mode_fuses_both_retrievers(self, test_db, test_user, channels, indexer):
+        """测试混合检索合并关键词和语义召回，并按页返回"""
+        general, random, _ = channels
+        await _add_messages(test_db, test_user, [
+            (general, "数据库迁移 今晚执行", 1),
+            (general, "今晚执行数据库的迁移脚本", 1),
+            (random, "午饭吃什么", 1),
+        ])
+        await indexer.sync()
+        service = SearchService(test_db, indexer)
+
+        keyword = await service.search("数据库迁移", test_user.id, search_type="keyword")
+        mixed = await service.search("数据库迁移", test_user.id, search_type="mixed")
+        first_page = await service.search("数据库迁移", test_user.id, search_type="mixed", limit=1)
+        second_page = await service.search("数据库迁移", test_user.id, search_type="mixed", offset=1, limit=1)
+
+        # 中文查询切分为三字片段：只含"数据库"的消息也能召回，完整命中的排在前面
+        assert [result.content for result in keyword] == ["数据库迁移 今晚执行", "今晚执行数据库的迁移脚本"]
+        assert mixed[0].content == "数据库迁移 今晚执行"
+        assert "今晚执行数据库的迁移脚本" in [result.content for result in mixed]
+        assert [result.message_id for result in first_page + second_page] == [result.message_id for result in mixed[:2]]
+
+    @pytest.mark.asyncio
+    async def test_search_page_reports_total_before_paging(self, test_db, test_user, channels, indexer):
+        """测试分页时返回分页前的候选总数，而不是这一页的条数"""
+        general, _, _ = channels
+        await _add_messages(test_db, test_user, [(general, f"deploy 第{i}次", i + 1) for i in range(5)])
+        service = SearchService(test_db, indexer)
+
+        results, total = await service.search_page("deploy", test_user.id, search_type="keyword", limit=2)
+        assert len(results) == 2
+        # 每路多召回一条，候选总数大于 offset + limit 说明还有下一页
+        assert total == 3
+
+        results, total = await service.search_page("deploy", test_user.id, search_type="keyword", offset=4, limit=2)
+        assert len(results) == 1
+        assert total == 5
+
+    @pytest.mark.asyncio
+    async def test_semantic_mode_skips_deleted_messages(self, test_db, test_user, channels, indexer):
+        """测试向量索引尚未同步删除时也不返回已删除的消息"""
+        general, _, _ = channels
+        deleted, kept = await _add_messages(test_db, test_user, [
+            (general, "数据库迁移计划", 1),
+            (general, "数据库迁移回滚", 2),
+        ])
+        await indexer.sync()
+        await test_db.execute(update(Message).where(Message.id == deleted.id).values(is_deleted=True))
+        await test_db.commit()
+
+        results = await SearchService(test_db, indexer).search("数据库迁移", test_user.id, search_type="semantic")
+
+        assert [result.message_id for result in results] == [kept.id]
+
+    @pytest.mark.asyncio
+    async def test_recency_and_affinity_boosts(self, test_db, test_user, test_user_2, channels, indexer):
+        """测试同等相关的结果中，较新的消息和用户活跃频道的消息排前面"""
+        general, random, _ = channels
+        old, new = await _add_messages(test_db, test_user_2, [
+            (general, "季度规划", 24 * 60),
+            (general, "季度规划", 1),
+        ])
+        active, quiet = await _add_messages(test_db, test_user_2, [
+            (general, "发布 清单", 24 * 60),
+            (random, "发布 清单", 24 * 60),
+        ])
+        # test_user 最近在 general 频道发言
+        await _add_messages(test_db, test_user, [(general, "大家好", 1)])
+        service = SearchService(test_db, indexer)
+
+        results = await service.search("季度规划", test_user.id, search_type="keyword")
+        assert [result.message_id for result in results] == [new.id, old.id]
+
+        results = await service.search("发布", test_user.id, search_type="keyword")
+        assert [result.message_id for result in results] == [active.id, quiet.id]
@@ -0,0 +1,189 @@
+"""
+回复建议上下文与AI配置缓存测试
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app.main import app
+from app.models.ai_task import AIConfig
+from app.models.message import Message
+from app.schemas.ai import AIConfigRequest, MessageSuggestionRequest
+from app.services.ai_config_service import AIConfigCache, AIConfigService
+from app.services.message_suggester import MessageSuggester
+from app.services.suggestion_context import SuggestionContextBuilder
+
+
+@pytest.fixture
+def statements(test_db):
+    """记录执行的SQL语句"""
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    engine = test_db.bind.sync_engine
+    event.listen(engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(engine, "before_cursor_execute", record)
+
+
+async def _add_messages(test_db, channel, author, contents):
+    messages = [Message(content=content, author_id=author.id, channel_id=channel.id) for content in contents]
+    test_db.add_all(messages)
+    await test_db.commit()
+    return messages
+
+
+class TestSuggestionContextBuilder:
+    """频道上下文窗口测试"""
+
+    @pytest.mark.asyncio
+    async def test_budget_keeps_most_recent_messages(self, test_db, test_user, channel):
+        """测试按token预算从最新的消息往前选取，结果按时间顺序排列"""
+        await _add_messages(test_db, channel, test_user, ["很早的消息" * 20, "第二条", "第三条"])
+        builder = SuggestionContextBuilder()
+
+        assert await builder.build(test_db, channel.id, token_budget=20) == ["Test User: 第二条", "Test User: 第三条"]
+        assert len(await builder.build(test_db, channel.id)) == 3
+
+    @pytest.mark.asyncio
+    async def test_window_is_not_requeried(self, test_db, test_user, channel, statements):
+        """测试刷新间隔内不再查询；本进程发送的消息直接追加，其他进程的消息在刷新时增量读取"""
+        await _add_messages(test_db, channel, test_user, ["第一条"])
+        builder = SuggestionContextBuilder(refresh_interval=3600)
+        await builder.build(test_db, channel.id)
+
+        statements.clear()
+        [local] = await _add_messages(test_db, channel, test_user, ["本进程"])
+        builder.append(channel.id, local.id, "Test User", local.content)
+        await _add_messages(test_db, channel, test_user, ["其他进程"])
+        statements.clear()
+
+        assert await builder.build(test_db, channel.id) == ["Test User: 第一条", "Test User: 本进程"]
+        assert statements == []
+
+        builder.refresh_interval = 0
+        assert (await builder.build(test_db, channel.id))[-1] == "Test User: 其他进程"
+        assert len(statements) == 1 and "messages.id >" in statements[0]
+
+    @pytest.mark.asyncio
+    async def test_invalidate_reloads_window(self, test_db, test_user, channel):
+        """测试消息被删除后窗口失效并重新加载"""
+        first, _ = await _add_messages(test_db, channel, test_user, ["第一条", "第二条"])
+        builder = SuggestionContextBuilder(refresh_interval=3600)
+        await builder.build(test_db, channel.id)
+
+        first.is_deleted = True
+        await test_db.commit()
+        builder.invalidate(channel.id)
+
+        assert await builder.build(test_db, channel.id) == ["Test User: 第二条"]
+
+    @pytest.mark.asyncio
+    async def test_other_worker_changes_are_refreshed(self, test_db, test_user, channel):
+        """测试其他进程编辑或删除窗口内的消息后，刷新时发现并重新加载"""
+        first, second = await _add_messages(test_db, channel, test_user, ["第一条", "第二条"])
+        builder = SuggestionContextBuilder(refresh_interval=0)
+        await builder.build(test_db, channel.id)
+
+        first.content = "第一条（已编辑）"
+        first.updated_at = datetime.now() + timedelta(minutes=1)
+        await test_db.commit()
+        assert await builder.build(test_db, channel.id) == ["Test User: 第一条（已编辑）", "Test User: 第二条"]
+
+        second.is_deleted = True
+        second.updated_at = datetime.now() + timedelta(minutes=2)
+        await test_db.commit()
+        assert await builder.build(test_db, channel.id) == ["Test User: 第一条（已编辑）"]
+
+    @pytest.mark.asyncio
+    async def test_late_lower_id_is_not_skipped(self, test_db, test_user, channel):
+        """测试本进程追加的消息不推进读取位置，其他进程id更小但提交更晚的消息在刷新时读到"""
+        await _add_messages(test_db, channel, test_user, ["第一条"])
+        builder = SuggestionContextBuilder(refresh_interval=0)
+        await builder.build(test_db, channel.id)
+
+        local = Message(id=10, content="本进程", author_id=test_user.id, channel_id=channel.id)
+        test_db.add(local)
+        await test_db.commit()
+        builder.append(channel.id, local.id, "Test User", local.content, local.updated_at)
+        test_db.add(Message(id=5, content="其他进程", author_id=test_user.id, channel_id=channel.id))
+        await test_db.commit()
+
+        assert await builder.build(test_db, channel.id) == ["Test User: 第一条", "Test User: 其他进程", "Test User: 本进程"]
+
+
+class TestAIConfigCache:
+    """AI配置缓存测试"""
+
+    @pytest.mark.asyncio
+    async def test_settings_are_cached(self, test_db, test_user, statements):
+        """测试配置读取一次后命中缓存，修改后缓存立即更新"""
+        service = AIConfigService(test_db, cache=AIConfigCache())
+
+        default = await service.get_settings(test_user.id)
+        assert default.max_suggestions_per_request == 3 and default.updated_at is None
+
+        statements.clear()
+        assert await service.get_settings(test_user.id) is default
+        assert statements == []
+
+        updated = await service.update(test_user.id, AIConfigRequest(suggestion_sensitivity=0.2, language_preference="en"))
+        statements.clear()
+        cached = await service.get_settings(test_user.id)
+        assert cached is updated and cached.language_preference == "en" and cached.updated_at is not None
+        assert statements == []
+
+    @pytest.mark.asyncio
+    async def test_config_endpoints(self, client, auth_headers):
+        """测试读取时创建默认配置，修改后再次读取得到新配置"""
+        response = await client.get(app.url_path_for("get_ai_config"), headers=auth_headers)
+        assert response.status_code == 200
+        assert response.json()["suggestion_sensitivity"] == 0.7
+
+        response = await client.put(
+            app.url_path_for("update_ai_config"),
+            json={"enable_suggestions": False, "suggestion_sensitivity": 0.3},
+            headers=auth_headers
+        )
+        assert response.status_code == 200
+
+        response = await client.get(app.url_path_for("get_ai_config"), headers=auth_headers)
+        assert response.json()["enable_suggestions"] is False and response.json()["suggestion_sensitivity"] == 0.3
+
+
+class TestSuggestionSettings:
+    """建议生成使用用户配置测试"""
+
+    @pytest.mark.asyncio
+    async def test_count_and_language(self, test_db, test_user, channel, llm, llm_server):
+        """测试建议条数、语言和多样性取自用户配置"""
+        await _add_messages(test_db, channel, test_user, ["今天发布吗"])
+        test_db.add(AIConfig(
+            user_id=test_user.id, max_suggestions_per_request=2,
+            language_preference="en", suggestion_sensitivity=0.34
+        ))
+        await test_db.commit()
+
+        result = await MessageSuggester(test_db, llm=llm).suggest(
+            MessageSuggestionRequest(channel_id=channel.id), test_user.id
+        )
+
+        assert result.suggestions == ["好的，我来跟进", "收到，今天处理"]
+        assert result.context_used == 1
+        request = llm_server.requests[0]
+        assert "请给出2条候选回复" in request["messages"][1]["content"]
+        assert "请用英文回复" in request["messages"][1]["content"]
+        assert request["temperature"] == 0.3
+
+    @pytest.mark.asyncio
+    async def test_disabled_suggestions(self, test_db, test_user, channel, llm, llm_server):
+        """测试关闭建议功能后不调用模型"""
+        test_db.add(AIConfig(user_id=test_user.id, enable_suggestions=False))
+        await test_db.commit()
+
+        with pytest.raises(PermissionError):
+            await MessageSuggester(test_db, llm=llm).suggest(MessageSuggestionRequest(channel_id=channel.id), test_user.id)
+        assert llm_server.requests == []
@@ -0,0 +1,286 @@
+"""
+用户行为画像测试
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+
+from app.database.database import Base
+from app.main import app
+from app.models.message import Message
+from app.models.team_member import TeamMember
+from app.services import user_profiles
+from app.services.user_profiles import (
+    MessageBatch, ProfileStore, UserProfiler, describe_profile, rebuild_profiles, reply_latencies
+)
+from app.services.vector_index import to_epoch
+
+
+# 2025-03-03 是星期一
+MONDAY = datetime(2025, 3, 3, 9, 0)
+
+
+def _batch(rows):
+    """rows: [(id, 作者, 频道, 距 MONDAY 的秒数, 长度, 回复对象的 (秒数, 作者) 或 None)]"""
+    ids, authors, channels, offsets, lengths, parents = zip(*rows)
+    return MessageBatch(
+        ids=np.array(ids),
+        author_ids=np.array(authors),
+        channel_ids=np.array(channels),
+        timestamps=to_epoch(MONDAY) + np.array(offsets, dtype=np.float64),
+        lengths=np.array(lengths),
+        parent_timestamps=np.array([to_epoch(MONDAY) + p[0] if p else -1.0 for p in parents]),
+        parent_author_ids=np.array([p[1] if p else -1 for p in parents]),
+    )
+
+
+def _messages(rows):
+    """rows: [(作者, 频道, 距 MONDAY 的分钟数, 内容)]"""
+    return [
+        Message(
+            content=content, author_id=author, channel_id=channel,
+            created_at=MONDAY + timedelta(minutes=minutes), updated_at=MONDAY + timedelta(minutes=minutes)
+        )
+        for author, channel, minutes, content in rows
+    ]
+
+
+class TestFeatureExtraction:
+    """特征提取测试"""
+
+    def test_reply_latencies(self):
+        """测试换人发言按同频道上一条他人消息计算，线程回复按原消息计算，并跨批次衔接"""
+        state = {}
+        first = _batch([
+            (1, 10, 1, 0, 5, None),
+            (2, 20, 2, 0, 5, None),
+            (3, 20, 1, 30, 5, None),
+            (4, 20, 1, 60, 5, None),
+        ])
+        second = _batch([
+            (5, 10, 1, 200, 5, None),
+            (6, 10, 2, 100000, 5, None),
+            (7, 10, 1, 400, 5, (30, 20)),
+        ])
+
+        assert reply_latencies(first, state).tolist() == pytest.approx([np.nan, np.nan, 30, np.nan], nan_ok=True)
+        # 6 距频道2上一条他人消息超过1天；7 是对 3 的线程回复
+        assert reply_latencies(second, state).tolist() == pytest.approx([140, np.nan, 370], nan_ok=True)
+        assert state[1] == (7, 10, to_epoch(MONDAY) + 400)
+
+    def test_store_add_merge_and_snapshot(self, tmp_path):
+        """测试按用户累加特征、合并分区结果，以及快照的保存和加载"""
+        batch = _batch([
+            (1, 10, 1, 0, 5, None),
+            (2, 20, 1, 30, 50, None),
+            (3, 10, 2, 3600, 500, None),
+        ])
+        store = ProfileStore(capacity=1)
+        store.add(batch, reply_latencies(batch, {}))
+
+        profile = store.get(10)
+        assert profile.hour_counts[9] == 1 and profile.hour_counts[10] == 1 and profile.hour_counts.sum() == 2
+        assert profile.length_counts.tolist() == [1, 0, 0, 0, 1]
+        assert profile.channels == {1: 1, 2: 1}
+        assert store.get(20).latency_counts.tolist() == [1, 0, 0, 0, 0]
+        assert store.watermark == 3 and store.get(30) is None
+
+        merged = ProfileStore()
+        merged.merge(store)
+        merged.merge(store)
+        assert merged.get(10).hour_counts.sum() == 4 and merged.get(10).channels == {1: 2, 2: 2}
+
+        store.generation = 2
+        store.save(str(tmp_path))
+        loaded = ProfileStore.load(str(tmp_path))
+        assert ProfileStore.read_generation(str(tmp_path)) == 2
+        assert loaded.watermark == 3 and loaded.generation == 2 and len(loaded) == 2
+        assert loaded.get(10).channels == profile.channels
+        assert loaded.get(10).length_counts.tolist() == profile.length_counts.tolist()
+        assert loaded.get(20).last_active == store.get(20).last_active
+
+    def test_describe_profile(self):
+        """测试由特征生成活跃时段、沟通风格和协作模式"""
+        rows = [(i, 10, 1, 3600 * (i % 3), 5, None) for i in range(9)] + [(9, 10, 2, 8 * 3600, 5, None)]
+        batch = _batch(rows)
+        store = ProfileStore()
+        store.add(batch, reply_latencies(batch, {}))
+
+        result = describe_profile(10, store.get(10))
+
+        assert result.message_count == 10 and result.active_channels == 2
+        assert result.preferred_times == ["09:00-12:00"]
+        assert result.communication_style == "简洁直接"
+        assert result.collaboration_pattern == "以发起话题和分享信息为主"
+        assert result.profile.hour_histogram[17] == 1 and result.profile.weekday_histogram[0] == 10
+        assert result.profile.top_channels == [1, 2]
+
+        empty = describe_profile(20, None)
+        assert empty.message_count == 0 and empty.profile is None
+
+
+class TestUserProfiler:
+    """增量更新测试"""
+
+    @pytest.fixture
+    def profiler(self, test_db, tmp_path):
+        return UserProfiler(
+            session_factory=async_sessionmaker(test_db.bind, class_=AsyncSession, expire_on_commit=False),
+            profile_dir=str(tmp_path),
+            batch_size=2
+        )
+
+    @pytest.mark.asyncio
+    async def test_incremental_sync(self, test_db, profiler):
+        """测试分批读取新消息，重复同步不会重复计数，已删除的消息不计入"""
+        messages = _messages([(10, 1, 0, "早"), (20, 1, 2, "早上好"), (10, 1, 3, "开会")])
+        test_db.add_all(messages)
+        await test_db.commit()
+
+        assert await profiler.sync() == 3
+        assert await profiler.sync() == 0
+
+        deleted = _messages([(20, 1, 4, "已删除")])[0]
+        deleted.is_deleted = True
+        test_db.add_all([deleted] + _messages([(20, 2, 5, "收到")]))
+        await test_db.commit()
+        assert await profiler.sync() == 1
+
+        user_10, user_20 = await profiler.get_profile(10), await profiler.get_profile(20)
+        assert user_10.hour_counts.sum() == 2 and user_20.channels == {1: 1, 2: 1}
+        assert user_20.latency_counts.tolist() == [0, 1, 0, 0, 0]
+        assert user_10.latency_counts.tolist() == [1, 0, 0, 0, 0]
+        assert profiler.store.watermark == messages[-1].id + 2
+
+    @pytest.mark.asyncio
+    async def test_checkpoint_loads_newer_rebuild(self, test_db, profiler, tmp_path):
+        """测试磁盘上有更新一代的快照时加载它，否则保存本进程的特征"""
+        test_db.add_all(_messages([(10, 1, 0, "早")]))
+        await test_db.commit()
+        await profiler.sync()
+        await profiler.checkpoint()
+        assert ProfileStore.load(str(tmp_path)).get(10).hour_counts.sum() == 1
+
+        rebuilt = ProfileStore()
+        rebuilt.generation = 1
+        rebuilt.save(str(tmp_path))
+        await profiler.checkpoint()
+
+        assert profiler.store.generation == 1 and profiler.store.get(10) is None
+        # 新快照的水位为0，之后从头增量更新
+        await profiler.sync()
+        assert profiler.store.get(10).hour_counts.sum() == 1
+
+    @pytest.mark.asyncio
+    async def test_restart_does_not_double_count(self, test_db, profiler, tmp_path):
+        """测试进程重启后从快照恢复，回看区间内已处理的消息不会重复计数"""
+        test_db.add_all(_messages([(10, 1, minutes, "早") for minutes in range(5)]))
+        await test_db.commit()
+        assert await profiler.sync() == 5
+        await profiler.checkpoint()
+
+        restarted = UserProfiler(session_factory=profiler.session_factory, profile_dir=str(tmp_path), batch_size=2)
+        assert await restarted.sync() == 0
+        assert restarted.store.get(10).hour_counts.sum() == 5
+
+        test_db.add_all(_messages([(10, 1, 6, "开会")]))
+        await test_db.commit()
+        assert await restarted.sync() == 1
+        assert restarted.store.get(10).hour_counts.sum() == 6
+
+
+class TestRebuildProfiles:
+    """全量重算测试"""
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("workers", [1, 2])
+    async def test_rebuild_matches_incremental(self, tmp_path, workers):
+        """测试按频道分区（包括进程池）重算的结果与增量更新一致，并写入新一代快照"""
+        url = f"sqlite:///{tmp_path}/app.db"
+        engine = create_engine(url)
+        Base.metadata.create_all(engine)
+        rows = [(10 + i % 3, i % 5, i * 7, "消息" * (i % 40)) for i in range(60)]
+        with Session(engine) as session:
+            session.add_all(_messages(rows))
+            session.commit()
+        engine.dispose()
+
+        store = await rebuild_profiles(
+            workers=workers, database_url=url, profile_dir=str(tmp_path / "profiles"), chunk_size=7
+        )
+
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/app.db")
+        profiler = UserProfiler(
+            session_factory=async_sessionmaker(async_engine, class_=AsyncSession),
+            profile_dir=str(tmp_path / "incremental")
+        )
+        await profiler.sync()
+
+        # 加载重算的快照后继续增量更新，不会重复计入重算时已处理的消息
+        follower = UserProfiler(
+            session_factory=async_sessionmaker(async_engine, class_=AsyncSession),
+            profile_dir=str(tmp_path / "profiles")
+        )
+        assert await follower.sync() == 0
+        await async_engine.dispose()
+
+        assert store.generation == 1 and store.watermark == 60
+        assert ProfileStore.read_generation(str(tmp_path / "profiles")) == 1
+        for user_id in (10, 11, 12):
+            expected, actual = profiler.store.get(user_id), store.get(user_id)
+            assert actual.hour_counts.tolist() == expected.hour_counts.tolist()
+            assert actual.length_counts.tolist() == expected.length_counts.tolist()
+            assert actual.latency_counts.tolist() == expected.latency_counts.tolist()
+            assert actual.channels == expected.channels
+
+
+class TestUserBehaviorEndpoint:
+    """用户行为分析接口测试"""
+
+    @pytest.mark.asyncio
+    async def test_analyze_user(self, client, auth_headers, test_db, test_user, tmp_path, monkeypatch):
+        """测试接口返回当前用户的行为画像"""
+        profiler = UserProfiler(
+            session_factory=async_sessionmaker(test_db.bind, class_=AsyncSession, expire_on_commit=False),
+            profile_dir=str(tmp_path)
+        )
+        monkeypatch.setattr(user_profiles, "user_profiler", profiler)
+        test_db.add_all(_messages([(test_user.id, 1, 0, "早"), (test_user.id, 1, 30, "今天发布")]))
+        await test_db.commit()
+
+        response = await client.post(app.url_path_for("analyze_user_behavior"), json={}, headers=auth_headers)
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["user_id"] == test_user.id and data["message_count"] == 2
+        assert data["preferred_times"] == ["09:00-10:00"]
+        assert data["profile"]["length_distribution"]["<10"] == 2
+
+    @pytest.mark.asyncio
+    async def test_analyze_other_user(self, client, auth_headers, test_db, test_user, test_user_2, channel, tmp_path, monkeypatch):
+        """测试只能分析同一团队的成员，常用频道只列出当前用户可以访问的频道"""
+        profiler = UserProfiler(
+            session_factory=async_sessionmaker(test_db.bind, class_=AsyncSession, expire_on_commit=False),
+            profile_dir=str(tmp_path)
+        )
+        monkeypatch.setattr(user_profiles, "user_profiler", profiler)
+        hidden_channel_id = channel.id + 100
+        test_db.add_all(_messages([(test_user_2.id, channel.id, 0, "早"), (test_user_2.id, hidden_channel_id, 30, "私聊")]))
+        await test_db.commit()
+        url = app.url_path_for("analyze_user_behavior")
+
+        response = await client.post(url, json={"user_id": test_user_2.id}, headers=auth_headers)
+        assert response.status_code == 403
+
+        test_db.add(TeamMember(team_id=channel.team_id, user_id=test_user_2.id))
+        await test_db.commit()
+        response = await client.post(url, json={"user_id": test_user_2.id}, headers=auth_headers)
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["message_count"] == 2
+        assert data["profile"]["top_channels"] == [channel.id]
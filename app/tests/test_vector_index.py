@@ -0,0 +1,265 @@
+"""
+消息向量索引与语义搜索测试
+
+使用本地哈希向量化器，不依赖外部接口。
+SQLite 的 CURRENT_TIMESTAMP 只精确到秒，测试数据显式设置 created_at / updated_at。
+"""
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.models.channel import Channel, ChannelType
+from app.models.channel_member import ChannelMember
+from app.models.message import Message
+from app.models.team import Team
+from app.models.team_member import TeamMember
+from app.schemas.ai import SmartSearchRequest
+from app.services import vector_index
+from app.services.ai_service import AIService
+from app.services.embedding import HashingEmbedder
+from app.services.vector_index import MessageIndexer, VectorIndex
+
+
+BASE_TIME = datetime(2025, 3, 2, 9, 0, tzinfo=timezone.utc)
+
+
+def _ts(minutes: int) -> float:
+    return (BASE_TIME + timedelta(minutes=minutes)).timestamp()
+
+
+@pytest.fixture
+def embedder():
+    return HashingEmbedder(dim=64)
+
+
+@pytest.fixture
+def session_factory(test_db):
+    return async_sessionmaker(test_db.bind, class_=AsyncSession, expire_on_commit=False)
+
+
+@pytest.fixture
+def indexer(embedder, session_factory, tmp_path):
+    return MessageIndexer(
+        embedder=embedder,
+        session_factory=session_factory,
+        index_dir=str(tmp_path / "index"),
+        batch_size=2
+    )
+
+
+def _random_index(dim: int = 16) -> VectorIndex:
+    rng = np.random.default_rng(0)
+    index = VectorIndex(dim)
+    for channel_id in (1, 2):
+        vectors = rng.normal(size=(50, dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        ids = np.arange(50, dtype=np.int64) + channel_id * 1000
+        index.upsert(channel_id, ids, vectors, np.asarray([_ts(i) for i in range(50)]))
+    return index
+
+
+class TestHashingEmbedder:
+    """哈希向量化测试"""
+
+    @pytest.mark.asyncio
+    async def test_deterministic_and_normalized(self, embedder):
+        """测试结果确定且已归一化"""
+        first = await embedder.embed(["部署 流水线 failed", ""])
+        second = await embedder.embed(["部署 流水线 failed", ""])
+
+        assert np.array_equal(first, second)
+        assert first.shape == (2, 64)
+        assert np.isclose(np.linalg.norm(first[0]), 1.0)
+        assert not first[1].any()
+
+    @pytest.mark.asyncio
+    async def test_related_text_scores_higher(self, embedder):
+        """测试共享词语的文本相似度更高"""
+        query, related, unrelated = await embedder.embed(["数据库迁移", "明天做数据库迁移", "午饭吃什么"])
+
+        assert query @ related > query @ unrelated
+
+
+class TestVectorIndex:
+    """向量索引测试"""
+
+    def test_search_matches_brute_force(self):
+        """测试分区 top-k 结果与全量计算一致，并只检索指定频道"""
+        index = _random_index()
+        queries = index.partitions[1].vectors[:3]
+
+        results = index.search(queries, [1], k=5)
+
+        vectors = index.partitions[1].vectors[:50]
+        for query, hits in zip(queries, results):
+            expected = np.argsort(-(vectors @ query))[:5] + 1000
+            assert [message_id for message_id, _ in hits] == expected.tolist()
+        assert index.search(queries, [3], k=5) == [[], [], []]
+
+    def test_time_range_filter(self):
+        """测试按消息时间过滤"""
+        index = _random_index()
+
+        hits = index.search(index.partitions[2].vectors[0], [1, 2], k=100, start_ts=_ts(10), end_ts=_ts(19))[0]
+
+        assert len(hits) == 20
+        assert {message_id % 1000 for message_id, _ in hits} == set(range(10, 20))
+
+    def test_upsert_and_remove(self):
+        """测试覆盖和删除后的检索结果"""
+        index = _random_index()
+        partition = index.partitions[1]
+        target = partition.vectors[10].copy()
+
+        index.remove(1, [1010, 1000, 9999])
+        assert len(partition) == 48
+        assert 1010 not in [message_id for message_id, _ in index.search(target, [1], k=48)[0]]
+
+        index.upsert(1, np.asarray([1049], dtype=np.int64), target[None, :], np.asarray([_ts(0)]))
+        assert len(partition) == 48
+        assert index.search(target, [1], k=1)[0][0][0] == 1049
+
+    def test_mutations_do_not_touch_published_view(self):
+        """测试删除和覆盖在新数组上进行，检索线程已取得的视图保持不变"""
+        index = _random_index()
+        partition = index.partitions[1]
+        ids, vectors, _ = partition.view()
+        before_ids, before_vectors = ids.copy(), vectors.copy()
+
+        index.remove(1, [1000, 1010])
+        index.upsert(1, np.asarray([1020], dtype=np.int64), np.zeros((1, 16), dtype=np.float32), np.asarray([_ts(0)]))
+
+        assert np.array_equal(ids, before_ids) and np.array_equal(vectors, before_vectors)
+        assert len(partition.view()[0]) == 48 and 1000 not in partition.view()[0]
+
+    def test_save_and_load(self, tmp_path):
+        """测试快照保存后以内存映射加载，修改时复制"""
+        index = _random_index()
+        index.watermark = (_ts(5), 7)
+        index.save(str(tmp_path))
+        index.save(str(tmp_path))
+        index.save(str(tmp_path))
+
+        loaded = VectorIndex.load(str(tmp_path), 16)
+
+        assert len(list(tmp_path.glob("snapshot-*"))) == 2
+        assert loaded.watermark == (_ts(5), 7)
+        assert isinstance(loaded.partitions[1].vectors, np.memmap)
+        query = index.partitions[2].vectors[3]
+        assert loaded.search(query, [1, 2], k=5) == index.search(query, [1, 2], k=5)
+
+        loaded.remove(2, [2003])
+        assert loaded.search(query, [2], k=1)[0][0][0] != 2003
+        assert VectorIndex.load(str(tmp_path), 16).search(query, [2], k=1)[0][0][0] == 2003
+
+    def test_load_without_snapshot(self, tmp_path):
+        """测试没有快照时返回空索引"""
+        assert len(VectorIndex.load(str(tmp_path), 16)) == 0
+
+
+class TestMessageIndexer:
+    """增量索引与语义搜索测试"""
+
+    @pytest.mark.asyncio
+    async def test_sync_tracks_new_edited_and_deleted_messages(self, test_db, indexer):
+        """测试增量同步新增、编辑和删除的消息"""
+        for i, content in enumerate(["数据库迁移计划", "午饭吃什么", "发布流程说明"]):
+            created_at = BASE_TIME + timedelta(minutes=i)
+            test_db.add(Message(content=content, author_id=1, channel_id=1, created_at=created_at, updated_at=created_at))
+        await test_db.commit()
+
+        assert await indexer.sync() == 3
+        assert await indexer.sync() == 0
+        hits = await indexer.search("数据库迁移", [1], k=1)
+        assert hits[0][0] == 1
+
+        edited_at = BASE_TIME + timedelta(hours=1)
+        await test_db.execute(update(Message).where(Message.id == 1).values(content="周末聚餐", updated_at=edited_at))
+        await test_db.execute(update(Message).where(Message.id == 3).values(is_deleted=True, updated_at=edited_at))
+        await test_db.commit()
+
+        assert await indexer.sync() == 2
+        hits = await indexer.search("数据库迁移", [1], k=5)
+        assert 3 not in [message_id for message_id, _ in hits]
+        assert len(hits) == 2
+
+    @pytest.mark.asyncio
+    async def test_index_survives_restart(self, test_db, indexer, embedder, session_factory):
+        """测试停止时保存快照，重新启动后从水位继续同步"""
+        test_db.add(Message(content="数据库迁移计划", author_id=1, channel_id=1, created_at=BASE_TIME))
+        await test_db.commit()
+        await indexer.start()
+        await indexer.sync()
+        await indexer.stop()
+
+        restarted = MessageIndexer(embedder=embedder, session_factory=session_factory, index_dir=indexer.index_dir)
+        index = await restarted.load()
+
+        assert len(index) == 1
+        assert index.watermark is not None
+
+    @pytest.mark.asyncio
+    async def test_single_writer_per_index_dir(self, test_db, indexer, embedder, session_factory):
+        """测试同一索引目录只有一个进程写入，其他进程跟随快照，写入进程退出后由跟随进程接替"""
+        test_db.add(Message(content="数据库迁移计划", author_id=1, channel_id=1, created_at=BASE_TIME))
+        await test_db.commit()
+        follower = MessageIndexer(embedder=embedder, session_factory=session_factory, index_dir=indexer.index_dir)
+        await indexer.start()
+        await follower.start()
+        try:
+            assert indexer.is_writer and not follower.is_writer
+
+            await indexer.sync()
+            indexer.index.save(indexer.index_dir)
+
+            assert await follower.follow()
+            assert not await follower.follow()
+            assert (await follower.search("数据库迁移", [1], k=1))[0][0] == 1
+        finally:
+            await indexer.stop()
+
+        try:
+            assert follower._acquire_writer()
+        finally:
+            await follower.stop()
+
+    @pytest.mark.asyncio
+    async def test_intelligent_search_respects_channel_access(
+        self, test_db, test_user, test_user_2, indexer, monkeypatch
+    ):
+        """测试语义搜索只返回用户可访问频道的消息"""
+        team = Team(name="团队", slug="search", owner_id=test_user.id)
+        test_db.add(team)
+        await test_db.flush()
+        public = Channel(name="general", type=ChannelType.PUBLIC, team_id=team.id, created_by=test_user.id)
+        private = Channel(name="secret", type=ChannelType.PRIVATE, team_id=team.id, created_by=test_user.id)
+        test_db.add_all([
+            public, private,
+            TeamMember(team_id=team.id, user_id=test_user.id),
+            TeamMember(team_id=team.id, user_id=test_user_2.id),
+        ])
+        await test_db.flush()
+        test_db.add(ChannelMember(channel_id=private.id, user_id=test_user.id))
+        times = {"created_at": BASE_TIME, "updated_at": BASE_TIME}
+        test_db.add_all([
+            Message(content="数据库迁移今晚进行", author_id=test_user.id, channel_id=public.id, **times),
+            Message(content="数据库迁移的密码", author_id=test_user.id, channel_id=private.id, **times),
+            Message(content="午饭吃什么", author_id=test_user.id, channel_id=public.id, **times),
+        ])
+        await test_db.commit()
+
+        monkeypatch.setattr(vector_index, "message_indexer", indexer)
+        await indexer.sync()
+
+        response = await AIService(test_db).intelligent_search(SmartSearchRequest(query="数据库迁移"), test_user_2.id)
+
+        assert response.search_type == "semantic"
+        assert response.results[0].content == "数据库迁移今晚进行"
+        assert response.results[0].channel_name == "general"
+        assert all(result.channel_name == "general" for result in response.results)
+
+        response = await AIService(test_db).intelligent_search(SmartSearchRequest(query="数据库迁移"), test_user.id)
+        assert {result.channel_name for result in response.results} == {"general", "secret"}
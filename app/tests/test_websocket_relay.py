@@ -0,0 +1,120 @@
+"""
+WebSocket 跨 worker 转发测试
+
+用 fakeredis 模拟共享的 Redis，两个连接管理器代表两个 worker。
+"""
+import asyncio
+import json
+
+import pytest
+
+from app.services.websocket_manager import ConnectionManager
+from app.services.websocket_relay import WebSocketRelay
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class FakeWebSocket:
+    """记录发送的消息"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text: str):
+        self.sent.append(json.loads(text))
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        pass
+
+
+@pytest.fixture
+async def workers():
+    """共享同一个 Redis 的两个 worker"""
+    server = fakeredis.FakeServer()
+    relays = []
+    for _ in range(2):
+        relay = WebSocketRelay(
+            ConnectionManager(), client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True),
+            presence_ttl=30, presence_interval=3600
+        )
+        await relay.start()
+        relays.append(relay)
+    yield [relay.manager for relay in relays]
+    for relay in relays:
+        await relay.stop()
+
+
+async def _received(websocket, count: int = 1):
+    for _ in range(100):
+        if len(websocket.sent) >= count:
+            break
+        await asyncio.sleep(0.01)
+    return websocket.sent
+
+
+class TestWebSocketRelay:
+    """跨 worker 转发测试"""
+
+    @pytest.mark.asyncio
+    async def test_broadcast_reaches_other_worker(self, workers):
+        """测试频道广播和个人消息送达其他 worker 上的连接，本 worker 的连接只收到一次"""
+        first, second = workers
+        local, remote = FakeWebSocket(), FakeWebSocket()
+        await first.connect(local, 1)
+        await second.connect(remote, 2)
+
+        await first.broadcast_to_channel(5, {"type": "new_message", "data": {"id": 1}})
+        assert await _received(remote) == [{"type": "new_message", "data": {"id": 1}}]
+
+        await first.send_personal_messages([(2, {"type": "notification", "data": {"id": 7}})])
+        assert (await _received(remote, 2))[-1] == {"type": "notification", "data": {"id": 7}}
+
+        await second.broadcast_to_channel(5, {"type": "user_typing"}, exclude_user=1)
+        await asyncio.sleep(0.1)
+        assert local.sent == [{"type": "new_message", "data": {"id": 1}}]
+        assert [message["type"] for message in remote.sent] == ["new_message", "notification", "user_typing"]
+
+    @pytest.mark.asyncio
+    async def test_presence_is_shared(self, workers):
+        """测试在线状态包括其他 worker 上的连接，断开后续期时变为离线"""
+        first, second = workers
+        await second.connect(FakeWebSocket(), 2)
+
+        assert not first.is_user_online(2)
+        await first.relay.sync_presence()
+        assert first.is_user_online(2)
+        assert not first.is_user_online(2, channel_id=5)
+
+        await second.disconnect(2)
+        await first.relay.sync_presence()
+        assert not first.is_user_online(2)
+
+    @pytest.mark.asyncio
+    async def test_stale_presence_expires(self, workers):
+        """测试超过 presence_ttl 未续期的 worker 上的用户视为离线"""
+        first, second = workers
+        await second.connect(FakeWebSocket(), 2)
+        await first.relay.sync_presence()
+        assert first.is_user_online(2)
+
+        # 第二个 worker 崩溃，不再续期
+        first.relay.presence_ttl = 1e-9
+        await asyncio.sleep(0.01)
+        await first.relay.sync_presence()
+        assert not first.is_user_online(2)
+
+    @pytest.mark.asyncio
+    async def test_custom_event(self, workers):
+        """测试自定义事件由其他 worker 上注册的处理函数处理，发布者自己不处理"""
+        first, second = workers
+        received = {first: [], second: []}
+        for manager in workers:
+            manager.relay.on("unread_count", lambda event, manager=manager: received[manager].append(event["user_ids"]))
+
+        await first.relay.publish("unread_count", user_ids=[1, 2])
+        for _ in range(100):
+            if received[second]:
+                break
+            await asyncio.sleep(0.01)
+
+        assert received == {first: [], second: [[1, 2]]}
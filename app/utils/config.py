@@ -2,31 +2,36 @@ import os
 from configparser import ConfigParser
 from functools import cached_property
 from pathlib import Path
-from typing import TypeVar, cast
+from typing import Optional, TypeVar, cast
 
 from pydantic import PostgresDsn
 
 T = TypeVar("T", str, bool, int, float)
 
 
+def _read_config_file(config_path: str = "config.ini") -> ConfigParser:
+    """Parse the INI file once; the result can be shared by all config sections"""
+    parser = ConfigParser()
+    if Path(config_path).exists():
+        parser.read(config_path)
+    else:
+        raise FileNotFoundError(f"Config file not found: {config_path}")
+    return parser
+
+
 class ConfigValue:
-    def __init__(self, section: str, use_section_prefix: bool = True):
+    def __init__(self, section: str, use_section_prefix: bool = True, parser: Optional[ConfigParser] = None):
         self._section = section
         self._use_section_prefix = use_section_prefix
-        self._config = ConfigParser()
-
-        # Load the INI file if it exists
-        config_path = "config.ini"
-        if Path(config_path).exists():
-            self._config.read(config_path)
-        else:
-            raise FileNotFoundError(f"Config file not found: {config_path}")
+        # Reuse an already parsed INI file when given, otherwise load it ourselves
+        self._config = parser if parser is not None else _read_config_file()
 
-    def get_value(self, key: str, value_type: type[T]) -> T:
+    def get_value(self, key: str, value_type: type[T], fallback: Optional[T] = None) -> T:
         """
         Get a configuration value with the following precedence:
         1. Environment variable (SECTION_KEY if use_section_prefix is True, otherwise just KEY)
         2. INI file value
+        3. fallback (if given and the key is missing from the INI file)
         """
         # First check environment variable
         env_key = f"{self._section.upper()}_{key.upper()}" if self._use_section_prefix else key.upper()
@@ -36,6 +41,8 @@ class ConfigValue:
             return self._cast_value(env_value, value_type)
 
         # Fallback to INI file
+        if fallback is not None and not self._config.has_option(self._section, key):
+            return fallback
         value = self._config.get(self._section, key)
         os.environ[env_key] = value
         return self._cast_value(value, value_type)
@@ -55,8 +62,8 @@ class ConfigValue:
 
 
 class _LLMConfig(ConfigValue):
-    def __init__(self) -> None:
-        super().__init__("llm")
+    def __init__(self, parser: Optional[ConfigParser] = None) -> None:
+        super().__init__("llm", parser=parser)
 
     @cached_property
     def endpoint(self) -> str:
@@ -70,13 +77,72 @@ class _LLMConfig(ConfigValue):
     def api_key(self) -> str:
         return self.get_value("api_key", str)
 
+    @cached_property
+    def max_concurrency(self) -> int:
+        # Upper bound on in-flight requests to the LLM endpoint from one process
+        return self.get_value("max_concurrency", int, fallback=4)
+
+    @cached_property
+    def timeout(self) -> float:
+        return self.get_value("timeout", float, fallback=60.0)
+
+    @cached_property
+    def segment_tokens(self) -> int:
+        # Token budget of one chunk of channel history sent in a single summarization request
+        return self.get_value("segment_tokens", int, fallback=3000)
+
+    @cached_property
+    def summary_window_bucket(self) -> int:
+        # Summary window starts are floored to a multiple of this many seconds so rolling windows share a cache entry
+        return self.get_value("summary_window_bucket", int, fallback=900)
+
+    @cached_property
+    def pool_size(self) -> int:
+        # Keep-alive connections held open to the LLM endpoint (never below max_concurrency)
+        return self.get_value("pool_size", int, fallback=16)
+
+    @cached_property
+    def keepalive_expiry(self) -> float:
+        return self.get_value("keepalive_expiry", float, fallback=30.0)
+
+    @cached_property
+    def requests_per_minute(self) -> int:
+        # Provider quota; 0 disables the limit
+        return self.get_value("requests_per_minute", int, fallback=0)
+
+    @cached_property
+    def tokens_per_minute(self) -> int:
+        # Provider quota on prompt + completion tokens; 0 disables the limit
+        return self.get_value("tokens_per_minute", int, fallback=0)
+
+    @cached_property
+    def quota_processes(self) -> int:
+        # Processes sharing the quotas above, each one limits itself to quota / quota_processes;
+        # 0 means [service] workers
+        return self.get_value("quota_processes", int, fallback=0)
+
+    @cached_property
+    def max_retries(self) -> int:
+        # Retries on 429 / 5xx / connection errors
+        return self.get_value("max_retries", int, fallback=3)
+
+    @cached_property
+    def batch_size(self) -> int:
+        # Max small prompts sharing one context merged into a single request
+        return self.get_value("batch_size", int, fallback=8)
+
+    @cached_property
+    def batch_wait(self) -> float:
+        # Seconds to wait for more prompts before sending a batch
+        return self.get_value("batch_wait", float, fallback=0.02)
+
     def __str__(self) -> str:
         return f"Endpoint: {self.endpoint} Model: {self.model} API Key: {self.api_key}"
 
 
 class _KnowledgeServerConfig(ConfigValue):
-    def __init__(self) -> None:
-        super().__init__("knowledge_server")
+    def __init__(self, parser: Optional[ConfigParser] = None) -> None:
+        super().__init__("knowledge_server", parser=parser)
 
     @cached_property
     def host(self) -> str:
@@ -91,8 +157,8 @@ class _KnowledgeServerConfig(ConfigValue):
 
 
 class _MinioConfig(ConfigValue):
-    def __init__(self) -> None:
-        super().__init__("minio")
+    def __init__(self, parser: Optional[ConfigParser] = None) -> None:
+        super().__init__("minio", parser=parser)
 
     @cached_property
     def endpoint(self) -> str:
@@ -110,23 +176,61 @@ class _MinioConfig(ConfigValue):
     def bucket(self) -> str:
         return self.get_value("bucket", str)
 
+    @cached_property
+    def region(self) -> str:
+        return self.get_value("region", str, fallback="us-east-1")
+
+    @cached_property
+    def secure(self) -> bool:
+        # Use HTTPS to reach the endpoint
+        return self.get_value("secure", bool, fallback=False)
+
+    def __str__(self) -> str:
+        return f"Endpoint: {self.endpoint} Bucket: {self.bucket}"
+
 
 class _ServiceConfig(ConfigValue):
-    def __init__(self) -> None:
+    def __init__(self, parser: Optional[ConfigParser] = None) -> None:
         # For service config, we don't want to prefix env vars with SERVICE_
-        super().__init__("service", use_section_prefix=False)
+        super().__init__("service", use_section_prefix=False, parser=parser)
 
     @cached_property
     def env(self) -> str:
         return self.get_value("env", str)
 
+    @cached_property
+    def host(self) -> str:
+        return self.get_value("host", str, fallback="0.0.0.0")
+
+    @cached_property
+    def port(self) -> int:
+        return self.get_value("port", int, fallback=8000)
+
+    @cached_property
+    def workers(self) -> int:
+        # Without the relay, real-time messages only reach sockets on the worker that handled the write
+        return self.get_value("workers", int, fallback=(os.cpu_count() or 1) if self.relay_url else 1)
+
+    @cached_property
+    def relay_url(self) -> str:
+        # Redis URL for relaying WebSocket messages and presence between workers; empty disables the relay
+        return self.get_value("relay_url", str, fallback="")
+
+    @cached_property
+    def presence_ttl(self) -> float:
+        return self.get_value("presence_ttl", float, fallback=30.0)
+
+    @cached_property
+    def presence_interval(self) -> float:
+        return self.get_value("presence_interval", float, fallback=10.0)
+
     def __str__(self) -> str:
         return f"Env: {self.env}"
 
 
 class _DatabaseConfig(ConfigValue):
-    def __init__(self) -> None:
-        super().__init__("database")
+    def __init__(self, parser: Optional[ConfigParser] = None) -> None:
+        super().__init__("database", parser=parser)
 
     @cached_property
     def host(self) -> str:
@@ -156,19 +260,349 @@ class _DatabaseConfig(ConfigValue):
     def url(self) -> str:
         return f"postgresql://{self.user}:{self.password}@{self.host}:{self.port}/{self.name}"
 
+    @cached_property
+    def replica_host(self) -> str:
+        # 留空表示没有只读副本，所有查询都走主库
+        return self.get_value("replica_host", str, fallback="")
+
+    @cached_property
+    def replica_port(self) -> int:
+        return self.get_value("replica_port", int, fallback=self.port)
+
+    @cached_property
+    def replica_lag_window(self) -> float:
+        # 用户写入后在该时间窗口（秒）内的读取仍然走主库，避免读到复制延迟前的旧数据
+        return self.get_value("replica_lag_window", float, fallback=5.0)
+
+    @cached_property
+    def pool_warmup(self) -> int:
+        # Number of connections opened per engine at startup before serving traffic
+        return self.get_value("pool_warmup", int, fallback=5)
+
+    @cached_property
+    def replica_url(self) -> Optional[str]:
+        if not self.replica_host:
+            return None
+        return f"postgresql://{self.user}:{self.password}@{self.replica_host}:{self.replica_port}/{self.name}"
+
+    def __str__(self) -> str:
+        return (
+            f"Host: {self.host} Port: {self.port} DB: {self.name} User: {self.user} Schema: {self.schema} "
+            f"Replica: {self.replica_host or '-'}"
+        )
+
+
+class _NotificationConfig(ConfigValue):
+    def __init__(self, parser: Optional[ConfigParser] = None) -> None:
+        super().__init__("notification", parser=parser)
+
+    @cached_property
+    def retention_days(self) -> int:
+        # 已读通知保留天数，超过后由后台任务分批清理；0 表示不清理
+        return self.get_value("retention_days", int, fallback=90)
+
+    @cached_property
+    def retention_batch_size(self) -> int:
+        return self.get_value("retention_batch_size", int, fallback=1000)
+
+    @cached_property
+    def retention_interval(self) -> float:
+        # 两次清理之间的间隔（秒）
+        return self.get_value("retention_interval", float, fallback=3600.0)
+
+    def __str__(self) -> str:
+        return f"Retention: {self.retention_days}d Batch: {self.retention_batch_size}"
+
+
+class _AIJobsConfig(ConfigValue):
+    def __init__(self, parser: Optional[ConfigParser] = None) -> None:
+        super().__init__("ai_jobs", parser=parser)
+
+    @cached_property
+    def workers(self) -> int:
+        # 同时执行的任务数
+        return self.get_value("workers", int, fallback=4)
+
+    @cached_property
+    def embedded(self) -> bool:
+        # 是否在API进程内运行任务执行器；生产环境建议关闭，改用 python -m app.worker 单独运行
+        # Under the pre-fork launcher only the first worker runs it (the others get AI_JOBS_EMBEDDED=false)
+        return self.get_value("embedded", bool, fallback=True)
+
+    @cached_property
+    def channel_concurrency(self) -> int:
+        # 批量摘要同时处理的频道数，每个频道占用一个数据库连接，应明显小于连接池大小
+        return self.get_value("channel_concurrency", int, fallback=4)
+
+    @cached_property
+    def poll_interval(self) -> float:
+        return self.get_value("poll_interval", float, fallback=2.0)
+
+    @cached_property
+    def lease_seconds(self) -> float:
+        # 执行中的任务超过该时间没有心跳，视为执行器已退出，任务重新排队
+        return self.get_value("lease_seconds", float, fallback=60.0)
+
+    @cached_property
+    def max_attempts(self) -> int:
+        return self.get_value("max_attempts", int, fallback=3)
+
+    @cached_property
+    def retry_base_delay(self) -> float:
+        # 第 n 次重试前等待 retry_base_delay * 2^(n-1) 秒
+        return self.get_value("retry_base_delay", float, fallback=5.0)
+
+    def __str__(self) -> str:
+        return f"Workers: {self.workers} Embedded: {self.embedded}"
+
+
+class _SearchConfig(ConfigValue):
+    def __init__(self, parser: Optional[ConfigParser] = None) -> None:
+        super().__init__("search", parser=parser)
+
+    @cached_property
+    def embedding_provider(self) -> str:
+        # hashing: 本地特征哈希（离线可用）；openai: OpenAI 兼容的 embeddings 接口
+        return self.get_value("embedding_provider", str, fallback="hashing")
+
+    @cached_property
+    def embedding_model(self) -> str:
+        return self.get_value("embedding_model", str, fallback="")
+
+    @cached_property
+    def embedding_endpoint(self) -> str:
+        # 留空时使用 [llm] endpoint
+        return self.get_value("embedding_endpoint", str, fallback="")
+
+    @cached_property
+    def embedding_dim(self) -> int:
+        return self.get_value("embedding_dim", int, fallback=256)
+
+    @cached_property
+    def index_dir(self) -> str:
+        return self.get_value("index_dir", str, fallback="data/vector_index")
+
+    @cached_property
+    def index_poll_interval(self) -> float:
+        # 增量索引轮询消息变更的间隔（秒），本进程内的消息变更会立即触发
+        return self.get_value("index_poll_interval", float, fallback=5.0)
+
+    @cached_property
+    def index_batch_size(self) -> int:
+        return self.get_value("index_batch_size", int, fallback=256)
+
+    @cached_property
+    def index_save_interval(self) -> float:
+        # Followers (workers without the writer lock) only see new messages after the writer saves a snapshot
+        return self.get_value("index_save_interval", float, fallback=60.0)
+
+    def __str__(self) -> str:
+        return f"Embedding: {self.embedding_provider} Dim: {self.embedding_dim} Index: {self.index_dir}"
+
+
+class _ProfilesConfig(ConfigValue):
+    def __init__(self, parser: Optional[ConfigParser] = None) -> None:
+        super().__init__("profiles", parser=parser)
+
+    @cached_property
+    def profile_dir(self) -> str:
+        return self.get_value("profile_dir", str, fallback="data/user_profiles")
+
+    @cached_property
+    def poll_interval(self) -> float:
+        # 增量更新轮询新消息的间隔（秒），本进程内发送的消息会立即触发
+        return self.get_value("poll_interval", float, fallback=10.0)
+
+    @cached_property
+    def batch_size(self) -> int:
+        return self.get_value("batch_size", int, fallback=1000)
+
+    @cached_property
+    def save_interval(self) -> float:
+        return self.get_value("save_interval", float, fallback=300.0)
+
+    @cached_property
+    def rebuild_workers(self) -> int:
+        # 全量重算的进程数
+        return self.get_value("rebuild_workers", int, fallback=4)
+
+    @cached_property
+    def rebuild_chunk_size(self) -> int:
+        return self.get_value("rebuild_chunk_size", int, fallback=50000)
+
+    def __str__(self) -> str:
+        return f"Dir: {self.profile_dir} Rebuild Workers: {self.rebuild_workers}"
+
+
+class _AttachmentsConfig(ConfigValue):
+    def __init__(self, parser: Optional[ConfigParser] = None) -> None:
+        super().__init__("attachments", parser=parser)
+
+    @cached_property
+    def backend(self) -> str:
+        # "local" stores files under local_dir; "minio" uses the S3-compatible store in [minio]
+        return self.get_value("backend", str, fallback="local")
+
+    @cached_property
+    def local_dir(self) -> str:
+        return self.get_value("local_dir", str, fallback="data/attachments")
+
+    @cached_property
+    def max_size(self) -> int:
+        return self.get_value("max_size", int, fallback=1024 ** 3)
+
+    @cached_property
+    def part_size(self) -> int:
+        # Part size of resumable uploads; S3 requires at least 5 MiB for all parts but the last
+        return self.get_value("part_size", int, fallback=8 * 1024 ** 2)
+
+    @cached_property
+    def presign_expiry(self) -> int:
+        # Seconds a presigned upload URL stays valid
+        return self.get_value("presign_expiry", int, fallback=900)
+
+    @cached_property
+    def download_redirect(self) -> bool:
+        # Redirect downloads from the S3-compatible store to presigned URLs instead of proxying them
+        return self.get_value("download_redirect", bool, fallback=True)
+
+    @cached_property
+    def cache_max_age(self) -> int:
+        # Cache-Control max-age of downloads; attachment contents never change
+        return self.get_value("cache_max_age", int, fallback=86400)
+
+    @cached_property
+    def hot_cache_size(self) -> int:
+        # Total bytes of small files kept in memory; 0 disables the cache
+        return self.get_value("hot_cache_size", int, fallback=64 * 1024 ** 2)
+
+    @cached_property
+    def hot_file_max_size(self) -> int:
+        return self.get_value("hot_file_max_size", int, fallback=1024 ** 2)
+
+    @cached_property
+    def gc_grace(self) -> int:
+        # Seconds an unreferenced blob is kept before garbage collection (covers uploads not yet sent in a message)
+        return self.get_value("gc_grace", int, fallback=86400)
+
+    @cached_property
+    def gc_batch_size(self) -> int:
+        return self.get_value("gc_batch_size", int, fallback=500)
+
+    @cached_property
+    def upload_expiry(self) -> int:
+        # Seconds after which an unfinished upload is aborted and its staged data deleted
+        return self.get_value("upload_expiry", int, fallback=86400)
+
+    @cached_property
+    def preview_workers(self) -> int:
+        # Processes rendering thumbnails and PDF previews
+        return self.get_value("preview_workers", int, fallback=2)
+
+    @cached_property
+    def preview_max_source_size(self) -> int:
+        # Files larger than this get no preview
+        return self.get_value("preview_max_source_size", int, fallback=50 * 1024 ** 2)
+
+    @cached_property
+    def preview_quality(self) -> int:
+        return self.get_value("preview_quality", int, fallback=80)
+
+    @cached_property
+    def preview_poll_interval(self) -> float:
+        # Seconds between scans for previews left pending by other processes or restarts
+        return self.get_value("preview_poll_interval", float, fallback=30.0)
+
+    @cached_property
+    def preview_lease(self) -> int:
+        # Seconds after which an unfinished preview job is claimed again
+        return self.get_value("preview_lease", int, fallback=600)
+
+    def __str__(self) -> str:
+        return f"Backend: {self.backend} Max Size: {self.max_size} Hot Cache Size: {self.hot_cache_size}"
+
+
+class _MonitoringConfig(ConfigValue):
+    def __init__(self, parser: Optional[ConfigParser] = None) -> None:
+        super().__init__("monitoring", parser=parser)
+
+    @cached_property
+    def query_stats(self) -> bool:
+        # Count and time SQL statements per HTTP request and WebSocket command
+        return self.get_value("query_stats", bool, fallback=True)
+
+    @cached_property
+    def server_timing(self) -> bool:
+        # Report database time in the Server-Timing response header
+        return self.get_value("server_timing", bool, fallback=True)
+
+    @cached_property
+    def slow_request(self) -> float:
+        # Requests slower than this (seconds) are logged with their most expensive statements
+        return self.get_value("slow_request", float, fallback=1.0)
+
+    @cached_property
+    def n_plus_one_threshold(self) -> int:
+        # The same statement executed at least this many times in one request is reported as an N+1 suspect
+        return self.get_value("n_plus_one_threshold", int, fallback=5)
+
+    @cached_property
+    def metrics_dir(self) -> str:
+        # Directory where each worker writes its metrics so /metrics can merge them; the prefork
+        # launcher uses a temporary directory when empty, a single process keeps metrics in memory
+        return self.get_value("metrics_dir", str, fallback="")
+
+    @cached_property
+    def metrics_flush_interval(self) -> float:
+        # Seconds between writes of a worker's metrics file
+        return self.get_value("metrics_flush_interval", float, fallback=5.0)
+
+    @cached_property
+    def profiling_admins(self) -> frozenset:
+        # Comma-separated usernames allowed to use the profiling endpoints; empty disables profiling
+        admins = self.get_value("profiling_admins", str, fallback="")
+        return frozenset(name.strip() for name in admins.split(",") if name.strip())
+
+    @cached_property
+    def profile_max_seconds(self) -> float:
+        # Upper bound on the duration of one sampling CPU profile
+        return self.get_value("profile_max_seconds", float, fallback=60.0)
+
+    @cached_property
+    def loop_watchdog(self) -> bool:
+        # Measure event-loop lag from a side thread and log the stack of callbacks that block the loop
+        return self.get_value("loop_watchdog", bool, fallback=True)
+
+    @cached_property
+    def loop_watchdog_interval(self) -> float:
+        # Seconds between two lag measurements
+        return self.get_value("loop_watchdog_interval", float, fallback=0.25)
+
+    @cached_property
+    def blocking_threshold(self) -> float:
+        # A callback holding the loop longer than this (seconds) is reported with its stack
+        return self.get_value("blocking_threshold", float, fallback=0.1)
+
     def __str__(self) -> str:
-        return f"Host: {self.host} Port: {self.port} DB: {self.name} User: {self.user} Schema: {self.schema}"
+        return f"Query Stats: {self.query_stats} Slow Request: {self.slow_request}"
 
 
 class _Config:
-    service = _ServiceConfig()
-    llm = _LLMConfig()
-    minio = _MinioConfig()
-    knowledge_server = _KnowledgeServerConfig()
-    database = _DatabaseConfig()
+    _parser = _read_config_file()
+    service = _ServiceConfig(_parser)
+    llm = _LLMConfig(_parser)
+    minio = _MinioConfig(_parser)
+    knowledge_server = _KnowledgeServerConfig(_parser)
+    database = _DatabaseConfig(_parser)
+    notification = _NotificationConfig(_parser)
+    ai_jobs = _AIJobsConfig(_parser)
+    search = _SearchConfig(_parser)
+    profiles = _ProfilesConfig(_parser)
+    attachments = _AttachmentsConfig(_parser)
+    monitoring = _MonitoringConfig(_parser)
 
     def __str__(self) -> str:
-        return f"Loaded config: LLM: {self.llm} Minio: {self.minio} Knowledge Server: {self.knowledge_server} Database: {self.database} Service: {self.service}"
+        return f"Loaded config: LLM: {self.llm} Minio: {self.minio} Knowledge Server: {self.knowledge_server} Database: {self.database} Notification: {self.notification} AI Jobs: {self.ai_jobs} Search: {self.search} Profiles: {self.profiles} Attachments: {self.attachments} Monitoring: {self.monitoring} Service: {self.service}"
 
 
 config = _Config()
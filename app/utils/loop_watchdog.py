@@ -0,0 +1,141 @@
+"""
+事件循环看门狗
+
+旁路线程定期用 call_soon_threadsafe 往事件循环投递一个回调，回调被执行前等待的时间即事件循环延迟，
+计入 event_loop_lag_seconds 指标。回调超过阈值仍未执行说明事件循环正被某个同步调用占用，
+此时旁路线程直接读取事件循环线程当前的调用栈并记录日志，定位到具体是哪段代码阻塞了事件循环。
+
+看门狗不在事件循环上运行任何任务，阻塞期间照样能采到栈。投递间隔为 interval，
+阻塞时间超过 threshold + interval 时一定会被捕获。
+
+测试中可以用 forbid_blocking() 让阻塞事件循环的代码直接失败（pytest --max-loop-block-ms=N 对所有测试生效）。
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Deque, Iterator, Optional
+
+from app.utils.config import config
+from app.utils.metrics import LOOP_BLOCKED, LOOP_LAG
+
+logger = logging.getLogger(__name__)
+
+# 保留的最近阻塞记录数
+MAX_BLOCKED_CALLS = 100
+
+
+@dataclass
+class BlockedCall:
+    """一次阻塞：阻塞时长（下限）和阻塞期间事件循环线程的调用栈"""
+    duration: float
+    stack: str
+
+
+class LoopWatchdog:
+    """测量事件循环延迟，捕获阻塞事件循环的调用栈"""
+
+    def __init__(self, threshold: Optional[float] = None, interval: Optional[float] = None, log: bool = True):
+        self.threshold = threshold
+        self.interval = interval
+        self.log = log
+        self.blocked: Deque[BlockedCall] = deque(maxlen=MAX_BLOCKED_CALLS)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """在事件循环中调用：启动看门狗线程"""
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止看门狗线程（线程最多在一个投递间隔内退出）"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        threshold = self.threshold or config.monitoring.blocking_threshold
+        interval = self.interval or config.monitoring.loop_watchdog_interval
+        loop = self._loop
+        while not self._stopping.wait(interval):
+            # 事件循环没在运行（例如测试中两次 run_until_complete 之间）时没有延迟可言
+            if not loop.is_running():
+                continue
+            beat = threading.Event()
+            posted = time.perf_counter()
+            try:
+                loop.call_soon_threadsafe(beat.set)
+            except RuntimeError:
+                # 事件循环已关闭
+                return
+            stack = None
+            if not beat.wait(threshold) and loop.is_running():
+                stack = self._loop_stack()
+            while not beat.wait(interval):
+                if self._stopping.is_set():
+                    return
+            lag = time.perf_counter() - posted
+            LOOP_LAG.observe(lag)
+            if stack is not None:
+                self._report(BlockedCall(lag, stack))
+
+    def _loop_stack(self) -> str:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return ""
+        return "".join(traceback.format_stack(frame))
+
+    def _report(self, call: BlockedCall) -> None:
+        LOOP_BLOCKED.inc()
+        self.blocked.append(call)
+        if self.log:
+            logger.warning(f"事件循环被阻塞 {call.duration * 1000:.0f}ms，阻塞期间的调用栈:\n{call.stack}")
+
+
+class LoopBlocked(AssertionError):
+    """代码阻塞事件循环超过允许的时间"""
+
+
+@contextmanager
+def forbid_blocking(max_ms: float) -> Iterator[LoopWatchdog]:
+    """
+    代码块中阻塞事件循环超过 max_ms 毫秒时失败（用于测试），在运行中的事件循环里使用
+
+        with forbid_blocking(50):
+            await client.post(...)
+    """
+    threshold = max_ms / 1000
+    watchdog = LoopWatchdog(threshold=threshold, interval=threshold / 4, log=False)
+    watchdog.start()
+    try:
+        yield watchdog
+    finally:
+        watchdog.stop()
+    if watchdog.blocked:
+        longest = max(watchdog.blocked, key=lambda call: call.duration)
+        raise LoopBlocked(
+            f"Event loop blocked for {longest.duration * 1000:.0f}ms (limit {max_ms:g}ms)\n{longest.stack}"
+        )
+
+
+# 全局看门狗
+loop_watchdog = LoopWatchdog()
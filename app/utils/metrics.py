@@ -0,0 +1,422 @@
+"""
+Prometheus 指标
+
+计数器、仪表和直方图，以 Prometheus 文本格式从 /metrics 导出。
+
+- 记录指标只是对预先创建的子指标做一次加法（直方图多一次二分查找），不构造字典、不加锁，
+  可以放在广播这样的热点路径上。带标签的子指标在模块加载或启动时用 labels() 取好并保存，热点路径直接使用；
+- 连接池、在线连接数这类状态由采集函数（register_collector）在导出时读取，平时没有开销；
+- 多 worker 部署时每个 worker 定期把自己的指标写到 metrics_dir 下以 pid 命名的文件，
+  任一 worker 响应 /metrics 时合并所有文件：计数器和直方图累加所有 worker（包括已退出的，保证单调递增），
+  仪表只累加仍在运行的 worker。
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import suppress
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.utils.config import config
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 耗时直方图的默认分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 样本：(名称后缀, 标签, 值)
+Sample = Tuple[str, Tuple[Tuple[str, str], ...], float]
+
+
+class CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def reset(self) -> None:
+        self.value = 0.0
+
+
+class GaugeChild(CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # 最后一个是 +Inf 桶
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def reset(self) -> None:
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self._default = self.labels()
+        (registry or metrics_registry).register(self)
+
+    @abstractmethod
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values) -> object:
+        """取（必要时创建）子指标；在热点路径之外调用并保存结果"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def reset(self) -> None:
+        # 子指标可能已被热点路径引用，原地清零而不是替换
+        for child in self._children.values():
+            child.reset()
+
+    def samples(self) -> Iterable[Sample]:
+        for key, child in list(self._children.items()):
+            labels = tuple(zip(self.labelnames, key))
+            yield from self._child_samples(labels, child)
+
+    def _child_samples(self, labels, child) -> Iterable[Sample]:
+        yield "", labels, child.value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> CounterChild:
+        return CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self) -> GaugeChild:
+        return GaugeChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default.dec(amount)
+
+    def set(self, value: float) -> None:
+        self._default.set(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS, registry=None
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def _child_samples(self, labels, child: HistogramChild) -> Iterable[Sample]:
+        cumulative = 0
+        counts = list(child.counts)
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            yield "_bucket", labels + (("le", _format_value(bound)),), cumulative
+        cumulative += counts[-1]
+        yield "_bucket", labels + (("le", "+Inf"),), cumulative
+        yield "_sum", labels, child.sum
+        yield "_count", labels, cumulative
+
+
+def _format_value(value: float) -> str:
+    if value == int(value) and abs(value) < 1e15:
+        return f"{int(value)}.0"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsRegistry:
+    """进程内的全部指标，以及多 worker 时的指标文件"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._directory: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def register_collector(self, collector: Callable[[], None]) -> None:
+        """导出前调用的采集函数，用来把当前状态写进仪表"""
+        self._collectors.append(collector)
+
+    @property
+    def directory(self) -> Optional[str]:
+        return self._directory or config.monitoring.metrics_dir or None
+
+    def use_directory(self, directory: str) -> None:
+        """多 worker 模式：由主进程在 fork 之前调用，清理上次运行留下的文件"""
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            os.unlink(path)
+        self._directory = directory
+
+    def reset(self) -> None:
+        """清零所有指标（fork 出的 worker 不继承主进程的计数）"""
+        for metric in self._metrics.values():
+            metric.reset()
+
+    def collect(self) -> Dict[str, Dict]:
+        """当前进程的指标快照"""
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f"指标采集失败: {e}")
+        return {
+            name: {
+                "type": metric.kind,
+                "help": metric.documentation,
+                "samples": [[suffix, [list(pair) for pair in labels], value] for suffix, labels, value in metric.samples()],
+            }
+            for name, metric in self._metrics.items()
+        }
+
+    def _write(self, snapshot: Dict) -> None:
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"pid": os.getpid(), "metrics": snapshot}, f)
+        os.replace(path + ".tmp", path)
+
+    async def flush(self) -> None:
+        """把本进程的指标写入指标文件"""
+        if self.directory is not None:
+            await asyncio.to_thread(self._write, self.collect())
+
+    def _read_all(self) -> List[Tuple[bool, Dict]]:
+        workers = []
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                # 正在被替换或已被删除
+                continue
+            workers.append((_pid_alive(data["pid"]), data["metrics"]))
+        return workers
+
+    async def render(self) -> str:
+        """Prometheus 文本格式；多 worker 时合并所有 worker 的指标"""
+        if self.directory is None:
+            return _render([(True, self.collect())])
+        await self.flush()
+        return _render(await asyncio.to_thread(self._read_all))
+
+    def start(self) -> None:
+        """多 worker 时定期写入指标文件"""
+        if self.directory is None or (self._task is not None and not self._task.done()):
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+            with suppress(OSError):
+                await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(config.monitoring.metrics_flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"写入指标文件失败: {e}")
+
+
+def _render(workers: List[Tuple[bool, Dict]]) -> str:
+    merged: Dict[str, Dict] = {}
+    for alive, metrics in workers:
+        for name, metric in metrics.items():
+            if metric["type"] == "gauge" and not alive:
+                continue
+            target = merged.setdefault(name, {"type": metric["type"], "help": metric["help"], "samples": {}})
+            for suffix, labels, value in metric["samples"]:
+                key = (suffix, tuple(tuple(pair) for pair in labels))
+                target["samples"][key] = target["samples"].get(key, 0) + value
+
+    lines = []
+    for name, metric in merged.items():
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for (suffix, labels), value in metric["samples"].items():
+            label_text = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+            lines.append(f"{name}{suffix}{{{label_text}}} {_format_value(value)}" if label_text
+                         else f"{name}{suffix} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# 全局指标注册表
+metrics_registry = MetricsRegistry()
+
+
+# HTTP
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ["method", "route"]
+)
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route template and status class", ["method", "route", "status"])
+
+# 数据库
+DB_QUERY_DURATION = Histogram("db_query_duration_seconds", "SQL statement latency by operation", ["operation"])
+DB_POOL_CHECKED_OUT = Gauge("db_pool_checked_out_connections", "Connections currently checked out of the pool", ["engine"])
+DB_POOL_IDLE = Gauge("db_pool_idle_connections", "Idle connections in the pool", ["engine"])
+
+# 实时推送
+WEBSOCKET_CONNECTIONS = Gauge("websocket_connections", "Open WebSocket connections")
+WEBSOCKET_SUBSCRIPTIONS = Gauge("websocket_channel_subscriptions", "Channel subscriptions of connected users")
+WEBSOCKET_ACTIVE_CHANNELS = Gauge("websocket_active_channels", "Channels with at least one subscribed user")
+WEBSOCKET_PENDING_SENDS = Gauge("websocket_pending_sends", "Frames handed to sockets and not yet written")
+WEBSOCKET_DROPPED_FRAMES = Counter("websocket_dropped_frames_total", "Frames that could not be delivered")
+BROADCAST_RECIPIENTS = Histogram(
+    "websocket_broadcast_recipients", "Connections a channel broadcast was delivered to",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+)
+BROADCAST_DURATION = Histogram("websocket_broadcast_duration_seconds", "Time to fan a broadcast out to all recipients")
+
+# 事件循环
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "Delay before a callback scheduled from the watchdog thread ran on the event loop",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+LOOP_BLOCKED = Counter("event_loop_blocked_total", "Callbacks that held the event loop longer than the blocking threshold")
+
+# AI
+AI_UPSTREAM_DURATION = Histogram(
+    "ai_upstream_request_duration_seconds", "LLM upstream request latency by outcome", ["outcome"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+)
+
+
+# 各路由的子指标：{(方法, 路由模板): (耗时直方图, {状态码首位: 计数器})}
+_route_children: Dict[Tuple[str, str], Tuple[HistogramChild, Dict[int, CounterChild]]] = {}
+def _http_children(method: str, route: str):
+    children = _route_children.get((method, route))
+    if children is None:
+        children = _route_children[(method, route)] = (
+            HTTP_REQUEST_DURATION.labels(method, route),
+            {digit: HTTP_REQUESTS.labels(method, route, f"{digit}xx") for digit in range(1, 6)},
+        )
+    return children
+
+
+def _route_template(scope) -> str:
+    """
+    请求匹配到的完整路由模板
+
+    被包含的路由器中的路由只带相对于前缀的模板（path_format），前缀从请求路径中取回：
+    模板和路径参数中共有几个 "/"，就从请求路径末尾去掉几段，剩下的就是各级前缀。
+    路由模板本身就是完整路径时剩下的前缀为空。
+    """
+    route = scope.get("route")
+    template = getattr(route, "path_format", None)
+    if template is None:
+        return getattr(route, "path", "unmatched")
+    depth = template.count("/") + sum(str(value).count("/") for value in scope.get("path_params", {}).values())
+    path = scope["path"]
+    prefix = path.rsplit("/", depth)[0] if depth else path
+    return prefix + template
+
+
+def preallocate_http_metrics(app) -> None:
+    """启动时按 OpenAPI 中的路由模板创建子指标；不在文档中的路由在第一次请求时创建"""
+    for template, operations in app.openapi().get("paths", {}).items():
+        for method in operations:
+            _http_children(method.upper(), template)
+
+
+class MetricsMiddleware:
+    """按路由模板统计 HTTP 请求耗时和状态"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # 路由匹配后 scope 中带有路由对象，未匹配的请求归为 unmatched，避免路径本身成为标签
+            duration, requests = _http_children(scope["method"], _route_template(scope))
+            duration.observe(loop.time() - started)
+            requests[min(max(status // 100, 1), 5)].inc()
@@ -1,6 +1,10 @@
 """
 密码处理工具
+
+bcrypt 单次计算需要数十到数百毫秒，在事件循环中应使用 *_async 版本，在线程中计算。
 """
+import asyncio
+
 from passlib.context import CryptContext
 
 # 密码加密上下文
@@ -14,4 +18,14 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def get_password_hash(password: str) -> str:
     """生成密码哈希"""
-    return pwd_context.hash(password) 
\ No newline at end of file
+    return pwd_context.hash(password) 
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """在线程中验证密码，不阻塞事件循环"""
+    return await asyncio.to_thread(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """在线程中生成密码哈希，不阻塞事件循环"""
+    return await asyncio.to_thread(get_password_hash, password)
@@ -0,0 +1,331 @@
+"""
+在线性能分析
+
+用于排查生产环境中某个 worker 变慢的原因，不需要重新部署：
+
+- CPU 采样：旁路线程按固定间隔读取事件循环线程的调用栈，输出折叠栈（collapsed stacks），
+  可直接交给 flamegraph.pl / speedscope 生成火焰图；
+- 单请求 cProfile：管理员的请求带 X-Profile 请求头时对该请求执行 cProfile，
+  响应头 X-Profile-Id 返回编号，之后按编号取回 pstats 文件或文本报告；
+- 内存：在一个请求内开启 tracemalloc，等待指定秒数后统计这段时间内新增且仍未释放的分配。
+
+多 worker 时后续请求会被分到任意一个 worker：单请求分析结果写入各 worker 共享的目录
+（由预启动器在 fork 之前指定），CPU 采样和内存统计都在一个请求内完成，不依赖 worker 的进程内状态。
+
+未在分析时不安装任何钩子；耗时的整理工作（栈格式化、pstats 排序、快照统计）都放到线程中执行，
+采样期间事件循环照常处理请求。cProfile 按线程生效，分析一个请求时同一事件循环上并发执行的其他请求也会计入。
+"""
+import asyncio
+import cProfile
+import glob
+import io
+import logging
+import marshal
+import os
+import pstats
+import secrets
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, OrderedDict
+from contextlib import suppress
+from typing import Dict, List, Optional, Union
+
+from jose import JWTError, jwt
+
+from app.utils.config import config
+
+logger = logging.getLogger(__name__)
+
+# 触发单请求分析的请求头，以及返回分析编号的响应头
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_HEADER = b"x-profile-id"
+
+# 默认采样间隔（秒）
+DEFAULT_SAMPLE_INTERVAL = 0.005
+# 保留的单请求分析结果数量
+MAX_REQUEST_PROFILES = 16
+
+
+def is_profiling_admin(username: Optional[str]) -> bool:
+    return username is not None and username in config.monitoring.profiling_admins
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def _sample_stacks(thread_id: int, duration: float, interval: float) -> Counter:
+    """在旁路线程中执行：按间隔记录目标线程的调用栈（只保存代码对象，结束后再格式化）"""
+    stacks: Counter = Counter()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        if stack:
+            stacks[tuple(reversed(stack))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def _collapse(stacks: Counter) -> str:
+    labels: Dict[object, str] = {}
+    lines = []
+    for stack, count in stacks.most_common():
+        names = []
+        for code in stack:
+            label = labels.get(code)
+            if label is None:
+                label = labels[code] = _frame_label(code)
+            names.append(label)
+        lines.append(f"{';'.join(names)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+class CPUProfiler:
+    """事件循环线程的采样分析，同一时刻只运行一个"""
+
+    def __init__(self):
+        self._running = False
+
+    async def sample(self, seconds: float, interval: float = DEFAULT_SAMPLE_INTERVAL) -> str:
+        """采样 seconds 秒，返回折叠栈文本（每行为 根;...;叶 次数）"""
+        if seconds <= 0 or seconds > config.monitoring.profile_max_seconds:
+            raise ValueError(f"Profile duration must be in (0, {config.monitoring.profile_max_seconds}] seconds")
+        if interval <= 0:
+            raise ValueError("Sample interval must be positive")
+        if self._running:
+            raise ValueError("A CPU profile is already running in this worker")
+
+        self._running = True
+        try:
+            thread_id = threading.get_ident()
+            stacks = await asyncio.to_thread(_sample_stacks, thread_id, seconds, interval)
+            return await asyncio.to_thread(_collapse, stacks)
+        finally:
+            self._running = False
+
+
+class RequestProfiles:
+    """
+    单请求 cProfile 结果，按编号保留最近的若干个
+
+    指定了共享目录时结果写成 <编号>.pstats 文件，任意 worker 都能取回；否则保存在进程内存中（单进程）。
+    """
+
+    def __init__(self, max_profiles: int = MAX_REQUEST_PROFILES):
+        self.max_profiles = max_profiles
+        self._profiles: "OrderedDict[str, cProfile.Profile]" = OrderedDict()
+        self._directory: Optional[str] = None
+        self.active = False
+
+    @property
+    def directory(self) -> Optional[str]:
+        return self._directory
+
+    def use_directory(self, directory: str) -> None:
+        """多 worker 模式：由主进程在 fork 之前调用，清理上次运行留下的文件"""
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, "*.pstats")):
+            os.unlink(path)
+        self._directory = directory
+
+    def new_id(self) -> str:
+        return secrets.token_hex(8)
+
+    async def add(self, profile_id: str, profile: cProfile.Profile) -> None:
+        if self._directory is not None:
+            await asyncio.to_thread(self._write, profile_id, profile)
+            return
+        self._profiles[profile_id] = profile
+        while len(self._profiles) > self.max_profiles:
+            self._profiles.popitem(last=False)
+
+    def _write(self, profile_id: str, profile: cProfile.Profile) -> None:
+        path = os.path.join(self._directory, f"{profile_id}.pstats")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_dump_stats(profile))
+        os.replace(tmp_path, path)
+        # 各 worker 写入同一目录，只保留最新的若干个
+        paths = sorted(glob.glob(os.path.join(self._directory, "*.pstats")), key=_mtime)
+        for old in paths[:-self.max_profiles]:
+            with suppress(FileNotFoundError):
+                os.unlink(old)
+
+    def get(self, profile_id: str) -> Union[cProfile.Profile, str]:
+        """进程内的 Profile，或共享目录中的 pstats 文件路径"""
+        if self._directory is not None:
+            path = os.path.join(self._directory, f"{profile_id}.pstats")
+            # 编号只由十六进制字符组成，防止路径穿越
+            if all(char in "0123456789abcdef" for char in profile_id) and os.path.exists(path):
+                return path
+            raise ValueError("Profile not found")
+        profile = self._profiles.get(profile_id)
+        if profile is None:
+            raise ValueError("Profile not found")
+        return profile
+
+    async def render(self, profile_id: str, output: str = "text", sort: str = "cumulative", limit: int = 50) -> bytes:
+        """text 为 pstats 文本报告，pstats 为可用 pstats.Stats / snakeviz 打开的文件内容"""
+        profile = self.get(profile_id)
+        if output == "pstats":
+            return await asyncio.to_thread(_dump_stats, profile)
+        if output == "text":
+            return await asyncio.to_thread(_format_stats, profile, sort, limit)
+        raise ValueError(f"Unsupported profile format: {output}")
+
+
+def _mtime(path: str) -> float:
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return 0.0
+
+
+def _dump_stats(profile: Union[cProfile.Profile, str]) -> bytes:
+    if isinstance(profile, str):
+        with open(profile, "rb") as f:
+            return f.read()
+    # 与 pstats.Stats.dump_stats 写入的文件内容相同
+    profile.create_stats()
+    return marshal.dumps(profile.stats)
+
+
+def _format_stats(profile: Union[cProfile.Profile, str], sort: str, limit: int) -> bytes:
+    stream = io.StringIO()
+    pstats.Stats(profile, stream=stream).sort_stats(sort).print_stats(limit)
+    return stream.getvalue().encode()
+
+
+def _statistic_row(statistic) -> Dict:
+    frame = statistic.traceback[0]
+    row = {
+        "location": f"{frame.filename}:{frame.lineno}",
+        "size_kb": round(statistic.size / 1024, 1),
+        "count": statistic.count,
+    }
+    if hasattr(statistic, "size_diff"):
+        row["size_diff_kb"] = round(statistic.size_diff / 1024, 1)
+        row["count_diff"] = statistic.count_diff
+    if len(statistic.traceback) > 1:
+        row["traceback"] = [f"{frame.filename}:{frame.lineno}" for frame in statistic.traceback]
+    return row
+
+
+class MemoryProfiler:
+    """在一个请求内完成的内存分析：开启 tracemalloc，等待一段时间后与开始时的快照比较，同一时刻只运行一个"""
+
+    def __init__(self):
+        self._running = False
+
+    async def growth(self, seconds: float, frames: int = 1, key_type: str = "lineno", limit: int = 20) -> List[Dict]:
+        """seconds 秒内新增且仍未释放的分配，按增长量降序"""
+        if seconds <= 0 or seconds > config.monitoring.profile_max_seconds:
+            raise ValueError(f"Profile duration must be in (0, {config.monitoring.profile_max_seconds}] seconds")
+        if self._running:
+            raise ValueError("A memory profile is already running in this worker")
+
+        self._running = True
+        # 追踪期间所有分配都有额外开销，只在本次分析期间开启（已由其他代码开启时保持原状）
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start(frames)
+        try:
+            base = await asyncio.to_thread(_take_snapshot)
+            await asyncio.sleep(seconds)
+            current = await asyncio.to_thread(_take_snapshot)
+            return await asyncio.to_thread(_compare, current, base, key_type, limit)
+        finally:
+            if started:
+                tracemalloc.stop()
+            self._running = False
+
+
+# 不统计 tracemalloc 自身和导入机制的分配
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+)
+
+
+def _take_snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+
+
+def _compare(current: tracemalloc.Snapshot, base: tracemalloc.Snapshot, key_type: str, limit: int) -> List[Dict]:
+    return [_statistic_row(statistic) for statistic in current.compare_to(base, key_type)[:limit]]
+
+
+# 全局分析器
+cpu_profiler = CPUProfiler()
+request_profiles = RequestProfiles()
+memory_profiler = MemoryProfiler()
+
+
+def _header(scope, name: bytes) -> Optional[bytes]:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value
+    return None
+
+
+def _bearer_username(scope) -> Optional[str]:
+    from app.auth.auth import ALGORITHM, SECRET_KEY
+
+    authorization = _header(scope, b"authorization")
+    if authorization is None or not authorization.lower().startswith(b"bearer "):
+        return None
+    try:
+        payload = jwt.decode(authorization[7:].decode(), SECRET_KEY, algorithms=[ALGORITHM])
+    except (JWTError, UnicodeDecodeError):
+        return None
+    return payload.get("sub")
+
+
+class ProfilingMiddleware:
+    """
+    管理员的请求带 X-Profile 请求头时对该请求执行 cProfile
+
+    未配置管理员时直接转发；同一 worker 同一时刻只分析一个请求，忙时忽略请求头。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or not config.monitoring.profiling_admins
+            or request_profiles.active
+            or _header(scope, PROFILE_HEADER) is None
+            or not is_profiling_admin(_bearer_username(scope))
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = request_profiles.new_id()
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((PROFILE_ID_HEADER, profile_id.encode()))
+                headers.append((b"x-worker-pid", str(os.getpid()).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        profile = cProfile.Profile()
+        request_profiles.active = True
+        profile.enable()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profile.disable()
+            request_profiles.active = False
+            await request_profiles.add(profile_id, profile)
+            logger.info(f"已分析请求 {scope['method']} {scope['path']}，分析编号 {profile_id}")
@@ -9,6 +9,7 @@ from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.database.database import get_db
+from app.database.instrumentation import track_command
 from app.services.websocket_manager import connection_manager
 from app.auth.dependencies import verify_websocket_token
 
@@ -34,6 +35,8 @@ async def websocket_endpoint(
             return
 
         user_id = current_user.id
+        # 接收循环不访问数据库：认证后立即归还连接，长连接不再各自占用连接池中的一个连接
+        await db.close()
         
         # 接受连接
         await websocket.accept()
@@ -59,7 +62,8 @@ async def websocket_endpoint(
                 
                 try:
                     message = json.loads(data)
-                    await connection_manager.handle_message(user_id, message)
+                    with track_command(f"ws {message.get('type')}"):
+                        await connection_manager.handle_message(user_id, message)
                 except json.JSONDecodeError:
                     logger.error(f"无法解析消息: {data}")
                     await websocket.send_text(json.dumps({
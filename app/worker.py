@@ -0,0 +1,53 @@
+"""
+批量AI任务执行器独立进程
+
+生产环境在 config.ini 中设置 [ai_jobs] embedded = false，然后单独部署：
+
+    python -m app.worker
+
+任务执行与API请求处理在不同进程中，长时间的批量摘要不会占用API的事件循环。
+可以启动多个执行器进程，任务领取是并发安全的。
+"""
+import asyncio
+import logging
+import signal
+
+from app.database.database import close_db, init_db
+from app.services.ai_job_service import ai_job_worker
+from app.utils.config import load_config
+
+logger = logging.getLogger(__name__)
+
+
+async def run() -> None:
+    """运行执行器直到收到 SIGTERM / SIGINT"""
+    load_config()
+    await init_db()
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop_event.set)
+
+    ai_job_worker.start()
+    try:
+        await stop_event.wait()
+    finally:
+        # 执行中的任务会释放回队列，由其他执行器或下次启动后继续
+        await ai_job_worker.stop()
+        await close_db()
+        logger.info("AI任务执行器已退出")
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    try:
+        import uvloop
+    except ImportError:
+        asyncio.run(run())
+    else:
+        asyncio.run(run(), loop_factory=uvloop.new_event_loop)
+
+
+if __name__ == "__main__":
+    main()
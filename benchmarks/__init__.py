@@ -0,0 +1,5 @@
+"""
+性能基准测试
+
+用合成的工作区数据测量服务层热点调用的耗时，见 README.md。
+"""
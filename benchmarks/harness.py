@@ -0,0 +1,176 @@
+"""
+基准测试计时与结果比较
+
+每个用例先预热若干次，再计时 iterations 次；每次调用使用新的会话，避免会话身份映射把查询变成缓存命中。
+结果保存为 JSON，与基线比较时按 p95 判断是否退化。
+"""
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+# 用例：(会话, 迭代序号) -> None
+CaseFunc = Callable[[AsyncSession, int], Awaitable[object]]
+
+RESULT_FORMAT_VERSION = 1
+
+
+@dataclass
+class BenchmarkCase:
+    """一个基准测试用例"""
+    name: str
+    func: CaseFunc
+    description: str = ""
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(durations: List[float]) -> Dict[str, float]:
+    """耗时（秒）的统计，单位毫秒"""
+    values = sorted(duration * 1000 for duration in durations)
+    total = sum(durations)
+    return {
+        "iterations": len(values),
+        "mean_ms": round(statistics.fmean(values), 3),
+        "p50_ms": round(_percentile(values, 0.50), 3),
+        "p95_ms": round(_percentile(values, 0.95), 3),
+        "p99_ms": round(_percentile(values, 0.99), 3),
+        "max_ms": round(values[-1], 3),
+        "ops_per_sec": round(len(values) / total, 1) if total else 0.0,
+    }
+
+
+async def run_case(
+    session_factory: async_sessionmaker,
+    case: BenchmarkCase,
+    iterations: int,
+    warmup: int = 5
+) -> Dict[str, float]:
+    durations: List[float] = []
+    for index in range(warmup + iterations):
+        async with session_factory() as db:
+            started = time.perf_counter()
+            await case.func(db, index)
+            elapsed = time.perf_counter() - started
+        if index >= warmup:
+            durations.append(elapsed)
+    return summarize(durations)
+
+
+async def run_suite(
+    session_factory: async_sessionmaker,
+    cases: List[BenchmarkCase],
+    iterations: int,
+    warmup: int = 5,
+    only: Optional[List[str]] = None,
+    progress: Optional[Callable[[str, Dict[str, float]], None]] = None
+) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for case in cases:
+        if only and case.name not in only:
+            continue
+        results[case.name] = await run_case(session_factory, case, iterations, warmup)
+        if progress is not None:
+            progress(case.name, results[case.name])
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=Path(__file__).resolve().parent
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_report(results: Dict[str, Dict[str, float]], **metadata) -> Dict:
+    return {
+        "version": RESULT_FORMAT_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        **metadata,
+        "results": results,
+    }
+
+
+def save_report(report: Dict, path: str) -> None:
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def load_report(path: str) -> Dict:
+    with open(path, encoding="utf-8") as f:
+        report = json.load(f)
+    if report.get("version") != RESULT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported benchmark result version: {report.get('version')}")
+    return report
+
+
+@dataclass
+class Regression:
+    """比基线慢超过阈值的用例"""
+    name: str
+    baseline_ms: float
+    current_ms: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current_ms / self.baseline_ms if self.baseline_ms else float("inf")
+
+
+def compare(
+    current: Dict,
+    baseline: Dict,
+    threshold: float = 0.2,
+    metric: str = "p95_ms",
+    min_delta_ms: float = 0.5
+) -> List[Regression]:
+    """
+    找出比基线慢超过 threshold（相对值）的用例
+
+    绝对差小于 min_delta_ms 的不算退化：亚毫秒级的调用抖动本身就有几十个百分点。
+    只在一边出现的用例不参与比较。
+    """
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        baseline_ms, current_ms = base[metric], result[metric]
+        if current_ms - baseline_ms >= min_delta_ms and current_ms > baseline_ms * (1 + threshold):
+            regressions.append(Regression(name, baseline_ms, current_ms))
+    return regressions
+
+
+def format_results(results: Dict[str, Dict[str, float]], baseline: Optional[Dict] = None) -> str:
+    """结果表格；有基线时附上 p95 的变化"""
+    header = f"{'case':<36}{'p50':>10}{'p95':>10}{'p99':>10}{'ops/s':>10}"
+    if baseline is not None:
+        header += f"{'Δp95':>10}"
+    lines = [header]
+    for name, result in results.items():
+        line = (
+            f"{name:<36}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+            f"{result['p99_ms']:>10.2f}{result['ops_per_sec']:>10.1f}"
+        )
+        base = (baseline or {}).get("results", {}).get(name)
+        if base and base["p95_ms"]:
+            line += f"{(result['p95_ms'] / base['p95_ms'] - 1) * 100:>+9.1f}%"
+        lines.append(line)
+    return "\n".join(lines)
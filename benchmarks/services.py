@@ -0,0 +1,82 @@
+"""
+服务层基准测试用例
+
+参数按真实访问模式挑选：读写集中在活跃频道和活跃用户上，同时覆盖长尾；
+搜索分别用最常见和最罕见的词，覆盖命中很多和几乎不命中两种情况。
+"""
+import random
+from typing import List
+
+from app.schemas.message import MessageCreate
+from app.services.channel_service import ChannelService
+from app.services.message_service import MessageService
+from app.services.notification_service import NotificationService
+
+from benchmarks.harness import BenchmarkCase
+from benchmarks.workspace import Workspace
+
+
+def build_cases(workspace: Workspace, seed: int = 0) -> List[BenchmarkCase]:
+    rng = random.Random(seed)
+    channels = workspace.channel_ids
+    sizes = workspace.channel_sizes
+    hottest_channel = channels[max(range(len(channels)), key=sizes.__getitem__)]
+    hottest_reader = workspace.members_of(hottest_channel)[0]
+    largest_team = max(workspace.team_ids, key=lambda team_id: len(workspace.team_members[team_id]))
+    private_channels = list(workspace.channel_members) or channels
+    common_word, rare_word = workspace.words[0], workspace.words[-1]
+
+    def pick_channel():
+        channel_id = rng.choices(channels, weights=sizes)[0]
+        return channel_id, rng.choice(workspace.members_of(channel_id))
+
+    async def create_message(db, index):
+        channel_id, author_id = pick_channel()
+        content = " ".join(rng.choices(workspace.words, k=12))
+        await MessageService(db).create_message(MessageCreate(content=content, channel_id=channel_id), author_id)
+
+    async def channel_messages_hot(db, index):
+        await MessageService(db).get_channel_messages(hottest_channel, hottest_reader, limit=50)
+
+    async def channel_messages(db, index):
+        channel_id, user_id = pick_channel()
+        await MessageService(db).get_channel_messages(channel_id, user_id, limit=50)
+
+    async def search_common(db, index):
+        await MessageService(db).search_messages(common_word, hottest_reader)
+
+    async def search_rare_in_team(db, index):
+        user_id = rng.choice(workspace.team_members[largest_team])
+        await MessageService(db).search_messages(rare_word, user_id, team_id=largest_team)
+
+    async def team_channels(db, index):
+        user_id = rng.choice(workspace.team_members[largest_team])
+        await ChannelService(db).get_team_channels(largest_team, user_id)
+
+    async def can_access_private(db, index):
+        channel_id = rng.choice(private_channels)
+        await ChannelService(db).can_user_access_channel(channel_id, rng.choice(workspace.members_of(channel_id)))
+
+    async def can_access_denied(db, index):
+        channel_id = rng.choice(private_channels)
+        await ChannelService(db).can_user_access_channel(channel_id, rng.choice(workspace.user_ids))
+
+    async def notifications(db, index):
+        await NotificationService(db).get_user_notifications(rng.choice(workspace.user_ids), limit=50)
+
+    async def notifications_unread(db, index):
+        await NotificationService(db).get_user_notifications(rng.choice(workspace.user_ids), limit=50, unread_only=True)
+
+    # 写入用例放在最后，不影响前面读取用例看到的数据量
+    return [
+        BenchmarkCase("get_channel_messages.hot", channel_messages_hot, "最活跃频道的最新一页"),
+        BenchmarkCase("get_channel_messages.weighted", channel_messages, "按活跃度随机挑选频道"),
+        BenchmarkCase("search_messages.common", search_common, "最常见的词，跨所有可访问频道"),
+        BenchmarkCase("search_messages.rare_in_team", search_rare_in_team, "最罕见的词，限定在最大的团队"),
+        BenchmarkCase("get_team_channels.largest", team_channels, "最大团队的频道列表"),
+        BenchmarkCase("can_user_access_channel.member", can_access_private, "私有频道成员"),
+        BenchmarkCase("can_user_access_channel.random", can_access_denied, "随机用户访问私有频道"),
+        BenchmarkCase("get_user_notifications", notifications, "随机用户的收件箱第一页"),
+        BenchmarkCase("get_user_notifications.unread", notifications_unread, "随机用户的未读通知"),
+        BenchmarkCase("create_message", create_message, "按活跃度随机挑选频道发消息"),
+    ]
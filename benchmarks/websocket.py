@@ -0,0 +1,462 @@
+"""
+WebSocket 扇出负载测试
+
+在进程内用 ASGI 直接驱动 /ws 端点，打开成千上万个客户端连接：
+
+- 每个客户端按频道活跃度加入几个有权限的频道（join_channel）；
+- 按泊松过程回放 typing、join_channel、leave_channel 事件，发消息走 POST /api/v1/messages
+  （/ws 端点不处理 send_message，客户端发消息本来就是走 REST，由路由广播到频道）；
+- 测量端到端投递延迟（事件发出到每个客户端收到帧）、扇出完成时间、每秒投递帧数、
+  每个连接占用的内存和事件循环延迟。
+
+连接数逐级增加（如 250、500、1000、2000），每一级测一轮，用来观察 ConnectionManager 随连接数和频道规模的变化。
+客户端和服务端共用一个事件循环，测得的吞吐是服务端和客户端合计的下限，适合比较改动前后的差异而不是估算容量。
+
+    python -m benchmarks.websocket --connections 250,500,1000,2000 --rate 50 --duration 10
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import suppress
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlencode
+
+import httpx
+import numpy as np
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.auth.auth import create_access_token
+from app.database.database import create_routing_sessionmaker, get_db
+from app.utils.config import load_config
+
+from benchmarks.harness import build_report, compare, load_report, save_report, summarize
+from benchmarks.workspace import PRESETS, Workspace, generate_workspace, power_law_weights, username_of
+
+logger = logging.getLogger("benchmarks")
+
+# 事件比例：输入状态最频繁，其次是发消息
+DEFAULT_MIX = {"typing": 0.6, "send_message": 0.2, "join_channel": 0.1, "leave_channel": 0.1}
+
+
+class LoopLagMonitor:
+    """按固定间隔睡眠，记录实际醒来比预期晚了多少"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self.samples = []
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> Dict[str, float]:
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        values = sorted(self.samples) or [0.0]
+        return {
+            "loop_lag_p99_ms": round(values[min(len(values) - 1, int(len(values) * 0.99))] * 1000, 3),
+            "loop_lag_max_ms": round(values[-1] * 1000, 3),
+        }
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+
+class InMemoryWebSocket:
+    """进程内的 WebSocket 客户端：直接调用 ASGI 应用，不经过网络"""
+
+    def __init__(self, app, path: str, query: Dict[str, str], on_frame: Callable[[str, float], None]):
+        self.app = app
+        self.scope = {
+            "type": "websocket", "asgi": {"version": "3.0"}, "scheme": "ws", "http_version": "1.1",
+            "path": path, "raw_path": path.encode(), "root_path": "",
+            "query_string": urlencode(query).encode(), "headers": [(b"host", b"bench")],
+            "client": ("127.0.0.1", 0), "server": ("bench", 80), "subprotocols": [],
+        }
+        self.on_frame = on_frame
+        self.accepted = False
+        self.closed = False
+        self._inbound: asyncio.Queue = asyncio.Queue()
+        self._handshake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def connect(self) -> bool:
+        self._inbound.put_nowait({"type": "websocket.connect"})
+        self._task = asyncio.create_task(self.app(self.scope, self._receive, self._send))
+        await self._handshake.wait()
+        return self.accepted
+
+    def send_json(self, message: Dict) -> None:
+        self._inbound.put_nowait({"type": "websocket.receive", "text": json.dumps(message)})
+
+    async def close(self, timeout: float = 5.0) -> None:
+        if self._task is None:
+            return
+        self._inbound.put_nowait({"type": "websocket.disconnect", "code": 1000})
+        with suppress(asyncio.TimeoutError, asyncio.CancelledError):
+            await asyncio.wait_for(self._task, timeout)
+        self._task = None
+
+    async def _receive(self) -> Dict:
+        return await self._inbound.get()
+
+    async def _send(self, message: Dict) -> None:
+        if message["type"] == "websocket.accept":
+            self.accepted = True
+            self._handshake.set()
+        elif message["type"] == "websocket.send":
+            self.on_frame(message.get("text") or "", time.perf_counter())
+        elif message["type"] == "websocket.close":
+            self.closed = True
+            self._handshake.set()
+
+
+@dataclass
+class _Event:
+    kind: str
+    channel_id: int
+    sent_at: float
+    # 发出时频道内已加入的客户端数
+    channel_size: int
+    deliveries: List[float] = field(default_factory=list)
+
+
+def _size_bucket(size: int) -> str:
+    if size < 10:
+        return "1-9"
+    if size < 100:
+        return "10-99"
+    if size < 1000:
+        return "100-999"
+    return "1000+"
+
+
+class FanoutLoad:
+    """一组客户端及其负载回放"""
+
+    def __init__(self, app, workspace: Workspace, mix: Optional[Dict[str, float]] = None, seed: int = 0):
+        self.app = app
+        self.workspace = workspace
+        self.mix = mix or DEFAULT_MIX
+        self.rng = random.Random(seed)
+        self.clients: Dict[int, InMemoryWebSocket] = {}
+        self.joined: Dict[int, Set[int]] = {}
+        self.channel_clients: Dict[int, int] = defaultdict(int)
+        self.frames = 0
+
+        # 用户有权限的频道，按频道活跃度加权
+        self.accessible: Dict[int, List[int]] = defaultdict(list)
+        for channel_id in workspace.channel_ids:
+            for user_id in workspace.members_of(channel_id):
+                self.accessible[user_id].append(channel_id)
+        self.activity = dict(zip(workspace.channel_ids, workspace.channel_sizes))
+        self.user_weights = dict(zip(
+            workspace.user_ids, power_law_weights(len(workspace.user_ids), workspace.spec.skew, np.random.default_rng(seed))
+        ))
+
+        # 等待投递的事件：{(帧类型, 关联键...): 事件}
+        self._pending: Dict[Tuple, _Event] = {}
+        self._events: List[_Event] = []
+        self._http: Optional[httpx.AsyncClient] = None
+        self._tokens: Dict[int, str] = {}
+
+    def _token(self, user_id: int) -> str:
+        if user_id not in self._tokens:
+            self._tokens[user_id] = create_access_token({"sub": username_of(user_id)})
+        return self._tokens[user_id]
+
+    def _on_frame(self, text: str, received_at: float) -> None:
+        self.frames += 1
+        message = json.loads(text)
+        data = message.get("data") or {}
+        if message.get("type") == "message":
+            key = ("message", data.get("content"))
+        else:
+            key = (message.get("type"), data.get("user_id"), data.get("channel_id"))
+        event = self._pending.get(key)
+        if event is not None:
+            event.deliveries.append(received_at - event.sent_at)
+
+    def _weighted_channel(self, channels) -> int:
+        channels = list(channels)
+        return self.rng.choices(channels, weights=[self.activity[channel] + 1 for channel in channels])[0]
+
+    async def connect(self, count: int) -> int:
+        """增加客户端到 count 个，每个客户端加入 1~5 个频道；返回新连接数"""
+        candidates = [user_id for user_id in self.workspace.user_ids if user_id not in self.clients]
+        added = 0
+        for user_id in candidates[:max(0, count - len(self.clients))]:
+            client = InMemoryWebSocket(self.app, "/ws", {"token": self._token(user_id)}, self._on_frame)
+            if not await client.connect():
+                raise RuntimeError(f"WebSocket connection rejected for user {user_id}")
+            self.clients[user_id] = client
+            self.joined[user_id] = set()
+            added += 1
+            channels = self.accessible[user_id]
+            for _ in range(min(len(channels), 1 + int(self.rng.expovariate(0.7)), 5)):
+                self._join(user_id, self._weighted_channel(set(channels) - self.joined[user_id]))
+        # 等加入频道的消息处理完
+        await self._drain()
+        return added
+
+    def _join(self, user_id: int, channel_id: int) -> None:
+        self.joined[user_id].add(channel_id)
+        self.channel_clients[channel_id] += 1
+        self.clients[user_id].send_json({"type": "join_channel", "data": {"channel_id": channel_id}})
+
+    def _track(self, key: Tuple, kind: str, channel_id: int) -> None:
+        event = _Event(kind, channel_id, time.perf_counter(), self.channel_clients[channel_id])
+        self._pending[key] = event
+        self._events.append(event)
+
+    async def _emit(self, event_id: int) -> None:
+        user_id = self.rng.choices(list(self.clients), weights=[self.user_weights[user] for user in self.clients])[0]
+        joined = self.joined[user_id]
+        kind = self.rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        unjoined = set(self.accessible[user_id]) - joined
+        if kind == "join_channel" and not unjoined or kind == "leave_channel" and len(joined) < 2:
+            kind = "typing"
+        if not joined:
+            if not unjoined:
+                return
+            kind = "join_channel"
+
+        if kind == "join_channel":
+            channel_id = self._weighted_channel(unjoined)
+            self._track(("user_online", user_id, channel_id), kind, channel_id)
+            self._join(user_id, channel_id)
+        elif kind == "leave_channel":
+            channel_id = self.rng.choice(sorted(joined))
+            self._track(("user_offline", user_id, channel_id), kind, channel_id)
+            joined.discard(channel_id)
+            self.channel_clients[channel_id] -= 1
+            self.clients[user_id].send_json({"type": "leave_channel", "data": {"channel_id": channel_id}})
+        elif kind == "typing":
+            channel_id = self._weighted_channel(joined)
+            self._track(("user_typing", user_id, channel_id), kind, channel_id)
+            self.clients[user_id].send_json({"type": "typing", "data": {"channel_id": channel_id, "is_typing": True}})
+        else:
+            channel_id = self._weighted_channel(joined)
+            content = f"#{event_id} " + " ".join(self.rng.choices(self.workspace.words[:50], k=8))
+            self._track(("message", content), kind, channel_id)
+            response = await self._http.post(
+                "/api/v1/messages", json={"content": content, "channel_id": channel_id},
+                headers={"Authorization": f"Bearer {self._token(user_id)}"}
+            )
+            if response.status_code != 201:
+                logger.warning(f"发送消息失败: {response.status_code} {response.text[:200]}")
+
+    async def _drain(self, quiet: float = 0.2, timeout: float = 30.0) -> None:
+        """等到一段时间内没有新的帧"""
+        deadline = time.perf_counter() + timeout
+        last = -1
+        while self.frames != last and time.perf_counter() < deadline:
+            last = self.frames
+            await asyncio.sleep(quiet)
+
+    async def run(self, duration: float, rate: float) -> Dict:
+        """按泊松过程以每秒 rate 个事件回放 duration 秒"""
+        self._pending.clear()
+        self._events = []
+        frames_before = self.frames
+        tasks: Set[asyncio.Task] = set()
+        monitor = LoopLagMonitor()
+        monitor.start()
+        started = time.perf_counter()
+        next_at = started
+        event_id = 0
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=self.app), base_url="http://bench") as http:
+            self._http = http
+            while next_at - started < duration:
+                await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+                event_id += 1
+                task = asyncio.create_task(self._emit(event_id))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                next_at += self.rng.expovariate(rate)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            await self._drain()
+        elapsed = time.perf_counter() - started
+        lag = await monitor.stop()
+        return self._summarize(self.frames - frames_before, elapsed, lag)
+
+    def _summarize(self, frames: int, elapsed: float, lag: Dict[str, float]) -> Dict:
+        deliveries = [latency for event in self._events for latency in event.deliveries]
+        completed = [event for event in self._events if event.deliveries]
+        result = summarize(deliveries) if deliveries else {}
+        # ops_per_sec 对投递延迟没有意义，换成每秒投递的帧数
+        result.pop("ops_per_sec", None)
+        result.update({
+            "connections": len(self.clients),
+            "events": len(self._events),
+            "frames": frames,
+            "frames_per_sec": round(frames / elapsed, 1) if elapsed else 0.0,
+            "recipients_per_event": round(len(deliveries) / len(completed), 1) if completed else 0.0,
+            **lag,
+        })
+        if completed:
+            result["fanout_p95_ms"] = summarize([max(event.deliveries) for event in completed])["p95_ms"]
+        by_kind = defaultdict(list)
+        by_size = defaultdict(list)
+        for event in completed:
+            by_kind[event.kind].extend(event.deliveries)
+            by_size[_size_bucket(event.channel_size)].append(max(event.deliveries))
+        result["by_event"] = {kind: summarize(values)["p95_ms"] for kind, values in sorted(by_kind.items())}
+        result["fanout_by_channel_size"] = {
+            bucket: summarize(values)["p95_ms"] for bucket, values in sorted(by_size.items())
+        }
+        return result
+
+    async def close(self) -> None:
+        await asyncio.gather(*(client.close() for client in self.clients.values()))
+        self.clients.clear()
+
+
+async def run_scaling(
+    app,
+    workspace: Workspace,
+    connection_counts: List[int],
+    duration: float,
+    rate: float,
+    seed: int = 0,
+    progress: Optional[Callable[[str, Dict], None]] = None
+) -> Dict[str, Dict]:
+    """逐级增加连接数，每一级回放一轮负载"""
+    load = FanoutLoad(app, workspace, seed=seed)
+    results = {}
+    try:
+        for count in sorted(connection_counts):
+            tracing = tracemalloc.is_tracing()
+            if not tracing:
+                tracemalloc.start()
+            gc.collect()
+            before = tracemalloc.get_traced_memory()[0]
+            started = time.perf_counter()
+            added = await load.connect(count)
+            connect_seconds = time.perf_counter() - started
+            gc.collect()
+            allocated = tracemalloc.get_traced_memory()[0] - before
+            if not tracing:
+                tracemalloc.stop()
+
+            result = await load.run(duration, rate)
+            result["connect_seconds"] = round(connect_seconds, 2)
+            result["memory_per_connection_kb"] = round(allocated / added / 1024, 1) if added else None
+            name = f"connections={len(load.clients)}"
+            results[name] = result
+            if progress is not None:
+                progress(name, result)
+    finally:
+        await load.close()
+    return results
+
+
+def format_scaling(results: Dict[str, Dict], baseline: Optional[Dict] = None) -> str:
+    header = f"{'step':<20}{'p50':>9}{'p95':>9}{'fanout95':>10}{'frames/s':>11}{'recv/ev':>9}{'KB/conn':>9}{'lag99':>9}"
+    if baseline is not None:
+        header += f"{'Δp95':>9}"
+    lines = [header]
+    for name, result in results.items():
+        line = (
+            f"{name:<20}{result.get('p50_ms', 0):>9.2f}{result.get('p95_ms', 0):>9.2f}"
+            f"{result.get('fanout_p95_ms', 0):>10.2f}{result['frames_per_sec']:>11.1f}"
+            f"{result['recipients_per_event']:>9.1f}{result['memory_per_connection_kb'] or 0:>9.1f}"
+            f"{result['loop_lag_p99_ms']:>9.2f}"
+        )
+        base = (baseline or {}).get("results", {}).get(name)
+        if base and base.get("p95_ms") and result.get("p95_ms"):
+            line += f"{(result['p95_ms'] / base['p95_ms'] - 1) * 100:>+8.1f}%"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+async def run(args) -> int:
+    from app.main import app
+
+    counts = [int(count) for count in args.connections.split(",")]
+    database_url = f"sqlite+aiosqlite:///{Path(tempfile.mkdtemp(prefix='huddle-ws-')) / 'bench.db'}"
+    spec = replace(
+        PRESETS["small"], users=max(counts), teams=max(2, max(counts) // 500), channels_per_team=20,
+        messages=max(counts) * 2, notifications_per_user=0, seed=args.seed
+    )
+    engine = create_async_engine(database_url, connect_args={"timeout": 30})
+    session_factory = create_routing_sessionmaker(engine)
+
+    async def override_get_db():
+        async with session_factory() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = override_get_db
+    try:
+        workspace = await generate_workspace(engine, spec)
+        logger.info(f"生成工作区完成：{spec.users} 个用户，{len(workspace.channel_ids)} 个频道")
+        results = await run_scaling(
+            app, workspace, counts, args.duration, args.rate, seed=args.seed,
+            progress=lambda name, result: logger.info(
+                f"{name}: p95 {result.get('p95_ms', 0):.2f}ms, {result['frames_per_sec']:.0f} 帧/秒"
+            )
+        )
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+        await engine.dispose()
+
+    report = build_report(results, benchmark="websocket", rate=args.rate, duration=args.duration)
+    baseline = load_report(args.baseline) if args.baseline else None
+    print(format_scaling(results, baseline))
+    if args.output:
+        save_report(report, args.output)
+        logger.info(f"结果已保存到 {args.output}")
+    if baseline is None:
+        return 0
+    regressions = compare(report, baseline, threshold=args.threshold)
+    for regression in regressions:
+        logger.error(
+            f"性能退化: {regression.name} 投递延迟 p95 {regression.baseline_ms:.2f}ms -> "
+            f"{regression.current_ms:.2f}ms ({regression.ratio:.2f}x)"
+        )
+    return 1 if regressions else 0
+
+
+def main() -> None:
+    load_config()
+
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.websocket", description="WebSocket 扇出负载测试")
+    parser.add_argument("--connections", default="250,500,1000,2000", help="逐级增加的连接数，逗号分隔")
+    parser.add_argument("--rate", type=float, default=50, help="每秒回放的事件数")
+    parser.add_argument("--duration", type=float, default=10, help="每一级回放的秒数")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--output", help="结果保存路径（JSON）")
+    parser.add_argument("--baseline", help="用于比较的基线结果（JSON）")
+    parser.add_argument("--threshold", type=float, default=0.2, help="投递延迟 p95 变慢超过该比例视为退化")
+    parser.add_argument(
+        "--log-level", default="WARNING",
+        help="应用日志级别；INFO 下每次投递都会写日志，日志本身会成为主要开销"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format="%(message)s")
+    logger.setLevel(logging.INFO)
+
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+合成工作区数据
+
+按规模生成团队、用户、频道、消息（含线程回复）和通知，分布尽量接近真实工作区：
+
+- 频道消息数服从幂律分布：少数频道非常活跃，大多数频道只有零星消息；
+- 用户发言量、加入的团队数、收到的通知数同样是长尾分布；
+- 消息内容从按 Zipf 分布抽样的词表生成，搜索常见词和罕见词的命中数相差几个数量级。
+
+数据用批量 INSERT 直接写入，主键由生成器分配（回复要引用父消息的 id），写完后修正 PostgreSQL 的序列。
+"""
+import random
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Sequence
+
+import numpy as np
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.database.database import Base
+from app.models.channel import Channel, ChannelType
+from app.models.channel_member import ChannelMember, ChannelRole
+from app.models.message import Message
+from app.models.notification import Notification, NotificationType
+from app.models.team import Team
+from app.models.team_member import TeamMember, TeamRole
+from app.models.user import User
+
+INSERT_BATCH_SIZE = 5000
+# 生成的用户统一使用的密码哈希（bcrypt("benchmark")），避免生成时逐个计算
+PASSWORD_HASH = "$2b$12$KIXQJ2iAbF3VdO0p8c8xCeHpWZ3u0H0yG9X1o3Zs8d1T8m1yq2Cmi"
+
+WORDS = tuple((
+    "deploy review build release hotfix design meeting standup incident rollback metrics dashboard "
+    "database migration index query cache latency throughput queue worker cron backup restore "
+    "frontend backend api gateway auth token session login password invite onboarding docs "
+    "roadmap sprint ticket bug feature flag experiment rollout canary staging production "
+    "kubernetes docker terraform ansible nginx redis postgres kafka grafana prometheus alert "
+    "customer feedback survey pricing invoice contract renewal churn retention growth funnel "
+    "lunch coffee weekend holiday offsite birthday welcome thanks congrats question answer"
+).split())
+
+
+@dataclass
+class WorkspaceSpec:
+    """工作区规模"""
+    teams: int = 5
+    channels_per_team: int = 10
+    users: int = 200
+    messages: int = 20000
+    # 回复（线程消息）占消息总数的比例
+    thread_ratio: float = 0.15
+    private_channel_ratio: float = 0.2
+    notifications_per_user: int = 20
+    # 幂律指数：越大越集中在少数频道和用户上
+    skew: float = 1.1
+    seed: int = 42
+
+
+PRESETS: Dict[str, WorkspaceSpec] = {
+    "tiny": WorkspaceSpec(teams=2, channels_per_team=4, users=20, messages=500, notifications_per_user=5),
+    "small": WorkspaceSpec(),
+    "medium": WorkspaceSpec(teams=20, channels_per_team=40, users=2000, messages=500_000),
+    "large": WorkspaceSpec(teams=50, channels_per_team=100, users=20000, messages=5_000_000),
+}
+
+
+@dataclass
+class Workspace:
+    """生成结果：基准测试据此挑选参数"""
+    spec: WorkspaceSpec
+    user_ids: List[int] = field(default_factory=list)
+    team_ids: List[int] = field(default_factory=list)
+    # {team_id: [user_id, ...]}
+    team_members: Dict[int, List[int]] = field(default_factory=dict)
+    channel_ids: List[int] = field(default_factory=list)
+    channel_team: Dict[int, int] = field(default_factory=dict)
+    # 私有频道的成员；公开频道对团队成员开放
+    channel_members: Dict[int, List[int]] = field(default_factory=dict)
+    # 每个频道的消息数，与 channel_ids 对应
+    channel_sizes: List[int] = field(default_factory=list)
+    # 消息用到的词，按出现频率从高到低
+    words: Sequence[str] = WORDS
+    elapsed: float = 0.0
+
+    def summary(self) -> Dict:
+        return {
+            "spec": asdict(self.spec),
+            "largest_channel": max(self.channel_sizes, default=0),
+            "median_channel": int(np.median(self.channel_sizes)) if self.channel_sizes else 0,
+            "generate_seconds": round(self.elapsed, 2),
+        }
+
+    def members_of(self, channel_id: int) -> List[int]:
+        return self.channel_members.get(channel_id) or self.team_members[self.channel_team[channel_id]]
+
+
+def username_of(user_id: int) -> str:
+    return f"user{user_id}"
+
+
+def power_law_weights(count: int, skew: float, rng: np.random.Generator) -> np.ndarray:
+    """count 个按幂律递减的权重（随机打乱顺序），和为1"""
+    weights = 1.0 / np.arange(1, count + 1) ** skew
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+async def _insert(engine: AsyncEngine, table, rows: List[Dict]) -> None:
+    async with engine.begin() as conn:
+        for start in range(0, len(rows), INSERT_BATCH_SIZE):
+            await conn.execute(insert(table), rows[start:start + INSERT_BATCH_SIZE])
+
+
+async def _reset_sequences(engine: AsyncEngine) -> None:
+    """主键由生成器指定，PostgreSQL 的序列需要跟上"""
+    if engine.dialect.name != "postgresql":
+        return
+    async with engine.begin() as conn:
+        for table in (User, Team, TeamMember, Channel, ChannelMember, Message, Notification):
+            name = table.__tablename__
+            await conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), COALESCE((SELECT MAX(id) FROM {name}), 1))"
+            ))
+
+
+async def generate_workspace(engine: AsyncEngine, spec: WorkspaceSpec, create_schema: bool = True) -> Workspace:
+    """在空数据库中生成工作区"""
+    started = time.perf_counter()
+    rng = np.random.default_rng(spec.seed)
+    chooser = random.Random(spec.seed)
+    if create_schema:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    async with engine.connect() as conn:
+        if await conn.scalar(select(func.count()).select_from(Message.__table__)):
+            raise ValueError("Benchmark database is not empty")
+
+    workspace = Workspace(spec=spec)
+    now = datetime.now(timezone.utc)
+    start_time = now - timedelta(days=365)
+
+    # 用户
+    workspace.user_ids = list(range(1, spec.users + 1))
+    await _insert(engine, User.__table__, [
+        {
+            "id": user_id, "username": username_of(user_id), "email": f"{username_of(user_id)}@bench.example",
+            "full_name": f"用户 {user_id}", "hashed_password": PASSWORD_HASH, "is_active": True
+        }
+        for user_id in workspace.user_ids
+    ])
+
+    # 团队：每个用户加入 1~3 个团队，团队规模服从幂律
+    team_weights = power_law_weights(spec.teams, spec.skew, rng)
+    workspace.team_ids = list(range(1, spec.teams + 1))
+    workspace.team_members = {team_id: [] for team_id in workspace.team_ids}
+    for user_id in workspace.user_ids:
+        joined = rng.choice(workspace.team_ids, size=min(spec.teams, int(rng.integers(1, 4))), replace=False, p=team_weights)
+        for team_id in joined:
+            workspace.team_members[int(team_id)].append(user_id)
+    for team_id, members in workspace.team_members.items():
+        if not members:
+            members.append(chooser.choice(workspace.user_ids))
+    await _insert(engine, Team.__table__, [
+        {"id": team_id, "name": f"团队 {team_id}", "slug": f"team-{team_id}", "owner_id": workspace.team_members[team_id][0]}
+        for team_id in workspace.team_ids
+    ])
+    await _insert(engine, TeamMember.__table__, [
+        {"team_id": team_id, "user_id": user_id, "role": (TeamRole.OWNER if index == 0 else TeamRole.MEMBER).value}
+        for team_id, members in workspace.team_members.items()
+        for index, user_id in enumerate(members)
+    ])
+
+    # 频道：部分为私有频道，成员从团队成员中抽取
+    channel_rows, member_rows = [], []
+    for team_id in workspace.team_ids:
+        team_members = workspace.team_members[team_id]
+        for index in range(spec.channels_per_team):
+            channel_id = len(workspace.channel_ids) + 1
+            private = index > 0 and rng.random() < spec.private_channel_ratio
+            workspace.channel_ids.append(channel_id)
+            workspace.channel_team[channel_id] = team_id
+            channel_rows.append({
+                "id": channel_id, "name": f"channel-{channel_id}", "team_id": team_id, "created_by": team_members[0],
+                "type": (ChannelType.PRIVATE if private else ChannelType.PUBLIC).value
+            })
+            if private:
+                size = max(1, int(len(team_members) * rng.uniform(0.05, 0.5)))
+                members = sorted(set(chooser.sample(team_members, size)) | {team_members[0]})
+                workspace.channel_members[channel_id] = members
+                member_rows.extend(
+                    {"channel_id": channel_id, "user_id": user_id, "role": ChannelRole.MEMBER.value} for user_id in members
+                )
+    await _insert(engine, Channel.__table__, channel_rows)
+    await _insert(engine, ChannelMember.__table__, member_rows)
+
+    # 消息：频道消息数服从幂律；每条回复引用同频道中更早的一条消息
+    channel_weights = power_law_weights(len(workspace.channel_ids), spec.skew, rng)
+    workspace.channel_sizes = rng.multinomial(spec.messages, channel_weights).tolist()
+    word_weights = power_law_weights(len(WORDS), spec.skew, rng)
+    workspace.words = [WORDS[index] for index in np.argsort(-word_weights)]
+    author_weights = {
+        channel_id: power_law_weights(len(workspace.members_of(channel_id)), spec.skew, rng)
+        for channel_id in workspace.channel_ids
+    }
+    interval = (now - start_time) / max(spec.messages, 1)
+
+    message_id = 0
+    rows: List[Dict] = []
+    # 按时间顺序交错生成各频道的消息
+    channel_sequence = rng.permutation(np.repeat(np.arange(len(workspace.channel_ids)), workspace.channel_sizes))
+    roots: Dict[int, List[int]] = {channel_id: [] for channel_id in workspace.channel_ids}
+    lengths = rng.integers(3, 25, size=spec.messages)
+    for position, channel_index in enumerate(channel_sequence):
+        channel_id = workspace.channel_ids[channel_index]
+        message_id += 1
+        members = workspace.members_of(channel_id)
+        author_id = members[int(rng.choice(len(members), p=author_weights[channel_id]))]
+        parent_id = None
+        channel_roots = roots[channel_id]
+        if channel_roots and rng.random() < spec.thread_ratio:
+            # 新消息更容易被回复
+            parent_id = channel_roots[-1 - min(int(rng.exponential(5)), len(channel_roots) - 1)]
+        else:
+            channel_roots.append(message_id)
+        created_at = start_time + interval * position
+        rows.append({
+            "id": message_id, "channel_id": channel_id, "author_id": author_id, "parent_id": parent_id,
+            "content": " ".join(rng.choice(WORDS, size=int(lengths[position]), p=word_weights)),
+            "created_at": created_at, "updated_at": created_at
+        })
+        if len(rows) >= INSERT_BATCH_SIZE * 10:
+            await _insert(engine, Message.__table__, rows)
+            rows = []
+    await _insert(engine, Message.__table__, rows)
+
+    # 通知：每个用户的通知数服从幂律，平均 notifications_per_user 条
+    user_weights = power_law_weights(spec.users, spec.skew, rng)
+    counts = rng.multinomial(spec.notifications_per_user * spec.users, user_weights)
+    notification_rows = []
+    for user_id, count in zip(workspace.user_ids, counts.tolist()):
+        for index in range(count):
+            created_at = start_time + timedelta(seconds=float(rng.uniform(0, 365 * 86400)))
+            notification_rows.append({
+                "user_id": user_id, "type": NotificationType.MESSAGE_MENTION.value, "title": "有人提到了你",
+                "message": "请查看频道中的新消息", "is_read": bool(rng.random() < 0.7),
+                "created_at": created_at, "updated_at": created_at
+            })
+    await _insert(engine, Notification.__table__, notification_rows)
+
+    await _reset_sequences(engine)
+    workspace.elapsed = time.perf_counter() - started
+    return workspace
+
+
+async def load_workspace(engine: AsyncEngine, spec: WorkspaceSpec, sample_size: int = 5000) -> Workspace:
+    """从已生成的数据库读回工作区（--skip-generate），词频从最近的消息中统计"""
+    workspace = Workspace(spec=spec)
+    async with engine.connect() as conn:
+        workspace.user_ids = list((await conn.execute(select(User.id).order_by(User.id))).scalars())
+        workspace.team_ids = list((await conn.execute(select(Team.id).order_by(Team.id))).scalars())
+        workspace.team_members = {team_id: [] for team_id in workspace.team_ids}
+        rows = await conn.execute(select(TeamMember.team_id, TeamMember.user_id).order_by(TeamMember.id))
+        for team_id, user_id in rows:
+            workspace.team_members[team_id].append(user_id)
+
+        sizes = dict((await conn.execute(
+            select(Message.channel_id, func.count()).group_by(Message.channel_id)
+        )).all())
+        rows = await conn.execute(select(Channel.id, Channel.team_id, Channel.type).order_by(Channel.id))
+        private = set()
+        for channel_id, team_id, channel_type in rows:
+            workspace.channel_ids.append(channel_id)
+            workspace.channel_team[channel_id] = team_id
+            workspace.channel_sizes.append(sizes.get(channel_id, 0))
+            if channel_type != ChannelType.PUBLIC.value:
+                private.add(channel_id)
+        rows = await conn.execute(select(ChannelMember.channel_id, ChannelMember.user_id).order_by(ChannelMember.id))
+        for channel_id, user_id in rows:
+            if channel_id in private:
+                workspace.channel_members.setdefault(channel_id, []).append(user_id)
+
+        contents = (await conn.execute(
+            select(Message.content).order_by(Message.id.desc()).limit(sample_size)
+        )).scalars()
+        counts = Counter(word for content in contents for word in content.split())
+    if not workspace.channel_ids or not counts:
+        raise ValueError("Benchmark database is empty, run without --skip-generate first")
+    workspace.words = [word for word, _ in counts.most_common()]
+    return workspace
@@ -22,20 +22,23 @@ const Navigation: React.FC<NavigationProps> = ({
   const dispatch = useAppDispatch();
   const { user } = useAppSelector((state) => state.auth);
   const { unreadCount } = useAppSelector((state) => state.notifications);
+  const { connectionState } = useAppSelector((state) => state.websocket);
   const { t } = useLanguage();
 
-  // 定期获取未读通知数量
+  // 获取一次未读通知数量，WebSocket连接后由推送更新；
+  // WebSocket只在聊天页面连接，未连接时每30秒更新一次
   useEffect(() => {
     if (user) {
       dispatch(fetchUnreadCount());
-      // 每30秒更新一次未读数量
-      const interval = setInterval(() => {
-        dispatch(fetchUnreadCount());
-      }, 30000);
-      
-      return () => clearInterval(interval);
+      if (connectionState !== 'connected') {
+        const interval = setInterval(() => {
+          dispatch(fetchUnreadCount());
+        }, 30000);
+
+        return () => clearInterval(interval);
+      }
     }
-  }, [dispatch, user]);
+  }, [dispatch, user, connectionState]);
 
   const handleLogout = () => {
     dispatch(logout());
@@ -1,12 +1,15 @@
 import { store } from '../store';
 import { addMessage, updateMessageInState, removeMessageFromState } from '../store/slices/messageSlice';
+import { addNotification, setUnreadCount } from '../store/slices/notificationSlice';
 import type { Message } from '../types';
 
 export interface WebSocketMessage {
-  type: 'message' | 'message_updated' | 'message_deleted' | 'user_typing' | 'user_online' | 'user_offline';
+  type: 'message' | 'message_updated' | 'message_deleted' | 'user_typing' | 'user_online' | 'user_offline'
+    | 'notification' | 'notification_count';
   data: any;
   channel_id?: number;
   user_id?: number;
+  unread_count?: number;
   timestamp: string;
 }
 
@@ -256,6 +259,23 @@ export class WebSocketService {
           this.emit('user_offline', message.data);
           break;
           
+        case 'notification':
+          // 服务端推送的新通知，附带最新未读数量
+          if (message.data) {
+            store.dispatch(addNotification(message.data));
+          }
+          if (typeof message.unread_count === 'number') {
+            store.dispatch(setUnreadCount(message.unread_count));
+          }
+          break;
+          
+        case 'notification_count':
+          // 未读数量变化（已读、全部已读、删除）
+          if (typeof message.data?.unread_count === 'number') {
+            store.dispatch(setUnreadCount(message.data.unread_count));
+          }
+          break;
+          
         default:
           console.warn('未知的WebSocket消息类型:', message.type);
       }
@@ -103,6 +103,9 @@ const notificationSlice = createSlice({
         state.unreadCount += 1;
       }
     },
+    setUnreadCount: (state, action) => {
+      state.unreadCount = action.payload;
+    },
   },
   extraReducers: (builder) => {
     builder
@@ -162,5 +165,5 @@ const notificationSlice = createSlice({
   },
 });
 
-export const { clearError, addNotification } = notificationSlice.actions;
+export const { clearError, addNotification, setUnreadCount } = notificationSlice.actions;
 export default notificationSlice.reducer; 
\ No newline at end of file